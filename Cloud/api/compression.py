@@ -0,0 +1,231 @@
+# imports
+import gzip
+import json
+import logging
+import zlib
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from flask import Response, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# zstd 為可選依賴（pip install zstandard），未安裝時僅支援 gzip
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# 請求主體解壓後的大小上限（防止壓縮炸彈）
+MAX_DECOMPRESSED_BYTES = 32 * 1024 * 1024
+
+# 回應主體小於此大小時不壓縮（壓縮標頭開銷大於節省）
+COMPRESS_MIN_BYTES = 1024
+
+# 串流回應（逐塊壓縮）適用的 MIME 類型
+STREAM_COMPRESSIBLE_MIMETYPES = ('application/x-ndjson',)
+
+# 串流讀取請求主體的區塊大小
+_READ_CHUNK_SIZE = 64 * 1024
+
+# gzip 壓縮等級（6 為速度與壓縮率的平衡點）
+GZIP_LEVEL = 6
+
+# zstd 壓縮等級
+ZSTD_LEVEL = 3
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """伺服器支援的內容編碼，依偏好順序排列"""
+    return ('zstd', 'gzip') if ZSTD_AVAILABLE else ('gzip',)
+
+
+def _accept_encoding_header() -> str:
+    return ', '.join(supported_encodings())
+
+
+class _BodyTooLarge(Exception):
+    """解壓後的請求主體超過上限"""
+
+
+def _decompress_stream(stream, encoding: str, max_bytes: int) -> bytes:
+    """串流解壓請求主體，累計輸出超過 max_bytes 時立即中止
+
+    每次解壓的輸出長度皆受限於剩餘額度，單一小區塊無法展開成巨大緩衝。
+    """
+    if encoding == 'zstd':
+        return _decompress_zstd(stream, max_bytes)
+
+    # wbits=16+MAX_WBITS：解析 gzip 標頭
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = []
+    total = 0
+    while True:
+        chunk = stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        out = decompressor.decompress(chunk, max_bytes - total + 1)
+        while out:
+            total += len(out)
+            if total > max_bytes:
+                raise _BodyTooLarge()
+            chunks.append(out)
+            if not decompressor.unconsumed_tail:
+                break
+            out = decompressor.decompress(decompressor.unconsumed_tail, max_bytes - total + 1)
+    tail = decompressor.flush()
+    total += len(tail)
+    if total > max_bytes:
+        raise _BodyTooLarge()
+    chunks.append(tail)
+    return b''.join(chunks)
+
+
+def _decompress_zstd(stream, max_bytes: int) -> bytes:
+    """以 stream_reader 解壓 zstd 主體，每次讀取的輸出長度不超過剩餘額度"""
+    reader = zstandard.ZstdDecompressor().stream_reader(stream)
+    chunks = []
+    total = 0
+    while True:
+        out = reader.read(min(_READ_CHUNK_SIZE, max_bytes - total + 1))
+        if not out:
+            break
+        total += len(out)
+        if total > max_bytes:
+            raise _BodyTooLarge()
+        chunks.append(out)
+    return b''.join(chunks)
+
+
+def read_json_body(max_bytes: Optional[int] = None) -> Tuple[Optional[Any], Optional[Tuple[Response, int]]]:
+    """讀取（可能經壓縮的）JSON 請求主體
+
+    依 Content-Encoding 以串流方式解壓 gzip / zstd 主體，解壓後大小超過上限時中止。
+    未壓縮的請求行為與 request.get_json(silent=True) 相同。
+
+    Args:
+        max_bytes: 解壓後的大小上限（預設 MAX_DECOMPRESSED_BYTES）
+
+    Returns:
+        (data, error_response)：成功時 error_response 為 None；
+        主體無法解析為 JSON 時 data 為 None（由呼叫端回傳 400）
+    """
+    if max_bytes is None:
+        max_bytes = MAX_DECOMPRESSED_BYTES
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return request.get_json(silent=True), None
+
+    if encoding not in supported_encodings():
+        response = jsonify({
+            "success": False,
+            "error": f"Unsupported Content-Encoding '{encoding}'"
+        })
+        response.headers['Accept-Encoding'] = _accept_encoding_header()
+        return None, (response, 415)
+
+    try:
+        raw = _decompress_stream(request.stream, encoding, max_bytes)
+    except _BodyTooLarge:
+        logger.warning(f"Rejected {encoding} request body exceeding {max_bytes} bytes after decompression")
+        return None, (jsonify({
+            "success": False,
+            "error": f"Request body too large (max {max_bytes} bytes decompressed)"
+        }), 413)
+    except Exception as e:
+        logger.warning(f"Failed to decompress {encoding} request body: {e}")
+        return None, (jsonify({"success": False, "error": "Invalid compressed body"}), 400)
+
+    try:
+        return json.loads(raw), None
+    except ValueError:
+        return None, None
+
+
+def _choose_encoding() -> Optional[str]:
+    """依 Accept-Encoding 與 q 值選擇回應編碼"""
+    accept = request.accept_encodings
+    best = None
+    best_quality = 0.0
+    for encoding in supported_encodings():
+        quality = accept.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compress_chunks(chunks: Iterable[Any], encoding: str) -> Iterator[bytes]:
+    """逐塊壓縮串流回應；每塊後 sync flush，讓客戶端能即時解壓已收到的資料"""
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        sync_flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        sync_flush = zlib.Z_SYNC_FLUSH
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            out = compressor.compress(chunk) + compressor.flush(sync_flush)
+            if out:
+                yield out
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response: Response) -> Response:
+    """after_request 鉤子：依 Accept-Encoding 壓縮較大的 JSON 回應
+
+    同時以 Accept-Encoding 回應標頭告知客戶端伺服器接受的請求編碼（RFC 7694），
+    客戶端據此決定後續上傳是否壓縮。
+    """
+    response.headers['Accept-Encoding'] = _accept_encoding_header()
+    response.vary.add('Accept-Encoding')
+
+    if (
+        response.direct_passthrough
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+
+    if response.is_streamed:
+        # 串流回應不可 get_data()（會將整個串流讀入記憶體），改為逐塊壓縮
+        encoding = _choose_encoding() if response.mimetype in STREAM_COMPRESSIBLE_MIMETYPES else None
+        if encoding is not None:
+            response.response = _compress_chunks(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    if response.mimetype != 'application/json':
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if encoding == 'zstd':
+        compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # 強 ETag 必須區分不同內容編碼的表示；比對時由 conditional.etag_matches 去除後綴
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
@@ -0,0 +1,76 @@
+# imports
+import hashlib
+import json
+from typing import Any, Optional
+
+from flask import Response, jsonify, request
+
+from .compression import supported_encodings
+
+
+def compute_etag(payload: Any) -> str:
+    """以內容雜湊產生強 ETag 值（不含引號）
+
+    以排序鍵、緊湊分隔符的 JSON 正規化後取 SHA-256，
+    相同內容必得相同 ETag，與字典鍵順序無關。
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+def _strip_encoding_suffix(tag: str) -> str:
+    """移除壓縮回應附加的 -gzip / -zstd 後綴（見 compress_response）"""
+    for encoding in supported_encodings():
+        suffix = f'-{encoding}'
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def etag_matches(etag: str) -> Optional[str]:
+    """檢查 If-None-Match 是否包含指定 ETag
+
+    Args:
+        etag: 目前表示的 ETag 值（不含引號）
+
+    Returns:
+        符合時返回客戶端送出的標籤（可能帶壓縮後綴），否則 None
+    """
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+    if if_none_match.star_tag:
+        return etag
+    for tag in if_none_match.as_set():
+        if _strip_encoding_suffix(tag) == etag:
+            return tag
+    return None
+
+
+def not_modified(tag: str) -> Response:
+    """304 Not Modified 回應（無主體）"""
+    response = Response(status=304)
+    response.set_etag(tag)
+    return response
+
+
+def conditional_json(payload: Any, etag: Optional[str] = None, status: int = 200) -> Response:
+    """回傳帶強 ETag 的 JSON 回應；If-None-Match 符合時改回 304
+
+    Args:
+        payload: 回應內容
+        etag: ETag 值（不含引號）；None 時以內容雜湊計算
+        status: 內容回應的狀態碼
+
+    Returns:
+        Flask Response
+    """
+    if etag is None:
+        etag = compute_etag(payload)
+    matched = etag_matches(etag)
+    if matched is not None:
+        return not_modified(matched)
+    response = jsonify(payload)
+    response.status_code = status
+    response.set_etag(etag)
+    return response
@@ -3,24 +3,36 @@ import json
 import logging
 import re
 import sqlite3
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timezone
 from functools import wraps
 from pathlib import Path
-from typing import Any, Dict, Generator, List, Optional
+from typing import Any, Dict, Generator, List, Optional, Tuple
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from werkzeug.utils import secure_filename
 
 from .auth import CloudAuthService
+from .compression import compress_response, read_json_body
+from .conditional import conditional_json
 
 logger = logging.getLogger(__name__)
 
 # 僅允許安全的 user_id 字元（A-Z a-z 0-9 _ -），長度 1-64，防止路徑穿越
 _SAFE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
 
+# NDJSON 串流下載每次從 SQLite 游標取出並送出的列數
+STREAM_FETCH_SIZE = 500
+
+# 批次同步單次請求的操作數上限
+MAX_BATCH_OPS = 500
+
+# 批次同步支援的操作類型（對應 Edge CloudSyncQueue 的 op_type）
+BATCH_OP_TYPES = ('user_settings', 'command_history')
+
 # Blueprint
 data_sync_bp = Blueprint('data_sync', __name__, url_prefix='/api/cloud/data_sync')
+data_sync_bp.after_request(compress_response)
 
 # 認證服務實例（需在初始化時設定）
 _auth_service: Optional[CloudAuthService] = None
@@ -108,13 +120,7 @@ def _check_user_access(path_user_id: str):
     Returns:
         None 表示通過，否則回傳 Flask Response（403）
     """
-    token_user_id = getattr(request, 'user_id', None)
-    role = getattr(request, 'role', 'user')
-
-    if role == 'admin':
-        return None  # admin 可以存取所有用戶資料
-
-    if token_user_id != path_user_id:
+    if not _has_user_access(path_user_id):
         return jsonify({
             "error": "Forbidden",
             "message": "Access to another user's data is not allowed"
@@ -123,6 +129,13 @@ def _check_user_access(path_user_id: str):
     return None
 
 
+def _has_user_access(user_id: str) -> bool:
+    """token 用戶是否可存取指定用戶的資料（admin 可以存取所有用戶資料）"""
+    if getattr(request, 'role', 'user') == 'admin':
+        return True
+    return getattr(request, 'user_id', None) == user_id
+
+
 def _get_settings_path(user_id: str) -> Path:
     """取得用戶設定檔案路徑
 
@@ -199,6 +212,193 @@ def _ensure_history_table(conn: sqlite3.Connection) -> None:
         # 僅對 user_id 建立索引；id 是主鍵，SQLite 已自動索引，無需重複包含
         "CREATE INDEX IF NOT EXISTS idx_history_user ON command_history (user_id)"
     )
+    # 每位用戶的歷史記錄總筆數，由寫入時的 rowcount 維護，避免每次上傳都 COUNT(*) 全表
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_user_counts (
+            user_id     TEXT PRIMARY KEY,
+            total       INTEGER NOT NULL
+        )
+    """)
+    # 每個 (用戶, Edge) 已收到的最高 (created_at, command_id)，供 Edge 只上傳新記錄
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_watermarks (
+            user_id     TEXT NOT NULL,
+            edge_id     TEXT NOT NULL,
+            created_at  TEXT NOT NULL,
+            command_id  TEXT NOT NULL,
+            updated_at  TEXT NOT NULL,
+            PRIMARY KEY (user_id, edge_id)
+        )
+    """)
+
+
+def _record_watermark_key(record: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """取得記錄的水位鍵 (created_at, command_id)；缺少任一欄位時返回 None
+
+    created_at 須為 UTC ISO 8601 字串，才能以字串比較排序。
+    """
+    created_at = record.get('created_at')
+    command_id = record.get('command_id')
+    if not isinstance(created_at, str) or not created_at or not command_id:
+        return None
+    return created_at, str(command_id)
+
+
+def _get_watermark(conn: sqlite3.Connection, user_id: str, edge_id: str) -> Optional[Dict[str, str]]:
+    """取得 (用戶, Edge) 的上傳高水位"""
+    row = conn.execute(
+        "SELECT created_at, command_id FROM history_watermarks WHERE user_id = ? AND edge_id = ?",
+        (user_id, edge_id)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"created_at": row["created_at"], "command_id": row["command_id"]}
+
+
+def _advance_watermark(
+    conn: sqlite3.Connection,
+    user_id: str,
+    edge_id: str,
+    records: List[Dict[str, Any]],
+    now: str,
+) -> Optional[Dict[str, str]]:
+    """以本次上傳的記錄推進 (用戶, Edge) 的高水位（只前進不後退）
+
+    Returns:
+        推進後的高水位；沒有 Edge ID 或可比較的記錄時返回既有水位
+    """
+    if not edge_id:
+        return None
+
+    keys = [key for key in map(_record_watermark_key, records) if key is not None]
+    current = _get_watermark(conn, user_id, edge_id)
+    if not keys:
+        return current
+
+    newest = max(keys)
+    if current is not None and (current["created_at"], current["command_id"]) >= newest:
+        return current
+
+    conn.execute(
+        """
+        INSERT INTO history_watermarks (user_id, edge_id, created_at, command_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, edge_id) DO UPDATE SET
+            created_at = excluded.created_at,
+            command_id = excluded.command_id,
+            updated_at = excluded.updated_at
+        """,
+        (user_id, edge_id, newest[0], newest[1], now)
+    )
+    return {"created_at": newest[0], "command_id": newest[1]}
+
+
+def _add_user_count(conn: sqlite3.Connection, user_id: str, delta: int) -> int:
+    """以本次新增筆數更新用戶歷史總筆數計數器
+
+    計數器不存在（新用戶或升級前的資料庫）時以 COUNT(*) 回填一次，
+    之後僅做增量更新。呼叫時須已處於寫入交易內，讀寫之間不會被其他寫入插入。
+
+    Returns:
+        更新後的總筆數
+    """
+    updated = conn.execute(
+        "UPDATE history_user_counts SET total = total + ? WHERE user_id = ?",
+        (delta, user_id)
+    )
+    if updated.rowcount == 0:
+        total = conn.execute(
+            "SELECT COUNT(*) FROM command_history WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO history_user_counts (user_id, total) VALUES (?, ?)",
+            (user_id, total)
+        )
+        return total
+    return conn.execute(
+        "SELECT total FROM history_user_counts WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+
+
+def _get_user_count(conn: sqlite3.Connection, user_id: str) -> int:
+    """取得用戶歷史總筆數（優先使用計數器，不存在時退回 COUNT(*)）"""
+    row = conn.execute(
+        "SELECT total FROM history_user_counts WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    return conn.execute(
+        "SELECT COUNT(*) FROM command_history WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+
+
+def _save_settings(user_id: str, settings: Dict[str, Any], edge_id: Optional[str]) -> str:
+    """寫入用戶設定檔
+
+    Args:
+        user_id: 已驗證的用戶 ID
+        settings: 用戶設定
+        edge_id: 來源 Edge ID
+
+    Returns:
+        更新時間（ISO 格式）
+    """
+    updated_at = datetime.now(timezone.utc).isoformat()
+    payload: Dict[str, Any] = {
+        'user_id': user_id,
+        'settings': settings,
+        'edge_id': edge_id,
+        'updated_at': updated_at
+    }
+
+    settings_path = _get_settings_path(user_id)
+    with open(settings_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+
+    logger.info(f"Settings synced for user '{user_id}'")
+    return updated_at
+
+
+def _save_history(
+    conn: sqlite3.Connection,
+    user_id: str,
+    records: List[Dict[str, Any]],
+    edge_id: str,
+    synced_at: str,
+) -> Tuple[int, int, Optional[Dict[str, str]]]:
+    """寫入指令歷史記錄（以 (user_id, command_id) 去重）
+
+    Args:
+        conn: 歷史記錄資料庫連線
+        user_id: 已驗證的用戶 ID
+        records: 歷史記錄列表
+        edge_id: 來源 Edge ID
+        synced_at: 同步時間
+
+    Returns:
+        (本次新增筆數, 該用戶總筆數, 該 Edge 推進後的上傳高水位)
+    """
+    # INSERT OR IGNORE 以「第一次寫入為準」的策略去重：
+    # 歷史記錄一旦寫入即視為不可變，後續相同 command_id 的上傳
+    # 不會覆蓋既有資料。若需更新舊紀錄，應改用 INSERT OR REPLACE。
+    # executemany 的 rowcount 為所有實際插入列數的總和（被忽略的重複記錄不計入）
+    cursor = conn.executemany(
+        """
+        INSERT OR IGNORE INTO command_history
+            (user_id, command_id, edge_id, record_json, synced_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (
+            (user_id, record.get('command_id'), edge_id, json.dumps(record), synced_at)
+            for record in records
+            if record.get('command_id')
+        )
+    )
+    synced_count = max(cursor.rowcount, 0)
+
+    total = _add_user_count(conn, user_id, synced_count)
+    watermark = _advance_watermark(conn, user_id, edge_id, records, synced_at)
+    return synced_count, total, watermark
 
 
 # ==================== 用戶設定同步端點 ====================
@@ -234,7 +434,9 @@ def upload_settings(user_id: str):
     if access_error is not None:
         return access_error
 
-    data = request.get_json(silent=True)
+    data, body_error = read_json_body()
+    if body_error is not None:
+        return body_error
     if not data or not isinstance(data, dict):
         return jsonify({"success": False, "error": "Invalid JSON body"}), 400
 
@@ -243,19 +445,7 @@ def upload_settings(user_id: str):
         return jsonify({"success": False, "error": "Missing or invalid 'settings' field"}), 400
 
     try:
-        updated_at = datetime.now(timezone.utc).isoformat()
-        payload: Dict[str, Any] = {
-            'user_id': user_id,
-            'settings': settings,
-            'edge_id': data.get('edge_id'),
-            'updated_at': updated_at
-        }
-
-        settings_path = _get_settings_path(user_id)
-        with open(settings_path, 'w', encoding='utf-8') as f:
-            json.dump(payload, f, indent=2, ensure_ascii=False)
-
-        logger.info(f"Settings synced for user '{user_id}'")
+        updated_at = _save_settings(user_id, settings, data.get('edge_id'))
         return jsonify({
             "success": True,
             "message": "Settings synced",
@@ -285,6 +475,7 @@ def download_settings(user_id: str):
                 "updated_at": "2026-01-01T00:00:00Z"
             }
         }
+        回應帶內容雜湊的強 ETag；If-None-Match 符合時回傳 304（無主體）。
     """
     if _storage_path is None:
         return jsonify({"success": False, "error": "Storage not initialized"}), 503
@@ -304,7 +495,7 @@ def download_settings(user_id: str):
         with open(settings_path, 'r', encoding='utf-8') as f:
             payload = json.load(f)
 
-        return jsonify({"success": True, "data": payload})
+        return conditional_json({"success": True, "data": payload})
 
     except Exception as e:
         logger.error(f"Failed to load settings for user '{user_id}': {e}")
@@ -340,11 +531,13 @@ def upload_history(user_id: str):
         {
             "success": true,
             "synced_count": 5,
-            "total": 42
+            "total": 42,
+            "watermark": {"created_at": "...", "command_id": "cmd-001"}
         }
 
     Note:
         歷史記錄儲存於 SQLite，以 (user_id, command_id) 為唯一鍵自動去重。
+        每個 (user_id, edge_id) 記錄已收到的最高 (created_at, command_id) 作為上傳高水位。
         SQLite WAL 模式支援多讀單寫並行，不需額外執行緒鎖。
     """
     if _storage_path is None:
@@ -357,7 +550,9 @@ def upload_history(user_id: str):
     if access_error is not None:
         return access_error
 
-    data = request.get_json(silent=True)
+    data, body_error = read_json_body()
+    if body_error is not None:
+        return body_error
     if not data or not isinstance(data, dict):
         return jsonify({"success": False, "error": "Invalid JSON body"}), 400
 
@@ -369,28 +564,8 @@ def upload_history(user_id: str):
     synced_at = datetime.now(timezone.utc).isoformat()
 
     try:
-        synced_count = 0
         with _history_db_conn() as conn:
-            for record in records:
-                command_id = record.get('command_id')
-                if not command_id:
-                    continue
-                cursor = conn.execute(
-                    """
-                    INSERT OR IGNORE INTO command_history
-                        (user_id, command_id, edge_id, record_json, synced_at)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    # INSERT OR IGNORE 以「第一次寫入為準」的策略去重：
-                    # 歷史記錄一旦寫入即視為不可變，後續相同 command_id 的上傳
-                    # 不會覆蓋既有資料。若需更新舊紀錄，應改用 INSERT OR REPLACE。
-                    (user_id, command_id, edge_id, json.dumps(record), synced_at)
-                )
-                synced_count += cursor.rowcount
-
-            total = conn.execute(
-                "SELECT COUNT(*) FROM command_history WHERE user_id = ?", (user_id,)
-            ).fetchone()[0]
+            synced_count, total, watermark = _save_history(conn, user_id, records, edge_id, synced_at)
 
         logger.info(
             f"History synced for user '{user_id}': "
@@ -399,7 +574,8 @@ def upload_history(user_id: str):
         return jsonify({
             "success": True,
             "synced_count": synced_count,
-            "total": total
+            "total": total,
+            "watermark": watermark
         })
 
     except Exception as e:
@@ -417,20 +593,26 @@ def download_history(user_id: str):
 
     Query Parameters:
         limit: 返回記錄數上限（預設 100，最大 1000）
-        offset: 查詢偏移量（預設 0）
+        offset: 查詢偏移量（預設 0，提供 cursor 時忽略）
+        cursor: 增量下載游標（上一頁回傳的 next_cursor，從 0 開始）
+        exclude_edge_id: 排除由此 Edge 上傳的記錄（Edge 拉取其他裝置的新記錄時使用）
 
     Response:
         {
             "success": true,
             "data": {
                 "records": [...],
-                "total": 42
+                "total": 42,
+                "next_cursor": 57,
+                "has_more": false
             }
         }
 
     Note:
         分頁查詢透過 SQLite LIMIT/OFFSET 實作，僅讀取所需資料列，
         不需將全部記錄載入記憶體。
+        提供 cursor 時改用 keyset 分頁（id > cursor），成本只與新記錄數相關，
+        並省略需掃描全部記錄的 total（回傳 null）。
     """
     if _storage_path is None:
         return jsonify({"success": False, "error": "Storage not initialized"}), 503
@@ -445,34 +627,326 @@ def download_history(user_id: str):
     try:
         limit = request.args.get('limit', 100, type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor', None, type=int)
+        exclude_edge_id = request.args.get('exclude_edge_id')
         limit = min(max(limit, 1), 1000)
         offset = max(offset, 0)
 
+        # exclude_edge_id 為 NULL 時條件恆真
+        edge_filter = (exclude_edge_id or None,) * 2
+
         with _history_db_conn() as conn:
-            total = conn.execute(
-                "SELECT COUNT(*) FROM command_history WHERE user_id = ?", (user_id,)
-            ).fetchone()[0]
-
-            rows = conn.execute(
-                """
-                SELECT record_json FROM command_history
-                WHERE user_id = ?
-                ORDER BY id
-                LIMIT ? OFFSET ?
-                """,
-                (user_id, limit, offset)
-            ).fetchall()
+            if cursor is not None:
+                total = None
+                rows = conn.execute(
+                    """
+                    SELECT id, record_json FROM command_history
+                    WHERE user_id = ? AND id > ?
+                      AND (? IS NULL OR edge_id IS NULL OR edge_id != ?)
+                    ORDER BY id
+                    LIMIT ?
+                    """,
+                    (user_id, max(cursor, 0), *edge_filter, limit + 1)
+                ).fetchall()
+            else:
+                if exclude_edge_id:
+                    total = conn.execute(
+                        """
+                        SELECT COUNT(*) FROM command_history
+                        WHERE user_id = ? AND (edge_id IS NULL OR edge_id != ?)
+                        """,
+                        (user_id, exclude_edge_id)
+                    ).fetchone()[0]
+                else:
+                    total = _get_user_count(conn, user_id)
+                rows = conn.execute(
+                    """
+                    SELECT id, record_json FROM command_history
+                    WHERE user_id = ? AND (? IS NULL OR edge_id IS NULL OR edge_id != ?)
+                    ORDER BY id
+                    LIMIT ? OFFSET ?
+                    """,
+                    (user_id, *edge_filter, limit + 1, offset)
+                ).fetchall()
 
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         page: List[Dict[str, Any]] = [json.loads(row["record_json"]) for row in rows]
+        if rows:
+            next_cursor = rows[-1]["id"]
+        else:
+            next_cursor = cursor
 
         return jsonify({
             "success": True,
             "data": {
                 "records": page,
-                "total": total
+                "total": total,
+                "next_cursor": next_cursor,
+                "has_more": has_more
             }
         })
 
     except Exception as e:
         logger.error(f"Failed to load history for user '{user_id}': {e}")
         return jsonify({"success": False, "error": "Failed to load history"}), 500
+
+
+@data_sync_bp.route('/history/<user_id>/stream', methods=['GET'])
+@_require_auth
+def stream_history(user_id: str):
+    """以 NDJSON 串流下載指令執行歷史（游標分頁）
+
+    直接從 SQLite 游標逐批讀取並送出，記憶體用量與記錄總數無關，
+    適合全新 Edge 還原完整歷史。
+
+    Path Parameters:
+        user_id: 用戶 ID
+
+    Query Parameters:
+        cursor: 起始游標（不含，預設 0 表示從頭開始）
+        limit: 本次最多送出的記錄數（預設 0 表示不限制）
+        exclude_edge_id: 排除由此 Edge 上傳的記錄
+
+    Response (application/x-ndjson):
+        {"id": 1, "record": {...}}
+        {"id": 2, "record": {...}}
+        {"done": true, "next_cursor": 2, "count": 2, "has_more": false}
+
+    Note:
+        最後一行為結尾標記；串流中途失敗時結尾為 {"done": false, "error": "..."}，
+        客戶端未收到 done=true 即應視為不完整，並從最後收到的 id 繼續。
+    """
+    if _storage_path is None:
+        return jsonify({"success": False, "error": "Storage not initialized"}), 503
+
+    if not _validate_user_id(user_id):
+        return jsonify({"success": False, "error": "Invalid user_id"}), 400
+
+    access_error = _check_user_access(user_id)
+    if access_error is not None:
+        return access_error
+
+    cursor = max(request.args.get('cursor', 0, type=int), 0)
+    limit = max(request.args.get('limit', 0, type=int), 0)
+    exclude_edge_id = request.args.get('exclude_edge_id') or None
+
+    def generate() -> Generator[str, None, None]:
+        next_cursor = cursor
+        count = 0
+        try:
+            with _history_db_conn() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT id, record_json FROM command_history
+                    WHERE user_id = ? AND id > ?
+                      AND (? IS NULL OR edge_id IS NULL OR edge_id != ?)
+                    ORDER BY id
+                    """,
+                    (user_id, cursor, exclude_edge_id, exclude_edge_id)
+                )
+                has_more = False
+                while True:
+                    fetch_size = STREAM_FETCH_SIZE if not limit else min(STREAM_FETCH_SIZE, limit - count)
+                    batch = rows.fetchmany(fetch_size) if fetch_size > 0 else []
+                    if not batch:
+                        # 達到 limit 時多讀一列判斷是否還有後續記錄
+                        has_more = bool(limit) and count >= limit and rows.fetchone() is not None
+                        break
+                    # record_json 已是 JSON 字串，直接嵌入避免重新解析與序列化
+                    yield ''.join(
+                        f'{{"id": {row["id"]}, "record": {row["record_json"]}}}\n' for row in batch
+                    )
+                    count += len(batch)
+                    next_cursor = batch[-1]["id"]
+        except Exception as e:
+            logger.error(f"Failed to stream history for user '{user_id}': {e}")
+            yield json.dumps({"done": False, "error": "Failed to stream history", "next_cursor": next_cursor}) + '\n'
+            return
+
+        logger.info(f"Streamed {count} history records for user '{user_id}'")
+        yield json.dumps({"done": True, "next_cursor": next_cursor, "count": count, "has_more": has_more}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@data_sync_bp.route('/history/<user_id>/watermark', methods=['GET'])
+@_require_auth
+def get_history_watermark(user_id: str):
+    """取得 Edge 上傳指令歷史的高水位
+
+    Edge 遺失本地水位（例如重新安裝）時以此還原，只上傳雲端尚未收到的記錄。
+
+    Path Parameters:
+        user_id: 用戶 ID
+
+    Query Parameters:
+        edge_id: Edge 裝置 ID（必填）
+
+    Response:
+        {
+            "success": true,
+            "data": {"created_at": "2026-01-01T00:00:00+00:00", "command_id": "cmd-001"}
+        }
+        尚無水位時 data 為 null。
+    """
+    if _storage_path is None:
+        return jsonify({"success": False, "error": "Storage not initialized"}), 503
+
+    if not _validate_user_id(user_id):
+        return jsonify({"success": False, "error": "Invalid user_id"}), 400
+
+    access_error = _check_user_access(user_id)
+    if access_error is not None:
+        return access_error
+
+    edge_id = request.args.get('edge_id')
+    if not edge_id:
+        return jsonify({"success": False, "error": "Missing 'edge_id' parameter"}), 400
+
+    try:
+        with _history_db_conn() as conn:
+            watermark = _get_watermark(conn, user_id, edge_id)
+        return jsonify({"success": True, "data": watermark})
+    except Exception as e:
+        logger.error(f"Failed to load history watermark for user '{user_id}': {e}")
+        return jsonify({"success": False, "error": "Failed to load watermark"}), 500
+
+
+# ==================== 批次同步端點 ====================
+
+@data_sync_bp.route('/batch', methods=['POST'])
+@_require_auth
+def upload_batch():
+    """批次上傳多個同步操作（Edge 同步佇列補發）
+
+    單一請求攜帶多個不同類型的操作，依陣列順序（即 Edge 佇列的 seq 順序）處理，
+    並回傳逐筆結果；單筆失敗不影響其他操作。
+
+    Request Body:
+        {
+            "ops": [
+                {"op_id": "uuid-1", "op_type": "user_settings",
+                 "payload": {"user_id": "user-123", "settings": {...}}},
+                {"op_id": "uuid-2", "op_type": "command_history",
+                 "payload": {"user_id": "user-123", "records": [...]}}
+            ],
+            "edge_id": "edge-001"
+        }
+
+    Response:
+        {
+            "success": true,
+            "results": [
+                {"op_id": "uuid-1", "success": true, "updated_at": "..."},
+                {"op_id": "uuid-2", "success": false, "status": 403, "error": "Forbidden"}
+            ],
+            "succeeded": 1,
+            "failed": 1
+        }
+
+    Note:
+        同一批次的所有 command_history 操作共用一個 SQLite 連線與交易，
+        每筆操作以 SAVEPOINT 隔離，失敗時僅回滾該筆。
+    """
+    if _storage_path is None:
+        return jsonify({"success": False, "error": "Storage not initialized"}), 503
+
+    data, body_error = read_json_body()
+    if body_error is not None:
+        return body_error
+    if not data or not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Invalid JSON body"}), 400
+
+    ops = data.get('ops')
+    if not isinstance(ops, list):
+        return jsonify({"success": False, "error": "Missing or invalid 'ops' field"}), 400
+    if len(ops) > MAX_BATCH_OPS:
+        return jsonify({
+            "success": False,
+            "error": f"Too many ops in batch (max {MAX_BATCH_OPS})"
+        }), 413
+
+    edge_id = data.get('edge_id')
+    synced_at = datetime.now(timezone.utc).isoformat()
+    has_history = any(isinstance(op, dict) and op.get('op_type') == 'command_history' for op in ops)
+
+    results: List[Dict[str, Any]] = []
+    try:
+        with (_history_db_conn() if has_history else nullcontext()) as conn:
+            for op in ops:
+                results.append(_apply_batch_op(conn, op, edge_id, synced_at))
+    except Exception as e:
+        logger.error(f"Failed to apply sync batch: {e}")
+        return jsonify({"success": False, "error": "Failed to apply batch"}), 500
+
+    succeeded = sum(1 for r in results if r['success'])
+    logger.info(
+        f"Sync batch applied: {succeeded}/{len(results)} ops succeeded "
+        f"(edge '{edge_id}')"
+    )
+    return jsonify({
+        "success": True,
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded
+    })
+
+
+def _apply_batch_op(
+    conn: Optional[sqlite3.Connection],
+    op: Any,
+    edge_id: Optional[str],
+    synced_at: str,
+) -> Dict[str, Any]:
+    """處理批次中的單一操作，回傳該操作的結果（不拋出例外）"""
+    if not isinstance(op, dict):
+        return {"op_id": None, "success": False, "status": 400, "error": "Invalid op"}
+
+    op_id = op.get('op_id')
+    op_type = op.get('op_type')
+    payload = op.get('payload')
+
+    def _fail(status: int, error: str) -> Dict[str, Any]:
+        return {"op_id": op_id, "success": False, "status": status, "error": error}
+
+    if op_type not in BATCH_OP_TYPES:
+        return _fail(400, f"Unsupported op_type: {op_type}")
+    if not isinstance(payload, dict):
+        return _fail(400, "Missing or invalid 'payload' field")
+
+    user_id = payload.get('user_id')
+    if not isinstance(user_id, str) or not _validate_user_id(user_id):
+        return _fail(400, "Invalid user_id")
+    if not _has_user_access(user_id):
+        return _fail(403, "Forbidden")
+
+    op_edge_id = payload.get('edge_id') or edge_id
+
+    if op_type == 'user_settings':
+        settings = payload.get('settings')
+        if not isinstance(settings, dict):
+            return _fail(400, "Missing or invalid 'settings' field")
+        try:
+            updated_at = _save_settings(user_id, settings, op_edge_id)
+        except Exception as e:
+            logger.error(f"Failed to save settings for user '{user_id}' in batch: {e}")
+            return _fail(500, "Failed to save settings")
+        return {"op_id": op_id, "success": True, "updated_at": updated_at}
+
+    records = payload.get('records')
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        return _fail(400, "Missing or invalid 'records' field")
+    conn.execute("SAVEPOINT batch_op")
+    try:
+        synced_count, total, watermark = _save_history(conn, user_id, records, op_edge_id or '', synced_at)
+    except Exception as e:
+        conn.execute("ROLLBACK TO SAVEPOINT batch_op")
+        conn.execute("RELEASE SAVEPOINT batch_op")
+        logger.error(f"Failed to save history for user '{user_id}' in batch: {e}")
+        return _fail(500, "Failed to save history")
+    conn.execute("RELEASE SAVEPOINT batch_op")
+    return {
+        "op_id": op_id, "success": True,
+        "synced_count": synced_count, "total": total, "watermark": watermark
+    }
@@ -6,13 +6,13 @@ Cloud API Flask 路由
 
 import logging
 from functools import wraps
-from io import BytesIO
 from typing import Optional
 
 from flask import Blueprint, request, jsonify, send_file
 
 from .auth import CloudAuthService
-from .storage import CloudStorageService
+from .storage import ChunkHashMismatchError, CloudStorageService, UploadOffsetMismatchError
+from .storage_index import StorageQuotaExceededError
 
 
 logger = logging.getLogger(__name__)
@@ -25,17 +25,21 @@ auth_service: Optional[CloudAuthService] = None
 storage_service: Optional[CloudStorageService] = None
 
 
-def init_cloud_services(jwt_secret: str, storage_path: str):
+def init_cloud_services(jwt_secret: str, storage_path: str, max_user_bytes: Optional[int] = None):
     """
     初始化雲服務
 
     Args:
         jwt_secret: JWT 密鑰
         storage_path: 儲存路徑
+        max_user_bytes: 每位使用者的儲存配額（位元組），None 表示不限制
     """
     global auth_service, storage_service
+    if storage_service is not None:
+        storage_service.stop_garbage_collector()
     auth_service = CloudAuthService(jwt_secret)
-    storage_service = CloudStorageService(storage_path)
+    storage_service = CloudStorageService(storage_path, max_user_bytes=max_user_bytes)
+    storage_service.start_garbage_collector()
     logger.info("Cloud services initialized")
 
 
@@ -173,6 +177,9 @@ def upload_file():
 
         return jsonify(result), 200
 
+    except StorageQuotaExceededError:
+        logger.warning(f"Storage quota exceeded for user {request.user_id}")
+        return jsonify({"error": "Payload Too Large", "message": "Storage quota exceeded"}), 413
     except ValueError:
         logger.warning("File upload validation error", exc_info=True)
         return jsonify({"error": "Bad Request", "message": "Invalid request"}), 400
@@ -181,11 +188,162 @@ def upload_file():
         return jsonify({"error": "Internal Server Error", "message": "An internal error has occurred"}), 500
 
 
+@cloud_bp.route('/storage/uploads', methods=['POST'])
+@require_auth
+def create_upload_session():
+    """
+    建立可續傳上傳工作階段
+
+    Request Body (JSON):
+        {
+            "filename": "firmware.bin",
+            "category": "general",      // 可選
+            "size": 104857600,          // 可選，檔案總大小
+            "sha256": "abc123...",      // 可選，完成時驗證整個檔案
+            "metadata": {}              // 可選
+        }
+
+    Response:
+        201 {"session_id": "...", "offset": 0, "size": 104857600, ...}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+        if not filename or not isinstance(filename, str):
+            return jsonify({"error": "Bad Request", "message": "filename is required"}), 400
+        size = data.get('size')
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool)):
+            return jsonify({"error": "Bad Request", "message": "size must be an integer"}), 400
+        metadata = data.get('metadata')
+        if metadata is not None and not isinstance(metadata, dict):
+            return jsonify({"error": "Bad Request", "message": "metadata must be an object"}), 400
+
+        session = storage_service.create_upload_session(
+            user_id=request.user_id,
+            filename=filename,
+            category=data.get('category', 'general'),
+            size=size,
+            sha256=data.get('sha256'),
+            metadata=metadata
+        )
+        return jsonify(session), 201
+
+    except StorageQuotaExceededError:
+        logger.warning(f"Storage quota exceeded for user {request.user_id}")
+        return jsonify({"error": "Payload Too Large", "message": "Storage quota exceeded"}), 413
+    except ValueError:
+        logger.warning("Upload session validation error", exc_info=True)
+        return jsonify({"error": "Bad Request", "message": "Invalid request"}), 400
+    except Exception:
+        logger.error("Upload session creation error", exc_info=True)
+        return jsonify({"error": "Internal Server Error", "message": "An internal error has occurred"}), 500
+
+
+@cloud_bp.route('/storage/uploads/<session_id>', methods=['GET'])
+@require_auth
+def get_upload_session(session_id: str):
+    """
+    查詢工作階段已接收的位元組數
+
+    Response:
+        200 {"session_id": "...", "offset": 52428800, ...}；不存在時 404
+    """
+    session = storage_service.get_upload_session(session_id, request.user_id)
+    if session is None:
+        return jsonify({"error": "Not Found", "message": "Upload session not found"}), 404
+    return jsonify(session), 200
+
+
+@cloud_bp.route('/storage/uploads/<session_id>', methods=['PUT'])
+@require_auth
+def upload_chunk(session_id: str):
+    """
+    上傳一個區塊（請求主體為原始位元組）
+
+    Request Headers:
+        Upload-Offset: 區塊起始位置（必須等於已接收的位元組數）
+        X-Chunk-SHA256: 區塊的 SHA-256（可選，不符時區塊被捨棄）
+
+    Response:
+        200 {"offset": <已接收位元組數>, ...}
+        409 offset 不符，回應含目前的 offset
+        400 區塊雜湊不符或超過大小上限；404 工作階段不存在
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({"error": "Bad Request", "message": "Upload-Offset header is required"}), 400
+
+    try:
+        session = storage_service.upload_chunk(
+            session_id=session_id,
+            user_id=request.user_id,
+            offset=offset,
+            chunk_data=request.stream,
+            chunk_sha256=request.headers.get('X-Chunk-SHA256')
+        )
+        if session is None:
+            return jsonify({"error": "Not Found", "message": "Upload session not found"}), 404
+        return jsonify(session), 200
+
+    except UploadOffsetMismatchError as e:
+        return jsonify({"error": "Conflict", "message": "Offset mismatch", "offset": e.offset}), 409
+    except ChunkHashMismatchError:
+        return jsonify({"error": "Bad Request", "message": "Chunk checksum mismatch"}), 400
+    except ValueError:
+        logger.warning("Upload chunk validation error", exc_info=True)
+        return jsonify({"error": "Bad Request", "message": "Invalid request"}), 400
+    except Exception:
+        logger.error("Upload chunk error", exc_info=True)
+        return jsonify({"error": "Internal Server Error", "message": "An internal error has occurred"}), 500
+
+
+@cloud_bp.route('/storage/uploads/<session_id>/complete', methods=['POST'])
+@require_auth
+def complete_upload_session(session_id: str):
+    """
+    完成上傳，存入儲存區
+
+    Response:
+        200 與 /storage/upload 相同的上傳結果
+        400 尚未收齊或雜湊不符；413 超過配額；404 工作階段不存在
+    """
+    try:
+        result = storage_service.finalize_upload_session(session_id, request.user_id)
+        if result is None:
+            return jsonify({"error": "Not Found", "message": "Upload session not found"}), 404
+        return jsonify(result), 200
+
+    except StorageQuotaExceededError:
+        logger.warning(f"Storage quota exceeded for user {request.user_id}")
+        return jsonify({"error": "Payload Too Large", "message": "Storage quota exceeded"}), 413
+    except ValueError as e:
+        logger.warning(f"Upload session {session_id} cannot be completed: {e}")
+        return jsonify({"error": "Bad Request", "message": "Upload incomplete or checksum mismatch"}), 400
+    except Exception:
+        logger.error("Upload completion error", exc_info=True)
+        return jsonify({"error": "Internal Server Error", "message": "An internal error has occurred"}), 500
+
+
+@cloud_bp.route('/storage/uploads/<session_id>', methods=['DELETE'])
+@require_auth
+def abort_upload_session(session_id: str):
+    """
+    中止上傳並刪除已接收的資料
+
+    Response:
+        200 {"message": "Upload session aborted"}；不存在時 404
+    """
+    if not storage_service.abort_upload_session(session_id, request.user_id):
+        return jsonify({"error": "Not Found", "message": "Upload session not found"}), 404
+    return jsonify({"message": "Upload session aborted"}), 200
+
+
 @cloud_bp.route('/storage/download/<file_id>', methods=['GET'])
 @require_auth
 def download_file(file_id: str):
     """
-    下載檔案
+    下載檔案（串流傳送，支援 HTTP Range 續傳）
 
     Path Parameters:
         file_id: 檔案 ID
@@ -193,27 +351,37 @@ def download_file(file_id: str):
     Query Parameters:
         category: 檔案類別（可選，預設 "general"）
 
+    Request Headers:
+        Range: bytes=<start>-<end>（可選，續傳時使用）
+        If-Range / If-None-Match: 以 ETag（即檔案 SHA-256）驗證續傳的檔案未變更
+
     Response:
-        檔案內容（binary）
+        200 檔案內容（binary）；帶 Range 時為 206 部分內容，範圍無效時為 416
+
+    Note:
+        以檔案路徑交給 send_file，不將檔案讀入記憶體；WSGI 伺服器支援
+        wsgi.file_wrapper 時使用 sendfile，設定 USE_X_SENDFILE 時改由前端代理傳送。
     """
     try:
         category = request.args.get('category', 'general')
 
-        # 下載檔案
-        content = storage_service.download_file(
+        file_path = storage_service.get_file_path(
             file_id=file_id,
             user_id=request.user_id,
             category=category
         )
 
-        if content is None:
+        if file_path is None:
             return jsonify({"error": "Not Found", "message": "File not found"}), 404
 
-        # 返回檔案
+        # 檔案以內容雜湊命名，file_id 即為強 ETag
         return send_file(
-            BytesIO(content),
+            file_path,
+            mimetype='application/octet-stream',
             download_name=f"{file_id}",
-            as_attachment=True
+            as_attachment=True,
+            conditional=True,
+            etag=file_id
         )
 
     except Exception as e:
@@ -235,9 +403,14 @@ def list_files():
             "files": [
                 {
                     "file_id": "abc123",
-                    "filename": "test.txt",
+                    "storage_filename": "abc123.txt",
+                    "filename": "abc123.txt",
+                    "original_filename": "test.txt",
                     "size": 1024,
+                    "hash": "abc123",
                     "category": "general",
+                    "metadata": {},
+                    "uploaded_at": "2025-01-01T00:00:00Z",
                     "modified_at": "2025-01-01T00:00:00Z"
                 }
             ],
@@ -323,6 +496,34 @@ def get_stats():
         return jsonify({"error": "Internal Server Error", "message": "Failed to retrieve storage statistics"}), 500
 
 
+@cloud_bp.route('/storage/dedup', methods=['GET'])
+@require_auth
+def get_dedup_report():
+    """
+    取得跨使用者去重報告（僅限 admin）
+
+    Response:
+        {
+            "references": 500,
+            "logical_bytes": 52428800000,
+            "blobs": 1,
+            "stored_bytes": 104857600,
+            "bytes_saved": 52323942400,
+            "dedup_ratio": 500.0,
+            "orphaned_blobs": 0,
+            "orphaned_bytes": 0,
+            "dedup_enabled": true
+        }
+    """
+    if getattr(request, 'role', None) != 'admin':
+        return jsonify({"error": "Forbidden", "message": "Admin role required"}), 403
+    try:
+        return jsonify(storage_service.get_dedup_report()), 200
+    except Exception as e:
+        logger.error(f"Dedup report error: {e}", exc_info=True)
+        return jsonify({"error": "Internal Server Error", "message": "Failed to retrieve dedup report"}), 500
+
+
 @cloud_bp.route('/health', methods=['GET'])
 def health_check():
     """
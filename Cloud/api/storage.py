@@ -3,19 +3,29 @@
 
 提供檔案上傳、下載、管理等功能
 目前支援本地檔案系統儲存（可擴充整合 S3 相容的物件儲存）
+
+檔案內容存放於全域內容儲存區 .blobs/（以 SHA-256 為鍵），{category}/{user_id}/ 下的檔案
+為 blob 的硬連結；引用數記錄於元數據索引，歸零的 blob 由垃圾回收刪除。
 """
 
 import hashlib
+import json
 import logging
 import os
 import re
+import secrets
+import shutil
 import tempfile
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Dict, Any, BinaryIO
+from typing import Optional, Dict, Any, BinaryIO, Iterator
 
 from werkzeug.utils import safe_join
 
+from .storage_index import StorageIndex, StorageQuotaExceededError
+
 
 logger = logging.getLogger(__name__)
 
@@ -26,23 +36,99 @@ SAFE_PATH_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
 # 分塊大小（8KB）
 CHUNK_SIZE = 8192
 
+# 串流下載的讀取區塊大小（64KB）
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 完整 SHA-256 檔案 ID（64 hex）
+FILE_ID_PATTERN = re.compile(r'^[0-9a-fA-F]{64}$')
+
+# 儲存檔名：{sha256}{可選副檔名}（與 upload_file 產生的檔名一致，重建索引時用於過濾）
+STORAGE_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]{1,10})?$')
+
+# 預設元數據索引檔名（位於儲存根目錄）
+INDEX_FILENAME = ".storage_index.db"
+
+# 可續傳上傳工作階段目錄（位於儲存根目錄，與儲存檔案同一檔案系統以便原子性搬移）
+UPLOAD_SESSION_DIR = ".uploads"
+
+# 上傳工作階段閒置多久後清除（秒），預設 24 小時
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# 跨使用者共用的內容儲存區（以 SHA-256 為鍵，{hash[:2]}/{hash}）；
+# 各使用者目錄中的檔案為指向 blob 的硬連結，相同內容只佔一份空間
+BLOB_DIR = ".blobs"
+
+# 儲存配置版本（索引記錄的版本不同時，啟動時以 reconcile_index() 遷移）
+STORAGE_LAYOUT = "blobs-v1"
+
+# 引用數歸零的 blob 保留多久後才回收（秒）：期間再次上傳相同內容可直接引用
+BLOB_GC_GRACE = 60 * 60
+
+# 背景垃圾回收的執行間隔（秒）
+BLOB_GC_INTERVAL = 10 * 60
+
+# 上傳工作階段 ID（32 hex）
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadOffsetMismatchError(ValueError):
+    """區塊的起始位置與工作階段已接收的位元組數不符（客戶端應從 offset 繼續）"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Chunk offset mismatch, expected offset {offset}")
+        self.offset = offset
+
+
+class ChunkHashMismatchError(ValueError):
+    """區塊內容與客戶端提供的 SHA-256 不符（區塊已捨棄）"""
+
 
 class CloudStorageService:
     """雲服務儲存服務"""
 
-    def __init__(self, storage_path: str, max_file_size: int = 100 * 1024 * 1024):
+    def __init__(
+        self,
+        storage_path: str,
+        max_file_size: int = 100 * 1024 * 1024,
+        index_path: Optional[str] = None,
+        max_user_bytes: Optional[int] = None
+    ):
         """
         初始化儲存服務
 
         Args:
             storage_path: 儲存路徑
             max_file_size: 最大檔案大小（位元組），預設 100MB
+            index_path: 元數據索引 SQLite 路徑，預設為 {storage_path}/.storage_index.db
+            max_user_bytes: 每位使用者的儲存配額（位元組），None 表示不限制
         """
         self.storage_path = Path(storage_path)
         self.max_file_size = max_file_size
+        self.max_user_bytes = max_user_bytes
 
         # 確保儲存目錄存在
         self.storage_path.mkdir(parents=True, exist_ok=True)
+
+        # 可續傳上傳：工作階段以目錄持久化，服務重啟後仍可續傳；每個工作階段的寫入以鎖序列化
+        self.upload_session_path = self.storage_path / UPLOAD_SESSION_DIR
+        self.upload_session_path.mkdir(exist_ok=True)
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._session_locks_guard = threading.Lock()
+
+        # 全域內容儲存區：檔案系統不支援硬連結時停用跨使用者去重（行為與各自儲存相同）
+        self.blob_path = self.storage_path / BLOB_DIR
+        self.blob_path.mkdir(exist_ok=True)
+        self.dedup_enabled = self._supports_hardlinks()
+        self._gc_thread: Optional[threading.Thread] = None
+        self._gc_stop = threading.Event()
+
+        # 元數據索引：列表、統計、配額與 file_id → 儲存檔名的查找都查詢索引，不列舉目錄
+        self._index = StorageIndex(index_path or str(self.storage_path / INDEX_FILENAME))
+        if self._index.get_meta("layout") != STORAGE_LAYOUT:
+            # 新建立的索引或舊版儲存配置（例如既有儲存區首次升級）：由磁碟建立索引並將檔案移入內容儲存區
+            self.reconcile_index()
+            self._index.set_meta("layout", STORAGE_LAYOUT)
+
         logger.info(f"Initialized storage service at: {self.storage_path}")
 
     def _validate_path_component(self, component: str, name: str):
@@ -71,16 +157,7 @@ class CloudStorageService:
         Returns:
             上傳結果資訊
         """
-        # 驗證路徑組件安全性
-        self._validate_path_component(category, "category")
-        self._validate_path_component(user_id, "user_id")
-
-        # 使用 werkzeug.safe_join 建立並驗證路徑（防止路徑穿越，含 startswith 繞過）
-        safe_path = safe_join(str(self.storage_path), category, user_id)
-        if safe_path is None:
-            raise ValueError("Path traversal detected")
-        category_path = Path(safe_path)
-        category_path.mkdir(parents=True, exist_ok=True)
+        category_path = self._prepare_category_path(category, user_id)
 
         # 建立臨時檔案並串流寫入，同時計算雜湊
         hash_obj = hashlib.sha256()
@@ -107,34 +184,106 @@ class CloudStorageService:
             # 計算最終雜湊
             file_hash = hash_obj.hexdigest()
 
-            # 使用雜湊作為檔名，避免衝突
-            # 僅保留單一英數副檔名（最多 10 字元），拒絕含路徑分隔符的副檔名
-            raw_ext = Path(filename).suffix
-            if raw_ext and re.match(r'^\.[A-Za-z0-9]{1,10}$', raw_ext):
-                safe_ext = raw_ext.lower()
-            else:
-                safe_ext = ''
-            storage_filename = f"{file_hash}{safe_ext}"
+            return self._commit_file(
+                temp_path, file_hash, file_size, filename, user_id, category, category_path, metadata
+            )
+
+        except Exception:
+            # 清理臨時檔案
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _prepare_category_path(self, category: str, user_id: str) -> Path:
+        """驗證並建立 {category}/{user_id} 儲存目錄"""
+        # 驗證路徑組件安全性
+        self._validate_path_component(category, "category")
+        self._validate_path_component(user_id, "user_id")
+
+        # 使用 werkzeug.safe_join 建立並驗證路徑（防止路徑穿越，含 startswith 繞過）
+        safe_path = safe_join(str(self.storage_path), category, user_id)
+        if safe_path is None:
+            raise ValueError("Path traversal detected")
+        category_path = Path(safe_path)
+        category_path.mkdir(parents=True, exist_ok=True)
+        return category_path
+
+    def _commit_file(
+        self,
+        temp_path: str,
+        file_hash: str,
+        file_size: int,
+        filename: str,
+        user_id: str,
+        category: str,
+        category_path: Path,
+        metadata: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """將已寫完的臨時檔案以內容雜湊命名存入儲存區並寫入索引
+
+        臨時檔案必須與儲存區位於同一檔案系統（os.rename 原子性搬移）；
+        失敗時由呼叫端清理臨時檔案。
+
+        Returns:
+            上傳結果資訊
+        """
+        # 使用雜湊作為檔名，避免衝突
+        # 僅保留單一英數副檔名（最多 10 字元），拒絕含路徑分隔符的副檔名
+        raw_ext = Path(filename).suffix
+        if raw_ext and re.match(r'^\.[A-Za-z0-9]{1,10}$', raw_ext):
+            safe_ext = raw_ext.lower()
+        else:
+            safe_ext = ''
+        storage_filename = f"{file_hash}{safe_ext}"
 
-            # 使用 safe_join 構建最終路徑（防止路徑穿越）
-            safe_file_path = safe_join(str(category_path), storage_filename)
-            if safe_file_path is None:
-                raise ValueError("Path traversal detected in storage filename")
-            file_path = Path(safe_file_path)
+        # 相同內容已存在（副檔名可能不同）時沿用既有儲存檔名，不另存一份
+        existing = self._index.get_file(category, user_id, file_hash)
+        if existing and (category_path / existing["storage_filename"]).is_file():
+            storage_filename = existing["storage_filename"]
 
+        # 使用 safe_join 構建最終路徑（防止路徑穿越）
+        safe_file_path = safe_join(str(category_path), storage_filename)
+        if safe_file_path is None:
+            raise ValueError("Path traversal detected in storage filename")
+        file_path = Path(safe_file_path)
+
+        # 先寫入索引（含配額檢查，超過時拋出 StorageQuotaExceededError），再搬移檔案
+        # modified_at 取最終檔案的 mtime（rename 保留臨時檔案的 mtime；硬連結與 blob 共用 mtime），
+        # 與重建索引時的 stat() 一致
+        uploaded_at = datetime.now(timezone.utc).isoformat()
+        blob = self._blob_file(file_hash)
+        if file_path.exists():
+            mtime_source = file_path
+        elif self.dedup_enabled and blob.is_file():
+            mtime_source = blob
+        else:
+            mtime_source = Path(temp_path)
+        previous = self._index.add_file(
+            category, user_id, file_hash, storage_filename, file_size,
+            original_filename=filename,
+            metadata=metadata,
+            uploaded_at=uploaded_at,
+            modified_at=datetime.fromtimestamp(mtime_source.stat().st_mtime, tz=timezone.utc).isoformat(),
+            max_user_bytes=self.max_user_bytes
+        )
+
+        try:
+            if self.dedup_enabled:
+                if self._link_to_blob(file_hash, file_path, temp_path):
+                    logger.info(f"File uploaded: {file_path}")
+                else:
+                    logger.info(f"File deduplicated against stored blob: {file_path}")
             # 如果檔案已存在（相同雜湊），刪除臨時檔案
-            if file_path.exists():
+            elif file_path.exists():
                 os.unlink(temp_path)
                 logger.info(f"File already exists: {file_path}")
             else:
                 # 原子性搬移到目標路徑
                 os.rename(temp_path, file_path)
                 logger.info(f"File uploaded: {file_path}")
-
         except Exception:
-            # 清理臨時檔案
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+            if previous is None:
+                self._index.remove_file(category, user_id, file_hash)
             raise
 
         # 返回檔案資訊
@@ -146,47 +295,444 @@ class CloudStorageService:
             "hash": file_hash,
             "category": category,
             "user_id": user_id,
-            "uploaded_at": datetime.now(timezone.utc).isoformat(),
+            "uploaded_at": uploaded_at,
             "metadata": metadata or {}
         }
 
-    def download_file(
+    # ==================== 內容儲存區 ====================
+
+    def _supports_hardlinks(self) -> bool:
+        """檢查儲存區所在檔案系統是否支援硬連結"""
+        probe_fd, probe_path = tempfile.mkstemp(dir=self.blob_path, prefix='.probe_')
+        os.close(probe_fd)
+        link_path = f"{probe_path}.link"
+        try:
+            os.link(probe_path, link_path)
+            os.unlink(link_path)
+            return True
+        except OSError:
+            logger.warning(f"Hard links not supported at {self.blob_path}, cross-user deduplication disabled")
+            return False
+        finally:
+            os.unlink(probe_path)
+
+    def _blob_file(self, file_hash: str) -> Path:
+        return self.blob_path / file_hash[:2] / file_hash
+
+    def _link_to_blob(self, file_hash: str, file_path: Path, source_path: Optional[str] = None) -> bool:
+        """讓使用者目錄中的 file_path 成為內容 blob 的硬連結
+
+        blob 不存在時以 source_path（已驗證雜湊的臨時檔案）或既有的 file_path 建立；
+        blob 已存在時捨棄 source_path，並以硬連結取代內容相同的獨立副本。
+
+        Returns:
+            是否新建立了 blob
+        """
+        blob = self._blob_file(file_hash)
+        created = False
+        if not blob.is_file():
+            blob.parent.mkdir(exist_ok=True)
+            if source_path is not None:
+                os.replace(source_path, blob)
+                source_path = None
+            else:
+                os.link(file_path, blob)
+            created = True
+        if source_path is not None:
+            os.unlink(source_path)
+
+        if not file_path.exists():
+            os.link(blob, file_path)
+        elif not os.path.samefile(file_path, blob):
+            # 先建立連結再原子性取代，過程中檔案始終可讀
+            link_tmp = file_path.with_name(f".link_{secrets.token_hex(8)}")
+            os.link(blob, link_tmp)
+            os.replace(link_tmp, file_path)
+        return created
+
+    def _remove_blob(self, file_hash: str) -> bool:
+        """刪除內容 blob；仍有使用者目錄中的硬連結時（索引與磁碟不一致）保留"""
+        blob = self._blob_file(file_hash)
+        try:
+            stat = blob.stat()
+        except FileNotFoundError:
+            return True
+        if stat.st_nlink > 1:
+            logger.warning(f"Blob {file_hash} has no indexed references but is still linked, run reconcile_index()")
+            return False
+        blob.unlink()
+        return True
+
+    def collect_garbage(self, grace_seconds: float = BLOB_GC_GRACE) -> Dict[str, int]:
+        """
+        回收引用數歸零超過寬限期的內容 blob
+
+        Args:
+            grace_seconds: 寬限期（秒）；期間再次上傳相同內容可直接引用
+
+        Returns:
+            {"deleted", "bytes_freed", "skipped"}
+        """
+        cutoff = time.time() - grace_seconds
+        deleted = bytes_freed = skipped = 0
+        for file_hash in self._index.list_orphaned_blobs(cutoff):
+            blob = self._blob_file(file_hash)
+            size = blob.stat().st_size if blob.is_file() else 0
+            if self._index.delete_orphaned_blob(file_hash, cutoff, self._remove_blob):
+                deleted += 1
+                bytes_freed += size
+            else:
+                skipped += 1
+        if deleted or skipped:
+            logger.info(f"Blob GC: deleted {deleted} blobs ({bytes_freed} bytes), skipped {skipped}")
+        return {"deleted": deleted, "bytes_freed": bytes_freed, "skipped": skipped}
+
+    def start_garbage_collector(
+        self,
+        interval: float = BLOB_GC_INTERVAL,
+        grace_seconds: float = BLOB_GC_GRACE
+    ) -> None:
+        """啟動背景垃圾回收執行緒（已啟動時不重複啟動）"""
+        if self._gc_thread and self._gc_thread.is_alive():
+            return
+        self._gc_stop.clear()
+
+        def _run():
+            while not self._gc_stop.wait(interval):
+                try:
+                    self.collect_garbage(grace_seconds)
+                except Exception:
+                    logger.error("Blob garbage collection failed", exc_info=True)
+
+        self._gc_thread = threading.Thread(target=_run, name="storage-blob-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop_garbage_collector(self, wait: bool = True) -> None:
+        """停止背景垃圾回收執行緒"""
+        self._gc_stop.set()
+        if wait and self._gc_thread:
+            self._gc_thread.join(timeout=5)
+        self._gc_thread = None
+
+    def get_dedup_report(self) -> Dict[str, Any]:
+        """
+        跨使用者去重報告
+
+        Returns:
+            references（使用者引用數）、logical_bytes（各使用者檔案大小總和）、
+            blobs / stored_bytes（實際儲存的內容）、bytes_saved、dedup_ratio、
+            orphaned_blobs / orphaned_bytes（等待回收）、dedup_enabled
+        """
+        report = self._index.get_dedup_report()
+        if not self.dedup_enabled:
+            # 未去重時每個引用各自佔用空間
+            report["stored_bytes"] = report["logical_bytes"]
+            report["bytes_saved"] = 0
+        report["dedup_ratio"] = (
+            round(report["logical_bytes"] / report["stored_bytes"], 2) if report["stored_bytes"] else 1.0
+        )
+        report["dedup_enabled"] = self.dedup_enabled
+        return report
+
+    # ==================== 可續傳上傳 ====================
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._session_locks_guard:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _session_dir(self, session_id: str) -> Optional[Path]:
+        if not SESSION_ID_PATTERN.match(session_id or ''):
+            return None
+        return self.upload_session_path / session_id
+
+    def _load_session(self, session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """讀取工作階段（不存在或不屬於該使用者時返回 None）"""
+        session_dir = self._session_dir(session_id)
+        if session_dir is None:
+            return None
+        try:
+            session = json.loads((session_dir / "session.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if session.get("user_id") != user_id:
+            return None
+        # 已接收的位元組數以資料檔大小為準（寫入中斷時已截回區塊起點）
+        session["offset"] = (session_dir / "data").stat().st_size
+        return session
+
+    def _save_session(self, session: Dict[str, Any]) -> None:
+        session_dir = self.upload_session_path / session["session_id"]
+        stored = {k: v for k, v in session.items() if k != "offset"}
+        stored["updated_at"] = time.time()
+        tmp_path = session_dir / "session.json.tmp"
+        tmp_path.write_text(json.dumps(stored, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, session_dir / "session.json")
+
+    @staticmethod
+    def _session_info(session: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "session_id": session["session_id"],
+            "filename": session["filename"],
+            "category": session["category"],
+            "size": session["size"],
+            "offset": session["offset"],
+            "expires_at": datetime.fromtimestamp(
+                session["updated_at"] + UPLOAD_SESSION_TTL, tz=timezone.utc
+            ).isoformat()
+        }
+
+    def create_upload_session(
         self,
-        file_id: str,
         user_id: str,
-        category: str = "general"
-    ) -> Optional[bytes]:
+        filename: str,
+        category: str = "general",
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
-        下載檔案
+        建立可續傳上傳工作階段
+
+        Args:
+            user_id: 上傳者 ID
+            filename: 檔案名稱
+            category: 檔案類別
+            size: 檔案總大小（可選；提供時於建立時檢查大小與配額，完成時檢查是否收齊）
+            sha256: 整個檔案的 SHA-256（可選；提供時於完成時驗證）
+            metadata: 額外元數據
+
+        Returns:
+            工作階段資訊（session_id、offset 等）
+        """
+        self._validate_path_component(category, "category")
+        self._validate_path_component(user_id, "user_id")
+        if size is not None:
+            if size < 0 or size > self.max_file_size:
+                raise ValueError(f"File size exceeds maximum {self.max_file_size}")
+            if self.max_user_bytes is not None:
+                used = self._index.get_usage(user_id)["total_size"]
+                if used + size > self.max_user_bytes:
+                    raise StorageQuotaExceededError(
+                        f"Storage quota exceeded for user {user_id}: {used} + {size} > {self.max_user_bytes} bytes"
+                    )
+        if sha256 is not None and not FILE_ID_PATTERN.match(sha256):
+            raise ValueError("Invalid sha256")
+
+        self.cleanup_upload_sessions()
+
+        session_id = secrets.token_hex(16)
+        session_dir = self.upload_session_path / session_id
+        session_dir.mkdir()
+        (session_dir / "data").touch()
+        session = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "filename": filename,
+            "category": category,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "metadata": metadata or {},
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "offset": 0
+        }
+        self._save_session(session)
+        session["updated_at"] = time.time()
+        logger.info(f"Upload session created: {session_id} ({filename}, size={size})")
+        return self._session_info(session)
+
+    def get_upload_session(self, session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢工作階段已接收的位元組數（客戶端斷線後以此決定續傳位置）
+
+        Returns:
+            工作階段資訊或 None（不存在）
+        """
+        session = self._load_session(session_id, user_id)
+        return self._session_info(session) if session else None
+
+    def upload_chunk(
+        self,
+        session_id: str,
+        user_id: str,
+        offset: int,
+        chunk_data: BinaryIO,
+        chunk_sha256: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        寫入一個區塊（必須從工作階段目前的 offset 開始）
+
+        區塊串流寫入資料檔並同時計算雜湊；雜湊不符、超過大小上限或連線中斷時
+        截回區塊起點，已接收的位元組數不受影響。
+
+        Args:
+            session_id: 工作階段 ID
+            user_id: 上傳者 ID
+            offset: 區塊起始位置
+            chunk_data: 區塊資料流
+            chunk_sha256: 區塊的 SHA-256（可選）
+
+        Returns:
+            工作階段資訊或 None（工作階段不存在）
+
+        Raises:
+            UploadOffsetMismatchError: offset 與已接收的位元組數不符
+            ChunkHashMismatchError: 區塊雜湊不符
+            ValueError: 超過檔案大小上限
+        """
+        with self._session_lock(session_id):
+            session = self._load_session(session_id, user_id)
+            if session is None:
+                return None
+            if offset != session["offset"]:
+                raise UploadOffsetMismatchError(session["offset"])
+
+            limit = self.max_file_size if session["size"] is None else min(session["size"], self.max_file_size)
+            hash_obj = hashlib.sha256()
+            received = offset
+            data_path = self.upload_session_path / session_id / "data"
+            try:
+                with open(data_path, "r+b") as f:
+                    f.seek(offset)
+                    while True:
+                        chunk = chunk_data.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        if received > limit:
+                            raise ValueError(f"File size exceeds maximum {limit}")
+                        hash_obj.update(chunk)
+                        f.write(chunk)
+                if chunk_sha256 is not None and hash_obj.hexdigest() != chunk_sha256.lower():
+                    raise ChunkHashMismatchError("Chunk SHA-256 mismatch")
+            except BaseException:
+                # 捨棄不完整或驗證失敗的區塊
+                os.truncate(data_path, offset)
+                raise
+
+            session["offset"] = received
+            self._save_session(session)
+            session["updated_at"] = time.time()
+        return self._session_info(session)
+
+    def finalize_upload_session(self, session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        完成上傳：驗證大小與雜湊後，以與 upload_file 相同的內容定址方式存入儲存區
+
+        Returns:
+            上傳結果資訊（與 upload_file 相同）或 None（工作階段不存在）
+
+        Raises:
+            ValueError: 尚未收齊或雜湊不符（工作階段保留，可繼續上傳或中止）
+            StorageQuotaExceededError: 超過使用者配額
+        """
+        with self._session_lock(session_id):
+            session = self._load_session(session_id, user_id)
+            if session is None:
+                return None
+            if session["size"] is not None and session["offset"] != session["size"]:
+                raise ValueError(f"Upload incomplete: received {session['offset']} of {session['size']} bytes")
+
+            session_dir = self.upload_session_path / session_id
+            data_path = session_dir / "data"
+            hash_obj = hashlib.sha256()
+            with open(data_path, "rb") as f:
+                for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                    hash_obj.update(chunk)
+            file_hash = hash_obj.hexdigest()
+            if session["sha256"] and file_hash != session["sha256"]:
+                raise ValueError("File SHA-256 mismatch")
+
+            category_path = self._prepare_category_path(session["category"], user_id)
+            result = self._commit_file(
+                str(data_path), file_hash, session["offset"], session["filename"],
+                user_id, session["category"], category_path, session["metadata"]
+            )
+            shutil.rmtree(session_dir, ignore_errors=True)
+        with self._session_locks_guard:
+            self._session_locks.pop(session_id, None)
+        logger.info(f"Upload session completed: {session_id} -> {file_hash}")
+        return result
+
+    def abort_upload_session(self, session_id: str, user_id: str) -> bool:
+        """
+        中止並刪除工作階段
+
+        Returns:
+            是否刪除成功（工作階段不存在時返回 False）
+        """
+        with self._session_lock(session_id):
+            if self._load_session(session_id, user_id) is None:
+                return False
+            shutil.rmtree(self.upload_session_path / session_id, ignore_errors=True)
+        with self._session_locks_guard:
+            self._session_locks.pop(session_id, None)
+        logger.info(f"Upload session aborted: {session_id}")
+        return True
+
+    def cleanup_upload_sessions(self, max_age: float = UPLOAD_SESSION_TTL) -> int:
+        """
+        清除閒置超過 max_age 秒的工作階段
+
+        Returns:
+            清除的工作階段數
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for session_dir in self.upload_session_path.iterdir():
+            if not SESSION_ID_PATTERN.match(session_dir.name):
+                continue
+            try:
+                last_update = (session_dir / "session.json").stat().st_mtime
+            except OSError:
+                last_update = session_dir.stat().st_mtime
+            if last_update < cutoff:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} expired upload sessions")
+        return removed
+
+    def _resolve_file_path(self, file_id: str, user_id: str, category: str) -> Optional[Path]:
+        """以檔案 ID 直接定位儲存檔案
+
+        依序嘗試：元數據索引記錄的儲存檔名 → 無副檔名的 {file_id} →（未索引的檔案）列舉目錄比對 stem。
+        列舉目錄找到的檔案會補寫入索引，之後的請求不再列舉目錄。
 
         Args:
             file_id: 檔案 ID（完整 SHA-256 雜湊，64 hex）
-            user_id: 下載者 ID
+            user_id: 擁有者 ID
             category: 檔案類別
 
         Returns:
-            檔案內容或 None（檔案不存在）
+            檔案路徑，或 None（格式不符、路徑不安全或檔案不存在）
         """
         # 驗證路徑組件安全性
         self._validate_path_component(category, "category")
         self._validate_path_component(user_id, "user_id")
 
         # 驗證 file_id 格式（完整 SHA-256：64 hex）
-        if len(file_id) != 64 or not all(c in "0123456789abcdefABCDEF" for c in file_id):
-            logger.warning(f"Invalid file_id format for download_file: {file_id}")
+        if not FILE_ID_PATTERN.match(file_id):
+            logger.warning(f"Invalid file_id format: {file_id}")
             return None
 
         # 使用 safe_join 建立並驗證路徑（防止路徑穿越）
         safe_cat_path = safe_join(str(self.storage_path), category, user_id)
         if safe_cat_path is None:
-            logger.warning(f"Path traversal detected in download_file: category={category} user_id={user_id}")
+            logger.warning(f"Path traversal detected: category={category} user_id={user_id}")
             return None
         category_path = Path(safe_cat_path)
+
+        entry = self._index.get_file(category, user_id, file_id)
+        for name in filter(None, (entry and entry["storage_filename"], file_id)):
+            candidate = category_path / name
+            if candidate.is_file():
+                return candidate
+
         if not category_path.exists():
             logger.warning(f"Category path not found: {category_path}")
             return None
 
-        # 尋找匹配的檔案：使用 iterdir() 列舉目錄後比對 stem，
+        # 索引未命中（例如直接放入儲存目錄的檔案）：列舉目錄比對 stem，
         # 避免將用戶提供的 file_id 直接嵌入 glob 模式（斷開 CodeQL 污染流）
         matches = [
             fp for fp in category_path.iterdir()
@@ -194,6 +740,9 @@ class CloudStorageService:
         ]
 
         if not matches:
+            if entry:
+                # 索引記錄的檔案已不在磁碟上：移除過期記錄
+                self._index.remove_file(category, user_id, file_id)
             logger.warning(f"File not found: {file_id}")
             return None
 
@@ -201,8 +750,126 @@ class CloudStorageService:
             logger.error(f"Multiple files matched for file_id={file_id}: {matches}")
             return None
 
-        # 讀取唯一匹配的檔案（路徑來自 iterdir()，非用戶資料）
-        file_path = matches[0]
+        stat = matches[0].stat()
+        modified_at = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat()
+        self._index.add_file(
+            category, user_id, file_id, matches[0].name, stat.st_size,
+            original_filename=matches[0].name,
+            uploaded_at=modified_at,
+            modified_at=modified_at
+        )
+        return matches[0]
+
+    def get_file_path(
+        self,
+        file_id: str,
+        user_id: str,
+        category: str = "general"
+    ) -> Optional[Path]:
+        """
+        取得檔案在儲存區的路徑（供 send_file / sendfile 直接傳送）
+
+        Args:
+            file_id: 檔案 ID（完整 SHA-256 雜湊，64 hex）
+            user_id: 下載者 ID
+            category: 檔案類別
+
+        Returns:
+            檔案路徑或 None（檔案不存在）
+        """
+        return self._resolve_file_path(file_id, user_id, category)
+
+    def open_file(
+        self,
+        file_id: str,
+        user_id: str,
+        category: str = "general"
+    ) -> Optional[BinaryIO]:
+        """
+        開啟檔案供串流讀取（呼叫端負責關閉）
+
+        Args:
+            file_id: 檔案 ID（完整 SHA-256 雜湊，64 hex）
+            user_id: 下載者 ID
+            category: 檔案類別
+
+        Returns:
+            唯讀二進位檔案物件或 None（檔案不存在）
+        """
+        file_path = self._resolve_file_path(file_id, user_id, category)
+        if file_path is None:
+            return None
+        return open(file_path, "rb")
+
+    def iter_file(
+        self,
+        file_id: str,
+        user_id: str,
+        category: str = "general",
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Optional[Iterator[bytes]]:
+        """
+        以固定大小區塊串流讀取檔案（可指定位元組範圍，用於續傳）
+
+        Args:
+            file_id: 檔案 ID（完整 SHA-256 雜湊，64 hex）
+            user_id: 下載者 ID
+            category: 檔案類別
+            start: 起始位元組（含）
+            end: 結束位元組（含），None 表示到檔案結尾
+            chunk_size: 每次讀取的位元組數
+
+        Returns:
+            位元組區塊迭代器或 None（檔案不存在或範圍無效）
+        """
+        file_path = self._resolve_file_path(file_id, user_id, category)
+        if file_path is None:
+            return None
+
+        size = file_path.stat().st_size
+        last = size - 1 if end is None else min(end, size - 1)
+        if start < 0 or (size > 0 and start > last):
+            logger.warning(f"Invalid byte range {start}-{end} for file {file_id} (size={size})")
+            return None
+
+        def _chunks() -> Iterator[bytes]:
+            remaining = last - start + 1
+            with open(file_path, "rb") as f:
+                f.seek(start)
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return _chunks()
+
+    def download_file(
+        self,
+        file_id: str,
+        user_id: str,
+        category: str = "general"
+    ) -> Optional[bytes]:
+        """
+        下載檔案（整個檔案讀入記憶體）
+
+        大型檔案請改用 get_file_path() / open_file() / iter_file() 串流傳送。
+
+        Args:
+            file_id: 檔案 ID（完整 SHA-256 雜湊，64 hex）
+            user_id: 下載者 ID
+            category: 檔案類別
+
+        Returns:
+            檔案內容或 None（檔案不存在）
+        """
+        file_path = self._resolve_file_path(file_id, user_id, category)
+        if file_path is None:
+            return None
+
         with open(file_path, "rb") as f:
             content = f.read()
         logger.info(f"File downloaded: {file_path}")
@@ -225,46 +892,14 @@ class CloudStorageService:
         Returns:
             是否刪除成功
         """
-        # 驗證路徑組件安全性
-        self._validate_path_component(category, "category")
-        self._validate_path_component(user_id, "user_id")
-
-        # 驗證 file_id 格式（完整 SHA-256：64 hex）
-        if len(file_id) != 64 or not all(c in "0123456789abcdefABCDEF" for c in file_id):
-            logger.warning(f"Invalid file_id format for delete_file: {file_id}")
-            return False
-
-        # 使用 safe_join 建立並驗證路徑（防止路徑穿越）
-        safe_cat_path = safe_join(str(self.storage_path), category, user_id)
-        if safe_cat_path is None:
-            logger.warning(f"Path traversal detected in delete_file: category={category} user_id={user_id}")
-            return False
-        category_path = Path(safe_cat_path)
-        if not category_path.exists():
-            logger.warning(f"Category path not found: {category_path}")
-            return False
-
-        # 尋找匹配的檔案：使用 iterdir() 列舉目錄後比對 stem，
-        # 避免將用戶提供的 file_id 直接嵌入 glob 模式（斷開 CodeQL 污染流）
-        matches = [
-            fp for fp in category_path.iterdir()
-            if fp.is_file() and fp.stem == file_id
-        ]
-
-        if not matches:
-            logger.info(f"No file found to delete for file_id={file_id} in {category_path}")
-            return False
-
-        if len(matches) > 1:
-            # 安全起見：若同一 file_id 對應多個檔案則不執行刪除
-            logger.error(
-                f"Multiple files matched for file_id={file_id} in {category_path}: {matches}"
-            )
+        file_path = self._resolve_file_path(file_id, user_id, category)
+        if file_path is None:
+            logger.info(f"No file found to delete for file_id={file_id}")
             return False
 
         # 僅刪除唯一匹配的檔案
-        file_path = matches[0]
         file_path.unlink()
+        self._index.remove_file(category, user_id, file_id)
         logger.info(f"File deleted: {file_path}")
         return True
 
@@ -274,7 +909,7 @@ class CloudStorageService:
         category: Optional[str] = None
     ) -> list:
         """
-        列出使用者的檔案
+        列出使用者的檔案（查詢元數據索引，不列舉目錄）
 
         Args:
             user_id: 使用者 ID
@@ -288,47 +923,26 @@ class CloudStorageService:
         if category:
             self._validate_path_component(category, "category")
 
-        files = []
-
-        # 決定搜尋路徑（使用 safe_join 防止路徑穿越）
-        if category:
-            safe_cat_path = safe_join(str(self.storage_path), category, user_id)
-            if safe_cat_path is None:
-                logger.warning(f"Path traversal detected in list_files: category={category} user_id={user_id}")
-                return []
-            search_paths = [Path(safe_cat_path)]
-        else:
-            search_paths = []
-            for p in self.storage_path.iterdir():
-                if not p.is_dir():
-                    continue
-                safe_user_path = safe_join(str(self.storage_path), p.name, user_id)
-                if safe_user_path is not None:
-                    search_paths.append(Path(safe_user_path))
-
-        # 搜尋檔案
-        for path in search_paths:
-            if not path.exists():
-                continue
-
-            for file_path in path.glob("*"):
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    # 返回 storage_filename（實際檔名）和 file_id（雜湊）
-                    files.append({
-                        "file_id": file_path.stem,
-                        "storage_filename": file_path.name,
-                        "filename": file_path.name,  # 保持相容性
-                        "size": stat.st_size,
-                        "category": path.parent.name,
-                        "modified_at": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat()
-                    })
-
-        return files
+        # 返回 storage_filename（實際檔名）和 file_id（雜湊）
+        return [
+            {
+                "file_id": entry["file_id"],
+                "storage_filename": entry["storage_filename"],
+                "filename": entry["storage_filename"],  # 保持相容性
+                "original_filename": entry["original_filename"],
+                "size": entry["size"],
+                "hash": entry["file_id"],
+                "category": entry["category"],
+                "metadata": entry["metadata"],
+                "uploaded_at": entry["uploaded_at"],
+                "modified_at": entry["modified_at"]
+            }
+            for entry in self._index.list_files(user_id, category or None)
+        ]
 
     def get_storage_stats(self, user_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        取得儲存統計資訊
+        取得儲存統計資訊（查詢元數據索引的用量彙總）
 
         Args:
             user_id: 使用者 ID（可選，None 表示全系統統計）
@@ -336,9 +950,6 @@ class CloudStorageService:
         Returns:
             統計資訊
         """
-        total_files = 0
-        total_size = 0
-
         if user_id:
             # 驗證 user_id 安全性（防止路徑穿越）
             try:
@@ -346,29 +957,88 @@ class CloudStorageService:
             except ValueError:
                 logger.warning(f"get_storage_stats: invalid user_id rejected: {user_id!r}")
                 raise
-            # 特定使用者統計
-            for category_path in self.storage_path.iterdir():
-                if not category_path.is_dir():
-                    continue
-                safe_user_path = safe_join(str(category_path), user_id)
-                if safe_user_path is None:
-                    continue
-                user_path = Path(safe_user_path)
-                if user_path.exists():
-                    for file_path in user_path.glob("*"):
-                        if file_path.is_file():
-                            total_files += 1
-                            total_size += file_path.stat().st_size
-        else:
-            # 全系統統計
-            for file_path in self.storage_path.rglob("*"):
-                if file_path.is_file():
-                    total_files += 1
-                    total_size += file_path.stat().st_size
 
-        return {
+        usage = self._index.get_usage(user_id or None)
+        total_size = usage["total_size"]
+
+        stats = {
             "user_id": user_id,
-            "total_files": total_files,
+            "total_files": usage["total_files"],
             "total_size": total_size,
             "total_size_mb": round(total_size / (1024 * 1024), 2)
         }
+        if user_id and self.max_user_bytes is not None:
+            stats["quota_bytes"] = self.max_user_bytes
+            stats["quota_remaining"] = max(self.max_user_bytes - total_size, 0)
+        return stats
+
+    def reconcile_index(self) -> Dict[str, int]:
+        """
+        由磁碟重建元數據索引
+
+        掃描 {category}/{user_id}/{sha256}{ext} 結構的儲存檔案（略過上傳中的臨時檔案與其他資料），
+        以 stat() 結果更新索引並重新彙總每位使用者的用量與 blob 引用數。已索引檔案的原始檔名與元數據會保留。
+        啟用去重時，尚未連結到內容儲存區的檔案（例如舊版儲存的檔案）在驗證雜湊後改為 blob 的硬連結。
+
+        Returns:
+            {"added", "updated", "removed", "total_files", "unreferenced_blobs", "linked"}
+        """
+        entries = {}
+        linked = 0
+        for category_path in sorted(self.storage_path.iterdir()):
+            if not category_path.is_dir() or not SAFE_PATH_PATTERN.match(category_path.name):
+                continue
+            for user_path in sorted(category_path.iterdir()):
+                if not user_path.is_dir() or not SAFE_PATH_PATTERN.match(user_path.name):
+                    continue
+                for file_path in sorted(user_path.iterdir()):
+                    match = STORAGE_FILENAME_PATTERN.match(file_path.name)
+                    if not match or not file_path.is_file():
+                        continue
+                    key = (category_path.name, user_path.name, match.group(1))
+                    if key in entries:
+                        kept = entries[key]["storage_filename"]
+                        logger.warning(f"Duplicate stored content for file_id={key[2]}, keeping {kept}")
+                        continue
+                    if self.dedup_enabled and self._migrate_to_blob(key[2], file_path):
+                        linked += 1
+                    stat = file_path.stat()
+                    entries[key] = {
+                        "category": key[0],
+                        "user_id": key[1],
+                        "file_id": key[2],
+                        "storage_filename": file_path.name,
+                        "size": stat.st_size,
+                        "modified_at": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).isoformat()
+                    }
+
+        blobs = {}
+        for prefix_path in self.blob_path.iterdir():
+            if not prefix_path.is_dir():
+                continue
+            for blob in prefix_path.iterdir():
+                if FILE_ID_PATTERN.match(blob.name) and blob.is_file():
+                    blobs[blob.name] = blob.stat().st_size
+
+        result = self._index.replace_all(entries.values(), blobs)
+        result["linked"] = linked
+        return result
+
+    def _migrate_to_blob(self, file_hash: str, file_path: Path) -> bool:
+        """將尚未連結的使用者檔案改為內容 blob 的硬連結（先驗證內容雜湊）
+
+        Returns:
+            是否做了連結
+        """
+        blob = self._blob_file(file_hash)
+        if blob.is_file() and os.path.samefile(file_path, blob):
+            return False
+        hash_obj = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                hash_obj.update(chunk)
+        if hash_obj.hexdigest() != file_hash:
+            logger.warning(f"Content of {file_path} does not match its hash, not deduplicated")
+            return False
+        self._link_to_blob(file_hash, file_path)
+        return True
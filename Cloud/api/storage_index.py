@@ -0,0 +1,562 @@
+"""
+雲服務儲存元數據索引
+
+以 SQLite 記錄 CloudStorageService 儲存的每個檔案（雜湊、大小、類別、擁有者、
+原始檔名、元數據、時間戳），並維護每位使用者的用量彙總，
+讓列表、統計與配額檢查只需查詢索引，不必列舉或 stat() 儲存目錄。
+
+索引於上傳／刪除時同步更新；索引與磁碟不一致時（例如手動搬移檔案），
+以 CloudStorageService.reconcile_index() 或 scripts/reconcile_storage_index.py 重建。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StorageQuotaExceededError(ValueError):
+    """上傳後使用者的儲存用量將超過配額"""
+
+
+class StorageIndex:
+    """儲存檔案元數據索引
+
+    - storage_files：每個檔案一列，主鍵 (category, user_id, file_id)
+    - storage_usage：每位使用者的檔案數與總大小，隨 storage_files 在同一交易中更新
+    - storage_blobs：全域內容儲存區（以雜湊為鍵）的引用計數，隨 storage_files 在同一交易中更新；
+      引用數歸零時記錄 orphaned_at，由垃圾回收在寬限期後刪除
+    - storage_index_meta：索引狀態（例如上次重建時間）
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """初始化索引
+
+        Args:
+            db_path: SQLite 資料庫路徑；None 表示使用記憶體資料庫（:memory:）
+        """
+        self._db_path = db_path or ":memory:"
+        self._lock = threading.RLock()
+
+        # 記憶體資料庫保持持久連線，避免資料在連線關閉後消失
+        self._is_memory_db = self._db_path == ":memory:"
+        self._persistent_conn: Optional[sqlite3.Connection] = None
+
+        self._init_db()
+
+    @contextmanager
+    def _get_conn(self) -> Generator[sqlite3.Connection, None, None]:
+        """取得資料庫連線（context manager）"""
+        if self._is_memory_db:
+            if self._persistent_conn is None:
+                self._persistent_conn = sqlite3.connect(
+                    self._db_path, check_same_thread=False
+                )
+                self._persistent_conn.row_factory = sqlite3.Row
+            yield self._persistent_conn
+        else:
+            conn = sqlite3.connect(self._db_path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def _init_db(self) -> None:
+        """初始化 SQLite 資料表"""
+        with self._lock:
+            with self._get_conn() as conn:
+                if not self._is_memory_db:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS storage_files (
+                        category            TEXT NOT NULL,
+                        user_id             TEXT NOT NULL,
+                        file_id             TEXT NOT NULL,
+                        storage_filename    TEXT NOT NULL,
+                        size                INTEGER NOT NULL,
+                        original_filename   TEXT,
+                        metadata            TEXT,
+                        uploaded_at         TEXT NOT NULL,
+                        modified_at         TEXT NOT NULL,
+                        PRIMARY KEY (category, user_id, file_id)
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_storage_files_user "
+                    "ON storage_files (user_id, category)"
+                )
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS storage_usage (
+                        user_id         TEXT PRIMARY KEY,
+                        total_files     INTEGER NOT NULL,
+                        total_size      INTEGER NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS storage_blobs (
+                        file_id         TEXT PRIMARY KEY,
+                        size            INTEGER NOT NULL,
+                        refcount        INTEGER NOT NULL,
+                        orphaned_at     REAL
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_storage_blobs_orphaned "
+                    "ON storage_blobs (orphaned_at) WHERE refcount = 0"
+                )
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS storage_index_meta (
+                        key     TEXT PRIMARY KEY,
+                        value   TEXT
+                    )
+                """)
+                conn.commit()
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        entry = dict(row)
+        entry["metadata"] = json.loads(entry["metadata"]) if entry["metadata"] else {}
+        return entry
+
+    @staticmethod
+    def _adjust_usage(conn: sqlite3.Connection, user_id: str, files: int, size: int) -> None:
+        conn.execute(
+            """
+            INSERT INTO storage_usage (user_id, total_files, total_size)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                total_files = total_files + excluded.total_files,
+                total_size = total_size + excluded.total_size
+            """,
+            (user_id, files, size),
+        )
+
+    @staticmethod
+    def _add_blob_ref(conn: sqlite3.Connection, file_id: str, size: int) -> None:
+        """內容 blob 引用數 +1（重新被引用的孤立 blob 不再被回收）"""
+        conn.execute(
+            """
+            INSERT INTO storage_blobs (file_id, size, refcount, orphaned_at)
+            VALUES (?, ?, 1, NULL)
+            ON CONFLICT (file_id) DO UPDATE SET refcount = refcount + 1, orphaned_at = NULL
+            """,
+            (file_id, size),
+        )
+
+    @staticmethod
+    def _release_blob_ref(conn: sqlite3.Connection, file_id: str) -> None:
+        """內容 blob 引用數 -1；歸零時記錄孤立時間，等待垃圾回收"""
+        conn.execute(
+            """
+            UPDATE storage_blobs
+            SET refcount = MAX(refcount - 1, 0),
+                orphaned_at = CASE WHEN refcount <= 1 THEN ? ELSE orphaned_at END
+            WHERE file_id = ?
+            """,
+            (time.time(), file_id),
+        )
+
+    # ==================== 查詢 ====================
+
+    def get_file(self, category: str, user_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        """取得單一檔案的索引記錄，不存在時返回 None"""
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    "SELECT * FROM storage_files WHERE category = ? AND user_id = ? AND file_id = ?",
+                    (category, user_id, file_id),
+                ).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def list_files(self, user_id: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出使用者的檔案記錄（以 (user_id, category) 索引查詢）
+
+        Args:
+            user_id: 使用者 ID
+            category: 檔案類別（可選，None 表示全部類別）
+
+        Returns:
+            依類別與上傳時間排序的檔案記錄
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT * FROM storage_files
+                    WHERE user_id = ? AND (? IS NULL OR category = ?)
+                    ORDER BY category, uploaded_at, file_id
+                    """,
+                    (user_id, category, category),
+                ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def get_usage(self, user_id: Optional[str] = None) -> Dict[str, int]:
+        """取得使用者（或全系統）的檔案數與總大小
+
+        Args:
+            user_id: 使用者 ID；None 表示全系統（彙總 storage_usage，不掃描檔案列）
+
+        Returns:
+            {"total_files": int, "total_size": int}
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    """
+                    SELECT COALESCE(SUM(total_files), 0) AS total_files,
+                           COALESCE(SUM(total_size), 0) AS total_size
+                    FROM storage_usage
+                    WHERE ? IS NULL OR user_id = ?
+                    """,
+                    (user_id, user_id),
+                ).fetchone()
+        return {"total_files": row["total_files"], "total_size": row["total_size"]}
+
+    # ==================== 更新 ====================
+
+    def add_file(
+        self,
+        category: str,
+        user_id: str,
+        file_id: str,
+        storage_filename: str,
+        size: int,
+        original_filename: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        uploaded_at: Optional[str] = None,
+        modified_at: Optional[str] = None,
+        max_user_bytes: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """新增或更新檔案記錄，並在同一交易中更新使用者用量與內容 blob 引用數
+
+        同一 (category, user_id, file_id) 已存在時更新原始檔名、元數據與時間戳，
+        保留既有的 storage_filename（內容相同，不另存一份）。
+
+        Args:
+            max_user_bytes: 使用者配額（位元組）；None 表示不限制
+
+        Returns:
+            更新前的既有記錄；新檔案時返回 None
+
+        Raises:
+            StorageQuotaExceededError: 新增後用量將超過 max_user_bytes
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        uploaded_at = uploaded_at or now
+        modified_at = modified_at or now
+        metadata_json = json.dumps(metadata or {}, ensure_ascii=False, default=str)
+
+        with self._lock:
+            with self._get_conn() as conn:
+                # BEGIN IMMEDIATE 取得寫鎖，讓配額檢查與寫入在多個 worker 間保持原子性
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    existing = conn.execute(
+                        "SELECT * FROM storage_files WHERE category = ? AND user_id = ? AND file_id = ?",
+                        (category, user_id, file_id),
+                    ).fetchone()
+                    size_delta = size - (existing["size"] if existing else 0)
+
+                    if max_user_bytes is not None and size_delta > 0:
+                        usage = conn.execute(
+                            "SELECT total_size FROM storage_usage WHERE user_id = ?", (user_id,)
+                        ).fetchone()
+                        used = usage["total_size"] if usage else 0
+                        if used + size_delta > max_user_bytes:
+                            raise StorageQuotaExceededError(
+                                f"Storage quota exceeded for user {user_id}: "
+                                f"{used} + {size_delta} > {max_user_bytes} bytes"
+                            )
+
+                    if existing:
+                        conn.execute(
+                            """
+                            UPDATE storage_files
+                            SET size = ?, original_filename = ?, metadata = ?,
+                                uploaded_at = ?, modified_at = ?
+                            WHERE category = ? AND user_id = ? AND file_id = ?
+                            """,
+                            (size, original_filename, metadata_json, uploaded_at, modified_at,
+                             category, user_id, file_id),
+                        )
+                    else:
+                        conn.execute(
+                            """
+                            INSERT INTO storage_files
+                                (category, user_id, file_id, storage_filename, size,
+                                 original_filename, metadata, uploaded_at, modified_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            (category, user_id, file_id, storage_filename, size,
+                             original_filename, metadata_json, uploaded_at, modified_at),
+                        )
+                        self._add_blob_ref(conn, file_id, size)
+                    self._adjust_usage(conn, user_id, 0 if existing else 1, size_delta)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        return self._row_to_entry(existing) if existing else None
+
+    def remove_file(self, category: str, user_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        """移除檔案記錄、扣除使用者用量並釋放內容 blob 的引用
+
+        Returns:
+            被移除的記錄；不存在時返回 None
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    "SELECT * FROM storage_files WHERE category = ? AND user_id = ? AND file_id = ?",
+                    (category, user_id, file_id),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "DELETE FROM storage_files WHERE category = ? AND user_id = ? AND file_id = ?",
+                    (category, user_id, file_id),
+                )
+                self._adjust_usage(conn, user_id, -1, -row["size"])
+                self._release_blob_ref(conn, file_id)
+                conn.commit()
+        return self._row_to_entry(row)
+
+    def replace_all(
+        self,
+        entries: Iterable[Dict[str, Any]],
+        blobs: Optional[Dict[str, int]] = None
+    ) -> Dict[str, int]:
+        """以磁碟掃描結果重建索引（單一交易）
+
+        已索引且仍存在的檔案保留原始檔名、元數據與上傳時間，只更新大小與修改時間；
+        磁碟上新出現的檔案以儲存檔名作為原始檔名；磁碟上已不存在的記錄移除。
+        最後由 storage_files 重新彙總 storage_usage 與 storage_blobs 的引用數。
+
+        Args:
+            entries: 含 category、user_id、file_id、storage_filename、size、modified_at 的字典
+            blobs: 內容儲存區中的 blob（file_id → 大小）；沒有引用者標記為孤立，等待垃圾回收
+
+        Returns:
+            {"added", "updated", "removed", "total_files", "unreferenced_blobs"}
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        added = updated = 0
+        seen = set()
+
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for entry in entries:
+                        key = (entry["category"], entry["user_id"], entry["file_id"])
+                        seen.add(key)
+                        existing = conn.execute(
+                            """
+                            SELECT storage_filename, size, modified_at FROM storage_files
+                            WHERE category = ? AND user_id = ? AND file_id = ?
+                            """,
+                            key,
+                        ).fetchone()
+                        if existing is None:
+                            conn.execute(
+                                """
+                                INSERT INTO storage_files
+                                    (category, user_id, file_id, storage_filename, size,
+                                     original_filename, metadata, uploaded_at, modified_at)
+                                VALUES (?, ?, ?, ?, ?, ?, '{}', ?, ?)
+                                """,
+                                (*key, entry["storage_filename"], entry["size"],
+                                 entry["storage_filename"], entry["modified_at"], entry["modified_at"]),
+                            )
+                            added += 1
+                        elif (existing["storage_filename"], existing["size"], existing["modified_at"]) != (
+                            entry["storage_filename"], entry["size"], entry["modified_at"]
+                        ):
+                            conn.execute(
+                                """
+                                UPDATE storage_files SET storage_filename = ?, size = ?, modified_at = ?
+                                WHERE category = ? AND user_id = ? AND file_id = ?
+                                """,
+                                (entry["storage_filename"], entry["size"], entry["modified_at"], *key),
+                            )
+                            updated += 1
+
+                    stale = [
+                        tuple(row) for row in conn.execute(
+                            "SELECT category, user_id, file_id FROM storage_files"
+                        )
+                        if tuple(row) not in seen
+                    ]
+                    conn.executemany(
+                        "DELETE FROM storage_files WHERE category = ? AND user_id = ? AND file_id = ?",
+                        stale,
+                    )
+
+                    conn.execute("DELETE FROM storage_usage")
+                    conn.execute("""
+                        INSERT INTO storage_usage (user_id, total_files, total_size)
+                        SELECT user_id, COUNT(*), SUM(size) FROM storage_files GROUP BY user_id
+                    """)
+
+                    conn.execute("DELETE FROM storage_blobs")
+                    conn.execute("""
+                        INSERT INTO storage_blobs (file_id, size, refcount, orphaned_at)
+                        SELECT file_id, MAX(size), COUNT(*), NULL FROM storage_files GROUP BY file_id
+                    """)
+                    unreferenced = conn.executemany(
+                        """
+                        INSERT OR IGNORE INTO storage_blobs (file_id, size, refcount, orphaned_at)
+                        VALUES (?, ?, 0, ?)
+                        """,
+                        [(file_id, size, time.time()) for file_id, size in (blobs or {}).items()],
+                    ).rowcount
+                    conn.execute(
+                        """
+                        INSERT INTO storage_index_meta (key, value) VALUES ('reconciled_at', ?)
+                        ON CONFLICT (key) DO UPDATE SET value = excluded.value
+                        """,
+                        (now,),
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+        result = {
+            "added": added,
+            "updated": updated,
+            "removed": len(stale),
+            "total_files": len(seen),
+            "unreferenced_blobs": max(unreferenced, 0),
+        }
+        logger.info(f"Storage index reconciled: {result}")
+        return result
+
+    # ==================== 內容去重與垃圾回收 ====================
+
+    def get_dedup_report(self) -> Dict[str, int]:
+        """跨使用者去重統計
+
+        Returns:
+            logical_bytes（所有使用者引用的總大小）、stored_bytes（被引用 blob 的實際大小）、
+            bytes_saved、references、blobs、orphaned_blobs、orphaned_bytes（等待回收）
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                refs = conn.execute(
+                    "SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS bytes FROM storage_files"
+                ).fetchone()
+                blobs = conn.execute(
+                    """
+                    SELECT
+                        COALESCE(SUM(CASE WHEN refcount > 0 THEN 1 ELSE 0 END), 0) AS live,
+                        COALESCE(SUM(CASE WHEN refcount > 0 THEN size ELSE 0 END), 0) AS live_bytes,
+                        COALESCE(SUM(CASE WHEN refcount = 0 THEN 1 ELSE 0 END), 0) AS orphaned,
+                        COALESCE(SUM(CASE WHEN refcount = 0 THEN size ELSE 0 END), 0) AS orphaned_bytes
+                    FROM storage_blobs
+                    """
+                ).fetchone()
+        return {
+            "references": refs["n"],
+            "logical_bytes": refs["bytes"],
+            "blobs": blobs["live"],
+            "stored_bytes": blobs["live_bytes"],
+            "bytes_saved": refs["bytes"] - blobs["live_bytes"],
+            "orphaned_blobs": blobs["orphaned"],
+            "orphaned_bytes": blobs["orphaned_bytes"],
+        }
+
+    def get_blob_refcount(self, file_id: str) -> int:
+        """內容 blob 的引用數（未登記時為 0）"""
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    "SELECT refcount FROM storage_blobs WHERE file_id = ?", (file_id,)
+                ).fetchone()
+        return row["refcount"] if row else 0
+
+    def list_orphaned_blobs(self, orphaned_before: float, limit: int = 1000) -> List[str]:
+        """引用數為 0 且孤立時間早於 orphaned_before（epoch 秒）的 blob"""
+        with self._lock:
+            with self._get_conn() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT file_id FROM storage_blobs
+                    WHERE refcount = 0 AND orphaned_at <= ?
+                    ORDER BY orphaned_at
+                    LIMIT ?
+                    """,
+                    (orphaned_before, limit),
+                ).fetchall()
+        return [row["file_id"] for row in rows]
+
+    def delete_orphaned_blob(self, file_id: str, orphaned_before: float, remove: Callable[[str], bool]) -> bool:
+        """在寫鎖內再次確認 blob 仍為孤立後呼叫 remove 刪除檔案並移除記錄
+
+        寫鎖讓同時進行的上傳不會在確認與刪除之間取得引用：上傳若先提交，
+        引用數大於 0 而略過；若後提交，會發現 blob 已不存在並重新寫入。
+
+        Args:
+            remove: 刪除 blob 檔案的回呼；返回 False 表示不可刪除（記錄保留）
+
+        Returns:
+            是否已刪除
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        "SELECT refcount, orphaned_at FROM storage_blobs WHERE file_id = ?", (file_id,)
+                    ).fetchone()
+                    if row is None or row["refcount"] > 0 or row["orphaned_at"] > orphaned_before:
+                        conn.rollback()
+                        return False
+                    if not remove(file_id):
+                        conn.rollback()
+                        return False
+                    conn.execute("DELETE FROM storage_blobs WHERE file_id = ?", (file_id,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        return True
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """讀取索引狀態值，不存在時返回 None"""
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    "SELECT value FROM storage_index_meta WHERE key = ?", (key,)
+                ).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """寫入索引狀態值"""
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO storage_index_meta (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+                    """,
+                    (key, value),
+                )
+                conn.commit()
+
+    def get_reconciled_at(self) -> Optional[str]:
+        """上次重建索引的時間（ISO 8601），從未重建時返回 None"""
+        return self.get_meta("reconciled_at")
+
+    def close(self) -> None:
+        """關閉持久記憶體資料庫連線"""
+        if self._persistent_conn:
+            self._persistent_conn.close()
+            self._persistent_conn = None
@@ -7,6 +7,7 @@ Engagement Module - 社群互動模組
 - models.py: SQLAlchemy 資料模型（Post, PostComment, PostLike, UserEngagementProfile, PointsLog）
 - database.py: 資料庫初始化與 session 管理
 - service.py: 業務邏輯（EngagementService）
+- leaderboard.py: 排行榜的行程內排名索引（前 N 名與用戶名次）
 - api.py: Flask Blueprint REST API 端點
 - engagement.py: 積分獎勵便利函式
 """
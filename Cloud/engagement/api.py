@@ -8,6 +8,7 @@ from flask import Blueprint, jsonify, request
 
 from Cloud.api.auth import CloudAuthService
 from Cloud.engagement.database import init_db, is_initialized, session_scope
+from Cloud.engagement.leaderboard import leaderboard
 from Cloud.engagement.service import EngagementService
 
 logger = logging.getLogger(__name__)
@@ -35,6 +36,13 @@ def init_engagement_api(jwt_secret: str, database_url: str, create_tables: bool
     global auth_service
     auth_service = CloudAuthService(jwt_secret)
     init_db(database_url, create_tables=create_tables)
+    # 由新資料庫重建排行榜索引（資料表尚未建立時留待第一次查詢重建）
+    leaderboard.clear()
+    try:
+        with session_scope() as session:
+            leaderboard.rebuild(session)
+    except Exception as e:
+        logger.warning(f"Leaderboard rebuild deferred: {e}")
     logger.info("Engagement API initialized")
 
 
@@ -48,7 +56,7 @@ def get_service():
     if not is_initialized():
         raise RuntimeError("Database not initialized. Call init_engagement_api() first.")
     with session_scope() as session:
-        yield EngagementService(session)
+        yield EngagementService(session, leaderboard=leaderboard)
 
 
 def require_auth(f):
@@ -142,14 +150,15 @@ def get_profile(username: str):
 def get_leaderboard():
     """取得排行榜
 
-    GET /api/cloud/engagement/leaderboard?sort_by=points&limit=10
+    GET /api/cloud/engagement/leaderboard?sort_by=points&limit=10&offset=0
     """
     try:
         sort_by = request.args.get('sort_by', 'points')
         limit = request.args.get('limit', 10, type=int)
+        offset = request.args.get('offset', 0, type=int)
 
         with get_service() as service:
-            profiles = service.get_leaderboard(limit=limit, sort_by=sort_by)
+            profiles = service.get_leaderboard(limit=limit, sort_by=sort_by, offset=offset)
 
         return jsonify({
             'success': True,
@@ -163,6 +172,33 @@ def get_leaderboard():
         return jsonify({'success': False, 'error': '伺服器錯誤'}), 500
 
 
+@bp.route('/leaderboard/rank/<username>', methods=['GET'])
+def get_leaderboard_rank(username: str):
+    """取得用戶在排行榜上的名次
+
+    GET /api/cloud/engagement/leaderboard/rank/<username>?sort_by=points
+    """
+    try:
+        sort_by = request.args.get('sort_by', 'points')
+
+        with get_service() as service:
+            rank = service.get_rank(username, sort_by=sort_by)
+            if rank is None:
+                return jsonify({'success': False, 'error': '用戶檔案不存在'}), 404
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'user_username': username,
+                'rank': rank,
+                'sort_by': sort_by,
+            },
+        }), 200
+    except Exception:
+        logger.error("Get leaderboard rank error", exc_info=True)
+        return jsonify({'success': False, 'error': '伺服器錯誤'}), 500
+
+
 # ──────────────────────────────
 # 討論區貼文
 # ──────────────────────────────
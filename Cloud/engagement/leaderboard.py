@@ -0,0 +1,390 @@
+"""
+排行榜的行程內排名索引
+
+每個排序欄位（points/level/reputation/commands）維護一個可索引跳躍串列
+（indexable skip list），前 N 名與「我的名次」查詢為期望 O(log n + N)，
+不再對所有用戶檔案執行 ORDER BY ... LIMIT。
+
+啟動時由資料庫重建（rebuild）；EngagementService 在積分變動後以 track() 登記，
+交易提交後才套用到索引，回滾的變動不會出現在排行榜上。
+多個 worker 行程各自持有索引，其他行程的變動在定期重建（REBUILD_INTERVAL）後反映。
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from Cloud.engagement.models import UserEngagementProfile
+
+logger = logging.getLogger(__name__)
+
+# 排序欄位 → 排名鍵（鍵越小名次越前；以 id 區分同分，與 SQL 排序一致）
+SORT_KEYS = {
+    'points': lambda v: (-v['points'], v['id']),
+    'level': lambda v: (-v['level'], -v['points'], v['id']),
+    'reputation': lambda v: (-v['reputation'], v['id']),
+    'commands': lambda v: (-v['total_commands'], v['id']),
+}
+
+DEFAULT_SORT = 'points'
+
+# 排名使用的檔案欄位
+RANKED_FIELDS = ('points', 'level', 'reputation', 'total_commands')
+
+# 距上次重建超過此秒數時由資料庫重建（反映其他行程的變動）
+REBUILD_INTERVAL = 600
+
+# 跳躍串列的最大層數與升層機率（4^16 筆以內維持 O(log n)）
+MAX_LEVEL = 16
+LEVEL_PROBABILITY = 0.25
+
+# session.info 中待提交變動的鍵前綴（每個 Leaderboard 實例各自一份）
+_PENDING_KEY = 'engagement_leaderboard_pending'
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: List[Optional['_Node']] = [None] * level
+        # width[i]：沿第 i 層走到下一個節點跨過的底層節點數（下一個為 None 時為到結尾的距離 + 1）
+        self.width = [1] * level
+
+
+class RankedIndex:
+    """可索引跳躍串列：鍵唯一且有序，插入、刪除、名次與依名次取值皆為期望 O(log n)"""
+
+    def __init__(self, seed: Optional[int] = None):
+        self._head = _Node(None, MAX_LEVEL)
+        self._size = 0
+        self._random = random.Random(seed)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def from_sorted(cls, keys: List[Any], seed: Optional[int] = None) -> 'RankedIndex':
+        """由已排序且唯一的鍵以 O(n) 建立（重建時使用，避免逐筆插入）
+
+        層數依名次決定（每 4 個節點升一層），建立後即為平衡的跳躍串列。
+        """
+        index = cls(seed=seed)
+        last = [index._head] * MAX_LEVEL
+        last_position = [0] * MAX_LEVEL
+        for position, key in enumerate(keys, 1):
+            level = 1
+            remainder = position
+            while level < MAX_LEVEL and remainder % 4 == 0:
+                remainder //= 4
+                level += 1
+            node = _Node(key, level)
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(MAX_LEVEL):
+            last[level].width[level] = len(keys) - last_position[level] + 1
+        index._size = len(keys)
+        return index
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < LEVEL_PROBABILITY:
+            level += 1
+        return level
+
+    def insert(self, key: Any) -> None:
+        """插入鍵（鍵已存在時行為未定義，由呼叫端確保唯一）"""
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        steps_at_level = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_level = self._random_level()
+        new_node = _Node(key, new_level)
+        steps = 0
+        for level in range(new_level):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(new_level, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any) -> None:
+        """移除鍵
+
+        Raises:
+            KeyError: 鍵不存在
+        """
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key: Any) -> int:
+        """小於 key 的鍵數量（key 存在時即為其 0 起算的名次）"""
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start: int, count: int) -> List[Any]:
+        """依名次取得 [start, start + count) 的鍵"""
+        if count <= 0 or start >= self._size:
+            return []
+        start = max(start, 0)
+        # 先沿高層定位到第 start 個節點之前，再沿底層逐一讀取
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not None and position + node.width[level] <= start:
+                position += node.width[level]
+                node = node.next[level]
+        keys = []
+        node = node.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """各排序欄位的排名索引（執行緒安全）"""
+
+    def __init__(self, rebuild_interval: float = REBUILD_INTERVAL):
+        """
+        初始化排行榜
+
+        Args:
+            rebuild_interval: 距上次重建超過此秒數時視為過期（0 表示不定期重建）
+        """
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.RLock()
+        # 同一時間只進行一次重建
+        self._rebuild_lock = threading.Lock()
+        self._indexes: Dict[str, RankedIndex] = {}
+        # profile id → 排名欄位值（含 id）
+        self._values: Dict[int, Dict[str, int]] = {}
+        self._ids_by_username: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        # 重建期間提交的變動，重建完成後重新套用到新索引
+        self._updates_during_rebuild: Optional[List[Tuple[int, str, Dict[str, int]]]] = None
+        self._pending_key = f'{_PENDING_KEY}:{id(self)}'
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def is_stale(self) -> bool:
+        """尚未載入，或距上次重建已超過 rebuild_interval"""
+        if self._loaded_at is None:
+            return True
+        return bool(self.rebuild_interval) and time.monotonic() - self._loaded_at > self.rebuild_interval
+
+    def rebuild(self, db_session) -> int:
+        """由資料庫重建所有排名索引
+
+        Args:
+            db_session: SQLAlchemy session
+
+        Returns:
+            int: 載入的用戶檔案數
+        """
+        with self._rebuild_lock:
+            return self._rebuild(db_session)
+
+    def refresh_if_stale(self, db_session) -> bool:
+        """索引過期時重建
+
+        尚未載入時等待重建完成；已載入但過期時若其他執行緒正在重建，
+        直接沿用現有索引，不阻塞查詢。
+
+        Returns:
+            bool: 是否執行了重建
+        """
+        if not self.is_stale():
+            return False
+        if not self._rebuild_lock.acquire(blocking=not self.is_loaded):
+            return False
+        try:
+            if not self.is_stale():
+                return False
+            self._rebuild(db_session)
+            return True
+        finally:
+            self._rebuild_lock.release()
+
+    def _rebuild(self, db_session) -> int:
+        started = time.perf_counter()
+        with self._lock:
+            self._updates_during_rebuild = []
+        try:
+            rows = db_session.query(
+                UserEngagementProfile.id,
+                UserEngagementProfile.user_username,
+                *(getattr(UserEngagementProfile, field) for field in RANKED_FIELDS)
+            ).all()
+        except Exception:
+            with self._lock:
+                self._updates_during_rebuild = None
+            raise
+
+        values = {}
+        ids_by_username = {}
+        for row in rows:
+            values[row[0]] = self._normalize(row[0], dict(zip(RANKED_FIELDS, row[2:])))
+            ids_by_username[row[1]] = row[0]
+        indexes = {
+            sort_by: RankedIndex.from_sorted(sorted(map(key_func, values.values())))
+            for sort_by, key_func in SORT_KEYS.items()
+        }
+
+        with self._lock:
+            self._indexes = indexes
+            self._values = values
+            self._ids_by_username = ids_by_username
+            replay, self._updates_during_rebuild = self._updates_during_rebuild or [], None
+            for profile_id, username, entry in replay:
+                self._apply(profile_id, username, entry)
+            self._loaded_at = time.monotonic()
+
+        logger.info(
+            f"Leaderboard rebuilt from {len(values)} profiles in "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        return len(values)
+
+    @staticmethod
+    def _normalize(profile_id: int, fields: Dict[str, Any]) -> Dict[str, int]:
+        entry = {field: int(fields.get(field) or 0) for field in RANKED_FIELDS}
+        entry['id'] = profile_id
+        return entry
+
+    def update(self, profile_id: int, username: str, **fields: Any) -> None:
+        """新增或更新用戶在各排名索引中的位置
+
+        Args:
+            profile_id: 用戶檔案 ID
+            username: 用戶名稱
+            **fields: RANKED_FIELDS 中欄位的最新值
+        """
+        entry = self._normalize(profile_id, fields)
+        with self._lock:
+            if self._updates_during_rebuild is not None:
+                self._updates_during_rebuild.append((profile_id, username, entry))
+            self._apply(profile_id, username, entry)
+
+    def _apply(self, profile_id: int, username: str, entry: Dict[str, int]) -> None:
+        old = self._values.get(profile_id)
+        if old == entry:
+            return
+        for sort_by, key_func in SORT_KEYS.items():
+            index = self._indexes.setdefault(sort_by, RankedIndex())
+            if old is not None:
+                index.remove(key_func(old))
+            index.insert(key_func(entry))
+        self._values[profile_id] = entry
+        self._ids_by_username[username] = profile_id
+
+    def top(self, sort_by: str = DEFAULT_SORT, limit: int = 10, offset: int = 0) -> List[int]:
+        """取得依 sort_by 排序的用戶檔案 ID
+
+        Args:
+            sort_by: 排序欄位（未知欄位使用 points）
+            limit: 筆數
+            offset: 起始名次（0 起算）
+
+        Returns:
+            List[int]: 用戶檔案 ID（名次由前到後）
+        """
+        sort_by = sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+        with self._lock:
+            index = self._indexes.get(sort_by)
+            if index is None:
+                return []
+            return [key[-1] for key in index.slice(offset, limit)]
+
+    def rank(self, user_username: str, sort_by: str = DEFAULT_SORT) -> Optional[int]:
+        """取得用戶的名次（1 起算）
+
+        Returns:
+            Optional[int]: 名次；用戶不在排行榜中時為 None
+        """
+        sort_by = sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+        with self._lock:
+            profile_id = self._ids_by_username.get(user_username)
+            index = self._indexes.get(sort_by)
+            if profile_id is None or index is None:
+                return None
+            return index.rank(SORT_KEYS[sort_by](self._values[profile_id])) + 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._values)
+
+    def track(self, db_session, profile: UserEngagementProfile) -> None:
+        """登記 session 中變動的用戶檔案，交易提交後才更新排名索引
+
+        Args:
+            db_session: 持有變動的 SQLAlchemy session（profile 須已 flush，具有 id）
+            profile: 變動後的用戶檔案
+        """
+        pending = db_session.info.setdefault(self._pending_key, {})
+        pending[profile.id] = (
+            profile.user_username,
+            {field: getattr(profile, field) for field in RANKED_FIELDS},
+        )
+        # 每個 session 只註冊一次（scoped_session 在同一執行緒重複使用同一個 session）
+        if not event.contains(db_session, 'after_commit', self._on_commit):
+            event.listen(db_session, 'after_commit', self._on_commit)
+            event.listen(db_session, 'after_rollback', self._on_rollback)
+
+    def _on_commit(self, db_session) -> None:
+        pending = db_session.info.pop(self._pending_key, None)
+        for profile_id, (username, fields) in (pending or {}).items():
+            self.update(profile_id, username, **fields)
+
+    def _on_rollback(self, db_session) -> None:
+        db_session.info.pop(self._pending_key, None)
+
+    def clear(self) -> None:
+        """清除索引（下次查詢時重建）"""
+        with self._lock:
+            self._indexes = {}
+            self._values = {}
+            self._ids_by_username = {}
+            self._loaded_at = None
+
+
+# 行程內共用的排行榜
+leaderboard = Leaderboard()
@@ -2,9 +2,11 @@
 import logging
 from typing import List, Optional, Tuple, Dict, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, and_, or_, func
 import bleach
 
+from Cloud.engagement.leaderboard import Leaderboard, SORT_KEYS, DEFAULT_SORT
+
 from Cloud.engagement.models import (
     UserEngagementProfile,
     Post,
@@ -98,13 +100,15 @@ class EngagementService:
     提供討論區貼文、評論、點讚、積分與排行榜等核心業務邏輯。
     """
 
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, leaderboard: Optional[Leaderboard] = None):
         """初始化服務
 
         Args:
             db_session: SQLAlchemy database session
+            leaderboard: 行程內排名索引；None 時排行榜與名次查詢直接以 SQL 排序
         """
         self.db = db_session
+        self.leaderboard = leaderboard
 
     # ──────────────────────────────
     # 用戶積分檔案
@@ -126,6 +130,7 @@ class EngagementService:
             profile = UserEngagementProfile(user_username=user_username)
             self.db.add(profile)
             self.db.flush()
+            self._track_ranking(profile)
         return profile
 
     def award_points(self, user_username: str, reason: str, amount: Optional[int] = None) -> UserEngagementProfile:
@@ -155,6 +160,7 @@ class EngagementService:
         log = PointsLog(user_username=user_username, amount=amount, reason=reason)
         self.db.add(log)
         self.db.flush()
+        self._track_ranking(profile)
 
         logger.info(f"Awarded {amount:+d} pts to {user_username} for '{reason}' (total: {profile.points})")
         return profile
@@ -436,29 +442,101 @@ class EngagementService:
         self,
         limit: int = 10,
         sort_by: str = 'points',
+        offset: int = 0,
     ) -> List[UserEngagementProfile]:
         """取得排行榜
 
+        有排名索引時由索引取得名次（O(log n + limit)），再以主鍵載入用戶檔案；
+        否則以 SQL 排序。同分時依 id 排序，level 同級時依積分排序。
+
         Args:
             limit: 筆數（最大 100）
-            sort_by: 排序欄位（points/level/reputation/total_commands）
+            sort_by: 排序欄位（points/level/reputation/commands）
+            offset: 起始名次（0 起算）
 
         Returns:
             List[UserEngagementProfile]
         """
         limit = min(limit, 100)
+        offset = max(offset, 0)
+        sort_by = sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+
+        if self.leaderboard is not None:
+            self.leaderboard.refresh_if_stale(self.db)
+            ids = self.leaderboard.top(sort_by, limit, offset)
+            if not ids:
+                return []
+            profiles = self.db.query(UserEngagementProfile).filter(UserEngagementProfile.id.in_(ids)).all()
+            by_id = {profile.id: profile for profile in profiles}
+            return [by_id[profile_id] for profile_id in ids if profile_id in by_id]
+
+        q = self.db.query(UserEngagementProfile).order_by(*self._leaderboard_order(sort_by))
+        if offset:
+            q = q.offset(offset)
+        return q.limit(limit).all()
+
+    def get_rank(self, user_username: str, sort_by: str = 'points') -> Optional[int]:
+        """取得用戶在排行榜上的名次（1 起算，同分依 id 排序）
+
+        Args:
+            user_username: 用戶名稱
+            sort_by: 排序欄位（points/level/reputation/commands）
 
+        Returns:
+            Optional[int]: 名次；用戶沒有積分檔案時為 None
+        """
+        sort_by = sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+        if self.leaderboard is not None:
+            self.leaderboard.refresh_if_stale(self.db)
+            rank = self.leaderboard.rank(user_username, sort_by)
+            if rank is not None:
+                return rank
+
+        # 其他行程新建立、尚未反映到索引的用戶以 SQL 計算
+        profile = self.get_profile(user_username)
+        if profile is None:
+            return None
+        ahead = self.db.query(func.count(UserEngagementProfile.id)).filter(
+            self._ranked_ahead_of(sort_by, profile)
+        ).scalar()
+        return (ahead or 0) + 1
+
+    @staticmethod
+    def _leaderboard_order(sort_by: str) -> tuple:
+        """排行榜的 SQL 排序（與 leaderboard.SORT_KEYS 一致）"""
+        profile = UserEngagementProfile
+        if sort_by == 'level':
+            return desc(profile.level), desc(profile.points), asc(profile.id)
         sort_field_map = {
-            'points': UserEngagementProfile.points,
-            'level': UserEngagementProfile.level,
-            'reputation': UserEngagementProfile.reputation,
-            'commands': UserEngagementProfile.total_commands,
+            'points': profile.points,
+            'reputation': profile.reputation,
+            'commands': profile.total_commands,
         }
-        sort_field = sort_field_map.get(sort_by, UserEngagementProfile.points)
-
-        return self.db.query(UserEngagementProfile).order_by(
-            desc(sort_field)
-        ).limit(limit).all()
+        return desc(sort_field_map.get(sort_by, profile.points)), asc(profile.id)
+
+    @staticmethod
+    def _ranked_ahead_of(sort_by: str, target: UserEngagementProfile):
+        """排名在 target 之前的用戶檔案條件"""
+        profile = UserEngagementProfile
+        if sort_by == 'level':
+            columns = ((profile.level, target.level or 0), (profile.points, target.points or 0))
+        else:
+            field = {'reputation': 'reputation', 'commands': 'total_commands'}.get(sort_by, 'points')
+            columns = ((getattr(profile, field), getattr(target, field) or 0),)
+
+        # (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ... OR (全部相等 AND id < target.id)
+        conditions = []
+        equal_so_far = []
+        for column, value in columns:
+            conditions.append(and_(*equal_so_far, func.coalesce(column, 0) > value))
+            equal_so_far.append(func.coalesce(column, 0) == value)
+        conditions.append(and_(*equal_so_far, profile.id < target.id))
+        return or_(*conditions)
+
+    def _track_ranking(self, profile: UserEngagementProfile) -> None:
+        """登記排名變動，交易提交後更新排名索引"""
+        if self.leaderboard is not None:
+            self.leaderboard.track(self.db, profile)
 
     def get_points_log(
         self,
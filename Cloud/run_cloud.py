@@ -73,7 +73,12 @@ def create_app(
 
     # 1. 初始化並註冊核心雲端服務（認證 + 檔案儲存）
     app.register_blueprint(cloud_bp)
-    init_cloud_services(jwt_secret=jwt_secret, storage_path=storage_path)
+    quota = os.environ.get('CLOUD_STORAGE_USER_QUOTA_BYTES', '')
+    init_cloud_services(
+        jwt_secret=jwt_secret,
+        storage_path=storage_path,
+        max_user_bytes=int(quota) if quota else None,
+    )
 
     # 2. 初始化並註冊資料同步服務
     app.register_blueprint(data_sync_bp)
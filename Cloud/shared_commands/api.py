@@ -1,4 +1,6 @@
 # imports
+import atexit
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
 from functools import wraps
 import logging
@@ -6,17 +8,25 @@ from typing import Optional
 from contextlib import contextmanager
 
 from Cloud.shared_commands.service import SharedCommandService
-from Cloud.shared_commands.database import session_scope, init_db, is_initialized
+from Cloud.shared_commands.browse_cache import browse_cache, FEATURED, POPULAR, CATEGORIES
+from Cloud.shared_commands.counters import command_counters
+from Cloud.shared_commands.database import session_scope, init_db, is_initialized, get_engine
 from Cloud.api.auth import CloudAuthService
+from Cloud.api.compression import compress_response
+from Cloud.api.conditional import compute_etag, conditional_json, etag_matches
 
 logger = logging.getLogger(__name__)
 
 # Blueprint
 bp = Blueprint('shared_commands_api', __name__, url_prefix='/api/cloud/shared_commands')
+bp.after_request(compress_response)
 
 # 服務實例（需要在初始化時設定）
 auth_service: Optional[CloudAuthService] = None
 
+# 行程結束前寫回計數器緩衝
+atexit.register(command_counters.stop)
+
 
 def init_shared_commands_api(jwt_secret: str, database_url: str, create_tables: bool = True):
     """初始化 shared commands API（認證 + 資料庫）
@@ -40,8 +50,12 @@ def init_shared_commands_api(jwt_secret: str, database_url: str, create_tables:
     auth_service = CloudAuthService(jwt_secret)
     logger.info("Shared commands auth service initialized")
     
-    # 初始化資料庫
+    # 初始化資料庫（先寫回前一個資料庫的計數器增量）
+    command_counters.stop()
+    command_counters.discard()
     init_db(database_url, create_tables=create_tables)
+    browse_cache.clear()
+    command_counters.start(get_engine)
     logger.info(f"Shared commands database initialized: {database_url}")
 
 
@@ -127,7 +141,7 @@ def get_service():
         )
     
     with session_scope() as session:
-        yield SharedCommandService(session)
+        yield SharedCommandService(session, cache=browse_cache, counters=command_counters)
 
 
 @bp.route('/upload', methods=['POST'])
@@ -199,17 +213,22 @@ def search_commands():
         category=分類&
         author=作者&
         min_rating=4.0&
-        sort_by=rating&
+        sort_by=relevance&
         order=desc&
         limit=50&
         offset=0
+
+    sort_by 可為 relevance/rating/downloads/usage/created_at；
+    未指定時有關鍵字以 relevance（全文檢索相關性加權評分與下載數）排序，否則以 rating 排序。
+
+    回應帶內容雜湊的強 ETag；If-None-Match 符合時回傳 304。
     """
     try:
         query = request.args.get('query')
         category = request.args.get('category')
         author = request.args.get('author')
         min_rating = request.args.get('min_rating', type=float)
-        sort_by = request.args.get('sort_by', 'rating')
+        sort_by = request.args.get('sort_by')
         order = request.args.get('order', 'desc')
         limit = request.args.get('limit', 50, type=int)
         offset = request.args.get('offset', 0, type=int)
@@ -226,7 +245,7 @@ def search_commands():
                 offset=offset
             )
 
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': {
                 'commands': [cmd.to_dict() for cmd in commands],
@@ -234,7 +253,7 @@ def search_commands():
                 'limit': limit,
                 'offset': offset
             }
-        }), 200
+        })
 
     except Exception as e:
         logger.error(f"Search commands error: {e}", exc_info=True)
@@ -246,6 +265,8 @@ def get_command(command_id: int):
     """取得指令詳情
 
     GET /api/cloud/shared_commands/<command_id>
+
+    回應帶內容雜湊的強 ETag；If-None-Match 符合時回傳 304。
     """
     try:
         with get_service() as service:
@@ -257,16 +278,30 @@ def get_command(command_id: int):
                     'error': '指令不存在或不公開'
                 }), 404
 
-        return jsonify({
-            'success': True,
-            'data': command.to_dict()
-        }), 200
+            payload = {
+                'success': True,
+                'data': command.to_dict()
+            }
+
+        return conditional_json(payload)
 
     except Exception as e:
         logger.error(f"Get command error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': '伺服器錯誤'}), 500
 
 
+def command_content_etag(command) -> str:
+    """共享指令內容的強 ETag（只包含導入相關欄位與版本）"""
+    return compute_etag({
+        'id': command.id,
+        'name': command.name,
+        'description': command.description,
+        'category': command.category,
+        'content': command.content,
+        'version': command.version,
+    })
+
+
 @bp.route('/<int:command_id>/download', methods=['POST'])
 @require_auth
 def download_command(command_id: int):
@@ -276,6 +311,10 @@ def download_command(command_id: int):
     {
         "edge_id": "edge-device-123"
     }
+
+    回應的 ETag 只涵蓋導入所需的指令內容（不含下載次數等統計）。
+    帶 If-None-Match 且符合時回傳 412（POST 的條件請求失敗，RFC 9110），
+    不計入下載次數，Edge 可沿用已導入的版本。
     """
     try:
         data = request.get_json()
@@ -288,13 +327,26 @@ def download_command(command_id: int):
             }), 400
 
         with get_service() as service:
+            command = service.get_command(command_id)
+            if command is not None:
+                etag = command_content_etag(command)
+                matched = etag_matches(etag)
+                if matched is not None:
+                    response = jsonify({'success': False, 'error': '指令未變更'})
+                    response.set_etag(matched)
+                    return response, 412
+
             command = service.download_command(command_id, edge_id)
+            payload = command.to_dict()
+            etag = command_content_etag(command)
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'message': '指令已成功下載',
-            'data': command.to_dict()
-        }), 200
+            'data': payload
+        })
+        response.set_etag(etag)
+        return response, 200
 
     except ValueError as e:
         logger.error(f"Download command error: {e}")
@@ -475,19 +527,23 @@ def get_featured_commands():
     """取得精選指令
 
     GET /api/cloud/shared_commands/featured?limit=10
+
+    結果經行程內快取（評分變動時失效）；回應帶強 ETag，If-None-Match 符合時回傳 304。
     """
     try:
         limit = request.args.get('limit', 10, type=int)
 
         with get_service() as service:
-            commands = service.get_featured_commands(limit)
+            commands, etag = browse_cache.get_or_build(
+                FEATURED, limit, lambda: [cmd.to_dict() for cmd in service.get_featured_commands(limit)]
+            )
 
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': {
-                'commands': [cmd.to_dict() for cmd in commands]
+                'commands': commands
             }
-        }), 200
+        }, etag=etag)
 
     except Exception as e:
         logger.error(f"Get featured commands error: {e}", exc_info=True)
@@ -499,19 +555,23 @@ def get_popular_commands():
     """取得熱門指令
 
     GET /api/cloud/shared_commands/popular?limit=10
+
+    結果經行程內快取（下載改變排名時失效）；回應帶強 ETag，If-None-Match 符合時回傳 304。
     """
     try:
         limit = request.args.get('limit', 10, type=int)
 
         with get_service() as service:
-            commands = service.get_popular_commands(limit)
+            commands, etag = browse_cache.get_or_build(
+                POPULAR, limit, lambda: [cmd.to_dict() for cmd in service.get_popular_commands(limit)]
+            )
 
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': {
-                'commands': [cmd.to_dict() for cmd in commands]
+                'commands': commands
             }
-        }), 200
+        }, etag=etag)
 
     except Exception as e:
         logger.error(f"Get popular commands error: {e}", exc_info=True)
@@ -523,18 +583,95 @@ def get_categories():
     """取得所有分類及其指令數量
 
     GET /api/cloud/shared_commands/categories
+
+    結果經行程內快取（上傳時失效）；回應帶強 ETag，If-None-Match 符合時回傳 304。
     """
     try:
         with get_service() as service:
-            categories = service.get_categories()
+            categories, etag = browse_cache.get_or_build(CATEGORIES, None, service.get_categories)
 
-        return jsonify({
+        return conditional_json({
             'success': True,
             'data': {
                 'categories': categories
             }
-        }), 200
+        }, etag=etag)
 
     except Exception as e:
         logger.error(f"Get categories error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': '伺服器錯誤'}), 500
+
+
+@bp.route('/changes', methods=['GET'])
+@require_auth
+def get_command_changes():
+    """取得水位之後變更的公開指令（Edge 增量同步）
+
+    GET /api/cloud/shared_commands/changes?since=2026-01-01T00:00:00.123456&since_id=42&limit=500
+
+    Query Parameters:
+        since: 上一頁回傳的 next_watermark.updated_at（省略表示從頭開始）
+        since_id: 上一頁回傳的 next_watermark.id
+        limit: 每頁筆數（預設 500，最大 1000）
+
+    Response:
+        {
+            "success": true,
+            "data": {
+                "commands": [...],
+                "next_watermark": {"updated_at": "...", "id": 57},
+                "has_more": false
+            }
+        }
+
+    以 (updated_at, id) keyset 分頁，成本只與變更筆數相關；沒有變更時 next_watermark
+    為傳入的水位。不計入下載次數。
+    """
+    try:
+        since_raw = request.args.get('since')
+        since_id = request.args.get('since_id', 0, type=int)
+        limit = request.args.get('limit', 500, type=int)
+        since = None
+        if since_raw:
+            try:
+                since = datetime.fromisoformat(since_raw)
+            except ValueError:
+                return jsonify({'success': False, 'error': '無效的 since 時間格式'}), 400
+            if since.tzinfo is not None:
+                since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+        with get_service() as service:
+            commands, has_more = service.get_changed_commands(since=since, since_id=since_id, limit=limit)
+            payload = [cmd.to_dict() for cmd in commands]
+
+        if payload:
+            next_watermark = {'updated_at': payload[-1]['updated_at'], 'id': payload[-1]['id']}
+        elif since is not None:
+            next_watermark = {'updated_at': since.isoformat(), 'id': since_id}
+        else:
+            next_watermark = None
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'commands': payload,
+                'next_watermark': next_watermark,
+                'has_more': has_more
+            }
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Get command changes error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': '伺服器錯誤'}), 500
+
+
+@bp.route('/cache/stats', methods=['GET'])
+@require_auth
+def get_cache_stats():
+    """取得瀏覽列表快取的命中率與重建耗時（僅限管理員）
+
+    GET /api/cloud/shared_commands/cache/stats
+    """
+    if getattr(request, 'role', None) != 'admin':
+        return jsonify({'success': False, 'error': 'Forbidden', 'message': 'Admin role required'}), 403
+    return jsonify({'success': True, 'data': browse_cache.get_stats()}), 200
@@ -0,0 +1,182 @@
+"""
+共享指令瀏覽結果快取
+
+精選、熱門與分類列表是每個 Edge 瀏覽頁面都會呼叫的 ORDER BY / GROUP BY 查詢。
+此模組以行程內 TTL 快取保存序列化後的結果與內容雜湊 ETag，
+並由 SharedCommandService 在上傳、評分、下載改變相關排序時主動失效。
+
+TTL 只作為保險：失效由寫入事件驅動；不影響排序的欄位（例如熱門列表中
+某指令的下載數小幅增加）可能在 TTL 內維持舊值。多個 worker 行程各自持有快取，
+其他行程的寫入同樣在 TTL 內反映。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from Cloud.api.conditional import compute_etag
+
+logger = logging.getLogger(__name__)
+
+# 快取種類
+FEATURED = 'featured'
+POPULAR = 'popular'
+CATEGORIES = 'categories'
+
+# 各種類的 TTL（秒）
+DEFAULT_TTLS = {
+    FEATURED: 300,
+    POPULAR: 300,
+    CATEGORIES: 600,
+}
+
+# 每個種類最多保存的參數組合數（例如不同的 limit）
+MAX_ENTRIES_PER_KIND = 32
+
+
+class _KindStats:
+    """單一快取種類的計數器"""
+
+    __slots__ = ('hits', 'misses', 'invalidations', 'rebuilds', 'rebuild_seconds', 'last_rebuild_seconds',
+                 'max_rebuild_seconds')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self.last_rebuild_seconds = 0.0
+        self.max_rebuild_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'rebuilds': self.rebuilds,
+            'avg_rebuild_ms': round(self.rebuild_seconds / self.rebuilds * 1000, 3) if self.rebuilds else 0.0,
+            'last_rebuild_ms': round(self.last_rebuild_seconds * 1000, 3),
+            'max_rebuild_ms': round(self.max_rebuild_seconds * 1000, 3),
+        }
+
+
+class BrowseCache:
+    """瀏覽列表的行程內 TTL 快取（執行緒安全）
+
+    每筆快取以 (種類, 參數) 為鍵，保存 (資料, ETag, 到期時間)。
+    每個種類有世代計數：失效時遞增，建立期間世代改變的結果不寫入快取，
+    避免與寫入交錯的重建把舊資料存回去。
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None):
+        """
+        初始化快取
+
+        Args:
+            ttls: 各種類的 TTL（秒），未指定的種類使用 DEFAULT_TTLS
+        """
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[Hashable, Tuple[Any, str, float]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._stats: Dict[str, _KindStats] = {}
+
+    def _kind_stats(self, kind: str) -> _KindStats:
+        stats = self._stats.get(kind)
+        if stats is None:
+            stats = self._stats[kind] = _KindStats()
+        return stats
+
+    def get_or_build(self, kind: str, params: Hashable, builder: Callable[[], Any]) -> Tuple[Any, str]:
+        """取得快取結果，未命中或過期時呼叫 builder 重建
+
+        Args:
+            kind: 快取種類
+            params: 查詢參數（可雜湊，例如 limit）
+            builder: 重建函數，返回可 JSON 序列化的資料
+
+        Returns:
+            Tuple[Any, str]: (資料, ETag)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(kind, {}).get(params)
+            stats = self._kind_stats(kind)
+            if entry is not None and entry[2] > now:
+                stats.hits += 1
+                return entry[0], entry[1]
+            stats.misses += 1
+            generation = self._generations.get(kind, 0)
+
+        started = time.perf_counter()
+        data = builder()
+        etag = compute_etag(data)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            stats = self._kind_stats(kind)
+            stats.rebuilds += 1
+            stats.rebuild_seconds += elapsed
+            stats.last_rebuild_seconds = elapsed
+            stats.max_rebuild_seconds = max(stats.max_rebuild_seconds, elapsed)
+            if self._generations.get(kind, 0) == generation:
+                entries = self._entries.setdefault(kind, {})
+                entries.pop(params, None)
+                entries[params] = (data, etag, time.monotonic() + self.ttls.get(kind, 0))
+                while len(entries) > MAX_ENTRIES_PER_KIND:
+                    entries.pop(next(iter(entries)))
+        return data, etag
+
+    def invalidate(self, kind: str, predicate: Optional[Callable[[Hashable, Any], bool]] = None) -> int:
+        """使某種類的快取失效
+
+        Args:
+            kind: 快取種類
+            predicate: (參數, 資料) -> 是否失效；None 表示整個種類失效
+
+        Returns:
+            int: 移除的快取筆數
+        """
+        with self._lock:
+            entries = self._entries.get(kind, {})
+            if predicate is None:
+                stale = list(entries)
+            else:
+                stale = [params for params, entry in entries.items() if predicate(params, entry[0])]
+            # 進行中的重建可能讀到寫入前的資料，遞增世代讓它不寫入快取
+            self._generations[kind] = self._generations.get(kind, 0) + 1
+            for params in stale:
+                del entries[params]
+            if stale:
+                self._kind_stats(kind).invalidations += 1
+        if stale:
+            logger.debug(f"Invalidated {len(stale)} {kind} cache entries")
+        return len(stale)
+
+    def clear(self) -> None:
+        """清除所有快取與統計"""
+        with self._lock:
+            for kind in set(self._entries) | set(self._generations):
+                self._generations[kind] = self._generations.get(kind, 0) + 1
+            self._entries.clear()
+            self._stats.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """取得各種類的命中率、重建耗時與快取筆數"""
+        with self._lock:
+            return {
+                kind: {
+                    **self._kind_stats(kind).to_dict(),
+                    'entries': len(self._entries.get(kind, {})),
+                    'ttl_seconds': self.ttls.get(kind, 0),
+                }
+                for kind in sorted(set(self.ttls) | set(self._stats))
+            }
+
+
+# 行程內共用的瀏覽快取
+browse_cache = BrowseCache()
@@ -0,0 +1,213 @@
+"""
+共享指令計數器的寫回緩衝（write-behind）
+
+下載與評分只在記憶體中累加增量，由背景執行緒定期以單一交易
+批次寫回 shared_advanced_command，熱門指令的下載尖峰不再讓每個請求
+都更新（並鎖定）同一列。讀取路徑以 apply_pending() 把尚未寫回的增量
+加回 ORM 物件，回應中的計數保持準確。
+
+增量只存在於本行程：行程異常終止時最多遺失一個寫回間隔內的增量；
+正常關閉（stop()）會先寫回。多個 worker 行程各自緩衝，其他行程的增量
+在寫回後才看得到。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm.attributes import set_committed_value
+
+logger = logging.getLogger(__name__)
+
+# 背景寫回間隔（秒）
+FLUSH_INTERVAL = 5.0
+
+# 緩衝的增量欄位：下載數、評分總和增量、評分人數增量
+COUNTER_FIELDS = ('download_count', 'rating_sum', 'rating_count')
+
+# 以 SQL 原子性地套用增量（SET 右側皆引用更新前的值）
+_FLUSH_SQL = text("""
+    UPDATE shared_advanced_command SET
+        download_count = COALESCE(download_count, 0) + :download_count,
+        average_rating = CASE
+            WHEN COALESCE(rating_count, 0) + :rating_count > 0 THEN
+                (COALESCE(average_rating, 0) * COALESCE(rating_count, 0) + :rating_sum)
+                / (COALESCE(rating_count, 0) + :rating_count)
+            ELSE 0
+        END,
+        rating_count = COALESCE(rating_count, 0) + :rating_count
+    WHERE id = :command_id
+""")
+
+
+def _empty() -> Dict[str, float]:
+    return {field: 0 for field in COUNTER_FIELDS}
+
+
+class CommandCounterBuffer:
+    """共享指令計數器的記憶體緩衝（執行緒安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Dict[str, float]] = {}
+        # 正在寫回的增量：寫回交易提交前仍計入讀取結果
+        self._inflight: Dict[int, Dict[str, float]] = {}
+        self._engine_getter: Optional[Callable[[], Any]] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_failures = 0
+        self.last_flush_seconds = 0.0
+
+    def increment(self, command_id: int, **deltas: float) -> None:
+        """
+        累加計數器增量
+
+        Args:
+            command_id: 指令 ID
+            **deltas: COUNTER_FIELDS 中欄位的增量
+        """
+        with self._lock:
+            entry = self._pending.setdefault(command_id, _empty())
+            for field, delta in deltas.items():
+                entry[field] += delta
+
+    def pending(self, command_id: int) -> Dict[str, float]:
+        """取得指令尚未寫回資料庫的增量（含寫回中的增量）"""
+        result = _empty()
+        with self._lock:
+            for source in (self._pending, self._inflight):
+                entry = source.get(command_id)
+                if entry:
+                    for field in COUNTER_FIELDS:
+                        result[field] += entry[field]
+        return result
+
+    def apply_pending(self, commands: Iterable[Any]) -> None:
+        """
+        把尚未寫回的增量加到 ORM 物件上（不標記為已修改，session 提交時不會寫回）
+
+        同一物件重複呼叫時以第一次讀到的資料庫值為基準，不會重複累加。
+
+        Args:
+            commands: SharedAdvancedCommand 物件
+        """
+        for command in commands:
+            current = (
+                command.download_count or 0,
+                command.average_rating or 0.0,
+                command.rating_count or 0,
+            )
+            applied = getattr(command, '_counters_applied', None)
+            # 物件重新載入後數值會與上次套用的結果不同，此時以新讀到的值為基準
+            base = applied[0] if applied is not None and applied[1] == current else current
+            delta = self.pending(command.id)
+            downloads, average, count = base
+            new_count = count + int(delta['rating_count'])
+            if delta['rating_sum'] or delta['rating_count']:
+                average = (average * count + delta['rating_sum']) / new_count if new_count > 0 else 0.0
+            values = (downloads + int(delta['download_count']), average, new_count)
+            for field, value in zip(('download_count', 'average_rating', 'rating_count'), values):
+                set_committed_value(command, field, value)
+            command._counters_applied = (base, values)
+
+    def flush(self, engine=None) -> int:
+        """
+        在單一交易中寫回所有緩衝的增量
+
+        Args:
+            engine: SQLAlchemy 引擎（預設使用 start() 指定的引擎）
+
+        Returns:
+            int: 寫回的指令數；失敗時增量留在緩衝中等待下次寫回
+        """
+        engine = engine if engine is not None else (self._engine_getter() if self._engine_getter else None)
+        with self._lock:
+            if engine is None or not self._pending or self._inflight:
+                return 0
+            self._inflight, self._pending = self._pending, {}
+            batch = self._inflight
+
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(_FLUSH_SQL, [
+                    {'command_id': command_id, **deltas} for command_id, deltas in sorted(batch.items())
+                ])
+        except Exception:
+            with self._lock:
+                # 放回緩衝，與寫回期間新增的增量合併
+                for command_id, deltas in batch.items():
+                    entry = self._pending.setdefault(command_id, _empty())
+                    for field in COUNTER_FIELDS:
+                        entry[field] += deltas[field]
+                self._inflight = {}
+                self.flush_failures += 1
+            logger.error("Failed to flush shared command counters", exc_info=True)
+            return 0
+
+        with self._lock:
+            self._inflight = {}
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.last_flush_seconds = time.perf_counter() - started
+        logger.debug(f"Flushed counters for {len(batch)} shared commands")
+        return len(batch)
+
+    def start(self, engine_getter: Callable[[], Any], interval: float = FLUSH_INTERVAL) -> None:
+        """啟動背景寫回執行緒（已啟動時不重複啟動）
+
+        Args:
+            engine_getter: 返回目前資料庫引擎的函數（例如 database.get_engine）
+            interval: 寫回間隔（秒）
+        """
+        self._engine_getter = engine_getter
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+
+        def _run():
+            while not self._stop_event.wait(interval):
+                self.flush()
+
+        self._thread = threading.Thread(target=_run, name="shared-command-counters", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        """停止背景寫回執行緒，並寫回剩餘的增量"""
+        self._stop_event.set()
+        if wait and self._thread:
+            self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def discard(self) -> int:
+        """丟棄所有未寫回的增量（切換資料庫前使用，避免寫入另一個資料庫）
+
+        Returns:
+            int: 被丟棄增量的指令數
+        """
+        with self._lock:
+            dropped = len(self._pending)
+            self._pending = {}
+        if dropped:
+            logger.warning(f"Discarded unflushed counters for {dropped} shared commands")
+        return dropped
+
+    def get_stats(self) -> Dict[str, Any]:
+        """取得緩衝統計"""
+        with self._lock:
+            return {
+                'pending_commands': len(self._pending),
+                'flushes': self.flushes,
+                'flushed_rows': self.flushed_rows,
+                'flush_failures': self.flush_failures,
+                'last_flush_ms': round(self.last_flush_seconds * 1000, 3),
+            }
+
+
+# 行程內共用的計數器緩衝
+command_counters = CommandCounterBuffer()
@@ -7,6 +7,8 @@ from sqlalchemy.orm import sessionmaker, Session, scoped_session
 from sqlalchemy.pool import StaticPool
 
 from Cloud.shared_commands.models import Base
+from Cloud.shared_commands.counters import command_counters
+from Cloud.shared_commands.search_index import ensure_search_index
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +23,7 @@ def init_db(database_url: str, echo: bool = False, create_tables: bool = True):
     Args:
         database_url: 資料庫 URL (例如: sqlite:///path/to/db.sqlite 或 postgresql://...)
         echo: 是否輸出 SQL 語句 (開發用)
-        create_tables: 是否自動建立資料表
+        create_tables: 是否自動建立資料表（SQLite 上同時建立全文檢索索引）
 
     Example:
         >>> init_db('sqlite:///cloud_commands.db')
@@ -52,6 +54,7 @@ def init_db(database_url: str, echo: bool = False, create_tables: bool = True):
     # 建立資料表
     if create_tables:
         Base.metadata.create_all(_engine)
+        ensure_search_index(_engine)
         logger.info(f"Database initialized with URL: {database_url}")
 
     return _engine
@@ -105,9 +108,13 @@ def close_db():
     """關閉資料庫連接
 
     清理所有 session 和引擎連接。應在應用程式關閉時呼叫。
+    關閉前先寫回計數器緩衝中尚未寫回的增量。
     """
     global _engine, _session_factory
 
+    if _engine is not None:
+        command_counters.flush(_engine)
+
     if _session_factory is not None:
         _session_factory.remove()
         _session_factory = None
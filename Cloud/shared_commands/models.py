@@ -52,6 +52,7 @@ class SharedAdvancedCommand(Base):
         Index('idx_category_rating', 'category', 'average_rating'),
         Index('idx_downloads', 'download_count'),
         Index('idx_featured', 'is_featured', 'average_rating'),
+        Index('idx_updated_id', 'updated_at', 'id'),  # 增量同步的 (updated_at, id) 水位
     )
 
     def to_dict(self) -> Dict[str, Any]:
@@ -0,0 +1,172 @@
+"""
+共享指令全文檢索索引
+
+以 SQLite FTS5 外部內容表（external content table）索引 shared_advanced_command 的
+name 與 description，並由資料庫觸發器在新增、更新與刪除時同步，任何寫入路徑
+（上傳、更新、管理工具直接寫入）都不會讓索引過期。
+
+優先使用 trigram 分詞器：可比對任意子字串（含中文），語意與原本的
+ILIKE '%q%' 一致；SQLite 不支援 trigram（< 3.34）時退回 unicode61 + 前綴比對。
+非 SQLite 資料庫或未編譯 FTS5 時不建立索引，search_commands 退回 ILIKE 篩選。
+"""
+
+import logging
+import weakref
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# FTS5 虛擬表名稱
+FTS_TABLE = 'shared_command_fts'
+
+# bm25 欄位權重（name, description）：名稱命中比說明命中重要
+BM25_WEIGHTS = (5.0, 1.0)
+
+# trigram 分詞器無法比對少於 3 個字元的詞
+TRIGRAM_MIN_TERM_LENGTH = 3
+
+_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shared_advanced_command BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shared_advanced_command BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    # 僅在 name / description 變動時重建該列索引（下載數、評分更新不觸發）
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON shared_advanced_command BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+)
+
+# engine -> 索引分詞器（None 表示索引不可用）
+_tokenizers: 'weakref.WeakKeyDictionary[Engine, Optional[str]]' = weakref.WeakKeyDictionary()
+
+
+def _create_fts_table(conn, tokenizer: str) -> None:
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"name, description, content='shared_advanced_command', content_rowid='id', "
+        f"tokenize='{tokenizer}')"
+    ))
+
+
+def _read_tokenizer(conn) -> Optional[str]:
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).scalar()
+    if not sql:
+        return None
+    return 'trigram' if 'trigram' in sql else 'unicode61'
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """建立全文檢索索引與同步觸發器（已存在時不重建）
+
+    首次建立時以 'rebuild' 從既有資料填入索引。
+
+    Args:
+        engine: SQLAlchemy 引擎（shared_advanced_command 表須已建立）
+
+    Returns:
+        bool: 索引是否可用（非 SQLite 或不支援 FTS5 時為 False）
+    """
+    if engine.dialect.name != 'sqlite':
+        _tokenizers[engine] = None
+        return False
+
+    try:
+        with engine.begin() as conn:
+            tokenizer = _read_tokenizer(conn)
+            created = tokenizer is None
+            if created:
+                try:
+                    _create_fts_table(conn, 'trigram')
+                    tokenizer = 'trigram'
+                except Exception:
+                    _create_fts_table(conn, 'unicode61')
+                    tokenizer = 'unicode61'
+            for trigger in _TRIGGERS:
+                conn.execute(text(trigger))
+            if created:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                logger.info(f"Full-text search index created (tokenizer={tokenizer})")
+    except Exception as e:
+        logger.warning(f"Full-text search index unavailable, falling back to ILIKE: {e}")
+        _tokenizers[engine] = None
+        return False
+
+    _tokenizers[engine] = tokenizer
+    return True
+
+
+def rebuild_search_index(engine: Engine) -> None:
+    """由 shared_advanced_command 重建全文檢索索引（修復或批次匯入後使用）"""
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def get_search_tokenizer(bind) -> Optional[str]:
+    """取得引擎上全文檢索索引的分詞器
+
+    Args:
+        bind: Session.get_bind() 取得的引擎
+
+    Returns:
+        Optional[str]: 'trigram' / 'unicode61'；索引不可用時為 None
+    """
+    if not isinstance(bind, Engine):
+        return None
+    if bind in _tokenizers:
+        return _tokenizers[bind]
+    if bind.dialect.name != 'sqlite':
+        tokenizer = None
+    else:
+        try:
+            with bind.connect() as conn:
+                tokenizer = _read_tokenizer(conn)
+        except Exception:
+            tokenizer = None
+    _tokenizers[bind] = tokenizer
+    return tokenizer
+
+
+def build_match_expression(query: str, tokenizer: str) -> Tuple[Optional[str], List[str]]:
+    """將使用者輸入轉為 FTS5 MATCH 表達式
+
+    每個以空白分隔的詞都加上雙引號（避免 FTS5 語法字元如 AND、*、: 被解讀），
+    多個詞為 AND 關係；unicode61 分詞器下每個詞以前綴比對。
+    trigram 分詞器無法比對少於 3 個字元的詞（例如兩字中文詞），這些詞另外返回，
+    由呼叫端在索引命中的列上以 ILIKE 篩選。
+
+    Args:
+        query: 使用者輸入的關鍵字
+        tokenizer: 索引分詞器
+
+    Returns:
+        Tuple[Optional[str], List[str]]: (MATCH 表達式, 需以 ILIKE 篩選的詞)；
+            沒有可用索引比對的詞時 MATCH 表達式為 None
+    """
+    indexed = []
+    residual = []
+    for term in query.split():
+        if tokenizer == 'trigram' and len(term) < TRIGRAM_MIN_TERM_LENGTH:
+            residual.append(term)
+            continue
+        quoted = '"' + term.replace('"', '""') + '"'
+        indexed.append(quoted if tokenizer == 'trigram' else f'{quoted}*')
+    if not indexed:
+        return None, residual
+    return ' '.join(indexed), residual
@@ -2,9 +2,10 @@
 import json
 import logging
 from typing import List, Optional, Dict, Any, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, asc
+from sqlalchemy import func, desc, asc, text, and_, or_, Integer, Float
+from sqlalchemy.exc import IntegrityError
 import bleach
 
 from Cloud.shared_commands.models import (
@@ -13,6 +14,14 @@ from Cloud.shared_commands.models import (
     CommandComment,
     SyncLog
 )
+from Cloud.shared_commands.browse_cache import BrowseCache, FEATURED, POPULAR, CATEGORIES
+from Cloud.shared_commands.counters import CommandCounterBuffer
+from Cloud.shared_commands.search_index import (
+    FTS_TABLE,
+    BM25_WEIGHTS,
+    build_match_expression,
+    get_search_tokenizer
+)
 
 # 嘗試導入 FHS 路徑管理
 try:
@@ -27,6 +36,23 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# 相關性排序的加權：relevance = -bm25 × (1 + 評分加成 + 下載加成)
+# 評分加成 = RELEVANCE_RATING_WEIGHT × 平均評分 / 5
+RELEVANCE_RATING_WEIGHT = 0.5
+# 下載加成 = RELEVANCE_DOWNLOAD_WEIGHT × d / (d + RELEVANCE_DOWNLOAD_HALF)，
+# 下載數達 RELEVANCE_DOWNLOAD_HALF 時取得一半加成，避免熱門指令完全蓋過文字相關性
+RELEVANCE_DOWNLOAD_WEIGHT = 0.5
+RELEVANCE_DOWNLOAD_HALF = 100.0
+
+# 寫回緩衝模式下評分寫入遇到並行衝突時的嘗試次數
+RATING_WRITE_ATTEMPTS = 3
+
+# 增量同步每頁筆數上限
+CHANGES_MAX_LIMIT = 1000
+# 增量同步只返回 updated_at 早於此秒數的變更：updated_at 在交易提交前就已決定，
+# 較晚提交的較早時間戳可能落在 Edge 已推進的水位之前而被永久略過
+CHANGES_SETTLE_SECONDS = 2.0
+
 
 def sanitize_html(text: Optional[str]) -> Optional[str]:
     """清理 HTML 內容以防止 XSS 攻擊
@@ -49,13 +75,25 @@ class SharedCommandService:
     提供進階指令的雲端共享功能核心業務邏輯。
     """
 
-    def __init__(self, db_session: Session):
+    def __init__(
+        self,
+        db_session: Session,
+        use_search_index: bool = True,
+        cache: Optional[BrowseCache] = None,
+        counters: Optional[CommandCounterBuffer] = None
+    ):
         """初始化服務
 
         Args:
             db_session: SQLAlchemy database session
+            use_search_index: 關鍵字搜尋是否使用全文檢索索引（索引不可用時自動退回 ILIKE）
+            cache: 精選／熱門／分類列表的快取；寫入提交後使受影響的列表失效（None 表示不使用）
+            counters: 下載／使用／評分計數器的寫回緩衝；None 時直接更新指令列
         """
         self.db = db_session
+        self.use_search_index = use_search_index
+        self.cache = cache
+        self.counters = counters
 
     def upload_command(
         self,
@@ -111,6 +149,7 @@ class SharedCommandService:
             existing.version = version
             existing.updated_at = datetime.utcnow()
             self.db.commit()
+            self._invalidate_listings(FEATURED, POPULAR, CATEGORIES)
 
             # 記錄同步日誌
             self._log_sync(edge_id, existing.id, 'update', 'success')
@@ -132,6 +171,7 @@ class SharedCommandService:
         )
         self.db.add(command)
         self.db.commit()
+        self._invalidate_listings(FEATURED, POPULAR, CATEGORIES)
 
         # 記錄同步日誌
         self._log_sync(edge_id, command.id, 'upload', 'success')
@@ -145,19 +185,23 @@ class SharedCommandService:
         category: Optional[str] = None,
         author: Optional[str] = None,
         min_rating: Optional[float] = None,
-        sort_by: str = 'rating',
+        sort_by: Optional[str] = None,
         order: str = 'desc',
         limit: int = 50,
         offset: int = 0
     ) -> Tuple[List[SharedAdvancedCommand], int]:
         """搜尋共享指令
 
+        有關鍵字且全文檢索索引可用時，以 FTS5 比對名稱與說明，總筆數只計算命中的列；
+        否則退回 ILIKE 篩選。
+
         Args:
             query: 搜尋關鍵字（搜尋名稱與說明）
             category: 指令分類
             author: 作者用戶名
             min_rating: 最低評分
-            sort_by: 排序欄位（rating/downloads/usage/created_at）
+            sort_by: 排序欄位（relevance/rating/downloads/usage/created_at）；
+                預設有關鍵字時為 relevance（bm25 相關性加權評分與下載數），否則為 rating
             order: 排序方向（asc/desc）
             limit: 每頁筆數（最大 100）
             offset: 分頁偏移量
@@ -175,16 +219,26 @@ class SharedCommandService:
         if sort_order not in valid_orders:
             logger.warning(f"Invalid sort order '{order}', defaulting to 'desc'")
             sort_order = 'desc'
+        if not sort_by:
+            sort_by = 'relevance' if query else 'rating'
         # 基本查詢
         q = self.db.query(SharedAdvancedCommand).filter_by(is_public=True)
 
         # 應用篩選條件
-        if query:
+        match, residual_terms = self._build_match(query) if query else (None, [])
+        if query and match is None:
             search_pattern = f'%{query}%'
             q = q.filter(
                 (SharedAdvancedCommand.name.ilike(search_pattern)) |
                 (SharedAdvancedCommand.description.ilike(search_pattern))
             )
+        for term in residual_terms:
+            # 索引無法比對的短詞：只在索引命中的列上篩選
+            term_pattern = f'%{term}%'
+            q = q.filter(or_(
+                SharedAdvancedCommand.name.ilike(term_pattern),
+                SharedAdvancedCommand.description.ilike(term_pattern)
+            ))
 
         if category:
             q = q.filter(SharedAdvancedCommand.category == category)
@@ -195,8 +249,18 @@ class SharedCommandService:
         if min_rating is not None:
             q = q.filter(SharedAdvancedCommand.average_rating >= min_rating)
 
-        # 計算總筆數
-        total = q.count()
+        # 計算總筆數（全文檢索時只計數命中的列，不計算相關性分數）
+        relevance = None
+        if match is not None:
+            matched = self._match_subquery(match, with_score=False)
+            total = q.join(matched, matched.c.command_id == SharedAdvancedCommand.id).count()
+            if sort_by == 'relevance':
+                relevance = self._match_subquery(match, with_score=True)
+                q = q.join(relevance, relevance.c.command_id == SharedAdvancedCommand.id)
+            else:
+                q = q.join(matched, matched.c.command_id == SharedAdvancedCommand.id)
+        else:
+            total = q.count()
 
         # 排序
         sort_field_map = {
@@ -205,7 +269,13 @@ class SharedCommandService:
             'usage': SharedAdvancedCommand.usage_count,
             'created_at': SharedAdvancedCommand.created_at,
         }
-        sort_field = sort_field_map.get(sort_by, SharedAdvancedCommand.average_rating)
+        if sort_by == 'relevance' and relevance is not None:
+            rating_boost = RELEVANCE_RATING_WEIGHT * func.coalesce(SharedAdvancedCommand.average_rating, 0.0) / 5.0
+            downloads = func.coalesce(SharedAdvancedCommand.download_count, 0)
+            download_boost = RELEVANCE_DOWNLOAD_WEIGHT * downloads / (downloads + RELEVANCE_DOWNLOAD_HALF)
+            sort_field = relevance.c.score * (1.0 + rating_boost + download_boost)
+        else:
+            sort_field = sort_field_map.get(sort_by, SharedAdvancedCommand.average_rating)
 
         if sort_order == 'desc':
             q = q.order_by(desc(sort_field))
@@ -214,14 +284,41 @@ class SharedCommandService:
 
         # 分頁
         commands = q.limit(limit).offset(offset).all()
+        self._apply_pending_counters(commands)
 
         logger.info(
             f"Search commands: query={query}, category={category}, "
-            f"results={len(commands)}/{total}"
+            f"fts={match is not None}, results={len(commands)}/{total}"
         )
 
         return commands, total
 
+    def _build_match(self, query: str) -> Tuple[Optional[str], List[str]]:
+        """關鍵字轉為 FTS5 MATCH 表達式與需另以 ILIKE 篩選的短詞；索引不可用時返回 (None, [])"""
+        if not self.use_search_index:
+            return None, []
+        tokenizer = get_search_tokenizer(self.db.get_bind())
+        if tokenizer is None:
+            return None, []
+        match, residual_terms = build_match_expression(query, tokenizer)
+        if match is None:
+            return None, []
+        return match, residual_terms
+
+    def _match_subquery(self, match: str, with_score: bool):
+        """命中 FTS5 索引的指令 ID；with_score 時附帶文字相關性分數（-bm25，越大越相關）"""
+        if with_score:
+            weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+            columns = f"rowid AS command_id, -bm25({FTS_TABLE}, {weights}) AS score"
+            name = 'fts_relevance'
+        else:
+            columns = "rowid AS command_id"
+            name = 'fts_match'
+        stmt = text(f"SELECT {columns} FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match").bindparams(match=match)
+        if with_score:
+            return stmt.columns(command_id=Integer, score=Float).subquery(name)
+        return stmt.columns(command_id=Integer).subquery(name)
+
     def get_command(self, command_id: int) -> Optional[SharedAdvancedCommand]:
         """取得指定的共享指令
 
@@ -231,10 +328,13 @@ class SharedCommandService:
         Returns:
             Optional[SharedAdvancedCommand]: 指令物件，若不存在則返回 None
         """
-        return self.db.query(SharedAdvancedCommand).filter_by(
+        command = self.db.query(SharedAdvancedCommand).filter_by(
             id=command_id,
             is_public=True
         ).first()
+        if command is not None:
+            self._apply_pending_counters([command])
+        return command
 
     def download_command(self, command_id: int, edge_id: str) -> SharedAdvancedCommand:
         """下載共享指令
@@ -253,9 +353,14 @@ class SharedCommandService:
         if not command:
             raise ValueError(f"指令不存在或不公開: {command_id}")
 
-        # 增加下載次數
-        command.download_count += 1
-        self.db.commit()
+        # 增加下載次數（有寫回緩衝時只累加增量，不更新也不鎖定指令列）
+        if self.counters is not None:
+            self.counters.increment(command.id, download_count=1)
+            self._apply_pending_counters([command])
+        else:
+            command.download_count += 1
+            self.db.commit()
+        self._invalidate_popular_if_reordered(command.id, command.download_count)
 
         # 記錄同步日誌
         self._log_sync(edge_id, command_id, 'download', 'success')
@@ -290,6 +395,9 @@ class SharedCommandService:
         if not 1 <= rating <= 5:
             raise ValueError("評分必須在 1-5 之間")
 
+        if self.counters is not None:
+            return self._rate_command_buffered(command_id, user_username, rating, comment)
+
         # 使用資料庫鎖定以防止競態條件
         command = self.db.query(SharedAdvancedCommand).filter_by(
             id=command_id,
@@ -317,6 +425,8 @@ class SharedCommandService:
             total = total - old_rating + rating
             command.average_rating = total / command.rating_count
             self.db.commit()
+            if command.is_featured:
+                self._invalidate_listings(FEATURED)
 
             logger.info(
                 f"Updated rating for command {command_id}: "
@@ -338,12 +448,85 @@ class SharedCommandService:
         command.rating_count += 1
         command.average_rating = total / command.rating_count
         self.db.commit()
+        if command.is_featured:
+            self._invalidate_listings(FEATURED)
 
         logger.info(
             f"New rating for command {command_id}: {rating}/5 by {user_username}"
         )
         return new_rating
 
+    def _rate_command_buffered(
+        self,
+        command_id: int,
+        user_username: str,
+        rating: int,
+        comment: Optional[str]
+    ) -> CommandRating:
+        """評分（寫回緩衝模式）
+
+        只寫入評分記錄；平均評分與評分人數的增量交由計數器緩衝批次寫回，
+        不鎖定指令列。同一用戶的並行評分以唯一索引與條件更新排除重複計算。
+        """
+        command = self.get_command(command_id)
+        if not command:
+            raise ValueError(f"指令不存在或不公開: {command_id}")
+
+        for _ in range(RATING_WRITE_ATTEMPTS):
+            existing_rating = self.db.query(CommandRating).filter_by(
+                command_id=command_id,
+                user_username=user_username
+            ).first()
+
+            if existing_rating is None:
+                new_rating = CommandRating(
+                    command_id=command_id,
+                    user_username=user_username,
+                    rating=rating,
+                    comment=comment
+                )
+                self.db.add(new_rating)
+                try:
+                    self.db.commit()
+                except IntegrityError:
+                    # 同一用戶並行的首次評分已先寫入：改為更新該記錄
+                    self.db.rollback()
+                    continue
+                self.counters.increment(command_id, rating_sum=rating, rating_count=1)
+                result, old_rating = new_rating, None
+                break
+
+            # 條件更新：評分在讀取後被並行修改時 rowcount 為 0，重新讀取後再試
+            old_rating = existing_rating.rating
+            updated = self.db.query(CommandRating).filter_by(
+                id=existing_rating.id,
+                rating=old_rating
+            ).update({
+                'rating': rating,
+                'comment': comment,
+                'updated_at': datetime.utcnow()
+            })
+            self.db.commit()
+            if updated:
+                self.counters.increment(command_id, rating_sum=rating - old_rating)
+                result = existing_rating
+                break
+            self.db.expire(existing_rating)
+        else:
+            raise ValueError(f"評分更新衝突，請重試: {command_id}")
+
+        if command.is_featured:
+            self._invalidate_listings(FEATURED)
+
+        if old_rating is None:
+            logger.info(f"New rating for command {command_id}: {rating}/5 by {user_username}")
+        else:
+            logger.info(
+                f"Updated rating for command {command_id}: "
+                f"{old_rating} -> {rating} by {user_username}"
+            )
+        return result
+
     def get_ratings(
         self,
         command_id: int,
@@ -440,12 +623,16 @@ class SharedCommandService:
         Returns:
             List[SharedAdvancedCommand]: 精選指令列表
         """
-        return self.db.query(SharedAdvancedCommand).filter_by(
+        commands = self.db.query(SharedAdvancedCommand).filter_by(
             is_public=True,
             is_featured=True
         ).order_by(
             desc(SharedAdvancedCommand.average_rating)
         ).limit(limit).all()
+        if self.counters is not None:
+            self._apply_pending_counters(commands)
+            commands.sort(key=lambda cmd: cmd.average_rating or 0.0, reverse=True)
+        return commands
 
     def get_popular_commands(self, limit: int = 10) -> List[SharedAdvancedCommand]:
         """取得熱門指令（根據下載次數）
@@ -456,11 +643,16 @@ class SharedCommandService:
         Returns:
             List[SharedAdvancedCommand]: 熱門指令列表
         """
-        return self.db.query(SharedAdvancedCommand).filter_by(
+        commands = self.db.query(SharedAdvancedCommand).filter_by(
             is_public=True
         ).order_by(
             desc(SharedAdvancedCommand.download_count)
         ).limit(limit).all()
+        if self.counters is not None:
+            # 以資料庫排名取前 N 名後加上未寫回的下載數重新排序
+            self._apply_pending_counters(commands)
+            commands.sort(key=lambda cmd: cmd.download_count or 0, reverse=True)
+        return commands
 
     def get_categories(self) -> List[Dict[str, Any]]:
         """取得所有分類及其指令數量
@@ -482,6 +674,75 @@ class SharedCommandService:
             for cat, count in results
         ]
 
+    def get_changed_commands(
+        self,
+        since: Optional[datetime] = None,
+        since_id: int = 0,
+        limit: int = 500,
+        settle_seconds: float = CHANGES_SETTLE_SECONDS
+    ) -> Tuple[List[SharedAdvancedCommand], bool]:
+        """取得 (updated_at, id) 水位之後變更的公開指令（keyset 分頁）
+
+        Args:
+            since: 水位的 updated_at（None 表示從頭開始）
+            since_id: 水位的指令 ID（updated_at 相同時的次序）
+            limit: 每頁筆數（最大 CHANGES_MAX_LIMIT）
+            settle_seconds: 只返回 updated_at 早於此秒數的變更
+
+        Returns:
+            Tuple[List[SharedAdvancedCommand], bool]: (依 (updated_at, id) 排序的指令, 是否仍有下一頁)
+        """
+        limit = min(max(limit, 1), CHANGES_MAX_LIMIT)
+        q = self.db.query(SharedAdvancedCommand).filter_by(is_public=True)
+        if since is not None:
+            q = q.filter(or_(
+                SharedAdvancedCommand.updated_at > since,
+                and_(SharedAdvancedCommand.updated_at == since, SharedAdvancedCommand.id > since_id)
+            ))
+        if settle_seconds > 0:
+            q = q.filter(SharedAdvancedCommand.updated_at <= datetime.utcnow() - timedelta(seconds=settle_seconds))
+
+        commands = q.order_by(
+            asc(SharedAdvancedCommand.updated_at),
+            asc(SharedAdvancedCommand.id)
+        ).limit(limit + 1).all()
+
+        has_more = len(commands) > limit
+        commands = commands[:limit]
+        self._apply_pending_counters(commands)
+        return commands, has_more
+
+    def _apply_pending_counters(self, commands: List[SharedAdvancedCommand]) -> None:
+        """把寫回緩衝中尚未寫回的計數加到讀取結果上"""
+        if self.counters is not None:
+            self.counters.apply_pending(commands)
+
+    def _invalidate_listings(self, *kinds: str) -> None:
+        """寫入已提交後使相關列表快取失效"""
+        if self.cache is None:
+            return
+        for kind in kinds:
+            self.cache.invalidate(kind)
+
+    def _invalidate_popular_if_reordered(self, command_id: int, download_count: int) -> None:
+        """下載後只在熱門排序可能改變時使快取失效
+
+        指令已在列表中且下載數超過前一名，或不在列表中但超過最後一名（列表未滿時一律失效）。
+        列表中其他位置的下載數變化只更新顯示值，留待 TTL 到期。
+        """
+        if self.cache is None:
+            return
+
+        def reordered(limit, commands) -> bool:
+            for index, cached in enumerate(commands):
+                if cached['id'] == command_id:
+                    return index > 0 and download_count > commands[index - 1]['download_count']
+            if len(commands) < limit:
+                return True
+            return not commands or download_count > commands[-1]['download_count']
+
+        self.cache.invalidate(POPULAR, reordered)
+
     def _log_sync(
         self,
         edge_id: str,
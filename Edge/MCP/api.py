@@ -38,6 +38,7 @@ from .plugins.commands import AdvancedCommandPlugin, WebUICommandPlugin
 from .plugins.devices import CameraPlugin, SensorPlugin
 from .robot_router import RobotRouter
 from .utils import setup_json_logging
+from src.common.network_monitor import get_network_monitor
 
 # 配置 logger（使用共用模組）
 logger = setup_json_logging(__name__, service_name='mcp-api', level=MCPConfig.LOG_LEVEL)
@@ -226,7 +227,8 @@ async def track_requests(request: Request, call_next):
 context_manager = ContextManager()
 logging_monitor = LoggingMonitor()
 auth_manager = AuthManager(logging_monitor=logging_monitor)
-robot_router = RobotRouter()
+# HTTP 下發結果回報給共用網路監控器，作為被動連線信號
+robot_router = RobotRouter(network_monitor=get_network_monitor())
 
 command_handler = CommandHandler(
     robot_router=robot_router,
@@ -5,6 +5,7 @@ MCP 機器人路由器
 
 import asyncio
 import logging
+import time
 from datetime import timedelta, datetime
 from typing import Any, Dict, List, Optional
 
@@ -25,11 +26,26 @@ logger = logging.getLogger(__name__)
 class RobotRouter:
     """機器人路由器"""
 
-    def __init__(self):
-        """初始化路由器"""
+    def __init__(self, network_monitor=None):
+        """
+        初始化路由器
+
+        Args:
+            network_monitor: 網路監控器（NetworkMonitor），提供時以 HTTP 下發結果作為被動連線信號
+        """
         self.robots: Dict[str, RobotRegistration] = {}
         self.robot_locks: Dict[str, asyncio.Lock] = {}
         self._cleanup_task: Optional[asyncio.Task] = None
+        self._network_monitor = network_monitor
+
+    def _record_outcome(self, success: bool, latency_ms: Optional[float] = None, error: Optional[str] = None):
+        """回報請求連線結果給網路監控器"""
+        if self._network_monitor is None:
+            return
+        if success:
+            self._network_monitor.record_success(source="robot_router", latency_ms=latency_ms)
+        else:
+            self._network_monitor.record_failure(source="robot_router", error=error)
 
     def start(self):
         """啟動路由器"""
@@ -260,8 +276,11 @@ class RobotRouter:
                     # 明確設定為 False（僅用於開發環境）
                     ssl_context = False
 
+            start = time.monotonic()
             async with aiohttp.ClientSession(timeout=timeout) as session:
                 async with session.post(url, json=payload, ssl=ssl_context) as response:
+                    # 收到回應即代表連線正常（不論狀態碼）
+                    self._record_outcome(True, latency_ms=(time.monotonic() - start) * 1000)
                     if response.status == 200:
                         result = await response.json()
                         return {"data": result, "summary": "指令執行成功"}
@@ -274,8 +293,11 @@ class RobotRouter:
                             }
                         }
         except asyncio.TimeoutError:
+            self._record_outcome(False, error="timeout")
             raise
         except Exception as e:
+            if isinstance(e, (aiohttp.ClientConnectionError, OSError)):
+                self._record_outcome(False, error=str(e))
             return {
                 "error": {
                     "code": ErrorCode.ERR_PROTOCOL,
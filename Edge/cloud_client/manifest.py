@@ -0,0 +1,136 @@
+"""
+本地檔案雜湊清單
+
+記錄同步目錄中每個檔案的 (size, mtime_ns) → SHA-256，
+只有大小或修改時間改變的檔案才重新以串流方式計算雜湊。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 清單檔名（位於同步目錄內，同步時略過）
+MANIFEST_FILENAME = ".sync_manifest.json"
+
+# 串流計算雜湊的區塊大小（1MB）
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 修改時間距今少於此值（奈秒）的檔案不寫入快取：同一時間粒度內再次修改時
+# (size, mtime_ns) 可能不變，下次同步需重新計算
+RACY_MTIME_WINDOW_NS = 2 * 1_000_000_000
+
+MANIFEST_VERSION = 1
+
+
+def hash_file(path: Path, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """以固定大小區塊串流計算檔案的 SHA-256（不將整個檔案讀入記憶體）"""
+    hash_obj = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest()
+
+
+class FileHashManifest:
+    """同步目錄的檔案雜湊清單（JSON 檔，執行緒安全）"""
+
+    def __init__(self, manifest_path: Path):
+        """
+        初始化清單
+
+        Args:
+            manifest_path: 清單檔路徑；不存在或損毀時視為空清單
+        """
+        self.manifest_path = Path(manifest_path)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, object]] = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable sync manifest {self.manifest_path}: {e}")
+            return
+        if data.get('version') == MANIFEST_VERSION and isinstance(data.get('files'), dict):
+            self._entries = data['files']
+
+    def get_hash(self, path: Path, name: Optional[str] = None) -> str:
+        """
+        取得檔案的 SHA-256；(size, mtime_ns) 與清單相同時直接返回快取值
+
+        Args:
+            path: 檔案路徑
+            name: 清單鍵（預設為檔名）
+
+        Returns:
+            SHA-256 hex
+        """
+        key = name or path.name
+        stat = path.stat()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                self.hits += 1
+                return entry['sha256']
+            self.misses += 1
+
+        file_hash = hash_file(path)
+        self.record(path, file_hash, name=key, stat=stat)
+        return file_hash
+
+    def record(self, path: Path, file_hash: str, name: Optional[str] = None, stat: Optional[os.stat_result] = None):
+        """
+        記錄已知內容雜湊的檔案（例如剛從雲端下載、以雜湊命名的檔案）
+
+        Args:
+            path: 檔案路徑
+            file_hash: SHA-256 hex
+            name: 清單鍵（預設為檔名）
+            stat: 計算雜湊前取得的 stat 結果（避免計算期間的修改被誤記）
+        """
+        stat = stat or path.stat()
+        key = name or path.name
+        with self._lock:
+            if time.time_ns() - stat.st_mtime_ns < RACY_MTIME_WINDOW_NS:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = {
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'sha256': file_hash,
+                }
+            self._dirty = True
+
+    def prune(self, names: Iterable[str]) -> None:
+        """移除不在 names 中的條目（本地已刪除的檔案）"""
+        keep = set(names)
+        with self._lock:
+            stale = [key for key in self._entries if key not in keep]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._dirty = True
+
+    def save(self) -> None:
+        """有變更時以原子性改名寫回清單檔"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps({'version': MANIFEST_VERSION, 'files': self._entries}, separators=(',', ':'))
+            tmp_path = self.manifest_path.with_name(self.manifest_path.name + '.tmp')
+            tmp_path.write_text(payload, encoding='utf-8')
+            os.replace(tmp_path, self.manifest_path)
+            self._dirty = False
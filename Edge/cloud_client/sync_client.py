@@ -4,15 +4,42 @@ Edge-Cloud 同步客戶端
 提供與雲服務 API 通訊的客戶端功能
 """
 
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, Tuple
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .manifest import MANIFEST_FILENAME, FileHashManifest, hash_file
 
 
 logger = logging.getLogger(__name__)
 
+# 檔案大小達此門檻時改用可續傳分塊上傳（8MB）
+RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+
+# 可續傳上傳的區塊大小（4MB）：中斷時最多重送一個區塊
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 連續失敗（未取得進度）的最大重試次數
+UPLOAD_MAX_RETRIES = 5
+
+# sync_files 並行傳輸數（亦為連線池大小）
+DEFAULT_MAX_WORKERS = 4
+
+# 重試退避的基準與上限（秒），每次失敗加倍
+UPLOAD_RETRY_DELAY = 1.0
+UPLOAD_RETRY_MAX_DELAY = 30.0
+
+
+class _ResumableUploadUnsupported(Exception):
+    """雲端未提供可續傳上傳端點（舊版服務）"""
+
 
 class CloudSyncClient:
     """Edge-Cloud 同步客戶端"""
@@ -21,7 +48,8 @@ class CloudSyncClient:
         self,
         cloud_api_url: str,
         token: Optional[str] = None,
-        timeout: int = 30
+        timeout: int = 30,
+        max_workers: int = DEFAULT_MAX_WORKERS
     ):
         """
         初始化客戶端
@@ -30,12 +58,27 @@ class CloudSyncClient:
             cloud_api_url: 雲服務 API URL
             token: JWT Token（可選）
             timeout: 請求超時時間（秒）
+            max_workers: sync_files 的並行傳輸數（連線池保留相同數量的連線）
         """
         self.cloud_api_url = cloud_api_url.rstrip('/')
         self.token = token
         self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+
+        # 共用 Session：重用 TCP/TLS 連線，並行傳輸時每個工作執行緒各取一條池內連線
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        # 進行中的可續傳上傳：(檔案路徑, SHA-256, 類別) → session_id，
+        # 上傳失敗後再次呼叫時從雲端已接收的位置繼續
+        self._upload_sessions: Dict[Tuple[str, str, str], str] = {}
         logger.info(f"Initialized CloudSyncClient for: {self.cloud_api_url}")
 
+    def close(self):
+        """關閉連線池"""
+        self._session.close()
+
     def set_token(self, token: str):
         """
         設定 JWT Token
@@ -65,7 +108,7 @@ class CloudSyncClient:
             健康狀態資訊
         """
         try:
-            response = requests.get(
+            response = self._session.get(
                 f'{self.cloud_api_url}/health',
                 timeout=self.timeout
             )
@@ -83,6 +126,9 @@ class CloudSyncClient:
         """
         上傳檔案到雲端
 
+        檔案大小達 RESUMABLE_UPLOAD_THRESHOLD 時改用可續傳分塊上傳（見 upload_file_resumable），
+        雲端不支援時退回單一請求上傳。
+
         Args:
             file_path: 本地檔案路徑
             category: 檔案類別
@@ -96,11 +142,17 @@ class CloudSyncClient:
                 logger.error(f"File not found: {file_path}")
                 return None
 
+            if path.stat().st_size >= RESUMABLE_UPLOAD_THRESHOLD:
+                try:
+                    return self._upload_resumable(path, category, UPLOAD_CHUNK_SIZE)
+                except _ResumableUploadUnsupported:
+                    logger.info("Resumable upload not supported by cloud, falling back to single request")
+
             with open(path, 'rb') as f:
                 files = {'file': (path.name, f)}
                 data = {'category': category}
 
-                response = requests.post(
+                response = self._session.post(
                     f'{self.cloud_api_url}/storage/upload',
                     files=files,
                     data=data,
@@ -114,6 +166,131 @@ class CloudSyncClient:
             logger.error(f"File upload failed: {e}")
             return None
 
+    def upload_file_resumable(
+        self,
+        file_path: str,
+        category: str = "general",
+        chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Optional[Dict[str, Any]]:
+        """
+        以可續傳工作階段分塊上傳檔案
+
+        每個區塊附帶 SHA-256；連線中斷或雲端暫時錯誤時查詢雲端已接收的 offset 並從該處繼續，
+        只重送未確認的區塊。重試用盡後保留工作階段，再次呼叫同一檔案時接續上傳。
+
+        Args:
+            file_path: 本地檔案路徑
+            category: 檔案類別
+            chunk_size: 區塊大小（位元組）
+
+        Returns:
+            上傳結果（與 upload_file 相同）或 None（失敗）
+        """
+        path = Path(file_path)
+        if not path.exists():
+            logger.error(f"File not found: {file_path}")
+            return None
+        try:
+            return self._upload_resumable(path, category, chunk_size)
+        except _ResumableUploadUnsupported:
+            logger.error("Resumable upload not supported by cloud")
+            return None
+        except requests.RequestException as e:
+            logger.error(f"Resumable upload failed: {e}")
+            return None
+
+    def _create_upload_session(self, path: Path, category: str, size: int, file_hash: str) -> str:
+        response = self._session.post(
+            f'{self.cloud_api_url}/storage/uploads',
+            json={'filename': path.name, 'category': category, 'size': size, 'sha256': file_hash},
+            headers=self._get_headers(),
+            timeout=self.timeout
+        )
+        if response.status_code in (404, 405):
+            raise _ResumableUploadUnsupported()
+        response.raise_for_status()
+        return response.json()['session_id']
+
+    def _get_upload_offset(self, session_id: str) -> Optional[int]:
+        """查詢雲端已接收的位元組數；工作階段不存在時返回 None"""
+        response = self._session.get(
+            f'{self.cloud_api_url}/storage/uploads/{session_id}',
+            headers=self._get_headers(),
+            timeout=self.timeout
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()['offset']
+
+    def _upload_resumable(self, path: Path, category: str, chunk_size: int) -> Dict[str, Any]:
+        size = path.stat().st_size
+        file_hash = hash_file(path)
+
+        session_key = (str(path.resolve()), file_hash, category)
+        session_id = self._upload_sessions.get(session_key)
+        offset = self._get_upload_offset(session_id) if session_id else None
+        if offset is None:
+            session_id = self._create_upload_session(path, category, size, file_hash)
+            self._upload_sessions[session_key] = session_id
+            offset = 0
+        elif offset:
+            logger.info(f"Resuming upload of {path.name} at byte {offset}/{size}")
+
+        session_url = f'{self.cloud_api_url}/storage/uploads/{session_id}'
+        failures = 0
+        with open(path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                headers = self._get_headers()
+                headers.update({
+                    'Content-Type': 'application/octet-stream',
+                    'Upload-Offset': str(offset),
+                    'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest(),
+                })
+                try:
+                    response = self._session.put(session_url, data=chunk, headers=headers, timeout=self.timeout)
+                    if response.status_code == 409:
+                        # 雲端已接收的位置與本地不同（例如上次回應遺失）：以雲端為準
+                        offset = response.json()['offset']
+                        continue
+                    if response.status_code == 404:
+                        # 工作階段已過期：重新建立並從頭上傳
+                        logger.warning(f"Upload session {session_id} expired, restarting upload of {path.name}")
+                        session_id = self._create_upload_session(path, category, size, file_hash)
+                        self._upload_sessions[session_key] = session_id
+                        session_url = f'{self.cloud_api_url}/storage/uploads/{session_id}'
+                        offset = 0
+                        continue
+                    response.raise_for_status()
+                    offset = response.json()['offset']
+                    failures = 0
+                except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                    status = getattr(getattr(e, 'response', None), 'status_code', None)
+                    if status is not None and status < 500:
+                        raise
+                    failures += 1
+                    if failures > UPLOAD_MAX_RETRIES:
+                        raise
+                    delay = min(UPLOAD_RETRY_DELAY * 2 ** (failures - 1), UPLOAD_RETRY_MAX_DELAY)
+                    logger.warning(
+                        f"Upload chunk at byte {offset} failed ({e}), retry {failures}/{UPLOAD_MAX_RETRIES} in {delay}s"
+                    )
+                    time.sleep(delay)
+                    try:
+                        current = self._get_upload_offset(session_id)
+                    except requests.RequestException:
+                        current = offset
+                    if current is not None:
+                        offset = current
+
+        response = self._session.post(f'{session_url}/complete', headers=self._get_headers(), timeout=self.timeout)
+        response.raise_for_status()
+        self._upload_sessions.pop(session_key, None)
+        logger.info(f"Resumable upload completed: {path.name} ({size} bytes)")
+        return response.json()
+
     def download_file(
         self,
         file_id: str,
@@ -121,7 +298,11 @@ class CloudSyncClient:
         category: str = "general"
     ) -> bool:
         """
-        從雲端下載檔案
+        從雲端下載檔案（中斷後可續傳）
+
+        下載內容先寫入 <save_path>.part；若 .part 已存在，以 Range 請求從已下載的位置
+        繼續，並以 If-Range（檔案 ETag 即 file_id）確保雲端檔案未變更，
+        雲端回傳 200 時表示需從頭下載。完成後才原子性改名為 save_path。
 
         Args:
             file_id: 檔案 ID
@@ -132,24 +313,40 @@ class CloudSyncClient:
             是否下載成功
         """
         try:
+            save_path_obj = Path(save_path)
+            save_path_obj.parent.mkdir(parents=True, exist_ok=True)
+            part_path = save_path_obj.with_name(save_path_obj.name + '.part')
+
+            headers = self._get_headers()
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            if offset > 0:
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = f'"{file_id}"'
+
             params = {'category': category}
-            response = requests.get(
+            response = self._session.get(
                 f'{self.cloud_api_url}/storage/download/{file_id}',
                 params=params,
-                headers=self._get_headers(),
+                headers=headers,
                 timeout=self.timeout,
                 stream=True
             )
+            if offset > 0 and response.status_code == 416:
+                # .part 已是完整檔案（或與雲端不一致），捨棄後從頭下載
+                response.close()
+                part_path.unlink()
+                return self.download_file(file_id, save_path, category)
             response.raise_for_status()
 
-            # 儲存檔案
-            save_path_obj = Path(save_path)
-            save_path_obj.parent.mkdir(parents=True, exist_ok=True)
-
-            with open(save_path_obj, 'wb') as f:
+            # 206 表示續傳；其他成功狀態表示從頭下載完整檔案
+            resumed = offset > 0 and response.status_code == 206
+            with open(part_path, 'ab' if resumed else 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     f.write(chunk)
 
+            os.replace(part_path, save_path_obj)
+            if resumed:
+                logger.info(f"File download resumed at byte {offset}: {save_path}")
             logger.info(f"File downloaded to: {save_path}")
             return True
 
@@ -175,7 +372,7 @@ class CloudSyncClient:
             if category:
                 params['category'] = category
 
-            response = requests.get(
+            response = self._session.get(
                 f'{self.cloud_api_url}/storage/files',
                 params=params,
                 headers=self._get_headers(),
@@ -205,7 +402,7 @@ class CloudSyncClient:
         """
         try:
             params = {'category': category}
-            response = requests.delete(
+            response = self._session.delete(
                 f'{self.cloud_api_url}/storage/files/{file_id}',
                 params=params,
                 headers=self._get_headers(),
@@ -227,7 +424,7 @@ class CloudSyncClient:
             統計資訊或 None（失敗）
         """
         try:
-            response = requests.get(
+            response = self._session.get(
                 f'{self.cloud_api_url}/storage/stats',
                 headers=self._get_headers(),
                 timeout=self.timeout
@@ -243,15 +440,20 @@ class CloudSyncClient:
         self,
         local_dir: str,
         category: str = "general",
-        direction: str = "both"
+        direction: str = "both",
+        max_workers: Optional[int] = None
     ) -> Dict[str, Any]:
         """
         同步本地與雲端檔案
 
+        本地檔案的雜湊記錄於 <local_dir>/.sync_manifest.json，以 (檔名, size, mtime_ns) 判斷是否變更，
+        只有變更的檔案才重新串流計算雜湊；上傳與下載在有界執行緒池中並行，共用 Session 連線池。
+
         Args:
             local_dir: 本地目錄
             category: 檔案類別
             direction: 同步方向（"upload", "download", "both"）
+            max_workers: 並行傳輸數（預設為建構時的 max_workers）
 
         Returns:
             同步結果統計
@@ -272,6 +474,8 @@ class CloudSyncClient:
         if not local_path.exists():
             local_path.mkdir(parents=True, exist_ok=True)
 
+        manifest = FileHashManifest(local_path / MANIFEST_FILENAME)
+
         try:
             # 取得雲端檔案清單
             cloud_files_data = self.list_files(category=category)
@@ -282,50 +486,66 @@ class CloudSyncClient:
 
             cloud_files = {f["file_id"]: f for f in cloud_files_data.get("files", [])}
 
-            # 上傳本地檔案（如果需要）
-            if direction in ["upload", "both"]:
-                for file_path in local_path.glob("*"):
-                    if file_path.is_file():
-                        # 計算本地檔案雜湊以檢查是否需要上傳
-                        import hashlib
-                        with open(file_path, 'rb') as f:
-                            file_hash = hashlib.sha256(f.read()).hexdigest()
-
-                        # 檢查雲端是否已存在相同檔案
-                        if file_hash in cloud_files:
-                            logger.debug(f"File already exists in cloud: {file_path.name}")
+            # 同步清單檔本身與下載中的 .part 檔不上傳
+            local_files = [
+                file_path for file_path in local_path.iterdir()
+                if file_path.is_file()
+                and not file_path.name.startswith(MANIFEST_FILENAME)
+                and not file_path.name.endswith('.part')
+            ]
+            manifest.prune(file_path.name for file_path in local_files)
+
+            def _upload(file_path: Path) -> str:
+                # 檢查雲端是否已存在相同檔案（未變更的檔案直接使用清單中的雜湊）
+                if manifest.get_hash(file_path) in cloud_files:
+                    logger.debug(f"File already exists in cloud: {file_path.name}")
+                    return "skipped"
+                return "uploaded" if self.upload_file(str(file_path), category=category) else "errors"
+
+            def _download(file_id: str, save_path: Path) -> str:
+                if not self.download_file(file_id=file_id, save_path=str(save_path), category=category):
+                    return "errors"
+                # 雲端以內容雜湊作為 file_id，下載後直接記入清單，下次同步不必重新計算
+                if save_path.exists():
+                    manifest.record(save_path, file_id)
+                return "downloaded"
+
+            workers = max(1, max_workers or self.max_workers)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cloud-sync") as pool:
+                futures = []
+
+                # 上傳本地檔案（如果需要）
+                if direction in ["upload", "both"]:
+                    futures.extend(pool.submit(_upload, file_path) for file_path in local_files)
+
+                # 下載雲端檔案（如果需要）
+                if direction in ["download", "both"]:
+                    for file_id, file_info in cloud_files.items():
+                        # 使用 storage_filename 如果存在，否則使用 filename
+                        filename = file_info.get("storage_filename", file_info.get("filename"))
+                        save_path = local_path / filename
+                        if save_path.exists():
                             result["skipped"] += 1
-                            continue
-
-                        # 上傳檔案
-                        uploaded = self.upload_file(str(file_path), category=category)
-                        if uploaded:
-                            result["uploaded"] += 1
-                        else:
-                            result["errors"] += 1
-
-            # 下載雲端檔案（如果需要）
-            if direction in ["download", "both"]:
-                for file_id, file_info in cloud_files.items():
-                    # 使用 storage_filename 如果存在，否則使用 filename
-                    filename = file_info.get("storage_filename", file_info.get("filename"))
-                    save_path = local_path / filename
-                    if not save_path.exists():
-                        downloaded = self.download_file(
-                            file_id=file_id,
-                            save_path=str(save_path),
-                            category=category
-                        )
-                        if downloaded:
-                            result["downloaded"] += 1
                         else:
-                            result["errors"] += 1
-                    else:
-                        result["skipped"] += 1
+                            futures.append(pool.submit(_download, file_id, save_path))
+
+                for future in as_completed(futures):
+                    try:
+                        result[future.result()] += 1
+                    except Exception as e:
+                        logger.error(f"Sync transfer failed: {e}")
+                        result["errors"] += 1
 
         except Exception as e:
             logger.error(f"Sync failed: {e}")
             result["errors"] += 1
-
-        logger.info(f"Sync completed: {result}")
+        finally:
+            try:
+                manifest.save()
+            except OSError as e:
+                logger.warning(f"Failed to save sync manifest: {e}")
+
+        logger.info(
+            f"Sync completed: {result} (hash cache hits={manifest.hits}, rehashed={manifest.misses})"
+        )
         return result
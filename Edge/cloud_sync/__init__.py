@@ -1,4 +1,5 @@
 from Edge.cloud_sync.sync_queue import CloudSyncQueue
 from Edge.cloud_sync.sync_service import CloudSyncService
+from Edge.cloud_sync.watermark_store import SyncWatermarkStore
 
-__all__ = ["CloudSyncQueue", "CloudSyncService"]
+__all__ = ["CloudSyncQueue", "CloudSyncService", "SyncWatermarkStore"]
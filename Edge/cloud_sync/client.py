@@ -1,10 +1,60 @@
 # imports
+import gzip
+import json
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+# zstd 為可選依賴（pip install zstandard），未安裝時僅使用 gzip
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# 請求主體小於此大小時不壓縮
+COMPRESS_MIN_BYTES = 1024
+
+# gzip 壓縮等級
+GZIP_LEVEL = 6
+
+# zstd 壓縮等級
+ZSTD_LEVEL = 3
+
+# 條件請求（If-None-Match）快取的最大項目數，超過時淘汰最久未使用者
+ETAG_CACHE_MAX_ENTRIES = 256
+
+
+class _NetworkOutcomeAdapter(HTTPAdapter):
+    """將每次 HTTP 請求的連線結果回報給網路監控器
+
+    收到任何回應（含 4xx/5xx）代表雲端可連線；連線錯誤或逾時代表連線失敗。
+    """
+
+    def __init__(self, network_monitor, source: str = 'cloud_sync', **kwargs):
+        super().__init__(**kwargs)
+        self._network_monitor = network_monitor
+        self._source = source
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self._network_monitor.record_failure(source=self._source, error=str(e))
+            raise
+        self._network_monitor.record_success(
+            source=self._source, latency_ms=(time.monotonic() - start) * 1000
+        )
+        return response
+
 
 def update_jwt_token(client: 'CloudSyncClient', new_token: str) -> None:
     """更新客戶端的 JWT token
@@ -28,7 +78,8 @@ class CloudSyncClient:
         cloud_api_url: str,
         edge_id: str,
         api_key: Optional[str] = None,
-        jwt_token: Optional[str] = None
+        jwt_token: Optional[str] = None,
+        network_monitor=None
     ):
         """初始化客戶端
 
@@ -37,6 +88,7 @@ class CloudSyncClient:
             edge_id: Edge 裝置 ID
             api_key: API 金鑰（已棄用，請使用 jwt_token）
             jwt_token: JWT token（推薦使用）
+            network_monitor: 網路監控器（NetworkMonitor），提供時以實際請求結果作為被動連線信號
         """
         self.cloud_api_url = cloud_api_url.rstrip('/')
         self.edge_id = edge_id
@@ -46,6 +98,209 @@ class CloudSyncClient:
             self.session.headers.update({
                 'Authorization': f'Bearer {self.jwt_token}'
             })
+        if network_monitor is not None:
+            adapter = _NetworkOutcomeAdapter(network_monitor)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+        # 雲端以 Accept-Encoding 回應標頭宣告接受的請求編碼；宣告前一律不壓縮上傳，
+        # 以相容不支援壓縮請求主體的舊版雲端
+        self._upload_encodings: Optional[tuple] = None
+        self._stats_lock = threading.Lock()
+        self._transfer_stats = {
+            'requests': 0,
+            'bytes_sent': 0,
+            'bytes_sent_uncompressed': 0,
+            'bytes_received': 0,
+            'bytes_received_uncompressed': 0,
+            'compressed_uploads': 0,
+            'not_modified': 0,
+        }
+        # 條件請求快取：請求鍵 → (ETag, 回應主體)
+        self._etag_cache: 'OrderedDict[str, Tuple[str, Dict[str, Any]]]' = OrderedDict()
+
+    # ==================== 壓縮與傳輸統計 ====================
+
+    def _choose_upload_encoding(self) -> Optional[str]:
+        """依雲端宣告的編碼選擇上傳壓縮方式（優先 zstd）"""
+        encodings = self._upload_encodings or ()
+        if ZSTD_AVAILABLE and 'zstd' in encodings:
+            return 'zstd'
+        if 'gzip' in encodings:
+            return 'gzip'
+        return None
+
+    def _learn_upload_encodings(self, response) -> None:
+        """從回應的 Accept-Encoding 標頭記錄雲端接受的請求編碼"""
+        header = response.headers.get('Accept-Encoding') if response is not None else None
+        if isinstance(header, str):
+            self._upload_encodings = tuple(
+                token.split(';')[0].strip().lower() for token in header.split(',') if token.strip()
+            )
+
+    def _record_transfer(
+        self,
+        bytes_sent: int,
+        bytes_sent_uncompressed: int,
+        response,
+        received_uncompressed: Optional[int] = None
+    ) -> None:
+        """累計一次請求在線上傳輸的位元組數
+
+        接收位元組以 urllib3 從連線讀取的原始長度計算（壓縮後大小），
+        無法取得時退回 Content-Length。串流回應須由呼叫端提供解壓後的接收位元組數。
+        """
+        if received_uncompressed is None:
+            content = getattr(response, 'content', None)
+            received_uncompressed = len(content) if isinstance(content, (bytes, bytearray)) else 0
+        received = 0
+        raw = getattr(response, 'raw', None)
+        tell = getattr(raw, 'tell', None)
+        if callable(tell):
+            try:
+                position = tell()
+                received = position if isinstance(position, int) else 0
+            except Exception:
+                received = 0
+        if not received:
+            length = response.headers.get('Content-Length') if response is not None else None
+            received = int(length) if isinstance(length, str) and length.isdigit() else received_uncompressed
+
+        with self._stats_lock:
+            stats = self._transfer_stats
+            stats['requests'] += 1
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_sent_uncompressed'] += bytes_sent_uncompressed
+            stats['bytes_received'] += received
+            stats['bytes_received_uncompressed'] += received_uncompressed
+            if bytes_sent < bytes_sent_uncompressed:
+                stats['compressed_uploads'] += 1
+
+    def get_transfer_stats(self) -> Dict[str, Any]:
+        """取得資料同步請求的線上傳輸統計
+
+        Returns:
+            Dict[str, Any]: 傳送/接收的線上位元組數、未壓縮位元組數與節省比例
+        """
+        with self._stats_lock:
+            stats = dict(self._transfer_stats)
+        raw_total = stats['bytes_sent_uncompressed'] + stats['bytes_received_uncompressed']
+        wire_total = stats['bytes_sent'] + stats['bytes_received']
+        stats['bytes_saved'] = max(raw_total - wire_total, 0)
+        stats['upload_encodings'] = list(self._upload_encodings or ())
+        return stats
+
+    def _post_json(self, url: str, payload: Dict[str, Any], timeout: int, headers: Optional[Dict[str, str]] = None):
+        """以（可能壓縮的）JSON 主體發送 POST 請求並記錄傳輸位元組
+
+        雲端曾宣告支援且主體達 COMPRESS_MIN_BYTES 時以 Content-Encoding 壓縮；
+        收到 415 時改以未壓縮主體重送一次。
+
+        Args:
+            headers: 額外的請求標頭（例如 If-None-Match）
+
+        Returns:
+            requests.Response
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        encoding = self._choose_upload_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+        extra_headers = headers or {}
+
+        if encoding is not None:
+            if encoding == 'zstd':
+                wire_body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+            else:
+                wire_body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            response = self.session.post(
+                url,
+                data=wire_body,
+                headers={'Content-Type': 'application/json', 'Content-Encoding': encoding, **extra_headers},
+                timeout=timeout
+            )
+            self._record_transfer(len(wire_body), len(body), response)
+            if response.status_code != 415:
+                self._learn_upload_encodings(response)
+                return response
+            logger.warning(f"Cloud rejected {encoding} request body, retrying uncompressed")
+            self._upload_encodings = ()
+            self._learn_upload_encodings(response)
+
+        response = self.session.post(
+            url,
+            data=body,
+            headers={'Content-Type': 'application/json', **extra_headers},
+            timeout=timeout
+        )
+        self._record_transfer(len(body), len(body), response)
+        self._learn_upload_encodings(response)
+        return response
+
+    # ==================== 條件請求（ETag）快取 ====================
+
+    @staticmethod
+    def _etag_cache_key(method: str, url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        query = '&'.join(f'{k}={params[k]}' for k in sorted(params)) if params else ''
+        return f'{method} {url}?{query}'
+
+    def _etag_cache_get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._stats_lock:
+            cached = self._etag_cache.get(key)
+            if cached is not None:
+                self._etag_cache.move_to_end(key)
+            return cached
+
+    def _etag_cache_put(self, key: str, response, body: Any) -> None:
+        """回應帶 ETag 時快取主體，供下次以 If-None-Match 條件請求"""
+        etag = response.headers.get('ETag')
+        if not isinstance(etag, str) or not isinstance(body, dict):
+            return
+        with self._stats_lock:
+            self._etag_cache[key] = (etag, body)
+            self._etag_cache.move_to_end(key)
+            while len(self._etag_cache) > ETAG_CACHE_MAX_ENTRIES:
+                self._etag_cache.popitem(last=False)
+
+    def _not_modified(self, cached: Tuple[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """以快取主體回應未變更的資源，並標記 not_modified 供呼叫端略過後續處理"""
+        with self._stats_lock:
+            self._transfer_stats['not_modified'] += 1
+        return {**cached[1], 'not_modified': True}
+
+    def _conditional_get(self, url: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30) -> Dict[str, Any]:
+        """以 If-None-Match 條件 GET；304 時返回快取主體（含 not_modified=True）
+
+        Raises:
+            requests.HTTPError: API 請求失敗
+        """
+        key = self._etag_cache_key('GET', url, params)
+        cached = self._etag_cache_get(key)
+        headers = {'If-None-Match': cached[0]} if cached else None
+        response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+        self._record_transfer(0, 0, response)
+        self._learn_upload_encodings(response)
+        if cached and response.status_code == 304:
+            return self._not_modified(cached)
+
+        response.raise_for_status()
+        body = response.json()
+        self._etag_cache_put(key, response, body)
+        return body
+
+    def clear_etag_cache(self) -> None:
+        """清除條件請求快取（下次請求一律取得完整主體）"""
+        with self._stats_lock:
+            self._etag_cache.clear()
+
+    def _get_json(self, url: str, params: Optional[Dict[str, Any]] = None, timeout: int = 30):
+        """發送 GET 請求並記錄傳輸位元組（回應由 requests 依 Content-Encoding 自動解壓）
+
+        Returns:
+            requests.Response
+        """
+        response = self.session.get(url, params=params, timeout=timeout)
+        self._record_transfer(0, 0, response)
+        self._learn_upload_encodings(response)
+        return response
 
     def upload_command(
         self,
@@ -122,7 +377,8 @@ class CloudSyncClient:
             offset: 分頁偏移量
 
         Returns:
-            Dict[str, Any]: API 回應（包含指令列表與總筆數）
+            Dict[str, Any]: API 回應（包含指令列表與總筆數）；
+                雲端回傳 304 時為快取的上次回應，並帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
@@ -142,13 +398,13 @@ class CloudSyncClient:
         params = {k: v for k, v in params.items() if v is not None}
 
         try:
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
+            result = self._conditional_get(url, params=params, timeout=30)
             logger.info(
                 f"Searched cloud commands: query={query}, category={category}, "
-                f"found={len(response.json().get('data', {}).get('commands', []))}"
+                f"found={len(result.get('data', {}).get('commands', []))}"
+                + (" (not modified)" if result.get('not_modified') else "")
             )
-            return response.json()
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to search commands: {e}")
             raise
@@ -160,7 +416,7 @@ class CloudSyncClient:
             command_id: 指令 ID
 
         Returns:
-            Dict[str, Any]: API 回應（包含指令詳情）
+            Dict[str, Any]: API 回應（包含指令詳情）；未變更時帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
@@ -168,10 +424,9 @@ class CloudSyncClient:
         url = f'{self.cloud_api_url}/shared_commands/{command_id}'
 
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            result = self._conditional_get(url, timeout=30)
             logger.info(f"Retrieved command {command_id} from cloud")
-            return response.json()
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to get command {command_id}: {e}")
             raise
@@ -183,19 +438,29 @@ class CloudSyncClient:
             command_id: 指令 ID
 
         Returns:
-            Dict[str, Any]: API 回應（包含指令完整內容）
+            Dict[str, Any]: API 回應（包含指令完整內容）；
+                指令內容自上次下載後未變更時為快取的上次回應，並帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
         """
         url = f'{self.cloud_api_url}/shared_commands/{command_id}/download'
         payload = {'edge_id': self.edge_id}
+        key = self._etag_cache_key('POST', url)
+        cached = self._etag_cache_get(key)
 
         try:
-            response = self.session.post(url, json=payload, timeout=30)
+            # POST 的條件請求不符合時雲端回傳 412（而非 304）
+            headers = {'If-None-Match': cached[0]} if cached else None
+            response = self._post_json(url, payload, timeout=30, headers=headers)
+            if cached and response.status_code == 412:
+                logger.info(f"Command {command_id} unchanged since last download")
+                return self._not_modified(cached)
             response.raise_for_status()
             logger.info(f"Downloaded command {command_id} from cloud")
-            return response.json()
+            result = response.json()
+            self._etag_cache_put(key, response, result)
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to download command {command_id}: {e}")
             raise
@@ -244,7 +509,8 @@ class CloudSyncClient:
             limit: 筆數
 
         Returns:
-            Dict[str, Any]: API 回應（包含精選指令列表）
+            Dict[str, Any]: API 回應（包含精選指令列表）；
+                雲端回傳 304 時為快取的上次回應，並帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
@@ -253,10 +519,12 @@ class CloudSyncClient:
         params = {'limit': limit}
 
         try:
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            logger.info(f"Retrieved {limit} featured commands from cloud")
-            return response.json()
+            result = self._conditional_get(url, params=params, timeout=30)
+            logger.info(
+                f"Retrieved {limit} featured commands from cloud"
+                + (" (not modified)" if result.get('not_modified') else "")
+            )
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to get featured commands: {e}")
             raise
@@ -268,7 +536,8 @@ class CloudSyncClient:
             limit: 筆數
 
         Returns:
-            Dict[str, Any]: API 回應（包含熱門指令列表）
+            Dict[str, Any]: API 回應（包含熱門指令列表）；
+                雲端回傳 304 時為快取的上次回應，並帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
@@ -277,10 +546,12 @@ class CloudSyncClient:
         params = {'limit': limit}
 
         try:
-            response = self.session.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            logger.info(f"Retrieved {limit} popular commands from cloud")
-            return response.json()
+            result = self._conditional_get(url, params=params, timeout=30)
+            logger.info(
+                f"Retrieved {limit} popular commands from cloud"
+                + (" (not modified)" if result.get('not_modified') else "")
+            )
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to get popular commands: {e}")
             raise
@@ -289,7 +560,8 @@ class CloudSyncClient:
         """取得所有分類
 
         Returns:
-            Dict[str, Any]: API 回應（包含分類列表）
+            Dict[str, Any]: API 回應（包含分類列表）；
+                雲端回傳 304 時為快取的上次回應，並帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
@@ -297,12 +569,46 @@ class CloudSyncClient:
         url = f'{self.cloud_api_url}/shared_commands/categories'
 
         try:
-            response = self.session.get(url, timeout=30)
+            result = self._conditional_get(url, timeout=30)
+            logger.info(
+                "Retrieved categories from cloud"
+                + (" (not modified)" if result.get('not_modified') else "")
+            )
+            return result
+        except requests.RequestException as e:
+            logger.error(f"Failed to get categories: {e}")
+            raise
+
+    def get_command_changes(
+        self,
+        since: Optional[str] = None,
+        since_id: int = 0,
+        limit: int = 500
+    ) -> Dict[str, Any]:
+        """取得 (updated_at, id) 水位之後變更的公開指令
+
+        Args:
+            since: 水位的 updated_at（上一頁的 next_watermark.updated_at，None 表示從頭開始）
+            since_id: 水位的指令 ID
+            limit: 每頁筆數（最大 1000）
+
+        Returns:
+            Dict[str, Any]: API 回應（含 data.commands、data.next_watermark、data.has_more）
+
+        Raises:
+            requests.HTTPError: API 請求失敗
+        """
+        url = f'{self.cloud_api_url}/shared_commands/changes'
+        params: Dict[str, Any] = {'limit': limit}
+        if since:
+            params['since'] = since
+            params['since_id'] = since_id
+        try:
+            response = self._get_json(url, params=params, timeout=30)
             response.raise_for_status()
-            logger.info("Retrieved categories from cloud")
             return response.json()
         except requests.RequestException as e:
-            logger.error(f"Failed to get categories: {e}")
+            logger.error(f"Failed to get command changes since ({since}, {since_id}): {e}")
             raise
 
     def health_check(self) -> bool:
@@ -349,7 +655,7 @@ class CloudSyncClient:
             'edge_id': edge_id or self.edge_id
         }
         try:
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self._post_json(url, payload, timeout=30)
             response.raise_for_status()
             logger.info(f"Uploaded settings for user '{user_id}'")
             return response.json()
@@ -364,17 +670,16 @@ class CloudSyncClient:
             user_id: 用戶 ID
 
         Returns:
-            Dict[str, Any]: API 回應（含 data.settings）
+            Dict[str, Any]: API 回應（含 data.settings）；未變更時帶 not_modified=True
 
         Raises:
             requests.HTTPError: API 請求失敗
         """
         url = f'{self.cloud_api_url}/data_sync/settings/{user_id}'
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            result = self._conditional_get(url, timeout=30)
             logger.info(f"Downloaded settings for user '{user_id}'")
-            return response.json()
+            return result
         except requests.RequestException as e:
             logger.error(f"Failed to download settings for user '{user_id}': {e}")
             raise
@@ -406,7 +711,7 @@ class CloudSyncClient:
             'edge_id': edge_id or self.edge_id
         }
         try:
-            response = self.session.post(url, json=payload, timeout=60)
+            response = self._post_json(url, payload, timeout=60)
             response.raise_for_status()
             logger.info(
                 f"Uploaded {len(records)} history records for user '{user_id}'"
@@ -420,28 +725,206 @@ class CloudSyncClient:
         self,
         user_id: str,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[int] = None,
+        exclude_edge_id: Optional[str] = None,
+        history_store=None
     ) -> Dict[str, Any]:
         """從雲端下載指令執行歷史
 
         Args:
             user_id: 用戶 ID
             limit: 返回記錄數上限（預設 100，最大 1000）
-            offset: 查詢偏移量（預設 0）
+            offset: 查詢偏移量（預設 0，提供 cursor 時忽略）
+            cursor: 增量下載游標（上一頁的 next_cursor）
+            exclude_edge_id: 排除由此 Edge 上傳的記錄
+            history_store: 提供 CommandHistoryStore 時改用 NDJSON 串流端點，
+                從 cursor 起下載全部記錄並批量寫入（忽略 limit/offset），
+                回傳格式同 download_command_history_to_store()
 
         Returns:
-            Dict[str, Any]: API 回應（含 data.records 和 data.total）
+            Dict[str, Any]: API 回應（含 data.records、data.total、data.next_cursor、data.has_more）
 
         Raises:
             requests.HTTPError: API 請求失敗
         """
+        if history_store is not None:
+            return self.download_command_history_to_store(
+                user_id, history_store, cursor=cursor or 0, exclude_edge_id=exclude_edge_id
+            )
+
         url = f'{self.cloud_api_url}/data_sync/history/{user_id}'
-        params = {'limit': limit, 'offset': offset}
+        params: Dict[str, Any] = {'limit': limit, 'offset': offset}
+        if cursor is not None:
+            params['cursor'] = cursor
+        if exclude_edge_id:
+            params['exclude_edge_id'] = exclude_edge_id
         try:
-            response = self.session.get(url, params=params, timeout=30)
+            response = self._get_json(url, params=params, timeout=30)
             response.raise_for_status()
             logger.info(f"Downloaded history for user '{user_id}'")
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Failed to download history for user '{user_id}': {e}")
             raise
+
+    def iter_command_history_stream(
+        self,
+        user_id: str,
+        cursor: int = 0,
+        exclude_edge_id: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+        """以 NDJSON 串流逐批取得雲端指令歷史
+
+        逐行解析回應，不將完整歷史載入記憶體。每批記錄附帶其最後一筆的游標，
+        呼叫端處理完一批後即可保存游標，中斷後從該位置繼續。
+
+        Args:
+            user_id: 用戶 ID
+            cursor: 起始游標（不含）
+            exclude_edge_id: 排除由此 Edge 上傳的記錄
+            batch_size: 每批記錄數
+
+        Yields:
+            (records, next_cursor)
+
+        Raises:
+            requests.RequestException: 請求失敗或串流未完整結束
+        """
+        url = f'{self.cloud_api_url}/data_sync/history/{user_id}/stream'
+        params: Dict[str, Any] = {'cursor': cursor}
+        if exclude_edge_id:
+            params['exclude_edge_id'] = exclude_edge_id
+
+        received = 0
+        batch: List[Dict[str, Any]] = []
+        response = self.session.get(url, params=params, stream=True, timeout=60)
+        try:
+            response.raise_for_status()
+            trailer: Optional[Dict[str, Any]] = None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                received += len(line) + 1
+                item = json.loads(line)
+                if 'record' not in item:
+                    trailer = item
+                    break
+                batch.append(item['record'])
+                cursor = item['id']
+                if len(batch) >= batch_size:
+                    yield batch, cursor
+                    batch = []
+
+            if trailer is None or not trailer.get('done'):
+                error = (trailer or {}).get('error', 'stream ended before completion')
+                raise requests.RequestException(f"History stream for user '{user_id}' incomplete: {error}")
+            if batch:
+                yield batch, cursor
+            logger.info(f"Streamed {trailer.get('count', 0)} history records for user '{user_id}'")
+        finally:
+            self._record_transfer(0, 0, response, received_uncompressed=received)
+            self._learn_upload_encodings(response)
+            response.close()
+
+    def download_command_history_to_store(
+        self,
+        user_id: str,
+        history_store,
+        cursor: int = 0,
+        exclude_edge_id: Optional[str] = None,
+        batch_size: int = 500
+    ) -> Dict[str, Any]:
+        """以串流下載雲端指令歷史並批量寫入本地 CommandHistoryStore
+
+        Args:
+            user_id: 用戶 ID
+            history_store: 本地指令歷史存儲（需提供 add_records）
+            cursor: 起始游標（不含）
+            exclude_edge_id: 排除由此 Edge 上傳的記錄
+            batch_size: 每次批量寫入的記錄數
+
+        Returns:
+            Dict[str, Any]: {'success', 'data': {'received', 'stored', 'next_cursor'}}
+
+        Raises:
+            requests.RequestException: 請求失敗或串流未完整結束
+        """
+        received = 0
+        stored = 0
+        try:
+            for records, cursor in self.iter_command_history_stream(
+                user_id, cursor=cursor, exclude_edge_id=exclude_edge_id, batch_size=batch_size
+            ):
+                received += len(records)
+                stored += history_store.add_records(records)
+        except requests.RequestException as e:
+            logger.error(f"Failed to stream history for user '{user_id}' (cursor={cursor}): {e}")
+            raise
+
+        logger.info(f"Restored {stored}/{received} history records for user '{user_id}'")
+        return {
+            'success': True,
+            'data': {'received': received, 'stored': stored, 'next_cursor': cursor}
+        }
+
+    def get_history_watermark(
+        self,
+        user_id: str,
+        edge_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """取得雲端記錄的此 Edge 指令歷史上傳高水位
+
+        Args:
+            user_id: 用戶 ID
+            edge_id: Edge 裝置 ID（可選）
+
+        Returns:
+            Dict[str, Any]: API 回應（data 為 {created_at, command_id} 或 None）
+
+        Raises:
+            requests.HTTPError: API 請求失敗
+        """
+        url = f'{self.cloud_api_url}/data_sync/history/{user_id}/watermark'
+        params = {'edge_id': edge_id or self.edge_id}
+        try:
+            response = self._get_json(url, params=params, timeout=30)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to get history watermark for user '{user_id}': {e}")
+            raise
+
+    # ==================== 批次同步 ====================
+
+    def upload_sync_batch(
+        self,
+        ops: list,
+        edge_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """以單一請求上傳多個同步操作
+
+        Args:
+            ops: 操作列表，每筆為 {'op_id', 'op_type', 'payload'}，依 seq 順序排列
+            edge_id: Edge 裝置 ID（可選）
+
+        Returns:
+            Dict[str, Any]: API 回應（含逐筆 results）
+
+        Raises:
+            requests.HTTPError: API 請求失敗（舊版雲端不支援時為 404）
+        """
+        url = f'{self.cloud_api_url}/data_sync/batch'
+        payload = {
+            'ops': ops,
+            'edge_id': edge_id or self.edge_id
+        }
+        try:
+            response = self._post_json(url, payload, timeout=60)
+            response.raise_for_status()
+            logger.info(f"Uploaded sync batch of {len(ops)} ops")
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to upload sync batch of {len(ops)} ops: {e}")
+            raise
@@ -4,9 +4,10 @@ import logging
 import sqlite3
 import threading
 from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+from typing import Any, Callable, Dict, Generator, List, Optional, Set, Tuple
 from uuid import uuid4
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,82 @@ class SyncItemStatus(Enum):
 # 發送處理器類型：接收 (op_type, payload)，返回是否成功
 SendHandler = Callable[[str, Dict[str, Any]], bool]
 
+# 批次發送處理器類型：接收 [(op_id, op_type, payload), ...]（依 seq 排序），
+# 返回 {op_id: 是否成功}；未出現在結果中的項目視為失敗
+BatchSendHandler = Callable[[List[Tuple[str, str, Dict[str, Any]]]], Dict[str, bool]]
+
+# 批次發送預設上限
+DEFAULT_PACK_MAX_OPS = 100
+DEFAULT_PACK_MAX_BYTES = 256 * 1024
+
+# 壓縮策略模式
+COMPACT_LAST_WRITE_WINS = "last_write_wins"  # 相同鍵僅保留最新一筆
+COMPACT_MERGE_RECORDS = "merge_records"      # 相同鍵的記錄列表合併為一筆
+
+
+@dataclass(frozen=True)
+class CompactionPolicy:
+    """單一 op_type 的入隊壓縮策略
+
+    Attributes:
+        mode: COMPACT_LAST_WRITE_WINS 或 COMPACT_MERGE_RECORDS
+        key_field: payload 中用於分組的欄位（例如 user_id），缺少此欄位的項目不壓縮
+        records_field: 合併模式下的記錄列表欄位
+        dedup_field: 合併模式下用於去重的記錄欄位（與雲端「第一次寫入為準」一致，保留先出現者）
+        max_records: 合併後記錄數上限，超過時另起新項目
+    """
+    mode: str
+    key_field: str = "user_id"
+    records_field: str = "records"
+    dedup_field: Optional[str] = "command_id"
+    max_records: int = 1000
+
+    def __post_init__(self):
+        if self.mode not in (COMPACT_LAST_WRITE_WINS, COMPACT_MERGE_RECORDS):
+            raise ValueError(f"Unknown compaction mode: {self.mode}")
+        if self.max_records < 1:
+            raise ValueError("max_records must be >= 1")
+
+    def key_of(self, payload: Dict[str, Any]) -> Optional[str]:
+        """取得 payload 的壓縮分組鍵"""
+        value = payload.get(self.key_field)
+        return None if value is None else str(value)
+
+    def merge(self, existing: Dict[str, Any], incoming: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        合併兩筆 payload 的記錄列表
+
+        Returns:
+            合併後的 payload；記錄欄位不是列表或超過 max_records 時返回 None（不合併）
+        """
+        old_records = existing.get(self.records_field)
+        new_records = incoming.get(self.records_field)
+        if not isinstance(old_records, list) or not isinstance(new_records, list):
+            return None
+
+        merged = list(old_records)
+        if self.dedup_field:
+            seen = {r.get(self.dedup_field) for r in merged if isinstance(r, dict)}
+            for record in new_records:
+                key = record.get(self.dedup_field) if isinstance(record, dict) else None
+                if key is not None and key in seen:
+                    continue
+                seen.add(key)
+                merged.append(record)
+        else:
+            merged.extend(new_records)
+
+        if len(merged) > self.max_records:
+            return None
+        return {**existing, **incoming, self.records_field: merged}
+
+
+# 雲端同步服務使用的預設壓縮策略
+DEFAULT_COMPACTION_POLICIES: Dict[str, CompactionPolicy] = {
+    "user_settings": CompactionPolicy(COMPACT_LAST_WRITE_WINS),
+    "command_history": CompactionPolicy(COMPACT_MERGE_RECORDS),
+}
+
 
 class CloudSyncQueue:
     """雲端同步佇列
@@ -36,6 +113,10 @@ class CloudSyncQueue:
        下次 flush 時重試，直到超出最大重試次數才標記 FAILED。
     4. **批次發送**：可設定 batch_size，每次 flush 批次取出項目，
        降低記憶體壓力。
+    5. **打包發送**：flush_batched() 將最多 N 筆或 M 位元組的項目打包成單一請求，
+       依 seq 順序排列，逐筆套用結果。
+    6. **入隊壓縮**：依 op_type 設定 CompactionPolicy，入隊時即合併待發送項目
+       （例如設定快照只保留最新一筆、歷史記錄合併為一筆），維持佇列精簡。
     """
 
     def __init__(
@@ -44,6 +125,7 @@ class CloudSyncQueue:
         max_size: int = 500,
         max_retry_count: int = 3,
         batch_size: int = 20,
+        compaction: Optional[Dict[str, CompactionPolicy]] = None,
     ):
         """初始化雲端同步佇列
 
@@ -52,13 +134,17 @@ class CloudSyncQueue:
             max_size: 最大佇列大小（PENDING 項目數）
             max_retry_count: 最大重試次數，超出後標記 FAILED
             batch_size: 每次 flush 批次大小
+            compaction: op_type → 壓縮策略；None 表示不壓縮
         """
         self._db_path = db_path or ":memory:"
         self._max_size = max_size
         self._max_retry_count = max_retry_count
         self._batch_size = batch_size
+        self._compaction = dict(compaction or {})
 
         self._lock = threading.RLock()
+        # 正在發送中的項目 ID：壓縮不可修改或刪除這些項目，避免與 flush 競爭
+        self._inflight_ids: Set[str] = set()
         self._is_online = False
 
         # 記憶體資料庫保持持久連線，避免資料在連線關閉後消失
@@ -69,6 +155,7 @@ class CloudSyncQueue:
         self._total_enqueued = 0
         self._total_sent = 0
         self._total_failed = 0
+        self._total_compacted = 0
 
         self._init_db()
 
@@ -77,6 +164,7 @@ class CloudSyncQueue:
             "max_size": max_size,
             "max_retry_count": max_retry_count,
             "batch_size": batch_size,
+            "compaction": {op: p.mode for op, p in self._compaction.items()},
             "service": "cloud_sync_queue",
         })
 
@@ -114,14 +202,23 @@ class CloudSyncQueue:
                         status     TEXT    NOT NULL DEFAULT 'pending',
                         retry_cnt  INTEGER NOT NULL DEFAULT 0,
                         last_error TEXT,
+                        compact_key TEXT,
                         created_at TEXT    NOT NULL,
                         updated_at TEXT    NOT NULL
                     )
                 """)
+                # 舊版資料庫沒有壓縮分組鍵欄位
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(sync_queue)")}
+                if "compact_key" not in columns:
+                    conn.execute("ALTER TABLE sync_queue ADD COLUMN compact_key TEXT")
                 conn.execute(
                     "CREATE UNIQUE INDEX IF NOT EXISTS idx_sq_seq "
                     "ON sync_queue (seq)"
                 )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_sq_compact "
+                    "ON sync_queue (op_type, compact_key, status)"
+                )
                 conn.execute(
                     "CREATE INDEX IF NOT EXISTS idx_sq_status "
                     "ON sync_queue (status)"
@@ -170,6 +267,10 @@ class CloudSyncQueue:
             payload: 要同步的資料（必須可 JSON 序列化）
             trace_id: 追蹤 ID（可選）
 
+        若 op_type 設有壓縮策略，入隊時即與同鍵的待發送項目合併：
+        last_write_wins 刪除舊項目後將新項目排到佇列尾端；
+        merge_records 將記錄併入既有項目並返回該項目的 ID。
+
         Returns:
             操作 ID（UUID），佇列已滿或序列化失敗時返回 None
         """
@@ -186,13 +287,24 @@ class CloudSyncQueue:
             })
             return None
 
+        policy = self._compaction.get(op_type)
+        compact_key = policy.key_of(payload) if policy else None
+
         with self._lock:
             with self._get_conn() as conn:
+                if compact_key is not None:
+                    merged_id = self._compact(conn, policy, op_type, compact_key, payload, now)
+                    if merged_id is not None:
+                        conn.commit()
+                        self._total_enqueued += 1
+                        return merged_id
+
                 cnt = conn.execute(
                     "SELECT COUNT(*) FROM sync_queue WHERE status = 'pending'"
                 ).fetchone()[0]
 
                 if cnt >= self._max_size:
+                    conn.rollback()
                     logger.warning("Sync queue full, rejecting item", extra={
                         "op_type": op_type,
                         "queue_size": cnt,
@@ -210,14 +322,15 @@ class CloudSyncQueue:
                         """
                         INSERT INTO sync_queue
                             (id, seq, op_type, payload, trace_id, status,
-                             retry_cnt, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)
+                             retry_cnt, compact_key, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?, ?)
                         """,
                         (op_id, next_seq, op_type, payload_json,
-                         trace_id, now, now),
+                         trace_id, compact_key, now, now),
                     )
                     conn.commit()
                 except Exception as e:
+                    conn.rollback()
                     logger.error("Failed to insert sync item", extra={
                         "op_type": op_type,
                         "error": str(e),
@@ -329,6 +442,71 @@ class CloudSyncQueue:
         })
         return {"sent": sent, "failed": failed, "remaining": remaining}
 
+    def flush_batched(
+        self,
+        batch_send_handler: BatchSendHandler,
+        max_ops: int = DEFAULT_PACK_MAX_OPS,
+        max_bytes: int = DEFAULT_PACK_MAX_BYTES,
+    ) -> Dict[str, Any]:
+        """打包清空佇列：每次請求攜帶多筆 PENDING 項目
+
+        以 seq 升序打包，每包最多 max_ops 筆、payload 合計最多 max_bytes 位元組
+        （單筆超過上限時仍單獨成包）。每包的結果在單一交易中套用；
+        本次 flush 中失敗的項目不會在同一次 flush 內重送，待下次 flush 重試。
+
+        Args:
+            batch_send_handler: 批次發送函式
+            max_ops: 每包最多筆數
+            max_bytes: 每包 payload 合計位元組上限
+
+        Returns:
+            Dict with keys: sent, failed, remaining, requests
+        """
+        if max_ops < 1 or max_bytes < 1:
+            raise ValueError("max_ops and max_bytes must be >= 1")
+
+        sent = 0
+        failed = 0
+        requests_made = 0
+        after_seq = -1
+
+        while True:
+            pack, last_seq = self._get_pending_pack(after_seq, max_ops, max_bytes)
+            if last_seq is None:
+                break
+            after_seq = last_seq
+            if not pack:
+                continue
+
+            requests_made += 1
+            try:
+                outcomes = batch_send_handler([(op_id, op_type, payload) for op_id, op_type, payload, _, _ in pack])
+            except Exception as e:
+                logger.error("batch_send_handler raised exception", extra={
+                    "ops": len(pack),
+                    "error": str(e),
+                    "service": "cloud_sync_queue",
+                })
+                outcomes = {}
+
+            pack_sent, pack_failed = self._apply_outcomes(pack, outcomes or {})
+            sent += pack_sent
+            failed += pack_failed
+
+            # 整包都失敗代表可能離線，停止避免持續打到不可用的雲端
+            if pack_sent == 0:
+                break
+
+        remaining = self.size()
+        logger.info("Sync queue batched flush completed", extra={
+            "sent": sent,
+            "failed": failed,
+            "remaining": remaining,
+            "requests": requests_made,
+            "service": "cloud_sync_queue",
+        })
+        return {"sent": sent, "failed": failed, "remaining": remaining, "requests": requests_made}
+
     # ==================== 查詢 ====================
 
     def size(self) -> int:
@@ -362,6 +540,7 @@ class CloudSyncQueue:
             "total_enqueued": self._total_enqueued,
             "total_sent": self._total_sent,
             "total_failed": self._total_failed,
+            "total_compacted": self._total_compacted,
             "max_size": self._max_size,
             "is_online": self._is_online,
         }
@@ -374,6 +553,7 @@ class CloudSyncQueue:
             with self._get_conn() as conn:
                 conn.execute("DELETE FROM sync_queue")
                 conn.commit()
+            self._inflight_ids.clear()
         logger.info("Sync queue cleared", extra={"service": "cloud_sync_queue"})
 
     def close(self) -> None:
@@ -384,6 +564,62 @@ class CloudSyncQueue:
 
     # ==================== 私有輔助 ====================
 
+    def _compact(
+        self,
+        conn: sqlite3.Connection,
+        policy: CompactionPolicy,
+        op_type: str,
+        compact_key: str,
+        payload: Dict[str, Any],
+        now: str,
+    ) -> Optional[str]:
+        """
+        依策略壓縮同鍵的待發送項目（呼叫端持有鎖，於同一交易中執行）
+
+        Returns:
+            合併後沿用的既有項目 ID；需要插入新項目時返回 None
+        """
+        rows = conn.execute(
+            """
+            SELECT id, payload FROM sync_queue
+            WHERE op_type = ? AND compact_key = ? AND status = 'pending'
+            ORDER BY seq ASC
+            """,
+            (op_type, compact_key),
+        ).fetchall()
+        rows = [row for row in rows if row["id"] not in self._inflight_ids]
+        if not rows:
+            return None
+
+        if policy.mode == COMPACT_LAST_WRITE_WINS:
+            conn.executemany(
+                "DELETE FROM sync_queue WHERE id = ?",
+                [(row["id"],) for row in rows],
+            )
+            self._total_compacted += len(rows)
+            logger.debug("Superseded pending sync items", extra={
+                "op_type": op_type,
+                "superseded": len(rows),
+                "service": "cloud_sync_queue",
+            })
+            return None
+
+        # COMPACT_MERGE_RECORDS：併入最新一筆
+        target = rows[-1]
+        try:
+            merged = policy.merge(json.loads(target["payload"]), payload)
+        except ValueError:
+            merged = None
+        if merged is None:
+            return None
+
+        conn.execute(
+            "UPDATE sync_queue SET payload = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(merged, ensure_ascii=False), now, target["id"]),
+        )
+        self._total_compacted += 1
+        return target["id"]
+
     def _get_pending_batch(self) -> List[Tuple]:
         """按 seq 升序取得一批 PENDING 項目"""
         with self._lock:
@@ -398,6 +634,7 @@ class CloudSyncQueue:
                     """,
                     (self._batch_size,),
                 ).fetchall()
+            self._inflight_ids.update(row["id"] for row in rows)
 
         result = []
         for row in rows:
@@ -415,6 +652,100 @@ class CloudSyncQueue:
                 })
         return result
 
+    def _get_pending_pack(
+        self,
+        after_seq: int,
+        max_ops: int,
+        max_bytes: int,
+    ) -> Tuple[List[Tuple], Optional[int]]:
+        """取得 seq 大於 after_seq 的下一包 PENDING 項目
+
+        Returns:
+            (項目列表, 本包最後讀取的 seq)；沒有更多項目時 seq 為 None
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                rows = conn.execute(
+                    """
+                    SELECT id, seq, op_type, payload, trace_id, retry_cnt
+                    FROM sync_queue
+                    WHERE status = 'pending' AND seq > ?
+                    ORDER BY seq ASC
+                    LIMIT ?
+                    """,
+                    (after_seq, max_ops),
+                ).fetchall()
+
+            # 同一鎖內標記為發送中，避免 enqueue 合併進已取出的項目
+            pack: List[Tuple] = []
+            last_seq: Optional[int] = None
+            total_bytes = 0
+            for row in rows:
+                size = len(row["payload"].encode("utf-8"))
+                if pack and total_bytes + size > max_bytes:
+                    break
+                last_seq = row["seq"]
+                total_bytes += size
+                try:
+                    payload = json.loads(row["payload"])
+                except Exception as e:
+                    logger.error("Failed to parse queued sync item", extra={
+                        "item_id": row["id"],
+                        "error": str(e),
+                        "service": "cloud_sync_queue",
+                    })
+                    continue
+                pack.append((row["id"], row["op_type"], payload, row["trace_id"], row["retry_cnt"]))
+            self._inflight_ids.update(item[0] for item in pack)
+        return pack, last_seq
+
+    def _apply_outcomes(self, pack: List[Tuple], outcomes: Dict[str, bool]) -> Tuple[int, int]:
+        """在單一交易中套用一包項目的發送結果
+
+        Returns:
+            (成功筆數, 失敗筆數)
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        sent_ids: List[Tuple[str]] = []
+        retry_rows: List[Tuple] = []
+        failed_rows: List[Tuple] = []
+
+        for op_id, op_type, _, trace_id, retry_cnt in pack:
+            if outcomes.get(op_id):
+                sent_ids.append((op_id,))
+                continue
+            new_retry = retry_cnt + 1
+            if new_retry >= self._max_retry_count:
+                failed_rows.append((SyncItemStatus.FAILED.value, "Max retries exceeded", new_retry, now, op_id))
+                logger.warning("Sync item permanently failed", extra={
+                    "op_id": op_id,
+                    "op_type": op_type,
+                    "trace_id": trace_id,
+                    "retry_cnt": new_retry,
+                    "service": "cloud_sync_queue",
+                })
+            else:
+                retry_rows.append((SyncItemStatus.PENDING.value, "Send failed, will retry", new_retry, now, op_id))
+
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.executemany("DELETE FROM sync_queue WHERE id = ?", sent_ids)
+                conn.executemany(
+                    """
+                    UPDATE sync_queue
+                    SET status = ?, last_error = ?, retry_cnt = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    retry_rows + failed_rows,
+                )
+                conn.commit()
+
+            self._total_sent += len(sent_ids)
+            self._total_failed += len(failed_rows)
+            self._inflight_ids.difference_update(item[0] for item in pack)
+
+        return len(sent_ids), len(retry_rows) + len(failed_rows)
+
     def _update_status(
         self,
         op_id: str,
@@ -445,6 +776,7 @@ class CloudSyncQueue:
                         (status.value, error, now, op_id),
                     )
                 conn.commit()
+            self._inflight_ids.discard(op_id)
 
     def _remove_item(self, op_id: str) -> None:
         """移除已成功發送的項目"""
@@ -454,3 +786,4 @@ class CloudSyncQueue:
                     "DELETE FROM sync_queue WHERE id = ?", (op_id,)
                 )
                 conn.commit()
+            self._inflight_ids.discard(op_id)
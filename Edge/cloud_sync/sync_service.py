@@ -1,11 +1,19 @@
 # imports
 import logging
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timezone
 import json
 
+import requests
+
 from Edge.cloud_sync.client import CloudSyncClient
-from Edge.cloud_sync.sync_queue import CloudSyncQueue
+from Edge.cloud_sync.sync_queue import (
+    DEFAULT_COMPACTION_POLICIES,
+    DEFAULT_PACK_MAX_BYTES,
+    DEFAULT_PACK_MAX_OPS,
+    CloudSyncQueue,
+)
+from Edge.cloud_sync.watermark_store import SyncWatermarkStore
 
 # 嘗試導入 FHS 路徑管理
 try:
@@ -19,8 +27,23 @@ except ImportError:
     get_sync_cache_dir = None
     get_sync_log_path = None
 
+# 共用網路監控器：雲端請求結果作為被動連線信號
+try:
+    from src.common.network_monitor import get_network_monitor
+except ImportError:
+    get_network_monitor = None
+
 logger = logging.getLogger(__name__)
 
+# 從雲端導入的指令在 description 結尾附加的來源註記
+CLOUD_SOURCE_NOTE = "\n\n[從雲端下載 - 原始作者: {author}]"
+
+
+def _cloud_description(data: Dict[str, Any]) -> str:
+    """雲端指令導入後的 description（附加原始作者註記以保持追蹤）"""
+    author = data.get('author_username', 'unknown')
+    return (data.get('description') or '') + CLOUD_SOURCE_NOTE.format(author=author)
+
 
 class CloudSyncService:
     """雲端同步服務
@@ -31,8 +54,12 @@ class CloudSyncService:
     - 寫入操作（user_settings、command_history）若雲端不可用，
       自動快取到本地 SQLite 佇列，確保資料不遺失。
     - 佇列以 FIFO 序號排序，flush_queue() 時按原始入隊順序依序發送。
+    - 入隊時即壓縮：設定快照每位用戶只保留最新一筆，歷史上傳合併為一筆記錄集。
+    - 指令歷史以高水位增量同步：只上傳水位之後的記錄，下載從游標繼續。
+    - 雲端共享指令以 (updated_at, id) 水位增量拉取，變更在單一交易中批次導入。
     - 呼叫 set_cloud_available(True) 後可手動或定期呼叫 flush_queue()
-      將快取資料補發到雲端。
+      將快取資料補發到雲端；flush_queue(batched=True) 以批次端點打包補發，
+      大量積壓時可大幅減少請求數。
     """
 
     def __init__(
@@ -43,6 +70,7 @@ class CloudSyncService:
         jwt_token: Optional[str] = None,
         auto_sync: bool = False,
         queue_db_path: Optional[str] = None,
+        network_monitor=None,
     ):
         """初始化同步服務
 
@@ -54,8 +82,14 @@ class CloudSyncService:
             auto_sync: 是否自動同步
             queue_db_path: 同步佇列 SQLite 路徑；None 時優先使用 FHS cache_dir/sync_queue.db，
                            FHS 不可用才退回記憶體資料庫（不跨重啟持久）
+            network_monitor: 網路監控器（NetworkMonitor）；None 時使用共用的全域監控器，
+                             雲端請求結果作為被動連線信號
         """
-        self.client = CloudSyncClient(cloud_api_url, edge_id, api_key=api_key, jwt_token=jwt_token)
+        if network_monitor is None and get_network_monitor is not None:
+            network_monitor = get_network_monitor()
+        self.client = CloudSyncClient(
+            cloud_api_url, edge_id, api_key=api_key, jwt_token=jwt_token, network_monitor=network_monitor
+        )
         self.auto_sync = auto_sync
         self.edge_id = edge_id
 
@@ -86,7 +120,20 @@ class CloudSyncService:
                 "(data will be lost on restart)"
             )
 
-        self._sync_queue = CloudSyncQueue(db_path=resolved_queue_db)
+        # 離線期間的設定快照只保留每位用戶最新一筆，歷史上傳合併為一筆
+        self._sync_queue = CloudSyncQueue(
+            db_path=resolved_queue_db,
+            compaction=DEFAULT_COMPACTION_POLICIES,
+        )
+        # 雲端是否支援批次端點；舊版雲端回應 404/405 時改為逐筆補發
+        self._batch_endpoint_supported = True
+
+        # 指令歷史增量同步的上傳高水位與下載游標（與同步佇列共用 SQLite 檔案）
+        self._watermarks = SyncWatermarkStore(db_path=resolved_queue_db)
+        # 已向雲端查詢過上傳高水位的用戶（本地無水位時只查一次）
+        self._remote_watermark_checked = set()
+        # 共享指令變更水位依雲端來源分開保存（切換雲端時從頭同步）
+        self._command_watermark_scope = cloud_api_url
 
     def close(self) -> None:
         """釋放同步佇列的資料庫連線
@@ -95,6 +142,7 @@ class CloudSyncService:
         建議在服務結束或測試 tearDown 時呼叫，避免連線累積。
         """
         self._sync_queue.close()
+        self._watermarks.close()
 
     def sync_approved_commands(self, db_session) -> Dict[str, Any]:
         """同步已批准的進階指令到雲端
@@ -213,6 +261,13 @@ class CloudSyncService:
 
             data = response.get('data', {})
 
+            # 雲端指令內容自上次下載後未變更：已導入的本地指令即為最新，略過導入
+            if response.get('not_modified') and data.get('name'):
+                existing = db_session.query(AdvancedCommand).filter_by(name=data['name']).first()
+                if existing:
+                    logger.info(f"Command '{data['name']}' unchanged on cloud, skipping re-import")
+                    return existing
+
             # 驗證必要欄位
             required_fields = ['name', 'description', 'category', 'content', 'version']
             for field in required_fields:
@@ -232,12 +287,9 @@ class CloudSyncService:
             # 建立本地指令
             # 從雲端下載的指令需要本地審核，預設為 pending 狀態
             # 在 description 中記錄原始作者資訊以保持追蹤
-            original_author_note = f"\n\n[從雲端下載 - 原始作者: {data.get('author_username', 'unknown')}]"
-            description_with_source = (data['description'] or '') + original_author_note
-
             local_cmd = AdvancedCommand(
                 name=data['name'],
-                description=description_with_source,
+                description=_cloud_description(data),
                 category=data['category'],
                 base_commands=data['content'],
                 version=data['version'],
@@ -259,6 +311,140 @@ class CloudSyncService:
             db_session.rollback()
             return None
 
+    def pull_command_changes(
+        self,
+        db_session,
+        user_id: int,
+        page_size: int = 500,
+        max_pages: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """以 (updated_at, id) 水位增量導入雲端公開指令的變更
+
+        從本地保存的水位開始分頁取得變更，所有頁面在同一個資料庫交易中批次導入，
+        提交成功後才推進水位；任何一頁失敗時整批回滾、水位不變，下次從原位置重試。
+        沒有變更時只需一次回傳空列表的請求。
+
+        導入規則與 download_and_import_command 相同：新指令以 pending 狀態建立；
+        先前從雲端導入、同一原始作者的指令在雲端版本較新時更新內容並重設為 pending
+        （需重新審核）；本地建立或來自其他作者的同名指令不覆寫。
+
+        Args:
+            db_session: 資料庫 session
+            user_id: 導入用戶 ID（新指令的 author_id）
+            page_size: 每頁指令數（最大 1000）
+            max_pages: 本次最多取得頁數，None 表示同步到最新
+
+        Returns:
+            Dict[str, Any]:
+                - success: 是否成功
+                - imported: 新建立的指令數
+                - updated: 更新的指令數
+                - skipped: 未變更或不覆寫的指令數
+                - watermark: 目前水位 (updated_at, id)
+                - has_more: 是否仍有未取得的變更
+                - error: 錯誤訊息（失敗時）
+        """
+        scope = self._command_watermark_scope
+        watermark = self._watermarks.get_command_watermark(scope)
+        results: Dict[str, Any] = {'imported': 0, 'updated': 0, 'skipped': 0}
+        next_watermark = watermark
+        pages = 0
+        has_more = True
+
+        try:
+            # 動態導入以避免循環依賴
+            from WebUI.app.models import AdvancedCommand
+
+            # 同名指令在同一批中可能出現多次（例如連續更新），以名稱追蹤本批已處理的本地物件
+            local_by_name: Dict[str, Any] = {}
+            while has_more and (max_pages is None or pages < max_pages):
+                since, since_id = next_watermark if next_watermark else (None, 0)
+                response = self.client.get_command_changes(since=since, since_id=since_id, limit=page_size)
+                if not response.get('success'):
+                    raise RuntimeError(response.get('error', 'Failed to fetch command changes'))
+                data = response.get('data', {})
+                commands = data.get('commands', [])
+                has_more = bool(data.get('has_more'))
+                pages += 1
+
+                names = [cmd['name'] for cmd in commands if cmd.get('name') and cmd['name'] not in local_by_name]
+                if names:
+                    for existing in db_session.query(AdvancedCommand).filter(AdvancedCommand.name.in_(names)).all():
+                        local_by_name[existing.name] = existing
+
+                for cmd in commands:
+                    self._import_command_change(db_session, AdvancedCommand, cmd, user_id, local_by_name, results)
+
+                if data.get('next_watermark'):
+                    next_watermark = (data['next_watermark']['updated_at'], data['next_watermark']['id'])
+                if not commands:
+                    break
+
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            logger.warning(f"Failed to pull command changes since {watermark}: {e}")
+            return {
+                'success': False, 'imported': 0, 'updated': 0, 'skipped': 0,
+                'watermark': watermark, 'has_more': True, 'error': str(e),
+            }
+
+        if next_watermark and next_watermark != watermark:
+            self._watermarks.set_command_watermark(scope, next_watermark)
+
+        if results['imported'] or results['updated']:
+            logger.info(
+                f"Pulled command changes from cloud: {results['imported']} imported, "
+                f"{results['updated']} updated, {results['skipped']} skipped"
+            )
+        else:
+            logger.debug(f"No command changes to import since {watermark}")
+        return {'success': True, **results, 'watermark': next_watermark, 'has_more': has_more}
+
+    @staticmethod
+    def _import_command_change(
+        db_session,
+        model,
+        data: Dict[str, Any],
+        user_id: int,
+        local_by_name: Dict[str, Any],
+        results: Dict[str, Any]
+    ) -> None:
+        """將單一雲端變更套用到本地（不提交，由呼叫端在同一交易中提交）"""
+        if any(field not in data for field in ('name', 'content', 'version')):
+            results['skipped'] += 1
+            return
+
+        existing = local_by_name.get(data['name'])
+        if existing is None:
+            local_cmd = model(
+                name=data['name'],
+                description=_cloud_description(data),
+                category=data.get('category'),
+                base_commands=data['content'],
+                version=data['version'],
+                author_id=user_id,
+                status='pending'  # 從雲端下載的指令需經過本地審核
+            )
+            db_session.add(local_cmd)
+            local_by_name[data['name']] = local_cmd
+            results['imported'] += 1
+            return
+
+        # 只更新先前從雲端導入、同一原始作者的指令
+        note = CLOUD_SOURCE_NOTE.format(author=data.get('author_username', 'unknown'))
+        from_same_source = (existing.description or '').endswith(note)
+        if not from_same_source or (existing.version or 0) >= (data['version'] or 0):
+            results['skipped'] += 1
+            return
+
+        existing.description = _cloud_description(data)
+        existing.category = data.get('category')
+        existing.base_commands = data['content']
+        existing.version = data['version']
+        existing.status = 'pending'  # 內容變更需重新審核
+        results['updated'] += 1
+
     def browse_cloud_commands(
         self,
         category: Optional[str] = None,
@@ -289,7 +475,10 @@ class CloudSyncService:
 
             if response.get('success'):
                 commands = response.get('data', {}).get('commands', [])
-                logger.info(f"Retrieved {len(commands)} commands from cloud")
+                if response.get('not_modified'):
+                    logger.info(f"Cloud commands unchanged, using {len(commands)} cached commands")
+                else:
+                    logger.info(f"Retrieved {len(commands)} commands from cloud")
                 return commands
             else:
                 logger.error("Failed to browse cloud commands")
@@ -357,7 +546,12 @@ class CloudSyncService:
         """
         self._sync_queue.set_online(is_available)
 
-    def flush_queue(self) -> Dict[str, Any]:
+    def flush_queue(
+        self,
+        batched: bool = False,
+        pack_max_ops: int = DEFAULT_PACK_MAX_OPS,
+        pack_max_bytes: int = DEFAULT_PACK_MAX_BYTES,
+    ) -> Dict[str, Any]:
         """清空同步佇列：按先後順序補發所有快取的同步操作
 
         呼叫時機：
@@ -365,18 +559,31 @@ class CloudSyncService:
         - 定期排程（例如每 5 分鐘）
         - 應用程式啟動時
 
+        Args:
+            batched: 是否以批次端點打包補發（每次請求最多 pack_max_ops 筆或 pack_max_bytes 位元組）
+            pack_max_ops: 每次批次請求最多筆數
+            pack_max_bytes: 每次批次請求 payload 合計位元組上限
+
         Returns:
-            Dict[str, Any]: 結果統計 {sent, failed, remaining}
+            Dict[str, Any]: 結果統計 {sent, failed, remaining}（批次模式另含 requests）
         """
+        if batched and self._batch_endpoint_supported:
+            return self._sync_queue.flush_batched(
+                self._dispatch_queued_batch,
+                max_ops=pack_max_ops,
+                max_bytes=pack_max_bytes,
+            )
         return self._sync_queue.flush(self._dispatch_queued_item)
 
     def get_queue_statistics(self) -> Dict[str, Any]:
         """取得同步佇列統計資訊
 
         Returns:
-            Dict[str, Any]: 統計資訊（pending、failed、total_sent 等）
+            Dict[str, Any]: 統計資訊（pending、failed、total_sent 等，transfer 為線上傳輸位元組統計）
         """
-        return self._sync_queue.get_statistics()
+        stats = self._sync_queue.get_statistics()
+        stats['transfer'] = self.client.get_transfer_stats()
+        return stats
 
     def _dispatch_queued_item(self, op_type: str, payload: Dict[str, Any]) -> bool:
         """將佇列中的項目實際發送到雲端
@@ -405,7 +612,10 @@ class CloudSyncService:
                     records=payload['records'],
                     edge_id=payload.get('edge_id', self.edge_id),
                 )
-                return bool(response.get('success'))
+                success = bool(response.get('success'))
+                if success:
+                    self._watermarks.mark_uploaded(payload['user_id'], payload['records'])
+                return success
 
             logger.warning("Unknown op_type in sync queue", extra={
                 "op_type": op_type,
@@ -420,6 +630,50 @@ class CloudSyncService:
             })
             return False
 
+    def _dispatch_queued_batch(
+        self,
+        items: List[Tuple[str, str, Dict[str, Any]]],
+    ) -> Dict[str, bool]:
+        """將一包佇列項目以單一請求發送到雲端批次端點
+
+        由 flush_queue(batched=True) 的 batch_send_handler 回呼此方法。
+        雲端不支援批次端點（404/405）時，記錄後改為逐筆發送本包項目。
+
+        Args:
+            items: [(op_id, op_type, payload), ...]，依 seq 排序
+
+        Returns:
+            {op_id: 是否成功}
+        """
+        ops = [
+            {'op_id': op_id, 'op_type': op_type, 'payload': payload}
+            for op_id, op_type, payload in items
+        ]
+        try:
+            response = self.client.upload_sync_batch(ops=ops, edge_id=self.edge_id)
+        except requests.HTTPError as e:
+            status = getattr(e.response, 'status_code', None)
+            if status not in (404, 405):
+                raise
+            logger.warning("Cloud does not support batch sync, falling back to per-item flush", extra={
+                "status": status,
+                "service": "cloud_sync_service",
+            })
+            self._batch_endpoint_supported = False
+            return {
+                op_id: self._dispatch_queued_item(op_type, payload)
+                for op_id, op_type, payload in items
+            }
+
+        outcomes = {
+            result.get('op_id'): bool(result.get('success'))
+            for result in response.get('results', [])
+        }
+        for op_id, op_type, payload in items:
+            if op_type == 'command_history' and outcomes.get(op_id):
+                self._watermarks.mark_uploaded(payload['user_id'], payload['records'])
+        return outcomes
+
     # ==================== 用戶設定同步 ====================
 
     def sync_user_settings(
@@ -489,7 +743,10 @@ class CloudSyncService:
             if response.get('success'):
                 data = response.get('data', {})
                 settings = data.get('settings')
-                logger.info(f"Restored settings from cloud for user '{user_id}'")
+                if response.get('not_modified'):
+                    logger.info(f"Cloud settings unchanged for user '{user_id}', using cached copy")
+                else:
+                    logger.info(f"Restored settings from cloud for user '{user_id}'")
                 return settings
             else:
                 logger.warning(f"No cloud settings found for user '{user_id}'")
@@ -508,7 +765,9 @@ class CloudSyncService:
         """將指令執行歷史上傳到雲端
 
         將本地 CommandRecord 記錄批次上傳到雲端，用於分析、備份及跨裝置查詢。
-        雲端會自動以 command_id 去重，避免重複記錄。
+        只上傳 (created_at, command_id) 高於上傳高水位的記錄（缺少 created_at 的記錄一律上傳）；
+        水位前 UPLOAD_TIE_WINDOW_SECONDS 內的記錄（相同時間戳或稍微亂序）以已上傳的 command_id 判斷，
+        更早的記錄視為已上傳。本地無水位時先向雲端查詢此 Edge 的水位。雲端仍以 command_id 去重。
 
         雲端不可用時自動快取到本地 SQLite 佇列（先後發送機制），
         呼叫 flush_queue() 後按入隊順序補發。
@@ -523,11 +782,20 @@ class CloudSyncService:
                 - queued: True 表示已快取到佇列（離線時）
                 - synced_count: 本次新增的記錄數（成功時）
                 - total: 雲端總記錄數（成功時）
+                - skipped: 因已在水位之前而略過的記錄數
                 - error: 錯誤訊息（失敗時）
         """
         if not records:
             return {'success': True, 'synced_count': 0, 'total': 0}
 
+        watermark = self._get_upload_watermark(user_id)
+        new_records = self._watermarks.filter_unsent(user_id, records, watermark)
+        skipped = len(records) - len(new_records)
+        if not new_records:
+            logger.debug(f"No new command history for user '{user_id}' past watermark")
+            return {'success': True, 'synced_count': 0, 'skipped': skipped}
+        records = new_records
+
         try:
             response = self.client.upload_command_history(
                 user_id=user_id,
@@ -535,12 +803,15 @@ class CloudSyncService:
                 edge_id=self.edge_id
             )
             if response.get('success'):
+                self._watermarks.mark_uploaded(user_id, records)
                 logger.info(
                     f"Command history synced for user '{user_id}': "
-                    f"{response.get('synced_count', 0)} records added"
+                    f"{response.get('synced_count', 0)} records added, {skipped} skipped"
                 )
             else:
                 logger.warning(f"Failed to sync history for user '{user_id}'")
+            if isinstance(response, dict):
+                response = {**response, 'skipped': skipped}
             return response
         except Exception as e:
             logger.warning(
@@ -558,6 +829,116 @@ class CloudSyncService:
                 return {'success': False, 'queued': True, 'op_id': op_id}
             return {'success': False, 'queued': False, 'error': 'Queue full'}
 
+    def pull_command_history(
+        self,
+        user_id: str,
+        page_size: int = 500,
+        max_pages: Optional[int] = None,
+        history_store=None
+    ) -> Dict[str, Any]:
+        """從雲端增量下載其他裝置上傳的指令歷史
+
+        從本地儲存的下載游標開始以 keyset 分頁下載，每頁完成後保存游標，
+        中斷後下次呼叫會從上次位置繼續。
+
+        Args:
+            user_id: 用戶 ID
+            page_size: 每頁記錄數（最大 1000）
+            max_pages: 本次最多下載頁數，None 表示下載到最新
+            history_store: 提供 CommandHistoryStore 時改用 NDJSON 串流下載，
+                每批直接寫入本地存儲（records 不回傳，記憶體用量固定），忽略 max_pages
+
+        Returns:
+            Dict[str, Any]:
+                - success: 是否成功
+                - records: 本次下載的記錄（串流模式為空列表）
+                - stored: 寫入本地存儲的筆數（僅串流模式）
+                - cursor: 目前下載游標
+                - has_more: 是否仍有未下載的記錄
+                - error: 錯誤訊息（失敗時）
+        """
+        cursor = self._watermarks.get_download_cursor(user_id)
+        if history_store is not None:
+            return self._stream_command_history(user_id, history_store, cursor, page_size)
+
+        records: List[Dict[str, Any]] = []
+        pages = 0
+        has_more = True
+
+        try:
+            while has_more and (max_pages is None or pages < max_pages):
+                response = self.client.download_command_history(
+                    user_id=user_id,
+                    limit=page_size,
+                    cursor=cursor,
+                    exclude_edge_id=self.edge_id,
+                )
+                if not response.get('success'):
+                    return {
+                        'success': False, 'records': records, 'cursor': cursor,
+                        'has_more': True, 'error': response.get('error', 'Download failed'),
+                    }
+                data = response.get('data', {})
+                records.extend(data.get('records', []))
+                has_more = bool(data.get('has_more'))
+                next_cursor = data.get('next_cursor')
+                if next_cursor is not None and next_cursor != cursor:
+                    cursor = next_cursor
+                    self._watermarks.set_download_cursor(user_id, cursor)
+                pages += 1
+        except Exception as e:
+            logger.warning(f"Failed to pull command history for user '{user_id}': {e}")
+            return {'success': False, 'records': records, 'cursor': cursor, 'has_more': True, 'error': str(e)}
+
+        logger.info(f"Pulled {len(records)} command history records for user '{user_id}'")
+        return {'success': True, 'records': records, 'cursor': cursor, 'has_more': has_more}
+
+    def _stream_command_history(
+        self,
+        user_id: str,
+        history_store,
+        cursor: int,
+        batch_size: int
+    ) -> Dict[str, Any]:
+        """以 NDJSON 串流下載指令歷史並逐批寫入本地存儲，每批寫入後保存游標"""
+        stored = 0
+        try:
+            for records, next_cursor in self.client.iter_command_history_stream(
+                user_id, cursor=cursor, exclude_edge_id=self.edge_id, batch_size=batch_size
+            ):
+                stored += history_store.add_records(records)
+                cursor = next_cursor
+                self._watermarks.set_download_cursor(user_id, cursor)
+        except Exception as e:
+            logger.warning(f"Failed to stream command history for user '{user_id}': {e}")
+            return {
+                'success': False, 'records': [], 'stored': stored, 'cursor': cursor,
+                'has_more': True, 'error': str(e),
+            }
+
+        logger.info(f"Streamed {stored} new command history records for user '{user_id}'")
+        return {'success': True, 'records': [], 'stored': stored, 'cursor': cursor, 'has_more': False}
+
+    def _get_upload_watermark(self, user_id: str) -> Optional[Tuple[str, str]]:
+        """取得上傳高水位：本地優先，本地沒有時向雲端查詢一次（重新安裝的 Edge 不重送全部歷史）"""
+        watermark = self._watermarks.get_upload_watermark(user_id)
+        if watermark is not None or user_id in self._remote_watermark_checked:
+            return watermark
+
+        self._remote_watermark_checked.add(user_id)
+        try:
+            response = self.client.get_history_watermark(user_id=user_id, edge_id=self.edge_id)
+        except Exception as e:
+            logger.debug(f"Could not fetch history watermark for user '{user_id}': {e}")
+            return None
+
+        data = response.get('data') if isinstance(response, dict) else None
+        if isinstance(data, dict) and data.get('created_at') and data.get('command_id'):
+            # 水位本身對應的記錄已在雲端，一併記入容忍窗口
+            self._watermarks.mark_uploaded(user_id, [data])
+            return self._watermarks.get_upload_watermark(user_id)
+        return None
+
     def get_cloud_status(self) -> Dict[str, Any]:
         """取得雲端服務狀態
 
@@ -572,6 +953,7 @@ class CloudSyncService:
             'auto_sync': self.auto_sync,
             'last_check': datetime.now(timezone.utc).isoformat(),
             'sync_queue': self._sync_queue.get_statistics(),
+            'transfer': self.client.get_transfer_stats(),
         }
 
         if is_available:
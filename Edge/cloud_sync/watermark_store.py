@@ -0,0 +1,356 @@
+# imports
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 高水位鍵：(created_at, command_id)
+WatermarkKey = Tuple[str, str]
+
+# 共享指令增量同步水位鍵：(updated_at, 雲端指令 ID)
+CommandWatermark = Tuple[str, int]
+
+# 水位的容忍窗口（秒）：created_at 落在水位之前此範圍內的記錄改以已上傳的 command_id 判斷，
+# 容許相同時間戳或稍微亂序寫入的記錄；更早的記錄視為已上傳
+UPLOAD_TIE_WINDOW_SECONDS = 300
+
+# 單次 IN 查詢的參數數量（低於 SQLite 預設的變數上限）
+_ID_QUERY_CHUNK = 500
+
+
+def record_watermark_key(record: Dict[str, Any]) -> Optional[WatermarkKey]:
+    """取得指令歷史記錄的水位鍵 (created_at, command_id)
+
+    created_at 須為 UTC ISO 8601 字串（CommandRecord.to_dict() 的格式），才能以字串比較排序。
+
+    Args:
+        record: 指令歷史記錄
+
+    Returns:
+        水位鍵；缺少 created_at 或 command_id 時返回 None（此類記錄無法比較，一律視為新記錄）
+    """
+    created_at = record.get('created_at')
+    command_id = record.get('command_id')
+    if not isinstance(created_at, str) or not created_at or not command_id:
+        return None
+    return created_at, str(command_id)
+
+
+def _window_floor(created_at: str) -> str:
+    """水位容忍窗口的下界（無法解析時間時只容許相同時間戳）"""
+    try:
+        floor = datetime.fromisoformat(created_at) - timedelta(seconds=UPLOAD_TIE_WINDOW_SECONDS)
+    except ValueError:
+        return created_at
+    return floor.isoformat()
+
+
+class SyncWatermarkStore:
+    """指令歷史與共享指令增量同步的本地水位
+
+    指令歷史每位用戶記錄：
+    - 上傳高水位：已成功上傳的最高 (created_at, command_id)，只上傳其後的記錄
+    - 容忍窗口內已上傳的 command_id：水位前 UPLOAD_TIE_WINDOW_SECONDS 內的記錄以此判斷是否已上傳
+    - 下載游標：雲端 keyset 分頁的 next_cursor，從上次位置繼續下載
+
+    共享指令記錄已導入的雲端變更水位 (updated_at, id)，依來源（scope）分開保存。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """初始化水位存儲
+
+        Args:
+            db_path: SQLite 資料庫路徑；None 表示使用記憶體資料庫（:memory:）
+        """
+        self._db_path = db_path or ":memory:"
+        self._lock = threading.RLock()
+
+        # 記憶體資料庫保持持久連線，避免資料在連線關閉後消失
+        self._is_memory_db = self._db_path == ":memory:"
+        self._persistent_conn: Optional[sqlite3.Connection] = None
+
+        self._init_db()
+
+    @contextmanager
+    def _get_conn(self) -> Generator[sqlite3.Connection, None, None]:
+        """取得資料庫連線（context manager）"""
+        if self._is_memory_db:
+            if self._persistent_conn is None:
+                self._persistent_conn = sqlite3.connect(
+                    self._db_path, check_same_thread=False
+                )
+                self._persistent_conn.row_factory = sqlite3.Row
+            yield self._persistent_conn
+        else:
+            conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def _init_db(self) -> None:
+        """初始化 SQLite 資料表"""
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS history_sync_state (
+                        user_id             TEXT PRIMARY KEY,
+                        upload_created_at   TEXT,
+                        upload_command_id   TEXT,
+                        download_cursor     INTEGER,
+                        updated_at          TEXT NOT NULL
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS history_upload_window (
+                        user_id             TEXT NOT NULL,
+                        command_id          TEXT NOT NULL,
+                        created_at          TEXT NOT NULL,
+                        PRIMARY KEY (user_id, command_id)
+                    )
+                """)
+                conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_history_upload_window_created
+                    ON history_upload_window (user_id, created_at)
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS command_sync_state (
+                        scope               TEXT PRIMARY KEY,
+                        changed_at          TEXT NOT NULL,
+                        command_id          INTEGER NOT NULL,
+                        updated_at          TEXT NOT NULL
+                    )
+                """)
+                conn.commit()
+
+    def _get_row(self, user_id: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            with self._get_conn() as conn:
+                return conn.execute(
+                    "SELECT * FROM history_sync_state WHERE user_id = ?", (user_id,)
+                ).fetchone()
+
+    # ==================== 上傳高水位 ====================
+
+    def get_upload_watermark(self, user_id: str) -> Optional[WatermarkKey]:
+        """取得用戶的上傳高水位
+
+        Args:
+            user_id: 用戶 ID
+
+        Returns:
+            (created_at, command_id)，尚未上傳過時返回 None
+        """
+        row = self._get_row(user_id)
+        if row is None or row["upload_created_at"] is None:
+            return None
+        return row["upload_created_at"], row["upload_command_id"]
+
+    def advance_upload_watermark(self, user_id: str, records: Iterable[Dict[str, Any]]) -> Optional[WatermarkKey]:
+        """以已成功上傳的記錄推進上傳高水位（只前進不後退）
+
+        Args:
+            user_id: 用戶 ID
+            records: 已上傳的記錄
+
+        Returns:
+            推進後的高水位
+        """
+        keys = [key for key in map(record_watermark_key, records) if key is not None]
+        return self.set_upload_watermark(user_id, max(keys)) if keys else self.get_upload_watermark(user_id)
+
+    def set_upload_watermark(self, user_id: str, key: WatermarkKey) -> WatermarkKey:
+        """設定上傳高水位（低於現有水位時保持不變）
+
+        Args:
+            user_id: 用戶 ID
+            key: (created_at, command_id)
+
+        Returns:
+            設定後的高水位
+        """
+        with self._lock:
+            current = self.get_upload_watermark(user_id)
+            if current is not None and current >= key:
+                return current
+            now = datetime.now(timezone.utc).isoformat()
+            with self._get_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO history_sync_state
+                        (user_id, upload_created_at, upload_command_id, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        upload_created_at = excluded.upload_created_at,
+                        upload_command_id = excluded.upload_command_id,
+                        updated_at = excluded.updated_at
+                    """,
+                    (user_id, key[0], key[1], now),
+                )
+                conn.commit()
+        return key
+
+    def mark_uploaded(self, user_id: str, records: Iterable[Dict[str, Any]]) -> None:
+        """以已成功上傳的記錄推進上傳高水位，並記錄容忍窗口內的 command_id
+
+        窗口下界之前的 command_id 隨水位前進刪除，保存的數量只與窗口內的記錄數有關。
+
+        Args:
+            user_id: 用戶 ID
+            records: 已上傳的記錄
+        """
+        records = [r for r in records if isinstance(r, dict)]
+        watermark = self.advance_upload_watermark(user_id, records)
+        if watermark is None:
+            return
+        floor = _window_floor(watermark[0])
+        keys = [key for key in map(record_watermark_key, records) if key is not None and key[0] >= floor]
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO history_upload_window (user_id, command_id, created_at)
+                    VALUES (?, ?, ?)
+                    """,
+                    [(user_id, command_id, created_at) for created_at, command_id in keys],
+                )
+                conn.execute(
+                    "DELETE FROM history_upload_window WHERE user_id = ? AND created_at < ?",
+                    (user_id, floor),
+                )
+                conn.commit()
+
+    def filter_unsent(
+        self,
+        user_id: str,
+        records: List[Any],
+        watermark: Optional[WatermarkKey],
+    ) -> List[Any]:
+        """篩選尚未上傳的記錄
+
+        - 水位鍵高於 watermark 的記錄：上傳
+        - 水位前容忍窗口內的記錄：command_id 未記錄為已上傳時上傳
+        - 更早的記錄：視為已上傳
+        - 缺少水位鍵的記錄：一律上傳
+
+        Args:
+            user_id: 用戶 ID
+            records: 待上傳的記錄
+            watermark: 上傳高水位；None 表示全部上傳
+
+        Returns:
+            尚未上傳的記錄，保持原順序
+        """
+        if watermark is None:
+            return list(records)
+        floor = _window_floor(watermark[0])
+
+        selected = []
+        in_window = []
+        for record in records:
+            key = record_watermark_key(record) if isinstance(record, dict) else None
+            if key is None or key > watermark:
+                selected.append((record, None))
+            elif key[0] >= floor:
+                selected.append((record, key[1]))
+                in_window.append(key[1])
+
+        uploaded = set()
+        if in_window:
+            with self._lock:
+                with self._get_conn() as conn:
+                    for start in range(0, len(in_window), _ID_QUERY_CHUNK):
+                        chunk = in_window[start:start + _ID_QUERY_CHUNK]
+                        placeholders = ', '.join('?' * len(chunk))
+                        rows = conn.execute(
+                            f"SELECT command_id FROM history_upload_window "
+                            f"WHERE user_id = ? AND command_id IN ({placeholders})",
+                            (user_id, *chunk),
+                        ).fetchall()
+                        uploaded.update(row["command_id"] for row in rows)
+        return [record for record, command_id in selected if command_id not in uploaded]
+
+    # ==================== 下載游標 ====================
+
+    def get_download_cursor(self, user_id: str) -> int:
+        """取得用戶的下載游標（尚未下載過時為 0）"""
+        row = self._get_row(user_id)
+        if row is None or row["download_cursor"] is None:
+            return 0
+        return row["download_cursor"]
+
+    def set_download_cursor(self, user_id: str, cursor: int) -> None:
+        """儲存用戶的下載游標
+
+        Args:
+            user_id: 用戶 ID
+            cursor: 雲端回傳的 next_cursor
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO history_sync_state (user_id, download_cursor, updated_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        download_cursor = excluded.download_cursor,
+                        updated_at = excluded.updated_at
+                    """,
+                    (user_id, cursor, now),
+                )
+                conn.commit()
+
+    # ==================== 共享指令變更水位 ====================
+
+    def get_command_watermark(self, scope: str) -> Optional[CommandWatermark]:
+        """取得共享指令的變更水位
+
+        Args:
+            scope: 水位來源（例如雲端 API URL）
+
+        Returns:
+            (updated_at, 雲端指令 ID)，尚未同步過時返回 None
+        """
+        with self._lock:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    "SELECT changed_at, command_id FROM command_sync_state WHERE scope = ?", (scope,)
+                ).fetchone()
+        if row is None:
+            return None
+        return row["changed_at"], row["command_id"]
+
+    def set_command_watermark(self, scope: str, key: CommandWatermark) -> None:
+        """儲存共享指令的變更水位（變更導入提交後呼叫）
+
+        Args:
+            scope: 水位來源
+            key: 雲端回傳的 (updated_at, id)
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            with self._get_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO command_sync_state (scope, changed_at, command_id, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (scope) DO UPDATE SET
+                        changed_at = excluded.changed_at,
+                        command_id = excluded.command_id,
+                        updated_at = excluded.updated_at
+                    """,
+                    (scope, key[0], int(key[1]), now),
+                )
+                conn.commit()
+
+    def close(self) -> None:
+        """關閉持久記憶體資料庫連線"""
+        if self._persistent_conn:
+            self._persistent_conn.close()
+            self._persistent_conn = None
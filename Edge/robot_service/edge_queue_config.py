@@ -89,6 +89,10 @@ class EdgeQueueConfig:
             config["sqs_config"] = EdgeQueueConfig.get_sqs_config()
         else:
             config["queue_max_size"] = int(os.getenv("EDGE_QUEUE_MAX_SIZE", "1000"))
+            config["queue_partition_by_robot"] = (
+                os.getenv("EDGE_QUEUE_PARTITION_BY_ROBOT", "false").lower() == "true"
+            )
+            config["queue_scheduling"] = os.getenv("EDGE_QUEUE_SCHEDULING", "round_robin").lower()
 
         return config
 
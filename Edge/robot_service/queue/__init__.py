@@ -5,11 +5,13 @@ Queue 模組
 """
 
 from .interface import QueueInterface, Message, MessagePriority
-from .memory_queue import MemoryQueue
+from .memory_queue import MemoryQueue, DeadLetterEntry
 from .rabbitmq_queue import RabbitMQQueue
 from .sqs_queue import SQSQueue
 from .handler import QueueHandler
 from .offline_buffer import OfflineBuffer, BufferEntry, BufferEntryStatus
+from .coalescing import CoalescingRules
+from .drain_scheduler import DrainScheduler
 from .offline_queue_service import OfflineQueueService
 
 # Alias for backward compatibility
@@ -20,6 +22,7 @@ __all__ = [
     "Message",
     "MessagePriority",
     "MemoryQueue",
+    "DeadLetterEntry",
     "RabbitMQQueue",
     "SQSQueue",
     "PriorityQueue",  # Alias for MemoryQueue
@@ -28,5 +31,7 @@ __all__ = [
     "OfflineBuffer",
     "BufferEntry",
     "BufferEntryStatus",
+    "CoalescingRules",
+    "DrainScheduler",
     "OfflineQueueService",
 ]
@@ -0,0 +1,163 @@
+"""
+Command Coalescing
+離線緩衝指令的合併與去重規則
+
+離線期間重複的狀態查詢、被後續指令取代的移動指令與 UI 重複點擊，
+若全部保留會在重連後一次重送。此模組定義 OfflineBuffer 在緩衝時套用的規則：
+- 最後寫入者勝出：相同 (機器人, 指令類型) 僅保留最新一筆
+- 內容雜湊去重：時間窗內完全相同的指令只保留一筆
+- 停止指令取代待發送的移動指令
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional
+
+from .interface import Message
+
+# 規則名稱（用於統計）
+RULE_LAST_WRITE_WINS = "last_write_wins"
+RULE_DEDUP = "dedup"
+RULE_STOP_SUPERSEDES_MOTION = "stop_supersedes_motion"
+
+
+@dataclass(frozen=True)
+class CoalescingRules:
+    """
+    指令合併規則
+
+    Attributes:
+        last_write_wins_types: 套用「最後寫入者勝出」的指令類型，
+            相同機器人的同類型待發送指令會被新指令取代
+        dedup_window_seconds: 內容完全相同的指令在此時間窗內只保留第一筆，0 表示停用
+        stop_supersedes_motion: 停止指令是否移除該機器人所有待發送的移動指令
+        stop_actions: 視為停止指令的動作
+        motion_actions: 視為移動指令的動作，None 表示停止動作以外的所有動作
+        dedup_ignore_keys: 計算內容雜湊時忽略的欄位（每次提交都不同的 ID、時間戳記）
+    """
+    last_write_wins_types: FrozenSet[str] = frozenset()
+    dedup_window_seconds: float = 0.0
+    stop_supersedes_motion: bool = False
+    stop_actions: FrozenSet[str] = frozenset({"stop"})
+    motion_actions: Optional[FrozenSet[str]] = None
+    dedup_ignore_keys: FrozenSet[str] = frozenset({"id", "command_id", "timestamp", "trace_id"})
+
+    def __post_init__(self):
+        if self.dedup_window_seconds < 0:
+            raise ValueError("dedup_window_seconds must be >= 0")
+
+    @property
+    def enabled(self) -> bool:
+        """是否有任何規則啟用"""
+        return bool(self.last_write_wins_types) or self.dedup_window_seconds > 0 or self.stop_supersedes_motion
+
+    def is_stop(self, actions: List[str]) -> bool:
+        """指令是否為停止指令（所有動作皆為停止動作）"""
+        return bool(actions) and all(a in self.stop_actions for a in actions)
+
+    def is_motion(self, actions: List[str]) -> bool:
+        """指令是否為移動指令（不含停止動作）"""
+        if not actions or any(a in self.stop_actions for a in actions):
+            return False
+        if self.motion_actions is None:
+            return True
+        return all(a in self.motion_actions for a in actions)
+
+
+def get_message_actions(message: Message) -> List[str]:
+    """
+    從訊息 payload 取得動作列表
+
+    解析規則與 CommandProcessor._extract_actions 一致，另支援 TUI 的 {"action": ...}。
+
+    Args:
+        message: 佇列訊息
+
+    Returns:
+        動作名稱列表，無法解析時為空列表
+    """
+    payload = message.payload or {}
+
+    if isinstance(payload.get("actions"), list):
+        actions = []
+        for item in payload["actions"]:
+            if isinstance(item, str):
+                actions.append(item)
+            elif isinstance(item, dict) and "action_name" in item:
+                actions.append(item["action_name"])
+            elif isinstance(item, dict) and "command" in item:
+                actions.append(item["command"])
+        return actions
+
+    for key in ("action_name", "action"):
+        if isinstance(payload.get(key), str):
+            return [payload[key]]
+
+    command = payload.get("command")
+    if isinstance(command, dict):
+        params = command.get("params") or {}
+        if isinstance(params, dict):
+            if "action_name" in params:
+                return [params["action_name"]]
+            if isinstance(params.get("actions"), list):
+                return get_message_actions(Message(payload={"actions": params["actions"]}))
+
+    if isinstance(payload.get("base_commands"), list):
+        return [
+            cmd["command"] for cmd in payload["base_commands"]
+            if isinstance(cmd, dict) and "command" in cmd
+        ]
+
+    return []
+
+
+def get_message_command_type(message: Message) -> Optional[str]:
+    """
+    取得訊息的指令類型（用於「最後寫入者勝出」規則）
+
+    依序取 payload 的 command_type、MCP command.type、單一動作名稱。
+
+    Args:
+        message: 佇列訊息
+
+    Returns:
+        指令類型，無法判斷時返回 None
+    """
+    payload = message.payload or {}
+
+    if isinstance(payload.get("command_type"), str):
+        return payload["command_type"]
+
+    command = payload.get("command")
+    if isinstance(command, dict) and isinstance(command.get("type"), str):
+        return command["type"]
+
+    actions = get_message_actions(message)
+    if len(actions) == 1:
+        return actions[0]
+
+    return None
+
+
+def get_message_content_hash(message: Message, ignore_keys: FrozenSet[str] = frozenset()) -> str:
+    """
+    計算訊息內容雜湊（payload 與優先權），用於去重
+
+    Args:
+        message: 佇列訊息
+        ignore_keys: 忽略的 payload 欄位（同時套用於 MCP 的 command 物件）
+
+    Returns:
+        SHA-256 十六進位字串
+    """
+    payload = {k: v for k, v in (message.payload or {}).items() if k not in ignore_keys}
+    if isinstance(payload.get("command"), dict):
+        payload["command"] = {k: v for k, v in payload["command"].items() if k not in ignore_keys}
+
+    content: Dict[str, Any] = {
+        "payload": payload,
+        "priority": message.priority.value,
+    }
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
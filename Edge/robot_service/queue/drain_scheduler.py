@@ -0,0 +1,279 @@
+"""
+Drain Scheduler
+重連後的緩衝排空排程
+
+大範圍斷線恢復時，大量 Edge 同時重連並全速排空緩衝，會一起衝擊佇列服務與雲端。
+DrainScheduler 提供：
+- 隨機啟動延遲（jitter），分散各 Edge 的排空起點
+- Token bucket 限制發送速率
+- 依觀察到的發送延遲與錯誤率自適應調整速率（AIMD）
+- 排空進度統計
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Optional, Tuple
+
+from src.common.datetime_utils import utc_now  # noqa: E402
+from .interface import Message  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# 發送處理器類型
+SendHandler = Callable[[Message], Coroutine[Any, Any, bool]]
+
+# 排空階段
+DRAIN_IDLE = "idle"
+DRAIN_WAITING = "waiting_jitter"
+DRAIN_DRAINING = "draining"
+
+
+class DrainScheduler:
+    """
+    Token bucket 排空排程器
+
+    每次發送前取得一個 token，token 以目前速率補充、上限為 burst。
+    每累積 window_size 筆發送結果調整一次速率：
+    錯誤率超過門檻或平均延遲超過目標時乘以 decrease_factor，否則加上 increase_step。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 50.0,
+        burst: int = 20,
+        min_rate: float = 1.0,
+        max_rate: Optional[float] = None,
+        start_jitter_seconds: float = 1.0,
+        latency_target_ms: float = 500.0,
+        error_rate_threshold: float = 0.2,
+        increase_step: float = 5.0,
+        decrease_factor: float = 0.5,
+        window_size: int = 20,
+    ):
+        """
+        初始化排空排程器
+
+        Args:
+            name: 名稱（用於日誌）
+            rate: 初始發送速率（訊息/秒）
+            burst: token bucket 容量
+            min_rate: 速率下限
+            max_rate: 速率上限，預設為初始速率的 10 倍
+            start_jitter_seconds: 排空前隨機延遲的上限（秒）
+            latency_target_ms: 平均發送延遲目標（毫秒）
+            error_rate_threshold: 錯誤率門檻（0-1）
+            increase_step: 健康時每次調整增加的速率
+            decrease_factor: 壅塞時每次調整的速率倍數（0-1）
+            window_size: 每次調整所需的發送結果筆數
+
+        Raises:
+            ValueError: 參數無效
+        """
+        if max_rate is None:
+            max_rate = rate * 10
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError("rates must satisfy 0 < min_rate <= rate <= max_rate")
+        if burst < 1:
+            raise ValueError("burst must be >= 1")
+        if start_jitter_seconds < 0:
+            raise ValueError("start_jitter_seconds must be >= 0")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+        if window_size < 1:
+            raise ValueError("window_size must be >= 1")
+
+        self.name = name
+        self._rate = float(rate)
+        self._initial_rate = float(rate)
+        self._burst = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._start_jitter = start_jitter_seconds
+        self._latency_target = latency_target_ms / 1000.0
+        self._error_rate_threshold = error_rate_threshold
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+        self._window_size = window_size
+
+        # token bucket
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        # 最近的發送結果 (延遲秒數, 是否成功)
+        self._window: Deque[Tuple[float, bool]] = deque(maxlen=window_size)
+        self._since_adjust = 0
+
+        # 進度
+        self._phase = DRAIN_IDLE
+        self._started_at = None
+        self._finished_at = None
+        self._backlog = 0
+        self._sent = 0
+        self._failed = 0
+
+    @property
+    def rate(self) -> float:
+        """目前發送速率（訊息/秒）"""
+        return self._rate
+
+    @property
+    def phase(self) -> str:
+        """目前排空階段"""
+        return self._phase
+
+    def start_delay(self) -> float:
+        """隨機啟動延遲（秒）"""
+        return random.uniform(0, self._start_jitter)  # nosec B311 - 僅用於分散重連時間
+
+    # ==================== Token bucket ====================
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self._burst), self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    async def acquire(self) -> None:
+        """取得一個發送 token，不足時等待補充"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    # ==================== 自適應速率 ====================
+
+    def record(self, latency_seconds: float, success: bool) -> None:
+        """
+        記錄一次發送結果
+
+        Args:
+            latency_seconds: 發送延遲（秒）
+            success: 是否成功
+        """
+        self._window.append((latency_seconds, success))
+        if success:
+            self._sent += 1
+        else:
+            self._failed += 1
+
+        self._since_adjust += 1
+        if self._since_adjust >= self._window_size:
+            self._adjust_rate()
+
+    def _adjust_rate(self) -> None:
+        self._since_adjust = 0
+        if not self._window:
+            return
+
+        error_rate = self._error_rate()
+        avg_latency = self._avg_latency()
+        old_rate = self._rate
+
+        if error_rate > self._error_rate_threshold or avg_latency > self._latency_target:
+            self._rate = max(self._min_rate, self._rate * self._decrease_factor)
+        else:
+            self._rate = min(self._max_rate, self._rate + self._increase_step)
+
+        if self._rate != old_rate:
+            logger.info("Drain rate adjusted", extra={
+                "drain": self.name,
+                "old_rate": round(old_rate, 2),
+                "new_rate": round(self._rate, 2),
+                "error_rate": round(error_rate, 3),
+                "avg_latency_ms": round(avg_latency * 1000, 2),
+                "service": "drain_scheduler"
+            })
+
+    def _error_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(1 for _, ok in self._window if not ok) / len(self._window)
+
+    def _avg_latency(self) -> float:
+        if not self._window:
+            return 0.0
+        return sum(latency for latency, _ in self._window) / len(self._window)
+
+    def wrap(self, handler: SendHandler) -> SendHandler:
+        """
+        包裝發送處理器：發送前取得 token，發送後記錄延遲與結果
+
+        Args:
+            handler: 原始發送處理器
+
+        Returns:
+            受速率限制的發送處理器
+        """
+        async def rate_limited(message: Message) -> bool:
+            await self.acquire()
+            start = time.monotonic()
+            try:
+                success = await handler(message)
+            except Exception:
+                self.record(time.monotonic() - start, False)
+                raise
+            self.record(time.monotonic() - start, bool(success))
+            return success
+
+        return rate_limited
+
+    # ==================== 進度 ====================
+
+    def mark_waiting(self) -> None:
+        """進入啟動延遲階段"""
+        self._phase = DRAIN_WAITING
+
+    def begin(self, backlog: int) -> None:
+        """
+        開始排空
+
+        Args:
+            backlog: 開始時的待發送數量
+        """
+        self._phase = DRAIN_DRAINING
+        self._started_at = utc_now()
+        self._finished_at = None
+        self._backlog = backlog
+        self._sent = 0
+        self._failed = 0
+
+    def finish(self) -> None:
+        """排空結束"""
+        self._phase = DRAIN_IDLE
+        self._finished_at = utc_now()
+
+    def get_progress(self, remaining: Optional[int] = None) -> Dict[str, Any]:
+        """
+        取得排空進度
+
+        Args:
+            remaining: 目前剩餘待發送數量
+
+        Returns:
+            進度資訊字典
+        """
+        progress = None
+        if self._backlog > 0:
+            progress = round(min(self._sent / self._backlog, 1.0), 4)
+
+        return {
+            "phase": self._phase,
+            "started_at": self._started_at.isoformat() if self._started_at else None,
+            "finished_at": self._finished_at.isoformat() if self._finished_at else None,
+            "backlog": self._backlog,
+            "sent": self._sent,
+            "failed": self._failed,
+            "remaining": remaining,
+            "progress": progress,
+            "rate": round(self._rate, 2),
+            "initial_rate": self._initial_rate,
+            "error_rate": round(self._error_rate(), 4),
+            "avg_latency_ms": round(self._avg_latency() * 1000, 2),
+        }
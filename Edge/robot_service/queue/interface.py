@@ -5,7 +5,7 @@ Queue Interface
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from typing import Any, Dict, Optional
 from uuid import uuid4
@@ -31,6 +31,43 @@ class Message:
     retry_count: int = 0
     max_retries: int = 3
     timeout_seconds: Optional[int] = None
+    expires_at: Optional[datetime] = None  # 絕對過期時間
+    deadline_ms: Optional[int] = None  # 相對 timestamp 的期限（毫秒）
+
+    @property
+    def effective_expires_at(self) -> Optional[datetime]:
+        """
+        實際過期時間
+
+        取 expires_at 與 timestamp + deadline_ms 兩者中較早者，皆未設定時返回 None。
+        """
+        candidates = []
+        if self.expires_at is not None:
+            expires_at = self.expires_at
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            candidates.append(expires_at)
+        if self.deadline_ms is not None:
+            timestamp = self.timestamp
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            candidates.append(timestamp + timedelta(milliseconds=self.deadline_ms))
+        return min(candidates) if candidates else None
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        """
+        檢查訊息是否已過期
+
+        Args:
+            now: 比較基準時間，預設為目前 UTC 時間
+
+        Returns:
+            是否已過期
+        """
+        expires_at = self.effective_expires_at
+        if expires_at is None:
+            return False
+        return (now or datetime.now(timezone.utc)) >= expires_at
 
     def to_dict(self) -> Dict[str, Any]:
         """轉換為字典"""
@@ -44,6 +81,8 @@ class Message:
             "retry_count": self.retry_count,
             "max_retries": self.max_retries,
             "timeout_seconds": self.timeout_seconds,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None,
+            "deadline_ms": self.deadline_ms,
         }
 
     @classmethod
@@ -59,9 +98,39 @@ class Message:
             retry_count=data.get("retry_count", 0),
             max_retries=data.get("max_retries", 3),
             timeout_seconds=data.get("timeout_seconds"),
+            expires_at=datetime.fromisoformat(data["expires_at"]) if data.get("expires_at") else None,
+            deadline_ms=data.get("deadline_ms"),
         )
 
 
+def get_payload_deadline_ms(payload: Dict[str, Any]) -> Optional[int]:
+    """
+    從指令 payload 取得期限（毫秒）
+
+    支援直接指定的 {"deadline_ms": ...}，以及 MCP CommandRequest 格式
+    {"command": {"timeout_ms": ...}}，讓上游的指令逾時延續為佇列訊息期限。
+
+    Args:
+        payload: 指令 payload
+
+    Returns:
+        期限（毫秒），未指定時返回 None
+    """
+    if not isinstance(payload, dict):
+        return None
+
+    deadline_ms = payload.get("deadline_ms")
+    if deadline_ms is None:
+        command = payload.get("command")
+        if isinstance(command, dict):
+            deadline_ms = command.get("timeout_ms")
+
+    try:
+        return int(deadline_ms) if deadline_ms is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
 class QueueInterface(ABC):
     """
     佇列抽象介面
@@ -4,16 +4,161 @@ Memory Queue
 """
 
 import asyncio
+import heapq
+import itertools
 import logging
+import random
+import time
 from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Deque, Dict, Hashable, Iterable, List, Optional, Tuple
 
 from .interface import Message, MessagePriority, QueueInterface
 
 
 logger = logging.getLogger(__name__)
 
+# 依優先權由高至低的取出順序
+_PRIORITY_ORDER = [
+    MessagePriority.URGENT,
+    MessagePriority.HIGH,
+    MessagePriority.NORMAL,
+    MessagePriority.LOW,
+]
+
+# 支援的分區排程策略
+SCHEDULING_ROUND_ROBIN = "round_robin"
+SCHEDULING_DEFICIT_ROUND_ROBIN = "deficit_round_robin"
+
+# 表示「沒有可服務分區」的哨兵值（None 已用作無 robot_id 訊息的分區 key）
+_NO_PARTITION = object()
+
+
+def get_message_robot_id(message: Message) -> Optional[str]:
+    """
+    從訊息 payload 取得目標機器人 ID
+
+    支援 {"robot_id": ...} 與 MCP 格式 {"command": {"target": {"robot_id": ...}}}，
+    與 CommandProcessor._extract_robot_id 的解析規則一致。
+
+    Args:
+        message: 佇列訊息
+
+    Returns:
+        機器人 ID，找不到則返回 None
+    """
+    payload = message.payload or {}
+    if payload.get("robot_id"):
+        return payload["robot_id"]
+
+    command = payload.get("command")
+    if isinstance(command, dict):
+        target = command.get("target")
+        if isinstance(target, dict) and target.get("robot_id"):
+            return target["robot_id"]
+
+    return None
+
+
+def get_message_cost(message: Message) -> int:
+    """
+    估算訊息的執行成本（供 deficit round-robin 使用）
+
+    以 payload 中的動作數量作為成本，無法判斷時視為 1。
+
+    Args:
+        message: 佇列訊息
+
+    Returns:
+        成本（至少為 1）
+    """
+    payload = message.payload or {}
+    for key in ("actions", "base_commands"):
+        items = payload.get(key)
+        if isinstance(items, list) and items:
+            return len(items)
+    return 1
+
+
+@dataclass
+class DeadLetterEntry:
+    """死信佇列項目"""
+    message: Message
+    reason: str
+    dead_lettered_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為字典"""
+        return {
+            "message": self.message.to_dict(),
+            "reason": self.reason,
+            "dead_lettered_at": self.dead_lettered_at.isoformat(),
+        }
+
+
+class _RobotPartitions:
+    """
+    單一優先權層級內的機器人分區
+
+    每個 robot_id 一個子佇列，並以輪替環（ring）記錄仍有待處理訊息的機器人。
+    沒有 robot_id 的訊息共用 None 分區，不受「每台機器人同時只處理一則」的限制。
+    """
+
+    def __init__(self):
+        self.queues: Dict[Optional[Hashable], Deque[Message]] = {}
+        self.ring: Deque[Optional[Hashable]] = deque()
+        self.deficits: Dict[Optional[Hashable], int] = {}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, key: Optional[Hashable], message: Message, front: bool = False) -> None:
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.ring.append(key)
+            self.deficits[key] = 0
+        if front:
+            queue.appendleft(message)
+        else:
+            queue.append(message)
+        self.count += 1
+
+    def pop(self, key: Optional[Hashable]) -> Message:
+        queue = self.queues[key]
+        message = queue.popleft()
+        self.count -= 1
+        if not queue:
+            # 子佇列清空：移出輪替環並重設 deficit（標準 DRR 行為）
+            del self.queues[key]
+            del self.deficits[key]
+            self.ring.remove(key)
+        return message
+
+    def remove_ids(self, key: Optional[Hashable], ids: set) -> int:
+        """移除指定分區中 ID 在 ids 內的訊息，返回移除數量"""
+        queue = self.queues.get(key)
+        if not queue:
+            return 0
+        kept = deque(m for m in queue if m.id not in ids)
+        removed = len(queue) - len(kept)
+        if kept:
+            self.queues[key] = kept
+        else:
+            del self.queues[key]
+            del self.deficits[key]
+            self.ring.remove(key)
+        self.count -= removed
+        return removed
+
+    def clear(self) -> None:
+        self.queues.clear()
+        self.ring.clear()
+        self.deficits.clear()
+        self.count = 0
+
 
 class MemoryQueue(QueueInterface):
     """
@@ -24,40 +169,300 @@ class MemoryQueue(QueueInterface):
     - 非同步操作
     - 基本的等待與通知機制
 
+    分區模式（partition_by_robot=True）：
+    - 每個優先權層級內，依 robot_id 維護獨立子佇列
+    - 以 round-robin 或 deficit round-robin 輪流服務各機器人，
+      避免單一機器人的大量批次阻塞整個機隊
+    - 已有訊息處理中的機器人不會再被分派第二則訊息
+
+    失敗重送：
+    - nack(requeue=True) 的訊息依 retry_count 以指數退避（含 jitter）延遲重送，
+      避免毒訊息或無法連線的機器人形成忙碌迴圈
+    - 超過 max_retries 或 requeue=False 的訊息移入有界死信佇列，
+      可透過 get_dead_letters / replay_dead_letters / purge_dead_letters 檢視與重播
+
+    訊息期限：
+    - 設定 expires_at / deadline_ms 的訊息過期後不會再被取出
+    - dequeue 時惰性丟棄，另以到期時間堆積在各操作時主動清除，釋放佇列空間
+
     注意：此實作不支援分散式部署，僅適用於單機場景
     """
 
-    def __init__(self, max_size: Optional[int] = None):
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        partition_by_robot: bool = False,
+        scheduling: str = SCHEDULING_ROUND_ROBIN,
+        quantum: int = 1,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 30.0,
+        retry_jitter: float = 0.2,
+        dead_letter_max_size: int = 1000,
+    ):
         """
         初始化記憶體佇列
 
         Args:
             max_size: 最大佇列大小，None 表示無限制
+            partition_by_robot: 是否啟用每台機器人獨立子佇列的公平排程
+            scheduling: 分區排程策略（"round_robin" 或 "deficit_round_robin"）
+            quantum: deficit round-robin 每輪給予各機器人的額度（以動作數計）
+            retry_base_delay: 第一次重送的延遲（秒），0 表示立即重新入隊
+            retry_max_delay: 重送延遲上限（秒）
+            retry_jitter: 延遲隨機擾動比例（0~1），避免同時失敗的訊息同步重送
+            dead_letter_max_size: 死信佇列上限，超過時捨棄最舊項目
         """
+        if scheduling not in (SCHEDULING_ROUND_ROBIN, SCHEDULING_DEFICIT_ROUND_ROBIN):
+            raise ValueError(f"Unsupported scheduling: {scheduling}")
+        if quantum < 1:
+            raise ValueError("quantum must be >= 1")
+        if retry_base_delay < 0 or retry_max_delay < 0:
+            raise ValueError("retry delays must be >= 0")
+        if not 0 <= retry_jitter <= 1:
+            raise ValueError("retry_jitter must be between 0 and 1")
+
         self.max_size = max_size
+        self.partition_by_robot = partition_by_robot
+        self.scheduling = scheduling
+        self.quantum = quantum
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retry_jitter = retry_jitter
+        self.dead_letter_max_size = dead_letter_max_size
         self._queues = {
-            MessagePriority.URGENT: deque(),
-            MessagePriority.HIGH: deque(),
-            MessagePriority.NORMAL: deque(),
-            MessagePriority.LOW: deque(),
+            priority: _RobotPartitions() if partition_by_robot else deque()
+            for priority in _PRIORITY_ORDER
         }
         self._in_flight: Dict[str, Message] = {}  # 處理中的訊息
+        self._busy_robots: Dict[Hashable, str] = {}  # robot_id -> 處理中的訊息 ID
+        self._delayed: List[Tuple[float, int, Message]] = []  # (到期時間, 序號, 訊息) 的最小堆積
+        self._delayed_seq = itertools.count()
+        self._dead_letters: Deque[DeadLetterEntry] = deque(maxlen=dead_letter_max_size)
+        self._expiring: Dict[str, Message] = {}  # 待處理且有期限的訊息
+        self._expiry_heap: List[Tuple[float, int, str]] = []  # (過期 epoch 秒, 序號, 訊息 ID)
         self._event = asyncio.Event()  # 用於等待新訊息
         self._lock = asyncio.Lock()  # 用於同步存取
         self._total_enqueued = 0
         self._total_dequeued = 0
         self._total_acked = 0
         self._total_nacked = 0
+        self._total_retried = 0
+        self._total_dead_lettered = 0
+        self._total_dead_letters_evicted = 0
+        self._total_expired = 0
 
         logger.info("MemoryQueue initialized", extra={
             "max_size": max_size,
+            "partition_by_robot": partition_by_robot,
+            "scheduling": scheduling if partition_by_robot else None,
+            "service": "robot_service.queue"
+        })
+
+    def _push(self, message: Message, front: bool = False) -> None:
+        """將訊息放入對應的優先權佇列（呼叫端需持有鎖）"""
+        queue = self._queues[message.priority]
+        if self.partition_by_robot:
+            queue.append(get_message_robot_id(message), message, front=front)
+        elif front:
+            queue.appendleft(message)
+        else:
+            queue.append(message)
+
+    def _select_partition(self, partitions: _RobotPartitions, consume: bool) -> Any:
+        """
+        在單一優先權層級內挑選下一個可服務的機器人分區（呼叫端需持有鎖）
+
+        Args:
+            partitions: 該層級的分區
+            consume: 是否推進輪替位置並扣除 deficit（peek 時為 False）
+
+        Returns:
+            分區 key；若所有分區的機器人皆忙碌則返回 _NO_PARTITION
+        """
+        ring = partitions.ring
+        eligible = [
+            key for key in ring
+            if key is None or key not in self._busy_robots
+        ]
+        if not eligible:
+            return _NO_PARTITION
+
+        if self.scheduling == SCHEDULING_ROUND_ROBIN:
+            key = eligible[0]
+            if consume:
+                # 將選中的分區移到環尾，下一次從其後的機器人開始
+                ring.remove(key)
+                ring.append(key)
+            return key
+
+        # Deficit round-robin：依環的順序，找出最少需再補幾輪額度即可負擔
+        # 隊首訊息成本的分區，並一次補足，避免逐輪空轉
+        deficits = partitions.deficits
+
+        def rounds_needed(k):
+            shortfall = get_message_cost(partitions.queues[k][0]) - deficits[k]
+            return max(0, -(-shortfall // self.quantum))
+
+        key = min(eligible, key=rounds_needed)
+        rounds = rounds_needed(key)
+        if not consume:
+            return key
+
+        if rounds:
+            for k in eligible:
+                deficits[k] += rounds * self.quantum
+        deficits[key] -= get_message_cost(partitions.queues[key][0])
+        ring.remove(key)
+        ring.append(key)
+        return key
+
+    def _pop_next(self) -> Optional[Message]:
+        """依優先權與排程策略取出下一則訊息（呼叫端需持有鎖）"""
+        for priority in _PRIORITY_ORDER:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            if not self.partition_by_robot:
+                return queue.popleft()
+            key = self._select_partition(queue, consume=True)
+            if key is not _NO_PARTITION:
+                return queue.pop(key)
+        return None
+
+    def _peek_next(self) -> Optional[Message]:
+        """查看下一則將被取出的訊息（呼叫端需持有鎖）"""
+        for priority in _PRIORITY_ORDER:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            if not self.partition_by_robot:
+                return queue[0]
+            key = self._select_partition(queue, consume=False)
+            if key is not _NO_PARTITION:
+                return queue.queues[key][0]
+        return None
+
+    def _pending_count(self) -> int:
+        """待處理訊息數（含等待重送者，呼叫端需持有鎖）"""
+        return sum(len(q) for q in self._queues.values()) + len(self._delayed)
+
+    def _retry_delay(self, retry_count: int) -> float:
+        """計算第 retry_count 次重送的退避延遲（秒）"""
+        if self.retry_base_delay <= 0:
+            return 0.0
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** max(0, retry_count - 1)))
+        if self.retry_jitter:
+            delay *= random.uniform(1 - self.retry_jitter, 1 + self.retry_jitter)  # nosec B311
+        return delay
+
+    def _promote_due_messages(self) -> None:
+        """將已到期的延遲重送訊息移回就緒佇列（呼叫端需持有鎖）"""
+        if not self._delayed:
+            return
+        now = asyncio.get_event_loop().time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, message = heapq.heappop(self._delayed)
+            # 分區模式下放回該機器人子佇列的隊首並解除保留，維持單一機器人的指令順序
+            self._push(message, front=self.partition_by_robot)
+            self._release_robot(message)
+
+    def _track_expiry(self, message: Message) -> None:
+        """登記待處理訊息的過期時間（呼叫端需持有鎖）"""
+        expires_at = message.effective_expires_at
+        if expires_at is None:
+            return
+        self._expiring[message.id] = message
+        heapq.heappush(self._expiry_heap, (expires_at.timestamp(), next(self._delayed_seq), message.id))
+
+    def _sweep_expired(self) -> int:
+        """
+        主動清除已過期的待處理訊息（呼叫端需持有鎖）
+
+        只檢查到期時間堆積的頂端，沒有訊息到期時為 O(1)。
+
+        Returns:
+            清除的訊息數
+        """
+        heap = self._expiry_heap
+        now = time.time()
+        if not heap or heap[0][0] > now:
+            return 0
+
+        expired: Dict[str, Message] = {}
+        while heap and heap[0][0] <= now:
+            _, _, message_id = heapq.heappop(heap)
+            # 已被取出或重複登記的項目不在 _expiring 中，直接略過
+            message = self._expiring.pop(message_id, None)
+            if message is not None:
+                expired[message_id] = message
+
+        if not expired:
+            return 0
+
+        ids = set(expired)
+        for priority in _PRIORITY_ORDER:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            if self.partition_by_robot:
+                keys = {get_message_robot_id(m) for m in expired.values() if m.priority == priority}
+                for key in keys:
+                    queue.remove_ids(key, ids)
+            elif any(m.priority == priority for m in expired.values()):
+                self._queues[priority] = deque(m for m in queue if m.id not in ids)
+
+        if self._delayed and any(entry[2].id in ids for entry in self._delayed):
+            kept = []
+            for entry in self._delayed:
+                if entry[2].id in ids:
+                    self._release_robot(entry[2])
+                else:
+                    kept.append(entry)
+            heapq.heapify(kept)
+            self._delayed = kept
+
+        self._total_expired += len(expired)
+
+        logger.info("Expired messages swept", extra={
+            "count": len(expired),
             "service": "robot_service.queue"
         })
 
+        return len(expired)
+
+    def _dead_letter(self, message: Message, reason: str) -> None:
+        """將訊息移入死信佇列（呼叫端需持有鎖）"""
+        if self.dead_letter_max_size <= 0:
+            return
+        if len(self._dead_letters) >= self.dead_letter_max_size:
+            self._total_dead_letters_evicted += 1
+        self._dead_letters.append(DeadLetterEntry(message=message, reason=reason))
+        self._total_dead_lettered += 1
+
+    def _release_robot(self, message: Message) -> None:
+        """解除機器人的處理中標記（呼叫端需持有鎖）"""
+        if not self.partition_by_robot:
+            return
+        robot_id = get_message_robot_id(message)
+        if robot_id is not None and self._busy_robots.get(robot_id) == message.id:
+            del self._busy_robots[robot_id]
+            # 該機器人可能仍有待處理訊息，喚醒等待中的 dequeue
+            self._event.set()
+
     async def enqueue(self, message: Message) -> bool:
         """將訊息加入佇列"""
         async with self._lock:
-            current_size = sum(len(q) for q in self._queues.values())
+            if message.is_expired():
+                self._total_expired += 1
+                logger.warning("Message already expired, rejecting", extra={
+                    "message_id": message.id,
+                    "expires_at": message.effective_expires_at.isoformat(),
+                    "service": "robot_service.queue"
+                })
+                return False
+
+            self._sweep_expired()
+            current_size = self._pending_count()
 
             if self.max_size and current_size >= self.max_size:
                 logger.warning("Queue full, rejecting message", extra={
@@ -68,7 +473,8 @@ class MemoryQueue(QueueInterface):
                 })
                 return False
 
-            self._queues[message.priority].append(message)
+            self._push(message)
+            self._track_expiry(message)
             self._total_enqueued += 1
 
             logger.info("Message enqueued", extra={
@@ -92,58 +498,83 @@ class MemoryQueue(QueueInterface):
 
         while True:
             async with self._lock:
-                # 依優先權順序檢查佇列
-                for priority in [MessagePriority.URGENT, MessagePriority.HIGH,
-                                 MessagePriority.NORMAL, MessagePriority.LOW]:
-                    queue = self._queues[priority]
-                    if queue:
-                        message = queue.popleft()
-                        self._in_flight[message.id] = message
-                        self._total_dequeued += 1
-
-                        # 清除事件，準備下次等待
-                        self._event.clear()
-
-                        logger.info("Message dequeued", extra={
-                            "message_id": message.id,
-                            "priority": priority.name,
-                            "trace_id": message.trace_id,
-                            "service": "robot_service.queue"
-                        })
-
-                        return message
+                self._sweep_expired()
+                self._promote_due_messages()
+
+                # 依優先權順序（分區模式下再依機器人輪替）取出
+                message = self._pop_next()
+                while message is not None and message.is_expired():
+                    # 惰性丟棄：在堆積清除前就已過期的訊息
+                    self._expiring.pop(message.id, None)
+                    self._total_expired += 1
+                    logger.info("Expired message dropped at dequeue", extra={
+                        "message_id": message.id,
+                        "trace_id": message.trace_id,
+                        "service": "robot_service.queue"
+                    })
+                    message = self._pop_next()
+
+                if message is not None:
+                    self._expiring.pop(message.id, None)
+                    self._in_flight[message.id] = message
+                    self._total_dequeued += 1
+
+                    if self.partition_by_robot:
+                        robot_id = get_message_robot_id(message)
+                        if robot_id is not None:
+                            self._busy_robots[robot_id] = message.id
+
+                    # 清除事件，準備下次等待
+                    self._event.clear()
+
+                    logger.info("Message dequeued", extra={
+                        "message_id": message.id,
+                        "priority": message.priority.name,
+                        "trace_id": message.trace_id,
+                        "service": "robot_service.queue"
+                    })
+
+                    return message
+
+                # 沒有可取出的訊息（佇列為空或所有機器人皆忙碌），清除事件後等待
+                self._event.clear()
+                next_due = self._delayed[0][0] if self._delayed else None
 
             # 佇列為空，檢查是否需要等待
             if timeout == 0:
                 return None
 
+            now = asyncio.get_event_loop().time()
+            wait: Optional[float] = None
             if deadline is not None:
-                remaining = deadline - asyncio.get_event_loop().time()
-                if remaining <= 0:
-                    return None
-                try:
-                    await asyncio.wait_for(self._event.wait(), timeout=remaining)
-                except asyncio.TimeoutError:
+                wait = deadline - now
+                if wait <= 0:
                     return None
-            else:
+            if next_due is not None:
+                # 最多等到下一則延遲訊息到期，再回頭檢查
+                until_due = max(0.0, next_due - now)
+                wait = until_due if wait is None else min(wait, until_due)
+
+            if wait is None:
                 # 無逾時，永久等待
                 await self._event.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    continue
 
     async def peek(self) -> Optional[Message]:
         """查看佇列頭部訊息但不取出"""
         async with self._lock:
-            for priority in [MessagePriority.URGENT, MessagePriority.HIGH,
-                             MessagePriority.NORMAL, MessagePriority.LOW]:
-                queue = self._queues[priority]
-                if queue:
-                    return queue[0]
-            return None
+            return self._peek_next()
 
     async def ack(self, message_id: str) -> bool:
         """確認訊息已處理"""
         async with self._lock:
             if message_id in self._in_flight:
-                del self._in_flight[message_id]
+                message = self._in_flight.pop(message_id)
+                self._release_robot(message)
                 self._total_acked += 1
 
                 logger.info("Message acknowledged", extra={
@@ -169,26 +600,42 @@ class MemoryQueue(QueueInterface):
                 })
                 return False
 
-            message = self._in_flight[message_id]
-            del self._in_flight[message_id]
+            message = self._in_flight.pop(message_id)
             self._total_nacked += 1
 
             if requeue and message.retry_count < message.max_retries:
                 message.retry_count += 1
-                self._queues[message.priority].append(message)
+                self._total_retried += 1
+                delay = self._retry_delay(message.retry_count)
+
+                if delay > 0:
+                    # 退避期間保留該機器人（分區模式），避免後續指令超車
+                    due = asyncio.get_event_loop().time() + delay
+                    heapq.heappush(self._delayed, (due, next(self._delayed_seq), message))
+                else:
+                    # 分區模式下重新放回該機器人子佇列的隊首，維持單一機器人的指令順序
+                    self._push(message, front=self.partition_by_robot)
+                    self._release_robot(message)
+                self._track_expiry(message)
 
                 logger.info("Message nacked and requeued", extra={
                     "message_id": message_id,
                     "retry_count": message.retry_count,
                     "max_retries": message.max_retries,
+                    "retry_delay": delay,
                     "service": "robot_service.queue"
                 })
 
+                # 喚醒等待中的 dequeue，使其依新的到期時間重新計算等待
                 self._event.set()
-                self._event.clear()
             else:
-                logger.warning("Message nacked and dropped", extra={
+                self._release_robot(message)
+                reason = "rejected" if not requeue else "max_retries_exceeded"
+                self._dead_letter(message, reason)
+
+                logger.warning("Message nacked and dead-lettered", extra={
                     "message_id": message_id,
+                    "reason": reason,
                     "retry_count": message.retry_count,
                     "max_retries": message.max_retries,
                     "service": "robot_service.queue"
@@ -197,9 +644,20 @@ class MemoryQueue(QueueInterface):
             return True
 
     async def size(self) -> int:
-        """取得佇列大小"""
+        """取得佇列大小（含等待重送的訊息）"""
         async with self._lock:
-            return sum(len(q) for q in self._queues.values())
+            self._sweep_expired()
+            return self._pending_count()
+
+    async def purge_expired(self) -> int:
+        """
+        主動清除已過期的待處理訊息
+
+        Returns:
+            清除的訊息數
+        """
+        async with self._lock:
+            return self._sweep_expired()
 
     async def clear(self) -> None:
         """清空佇列"""
@@ -207,6 +665,10 @@ class MemoryQueue(QueueInterface):
             for queue in self._queues.values():
                 queue.clear()
             self._in_flight.clear()
+            self._busy_robots.clear()
+            self._delayed.clear()
+            self._expiring.clear()
+            self._expiry_heap.clear()
 
             logger.info("Queue cleared", extra={
                 "service": "robot_service.queue"
@@ -215,23 +677,136 @@ class MemoryQueue(QueueInterface):
     async def health_check(self) -> Dict[str, Any]:
         """健康檢查"""
         async with self._lock:
+            self._sweep_expired()
             queue_sizes = {
                 priority.name: len(queue)
                 for priority, queue in self._queues.items()
             }
 
-            return {
+            health = {
                 "status": "healthy",
                 "type": "memory",
                 "queue_sizes": queue_sizes,
                 "in_flight_count": len(self._in_flight),
                 "total_size": sum(queue_sizes.values()),
                 "max_size": self.max_size,
+                "partition_by_robot": self.partition_by_robot,
+                "delayed_count": len(self._delayed),
+                "dead_letter_count": len(self._dead_letters),
                 "statistics": {
                     "total_enqueued": self._total_enqueued,
                     "total_dequeued": self._total_dequeued,
                     "total_acked": self._total_acked,
                     "total_nacked": self._total_nacked,
+                    "total_retried": self._total_retried,
+                    "total_dead_lettered": self._total_dead_lettered,
+                    "total_dead_letters_evicted": self._total_dead_letters_evicted,
+                    "total_expired": self._total_expired,
                 },
                 "timestamp": datetime.now(timezone.utc).isoformat(),
             }
+
+            if self.partition_by_robot:
+                pending_robots = set()
+                for partitions in self._queues.values():
+                    pending_robots.update(partitions.queues.keys())
+                health["scheduling"] = self.scheduling
+                health["pending_robot_count"] = len(pending_robots)
+                health["busy_robot_count"] = len(self._busy_robots)
+
+            return health
+
+    async def get_dead_letters(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        檢視死信佇列（由舊到新）
+
+        Args:
+            limit: 最多返回筆數，None 表示全部
+
+        Returns:
+            死信項目列表
+        """
+        async with self._lock:
+            entries = list(self._dead_letters)
+        if limit is not None:
+            entries = entries[:limit]
+        return [entry.to_dict() for entry in entries]
+
+    async def replay_dead_letters(
+        self,
+        message_ids: Optional[Iterable[str]] = None,
+        reset_retries: bool = True,
+    ) -> int:
+        """
+        將死信重新放回佇列
+
+        Args:
+            message_ids: 要重播的訊息 ID，None 表示全部
+            reset_retries: 是否將 retry_count 歸零
+
+        Returns:
+            實際重播的訊息數（佇列已滿時會提前停止）
+        """
+        wanted = set(message_ids) if message_ids is not None else None
+        replayed = 0
+
+        async with self._lock:
+            remaining: Deque[DeadLetterEntry] = deque(maxlen=self.dead_letter_max_size)
+            for entry in self._dead_letters:
+                if wanted is not None and entry.message.id not in wanted:
+                    remaining.append(entry)
+                    continue
+                if self.max_size and self._pending_count() >= self.max_size:
+                    remaining.append(entry)
+                    continue
+
+                if entry.message.is_expired():
+                    # 已過期的死信不再重播
+                    remaining.append(entry)
+                    continue
+
+                if reset_retries:
+                    entry.message.retry_count = 0
+                self._push(entry.message)
+                self._track_expiry(entry.message)
+                self._total_enqueued += 1
+                replayed += 1
+
+            self._dead_letters = remaining
+            if replayed:
+                self._event.set()
+
+        logger.info("Dead letters replayed", extra={
+            "replayed": replayed,
+            "remaining": len(remaining),
+            "service": "robot_service.queue"
+        })
+        return replayed
+
+    async def purge_dead_letters(self, message_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        刪除死信
+
+        Args:
+            message_ids: 要刪除的訊息 ID，None 表示全部
+
+        Returns:
+            刪除的項目數
+        """
+        async with self._lock:
+            before = len(self._dead_letters)
+            if message_ids is None:
+                self._dead_letters.clear()
+            else:
+                wanted = set(message_ids)
+                self._dead_letters = deque(
+                    (e for e in self._dead_letters if e.message.id not in wanted),
+                    maxlen=self.dead_letter_max_size,
+                )
+            purged = before - len(self._dead_letters)
+
+        logger.info("Dead letters purged", extra={
+            "purged": purged,
+            "service": "robot_service.queue"
+        })
+        return purged
@@ -10,18 +10,29 @@ Offline Buffer
 """
 
 import asyncio
+import heapq
 import json
 import logging
 import sqlite3
 import threading
 from contextlib import contextmanager
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Any, Callable, Coroutine, Dict, List, Optional
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
 
 from src.common.datetime_utils import utc_now  # noqa: E402
+from .coalescing import (  # noqa: E402
+    RULE_DEDUP,
+    RULE_LAST_WRITE_WINS,
+    RULE_STOP_SUPERSEDES_MOTION,
+    CoalescingRules,
+    get_message_actions,
+    get_message_command_type,
+    get_message_content_hash,
+)
 from .interface import Message  # noqa: E402
+from .memory_queue import get_message_robot_id  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
@@ -86,9 +97,10 @@ class OfflineBuffer:
     功能：
     - 離線時將指令持久化到 SQLite
     - 支援指令優先權
-    - 自動過期清理
-    - 重連後自動發送緩衝指令
+    - 自動過期清理（發送前惰性丟棄，並以到期時間堆積主動清除）
+    - 重連後自動發送緩衝指令（不同機器人的指令並行發送，同一機器人維持順序）
     - 發送失敗重試
+    - 可選的指令合併與去重（見 CoalescingRules）
     """
 
     def __init__(
@@ -99,6 +111,8 @@ class OfflineBuffer:
         max_retry_count: int = 3,
         retry_delay_seconds: float = 5.0,
         send_batch_size: int = 10,
+        send_concurrency: int = 4,
+        coalescing: Optional[CoalescingRules] = None,
     ):
         """
         初始化離線緩衝器
@@ -110,13 +124,23 @@ class OfflineBuffer:
             max_retry_count: 最大重試次數
             retry_delay_seconds: 重試延遲（秒）
             send_batch_size: 批次發送數量
+            send_concurrency: 同時發送的機器人數上限（同一機器人的指令依序發送）
+            coalescing: 指令合併規則，None 表示不合併
+
+        Raises:
+            ValueError: send_concurrency 小於 1
         """
+        if send_concurrency < 1:
+            raise ValueError("send_concurrency must be >= 1")
+
         self._db_path = db_path or ":memory:"
         self._max_size = max_size
         self._default_ttl_seconds = default_ttl_seconds
         self._max_retry_count = max_retry_count
         self._retry_delay_seconds = retry_delay_seconds
         self._send_batch_size = send_batch_size
+        self._send_concurrency = send_concurrency
+        self._coalescing = coalescing if coalescing and coalescing.enabled else None
 
         self._lock = threading.RLock()
         self._running = False
@@ -133,14 +157,28 @@ class OfflineBuffer:
         self._total_sent = 0
         self._total_failed = 0
         self._total_expired = 0
+        self._coalesced_by_rule: Dict[str, int] = {
+            RULE_LAST_WRITE_WINS: 0,
+            RULE_DEDUP: 0,
+            RULE_STOP_SUPERSEDES_MOTION: 0,
+        }
+
+        # 待發送條目的過期時間（epoch 秒）最小堆積，用於判斷是否需要清除
+        self._expiry_heap: List[float] = []
 
         # 初始化資料庫
         self._init_db()
+        self._seed_expiry_heap()
+
+        # 待發送條目數量（記憶體維護，避免每次 COUNT(*)）
+        self._pending_count = self._count_pending()
 
         logger.info("OfflineBuffer initialized", extra={
             "db_path": self._db_path,
             "max_size": max_size,
             "default_ttl_seconds": default_ttl_seconds,
+            "send_concurrency": send_concurrency,
+            "coalescing": self._coalescing is not None,
             "service": "offline_buffer"
         })
 
@@ -158,9 +196,23 @@ class OfflineBuffer:
                     updated_at TEXT NOT NULL,
                     retry_count INTEGER DEFAULT 0,
                     last_error TEXT,
-                    expires_at TEXT
+                    expires_at TEXT,
+                    robot_id TEXT,
+                    command_type TEXT,
+                    content_hash TEXT,
+                    is_motion INTEGER DEFAULT 0
                 )
             """)
+            # 舊版資料庫補上合併規則使用的欄位
+            columns = {row["name"] for row in cursor.execute("PRAGMA table_info(offline_buffer)")}
+            for column, definition in (
+                ("robot_id", "TEXT"),
+                ("command_type", "TEXT"),
+                ("content_hash", "TEXT"),
+                ("is_motion", "INTEGER DEFAULT 0"),
+            ):
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE offline_buffer ADD COLUMN {column} {definition}")
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_status
                 ON offline_buffer (status)
@@ -173,8 +225,48 @@ class OfflineBuffer:
                 CREATE INDEX IF NOT EXISTS idx_expires_at
                 ON offline_buffer (expires_at)
             """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_robot_command_type
+                ON offline_buffer (robot_id, command_type)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_content_hash
+                ON offline_buffer (content_hash)
+            """)
+            # 程序上次中斷時可能留下 SENDING 狀態的條目；重置為 PENDING 以允許重送
+            cursor.execute(
+                "UPDATE offline_buffer SET status = ? WHERE status = ?",
+                (BufferEntryStatus.PENDING.value, BufferEntryStatus.SENDING.value),
+            )
             conn.commit()
 
+    def _count_pending(self) -> int:
+        """從資料庫計算待發送條目數"""
+        with self._lock:
+            with self._get_connection() as conn:
+                row = conn.execute(
+                    "SELECT COUNT(*) AS count FROM offline_buffer WHERE status = ?",
+                    (BufferEntryStatus.PENDING.value,),
+                ).fetchone()
+                return row["count"] if row else 0
+
+    def _seed_expiry_heap(self) -> None:
+        """以資料庫中最早的過期時間補充堆積（重啟後或清除後使用）"""
+        try:
+            with self._lock:
+                with self._get_connection() as conn:
+                    row = conn.execute(
+                        "SELECT MIN(expires_at) AS next_expiry FROM offline_buffer WHERE expires_at IS NOT NULL"
+                    ).fetchone()
+                if row and row["next_expiry"]:
+                    next_expiry = datetime.fromisoformat(row["next_expiry"]).timestamp()
+                    heapq.heappush(self._expiry_heap, next_expiry)
+        except Exception as e:
+            logger.error("Failed to seed expiry heap", extra={
+                "error": str(e),
+                "service": "offline_buffer"
+            })
+
     @contextmanager
     def _get_connection(self):
         """取得資料庫連線"""
@@ -271,13 +363,11 @@ class OfflineBuffer:
         Returns:
             是否成功緩衝
         """
-        # 檢查緩衝區大小
-        current_size = await self.size()
-        if current_size >= self._max_size:
-            logger.warning("Buffer full, rejecting message", extra={
+        if message.is_expired():
+            self._total_expired += 1
+            logger.warning("Message already expired, not buffering", extra={
                 "message_id": message.id,
-                "current_size": current_size,
-                "max_size": self._max_size,
+                "trace_id": message.trace_id,
                 "service": "offline_buffer"
             })
             return False
@@ -286,6 +376,13 @@ class OfflineBuffer:
         ttl = ttl_seconds if ttl_seconds is not None else self._default_ttl_seconds
         expires_at = now + timedelta(seconds=ttl) if ttl > 0 else None
 
+        # 訊息本身的期限（expires_at / deadline_ms）較早時以其為準
+        message_expires_at = message.effective_expires_at
+        if message_expires_at is not None:
+            message_expires_at = message_expires_at.astimezone(timezone.utc)
+            if expires_at is None or message_expires_at < expires_at:
+                expires_at = message_expires_at
+
         entry = BufferEntry(
             id=message.id,
             message=message,
@@ -295,17 +392,65 @@ class OfflineBuffer:
             expires_at=expires_at,
         )
 
+        robot_id = get_message_robot_id(message)
+        command_type = get_message_command_type(message)
+        actions = get_message_actions(message)
+        content_hash = None
+        is_motion = False
+        if self._coalescing:
+            content_hash = get_message_content_hash(message, self._coalescing.dedup_ignore_keys)
+            is_motion = self._coalescing.is_motion(actions)
+
         try:
             message_json = json.dumps(message.to_dict(), ensure_ascii=False)
 
             with self._lock:
                 with self._get_connection() as conn:
                     cursor = conn.cursor()
+
+                    if self._coalescing and self._is_duplicate(cursor, entry.id, content_hash, now):
+                        # 時間窗內已有相同內容的待發送指令，視為已緩衝
+                        self._coalesced_by_rule[RULE_DEDUP] += 1
+                        logger.info("Duplicate message coalesced", extra={
+                            "message_id": message.id,
+                            "trace_id": message.trace_id,
+                            "service": "offline_buffer"
+                        })
+                        return True
+
+                    # 相同 ID 的待發送條目會被取代，不重複計數
+                    cursor.execute(
+                        "SELECT status FROM offline_buffer WHERE id = ?", (entry.id,)
+                    )
+                    existing = cursor.fetchone()
+                    replaces_pending = (
+                        existing is not None and existing["status"] == BufferEntryStatus.PENDING.value
+                    )
+
+                    superseded = {}
+                    if self._coalescing and robot_id is not None:
+                        superseded = self._remove_superseded(
+                            cursor, entry.id, robot_id, command_type, actions
+                        )
+                    removed = sum(superseded.values())
+
+                    current_size = self._pending_count - removed
+                    if not replaces_pending and current_size >= self._max_size:
+                        conn.rollback()
+                        logger.warning("Buffer full, rejecting message", extra={
+                            "message_id": message.id,
+                            "current_size": current_size,
+                            "max_size": self._max_size,
+                            "service": "offline_buffer"
+                        })
+                        return False
+
                     cursor.execute("""
                         INSERT OR REPLACE INTO offline_buffer
                         (id, message_json, priority, status, created_at, updated_at,
-                         retry_count, last_error, expires_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         retry_count, last_error, expires_at,
+                         robot_id, command_type, content_hash, is_motion)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """, (
                         entry.id,
                         message_json,
@@ -316,9 +461,21 @@ class OfflineBuffer:
                         entry.retry_count,
                         entry.last_error,
                         entry.expires_at.isoformat() if entry.expires_at else None,
+                        robot_id,
+                        command_type,
+                        content_hash,
+                        1 if is_motion else 0,
                     ))
                     conn.commit()
 
+                self._pending_count -= removed
+                if not replaces_pending:
+                    self._pending_count += 1
+                for rule, count in superseded.items():
+                    self._coalesced_by_rule[rule] += count
+                if entry.expires_at is not None:
+                    heapq.heappush(self._expiry_heap, entry.expires_at.timestamp())
+
             self._total_buffered += 1
 
             logger.info("Message buffered", extra={
@@ -339,10 +496,82 @@ class OfflineBuffer:
             })
             return False
 
+    def _is_duplicate(
+        self,
+        cursor: sqlite3.Cursor,
+        entry_id: str,
+        content_hash: str,
+        now: datetime,
+    ) -> bool:
+        """時間窗內是否已有相同內容的待發送指令"""
+        window = self._coalescing.dedup_window_seconds
+        if window <= 0:
+            return False
+
+        cursor.execute("""
+            SELECT 1 FROM offline_buffer
+            WHERE content_hash = ? AND status = ? AND id != ? AND created_at >= ?
+            LIMIT 1
+        """, (
+            content_hash,
+            BufferEntryStatus.PENDING.value,
+            entry_id,
+            (now - timedelta(seconds=window)).isoformat(),
+        ))
+        return cursor.fetchone() is not None
+
+    def _remove_superseded(
+        self,
+        cursor: sqlite3.Cursor,
+        entry_id: str,
+        robot_id: str,
+        command_type: Optional[str],
+        actions: List[str],
+    ) -> Dict[str, int]:
+        """
+        刪除被新指令取代的待發送指令（在呼叫端的交易中執行）
+
+        Returns:
+            各規則刪除的條目數
+        """
+        rules = self._coalescing
+        removed: Dict[str, int] = {}
+        pending = BufferEntryStatus.PENDING.value
+
+        if rules.stop_supersedes_motion and rules.is_stop(actions):
+            cursor.execute("""
+                DELETE FROM offline_buffer
+                WHERE robot_id = ? AND status = ? AND is_motion = 1 AND id != ?
+            """, (robot_id, pending, entry_id))
+            if cursor.rowcount > 0:
+                removed[RULE_STOP_SUPERSEDES_MOTION] = cursor.rowcount
+
+        if command_type is not None and command_type in rules.last_write_wins_types:
+            cursor.execute("""
+                DELETE FROM offline_buffer
+                WHERE robot_id = ? AND command_type = ? AND status = ? AND id != ?
+            """, (robot_id, command_type, pending, entry_id))
+            if cursor.rowcount > 0:
+                removed[RULE_LAST_WRITE_WINS] = cursor.rowcount
+
+        if removed:
+            logger.info("Superseded buffered messages removed", extra={
+                "robot_id": robot_id,
+                "command_type": command_type,
+                "removed": removed,
+                "service": "offline_buffer"
+            })
+
+        return removed
+
     async def flush(self) -> Dict[str, Any]:
         """
         發送所有緩衝的指令
 
+        每批條目依機器人分組：不同機器人並行發送（上限 send_concurrency），
+        同一機器人依序發送，遇到失敗即停止該機器人後續條目以維持順序。
+        每批的狀態轉換各以單一交易寫入。
+
         Returns:
             發送結果統計
         """
@@ -363,24 +592,28 @@ class OfflineBuffer:
 
         sent_count = 0
         failed_count = 0
-        remaining = await self.size()
 
-        while remaining > 0 and self._is_online:
+        while self._pending_count > 0 and self._is_online:
             entries = await self._get_pending_entries(self._send_batch_size)
             if not entries:
                 break
 
-            for entry in entries:
-                if not self._is_online:
-                    break
+            try:
+                entries = self._begin_batch(entries)
+                if not entries:
+                    continue
+                batch_sent, batch_failed = await self._send_batch(entries)
+            except Exception as e:
+                logger.error("Failed to flush batch", extra={
+                    "error": str(e),
+                    "service": "offline_buffer"
+                })
+                break
 
-                success = await self._send_entry(entry)
-                if success:
-                    sent_count += 1
-                else:
-                    failed_count += 1
+            sent_count += batch_sent
+            failed_count += batch_failed
 
-            remaining = await self.size()
+        remaining = self._pending_count
 
         result = {
             "sent": sent_count,
@@ -446,139 +679,167 @@ class OfflineBuffer:
 
         return entries
 
-    async def _send_entry(self, entry: BufferEntry) -> bool:
-        """發送單個條目"""
-        # 更新狀態為發送中
-        await self._update_entry_status(entry.id, BufferEntryStatus.SENDING)
+    def _begin_batch(self, entries: List[BufferEntry]) -> List[BufferEntry]:
+        """
+        在單一交易中將批次標記為 SENDING，並刪除查詢後才到期的條目
 
-        try:
-            success = await self._send_handler(entry.message)
+        Returns:
+            需要發送的條目
+        """
+        now = utc_now()
+        live = [e for e in entries if e.expires_at is None or e.expires_at > now]
+        expired_ids = [(e.id,) for e in entries if e.expires_at is not None and e.expires_at <= now]
 
-            if success:
-                # 發送成功，移除條目
-                await self._remove_entry(entry.id)
-                self._total_sent += 1
+        with self._lock:
+            with self._get_connection() as conn:
+                try:
+                    conn.executemany(
+                        "DELETE FROM offline_buffer WHERE id = ?", expired_ids
+                    )
+                    conn.executemany(
+                        "UPDATE offline_buffer SET status = ?, updated_at = ? WHERE id = ?",
+                        [(BufferEntryStatus.SENDING.value, now.isoformat(), e.id) for e in live],
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            self._pending_count -= len(entries)
+
+        if expired_ids:
+            # 惰性丟棄：查詢後才到期的條目不再發送
+            self._total_expired += len(expired_ids)
+            logger.info("Buffered messages expired before send", extra={
+                "count": len(expired_ids),
+                "service": "offline_buffer"
+            })
 
-                logger.info("Buffered message sent successfully", extra={
-                    "message_id": entry.message.id,
-                    "service": "offline_buffer"
-                })
+        return live
 
-                return True
-            else:
-                # 發送失敗，增加重試計數
-                entry.retry_count += 1
+    async def _send_batch(self, entries: List[BufferEntry]) -> Tuple[int, int]:
+        """
+        發送一批已標記為 SENDING 的條目並寫回結果
 
-                if entry.retry_count >= self._max_retry_count:
-                    await self._update_entry_status(
-                        entry.id,
-                        BufferEntryStatus.FAILED,
-                        error="Max retries exceeded",
-                        retry_count=entry.retry_count,
-                    )
-                    self._total_failed += 1
+        Returns:
+            (成功數, 失敗數)
+        """
+        lanes: Dict[Optional[str], List[BufferEntry]] = {}
+        for entry in entries:
+            lanes.setdefault(get_message_robot_id(entry.message), []).append(entry)
+
+        semaphore = asyncio.Semaphore(self._send_concurrency)
+        sent: List[BufferEntry] = []
+        retry: List[BufferEntry] = []
+        failed: List[BufferEntry] = []
+        unsent: List[BufferEntry] = []
+
+        async def run_lane(lane: List[BufferEntry]) -> None:
+            async with semaphore:
+                for index, entry in enumerate(lane):
+                    if not self._is_online:
+                        unsent.extend(lane[index:])
+                        return
+
+                    if await self._deliver(entry):
+                        sent.append(entry)
+                        continue
+
+                    entry.retry_count += 1
+                    if entry.retry_count >= self._max_retry_count:
+                        failed.append(entry)
+                    else:
+                        retry.append(entry)
+                    # 同一機器人的後續指令不可越過失敗的指令
+                    unsent.extend(lane[index + 1:])
+                    return
 
-                    logger.warning("Message send failed, max retries exceeded", extra={
-                        "message_id": entry.message.id,
-                        "retry_count": entry.retry_count,
-                        "service": "offline_buffer"
-                    })
-                else:
-                    await self._update_entry_status(
-                        entry.id,
-                        BufferEntryStatus.PENDING,
-                        error="Send returned false",
-                        retry_count=entry.retry_count,
-                    )
+        try:
+            await asyncio.gather(*(run_lane(lane) for lane in lanes.values()))
+        finally:
+            self._commit_batch(sent, retry, failed, unsent)
 
-                    logger.warning("Message send failed, will retry", extra={
-                        "message_id": entry.message.id,
-                        "retry_count": entry.retry_count,
-                        "max_retries": self._max_retry_count,
-                        "service": "offline_buffer"
-                    })
+        self._total_sent += len(sent)
+        self._total_failed += len(failed)
 
-                return False
+        return len(sent), len(retry) + len(failed)
 
+    async def _deliver(self, entry: BufferEntry) -> bool:
+        """呼叫發送處理器發送單一條目，失敗原因記錄於 entry.last_error"""
+        try:
+            success = await self._send_handler(entry.message)
         except Exception as e:
-            entry.retry_count += 1
-
-            if entry.retry_count >= self._max_retry_count:
-                await self._update_entry_status(
-                    entry.id,
-                    BufferEntryStatus.FAILED,
-                    error=str(e),
-                    retry_count=entry.retry_count,
-                )
-                self._total_failed += 1
-            else:
-                await self._update_entry_status(
-                    entry.id,
-                    BufferEntryStatus.PENDING,
-                    error=str(e),
-                    retry_count=entry.retry_count,
-                )
-
+            entry.last_error = str(e)
             logger.error("Error sending buffered message", extra={
                 "message_id": entry.message.id,
                 "error": str(e),
                 "retry_count": entry.retry_count,
                 "service": "offline_buffer"
             })
-
             return False
 
-    async def _update_entry_status(
-        self,
-        entry_id: str,
-        status: BufferEntryStatus,
-        error: Optional[str] = None,
-        retry_count: Optional[int] = None,
-    ) -> None:
-        """更新條目狀態"""
-        now = utc_now()
-
-        try:
-            with self._lock:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    if retry_count is not None:
-                        cursor.execute("""
-                            UPDATE offline_buffer
-                            SET status = ?, updated_at = ?, last_error = ?, retry_count = ?
-                            WHERE id = ?
-                        """, (status.value, now.isoformat(), error, retry_count, entry_id))
-                    else:
-                        cursor.execute("""
-                            UPDATE offline_buffer
-                            SET status = ?, updated_at = ?, last_error = ?
-                            WHERE id = ?
-                        """, (status.value, now.isoformat(), error, entry_id))
-                    conn.commit()
-
-        except Exception as e:
-            logger.error("Failed to update entry status", extra={
-                "entry_id": entry_id,
-                "error": str(e),
+        if success:
+            logger.info("Buffered message sent successfully", extra={
+                "message_id": entry.message.id,
                 "service": "offline_buffer"
             })
+            return True
 
-    async def _remove_entry(self, entry_id: str) -> None:
-        """移除條目"""
-        try:
-            with self._lock:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
+        entry.last_error = "Send returned false"
+        logger.warning("Message send failed", extra={
+            "message_id": entry.message.id,
+            "retry_count": entry.retry_count + 1,
+            "max_retries": self._max_retry_count,
+            "service": "offline_buffer"
+        })
+        return False
+
+    def _commit_batch(
+        self,
+        sent: List[BufferEntry],
+        retry: List[BufferEntry],
+        failed: List[BufferEntry],
+        unsent: List[BufferEntry],
+    ) -> None:
+        """在單一交易中寫回一批條目的發送結果"""
+        now = utc_now().isoformat()
+        pending = BufferEntryStatus.PENDING.value
+
+        with self._lock:
+            with self._get_connection() as conn:
+                try:
+                    conn.executemany(
                         "DELETE FROM offline_buffer WHERE id = ?",
-                        (entry_id,)
+                        [(e.id,) for e in sent],
                     )
+                    update_sql = """
+                        UPDATE offline_buffer
+                        SET status = ?, updated_at = ?, last_error = ?, retry_count = ?
+                        WHERE id = ?
+                    """
+                    retried = conn.executemany(
+                        update_sql,
+                        [(pending, now, e.last_error, e.retry_count, e.id) for e in retry],
+                    ).rowcount
+                    conn.executemany(
+                        update_sql,
+                        [(BufferEntryStatus.FAILED.value, now, "Max retries exceeded", e.retry_count, e.id)
+                         for e in failed],
+                    )
+                    restored = conn.executemany(
+                        "UPDATE offline_buffer SET status = ?, updated_at = ? WHERE id = ?",
+                        [(pending, now, e.id) for e in unsent],
+                    ).rowcount
                     conn.commit()
-
-        except Exception as e:
-            logger.error("Failed to remove entry", extra={
-                "entry_id": entry_id,
-                "error": str(e),
+                except Exception:
+                    conn.rollback()
+                    raise
+            # 以實際更新的列數計入：發送期間被 cleanup_expired 刪除的條目不再計入待發送數
+            self._pending_count += max(retried, 0) + max(restored, 0)
+
+        for entry in failed:
+            logger.warning("Message send failed, max retries exceeded", extra={
+                "message_id": entry.message.id,
+                "retry_count": entry.retry_count,
                 "service": "offline_buffer"
             })
 
@@ -586,15 +847,28 @@ class OfflineBuffer:
         """
         清理過期條目
 
+        先檢查到期時間堆積頂端，沒有條目到期時不會觸及資料庫。
+
         Returns:
             清理的條目數量
         """
         now = utc_now()
+        now_ts = now.timestamp()
 
         try:
             with self._lock:
+                if not self._expiry_heap or self._expiry_heap[0] > now_ts:
+                    return 0
+                while self._expiry_heap and self._expiry_heap[0] <= now_ts:
+                    heapq.heappop(self._expiry_heap)
+
                 with self._get_connection() as conn:
                     cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT COUNT(*) AS count FROM offline_buffer
+                        WHERE status = ? AND expires_at IS NOT NULL AND expires_at <= ?
+                    """, (BufferEntryStatus.PENDING.value, now.isoformat()))
+                    expired_pending = cursor.fetchone()["count"]
                     cursor.execute("""
                         DELETE FROM offline_buffer
                         WHERE expires_at IS NOT NULL AND expires_at <= ?
@@ -602,6 +876,11 @@ class OfflineBuffer:
                     conn.commit()
                     count = cursor.rowcount
 
+                self._pending_count -= expired_pending
+
+                # 補上資料庫中下一個到期時間（可能來自重啟前寫入的條目）
+                self._seed_expiry_heap()
+
             if count > 0:
                 self._total_expired += count
                 logger.info("Expired entries cleaned up", extra={
@@ -625,23 +904,7 @@ class OfflineBuffer:
         Returns:
             待發送條目數量
         """
-        try:
-            with self._lock:
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT COUNT(*) as count FROM offline_buffer
-                        WHERE status = ?
-                    """, (BufferEntryStatus.PENDING.value,))
-                    row = cursor.fetchone()
-                    return row["count"] if row else 0
-
-        except Exception as e:
-            logger.error("Failed to get buffer size", extra={
-                "error": str(e),
-                "service": "offline_buffer"
-            })
-            return 0
+        return self._pending_count
 
     async def clear(self) -> None:
         """清空緩衝區"""
@@ -651,6 +914,8 @@ class OfflineBuffer:
                     cursor = conn.cursor()
                     cursor.execute("DELETE FROM offline_buffer")
                     conn.commit()
+                self._expiry_heap.clear()
+                self._pending_count = 0
 
             logger.info("Buffer cleared", extra={
                 "service": "offline_buffer"
@@ -704,6 +969,8 @@ class OfflineBuffer:
             "total_sent": self._total_sent,
             "total_failed": self._total_failed,
             "total_expired": self._total_expired,
+            "total_coalesced": sum(self._coalesced_by_rule.values()),
+            "coalesced_by_rule": dict(self._coalesced_by_rule),
             "max_size": self._max_size,
             "is_online": self._is_online,
         }
@@ -39,13 +39,16 @@ Edge 可能使用網路佇列服務（Redis/RabbitMQ）連接到 Runner。
 
 import asyncio
 import logging
+import time
 from enum import Enum
 from typing import Any, Callable, Coroutine, Dict, Optional
 
-from src.common.network_monitor import NetworkMonitor, NetworkStatus  # noqa: E402
+from src.common.network_monitor import NetworkMonitor, NetworkStatus, get_network_monitor  # noqa: E402
 from src.common.shared_state import SharedStateManager  # noqa: E402
 from src.common.datetime_utils import utc_now  # noqa: E402
-from .interface import Message, MessagePriority  # noqa: E402
+from .interface import Message, MessagePriority, get_payload_deadline_ms  # noqa: E402
+from .coalescing import CoalescingRules  # noqa: E402
+from .drain_scheduler import DrainScheduler  # noqa: E402
 from .offline_buffer import OfflineBuffer  # noqa: E402
 from uuid import uuid4  # noqa: E402
 
@@ -82,7 +85,7 @@ class OfflineQueueService:
     1. **指令提交**：
        - 在線：指令直接發送到網路佇列服務
        - 離線：指令緩衝到本地 SQLite
-       - 恢復：自動將緩衝指令同步到網路佇列
+       - 恢復：自動將緩衝指令同步到網路佇列（隨機延遲後以自適應速率排空）
 
     2. **雲端同步**：
        - 在線：直接同步日誌/狀態到雲端
@@ -106,6 +109,11 @@ class OfflineQueueService:
         flush_batch_size: int = 50,
         flush_interval: float = 5.0,
         health_check_interval: float = 10.0,
+        flush_concurrency: int = 4,
+        command_coalescing: Optional[CoalescingRules] = None,
+        drain_rate: float = 50.0,
+        drain_burst: int = 20,
+        drain_start_jitter: float = 1.0,
     ):
         """
         初始化離線佇列服務
@@ -115,26 +123,35 @@ class OfflineQueueService:
             command_buffer_path: 指令緩衝資料庫路徑
             sync_buffer: 同步緩衝（離線時緩衝日誌/狀態）
             sync_buffer_path: 同步緩衝資料庫路徑
-            network_monitor: 網路監控器
+            network_monitor: 網路監控器（預設使用共用的全域監控器 get_network_monitor()）
             shared_state: 共享狀態管理器
             auto_flush_on_online: 網路恢復時是否自動同步
             flush_batch_size: 批次同步大小
             flush_interval: 同步檢查間隔（秒）
             health_check_interval: 佇列服務健康檢查間隔（秒）
+            flush_concurrency: 同步時同時發送的機器人數上限
+            command_coalescing: 指令緩衝的合併規則（僅在未傳入 command_buffer 時使用）
+            drain_rate: 排空緩衝的初始速率（訊息/秒），依發送延遲與錯誤率自適應調整
+            drain_burst: 排空速率的 token bucket 容量
+            drain_start_jitter: 恢復連線後開始排空前的隨機延遲上限（秒）
         """
         # 指令緩衝 - 處理網路佇列服務離線
         self._command_buffer = command_buffer or OfflineBuffer(
             db_path=command_buffer_path or ":memory:",
             send_batch_size=flush_batch_size,
+            send_concurrency=flush_concurrency,
+            coalescing=command_coalescing,
         )
 
         # 雲端同步緩衝 - 處理與雲端的離線
         self._sync_buffer = sync_buffer or OfflineBuffer(
             db_path=sync_buffer_path or ":memory:",
             send_batch_size=flush_batch_size,
+            send_concurrency=flush_concurrency,
         )
 
-        self._network_monitor = network_monitor or NetworkMonitor()
+        # 預設與 CloudSyncClient、RobotRouter 共用同一監控器，被動連線信號彙整在一起
+        self._network_monitor = network_monitor or get_network_monitor()
         self._shared_state = shared_state
 
         self._auto_flush_on_online = auto_flush_on_online
@@ -149,6 +166,21 @@ class OfflineQueueService:
         # 雲端同步處理器
         self._cloud_sync_handler: Optional[QueueSendHandler] = None
 
+        # 排空排程（指令緩衝 → 佇列服務、同步緩衝 → 雲端）
+        self._command_drain = DrainScheduler(
+            "command_buffer",
+            rate=drain_rate,
+            burst=drain_burst,
+            start_jitter_seconds=drain_start_jitter,
+        )
+        self._sync_drain = DrainScheduler(
+            "sync_buffer",
+            rate=drain_rate,
+            burst=drain_burst,
+            start_jitter_seconds=drain_start_jitter,
+        )
+        self._drain_tasks: Dict[str, asyncio.Task] = {}
+
         self._running = False
         self._flush_task: Optional[asyncio.Task] = None
         self._health_check_task: Optional[asyncio.Task] = None
@@ -208,8 +240,8 @@ class OfflineQueueService:
         Args:
             handler: 發送處理函式，用於發送指令到網路佇列服務
         """
-        self._queue_send_handler = handler
-        self._command_buffer.set_send_handler(handler)
+        self._queue_send_handler = self._observe_outcome(handler, "queue_service")
+        self._command_buffer.set_send_handler(self._command_drain.wrap(self._queue_send_handler))
 
     def set_queue_health_check_handler(self, handler: QueueHealthCheckHandler) -> None:
         """
@@ -227,8 +259,37 @@ class OfflineQueueService:
         Args:
             handler: 同步處理函式，用於同步日誌/狀態到雲端
         """
-        self._cloud_sync_handler = handler
-        self._sync_buffer.set_send_handler(handler)
+        self._cloud_sync_handler = self._observe_outcome(handler, "cloud_sync")
+        self._sync_buffer.set_send_handler(self._sync_drain.wrap(self._cloud_sync_handler))
+
+    def _observe_outcome(self, handler: QueueSendHandler, source: str) -> QueueSendHandler:
+        """
+        包裝發送處理器，將實際發送結果回報給網路監控器作為被動連線信號
+
+        成功視為連線正常、拋出例外視為連線失敗；返回 False 代表對方已回應但拒絕，
+        不作為連線信號。
+
+        Args:
+            handler: 原始發送處理器
+            source: 信號來源名稱
+
+        Returns:
+            會回報結果的發送處理器
+        """
+        monitor = self._network_monitor
+
+        async def observed(message: Message) -> bool:
+            start = time.monotonic()
+            try:
+                success = await handler(message)
+            except Exception as e:
+                monitor.record_failure(source=source, error=str(e))
+                raise
+            if success:
+                monitor.record_success(source=source, latency_ms=(time.monotonic() - start) * 1000)
+            return success
+
+        return observed
 
     # ==================== 生命週期 ====================
 
@@ -281,6 +342,15 @@ class OfflineQueueService:
         self._flush_task = None
         self._health_check_task = None
 
+        for task in self._drain_tasks.values():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                # 任務取消是預期行為，安全忽略
+                pass
+        self._drain_tasks.clear()
+
         # 停止網路監控
         await self._network_monitor.stop()
 
@@ -300,6 +370,7 @@ class OfflineQueueService:
         priority: MessagePriority = MessagePriority.NORMAL,
         trace_id: Optional[str] = None,
         correlation_id: Optional[str] = None,
+        deadline_ms: Optional[int] = None,
     ) -> Optional[str]:
         """
         提交指令
@@ -313,6 +384,7 @@ class OfflineQueueService:
             priority: 優先權
             trace_id: 追蹤 ID
             correlation_id: 關聯 ID
+            deadline_ms: 指令期限（毫秒），預設取自 payload 的 deadline_ms 或 command.timeout_ms
 
         Returns:
             訊息 ID，失敗則返回 None
@@ -322,6 +394,7 @@ class OfflineQueueService:
             priority=priority,
             trace_id=trace_id,
             correlation_id=correlation_id,
+            deadline_ms=deadline_ms if deadline_ms is not None else get_payload_deadline_ms(payload),
         )
 
         self._stats["commands_submitted"] += 1
@@ -544,9 +617,9 @@ class OfflineQueueService:
                 "service": "offline_queue_service"
             })
 
-            # 狀態變為可用時，嘗試清空緩衝
+            # 狀態變為可用時，排程清空緩衝
             if status == QueueServiceStatus.AVAILABLE and self._auto_flush_on_online:
-                await self.flush_command_buffer()
+                self._schedule_drain("command_buffer")
 
     async def _check_queue_service_health(self) -> bool:
         """檢查佇列服務健康狀態"""
@@ -615,9 +688,61 @@ class OfflineQueueService:
             if is_healthy:
                 await self._set_queue_service_status(QueueServiceStatus.AVAILABLE)
 
-            # 同步雲端緩衝
+            # 排程同步雲端緩衝
             if self._auto_flush_on_online:
-                await self.flush_sync_buffer()
+                self._schedule_drain("sync_buffer")
+
+    def _schedule_drain(self, name: str) -> None:
+        """排程排空緩衝（已有排空進行中時略過）"""
+        task = self._drain_tasks.get(name)
+        if task and not task.done():
+            return
+        scheduler = self._command_drain if name == "command_buffer" else self._sync_drain
+        scheduler.mark_waiting()
+        self._drain_tasks[name] = asyncio.create_task(self._run_drain(name))
+
+    def _is_draining(self, name: str) -> bool:
+        task = self._drain_tasks.get(name)
+        return task is not None and not task.done()
+
+    async def _run_drain(self, name: str) -> None:
+        """
+        排空緩衝：先隨機延遲以分散重連尖峰，再以速率限制發送
+
+        Args:
+            name: "command_buffer" 或 "sync_buffer"
+        """
+        if name == "command_buffer":
+            scheduler, buffer, flush = self._command_drain, self._command_buffer, self.flush_command_buffer
+        else:
+            scheduler, buffer, flush = self._sync_drain, self._sync_buffer, self.flush_sync_buffer
+
+        delay = scheduler.start_delay()
+
+        logger.info("Drain scheduled", extra={
+            "drain": name,
+            "delay_seconds": round(delay, 3),
+            "service": "offline_queue_service"
+        })
+
+        try:
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._shutdown_event.wait(), timeout=delay)
+                    return  # 收到關閉信號
+                except asyncio.TimeoutError:
+                    pass
+
+            scheduler.begin(await buffer.size())
+            await flush()
+        except Exception as e:
+            logger.error("Drain failed", extra={
+                "drain": name,
+                "error": str(e),
+                "service": "offline_queue_service"
+            })
+        finally:
+            scheduler.finish()
 
     async def _periodic_flush(self) -> None:
         """定期嘗試同步緩衝資料"""
@@ -632,14 +757,18 @@ class OfflineQueueService:
                 if not self._running:
                     break
 
-                # 嘗試同步指令緩衝
-                if self.is_queue_service_available:
+                # 主動清除過期條目（離線時也執行，避免過期指令佔用緩衝空間）
+                await self._command_buffer.cleanup_expired()
+                await self._sync_buffer.cleanup_expired()
+
+                # 嘗試同步指令緩衝（排空進行中時由排空任務處理）
+                if self.is_queue_service_available and not self._is_draining("command_buffer"):
                     command_buffer_size = await self._command_buffer.size()
                     if command_buffer_size > 0:
                         await self.flush_command_buffer()
 
                 # 嘗試同步雲端緩衝
-                if self.is_network_online:
+                if self.is_network_online and not self._is_draining("sync_buffer"):
                     sync_buffer_size = await self._sync_buffer.size()
                     if sync_buffer_size > 0:
                         await self.flush_sync_buffer()
@@ -664,6 +793,10 @@ class OfflineQueueService:
             "stats": self._stats.copy(),
             "command_buffer": command_buffer_stats,
             "sync_buffer": sync_buffer_stats,
+            "drain": {
+                "command_buffer": self._command_drain.get_progress(command_buffer_stats.get("pending")),
+                "sync_buffer": self._sync_drain.get_progress(sync_buffer_stats.get("pending")),
+            },
             "network": network_state,
             "timestamp": utc_now().isoformat(),
         }
@@ -221,6 +221,12 @@ class RabbitMQQueue(QueueInterface):
                 # 序列化訊息
                 body = json.dumps(message.to_dict()).encode()
 
+                # 訊息期限轉為 AMQP per-message TTL，逾期由 broker 丟棄
+                expiration = None
+                expires_at = message.effective_expires_at
+                if expires_at is not None:
+                    expiration = max((expires_at - datetime.now(timezone.utc)).total_seconds(), 0.001)
+
                 # 建立 AMQP 訊息（持久化、優先權）
                 amqp_message = AMQPMessage(
                     body=body,
@@ -228,6 +234,7 @@ class RabbitMQQueue(QueueInterface):
                     priority=self.PRIORITY_MAP[message.priority],
                     message_id=message.id,
                     timestamp=datetime.now(timezone.utc),
+                    expiration=expiration,
                     headers={
                         "trace_id": message.trace_id,
                         "correlation_id": message.correlation_id,
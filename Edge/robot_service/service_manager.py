@@ -10,6 +10,7 @@ import threading
 from typing import Any, Callable, Dict, List, Optional
 
 from .queue import Message, MessagePriority, MemoryQueue, RabbitMQQueue, SQSQueue, QueueHandler, QueueInterface
+from .queue.interface import get_payload_deadline_ms
 from .command_processor import CommandProcessor
 
 
@@ -36,6 +37,8 @@ class ServiceManager:
         rabbitmq_url: Optional[str] = None,
         rabbitmq_config: Optional[Dict[str, Any]] = None,
         sqs_config: Optional[Dict[str, Any]] = None,
+        queue_partition_by_robot: bool = False,
+        queue_scheduling: str = "round_robin",
     ):
         """
         初始化服務管理器
@@ -48,6 +51,8 @@ class ServiceManager:
             rabbitmq_url: RabbitMQ 連線 URL（當 queue_type="rabbitmq" 時必需）
             rabbitmq_config: RabbitMQ 額外配置（exchange、queue 名稱等）
             sqs_config: AWS SQS 配置（queue_url、region 等）
+            queue_partition_by_robot: 是否啟用每台機器人公平排程（僅用於 MemoryQueue）
+            queue_scheduling: 分區排程策略 "round_robin" 或 "deficit_round_robin"（僅用於 MemoryQueue）
         """
         self.queue_type = queue_type
         self.max_workers = max_workers
@@ -108,10 +113,15 @@ class ServiceManager:
 
         else:
             # 預設使用 MemoryQueue
-            self.queue = MemoryQueue(max_size=queue_max_size)
+            self.queue = MemoryQueue(
+                max_size=queue_max_size,
+                partition_by_robot=queue_partition_by_robot,
+                scheduling=queue_scheduling,
+            )
 
             logger.info("ServiceManager initialized with MemoryQueue", extra={
                 "queue_max_size": queue_max_size,
+                "partition_by_robot": queue_partition_by_robot,
                 "max_workers": max_workers,
                 "service": "robot_service"
             })
@@ -197,6 +207,7 @@ class ServiceManager:
         priority: MessagePriority = MessagePriority.NORMAL,
         trace_id: Optional[str] = None,
         correlation_id: Optional[str] = None,
+        deadline_ms: Optional[int] = None,
     ) -> Optional[str]:
         """
         提交指令到佇列
@@ -206,6 +217,8 @@ class ServiceManager:
             priority: 優先權
             trace_id: 追蹤 ID
             correlation_id: 關聯 ID
+            deadline_ms: 指令期限（毫秒），預設取自 payload 的 deadline_ms 或
+                MCP 指令的 command.timeout_ms，逾期未處理的指令會被丟棄
 
         Returns:
             訊息 ID，失敗則返回 None
@@ -215,6 +228,7 @@ class ServiceManager:
             priority=priority,
             trace_id=trace_id,
             correlation_id=correlation_id,
+            deadline_ms=deadline_ms if deadline_ms is not None else get_payload_deadline_ms(payload),
         )
 
         success = await self.queue.enqueue(message)
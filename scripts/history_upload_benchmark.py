@@ -0,0 +1,126 @@
+"""
+History Upload Benchmark
+
+指令歷史上傳吞吐量基準測試：在暫存目錄中啟動資料同步 API（Flask 測試客戶端），
+以指定批次大小連續上傳指令歷史，輸出吞吐量（uploads/s、records/s）與
+每次上傳延遲百分位（p50/p95/max，毫秒）的 JSON 報告。
+
+用法範例：
+    python scripts/history_upload_benchmark.py
+    python scripts/history_upload_benchmark.py --uploads 20 --batch-size 10000
+    python scripts/history_upload_benchmark.py --duplicate-ratio 0.5
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 確保可從專案根目錄 import（Cloud.api）
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from flask import Flask  # noqa: E402
+
+from Cloud.api.auth import CloudAuthService  # noqa: E402
+from Cloud.api.data_sync import data_sync_bp, init_data_sync_api  # noqa: E402
+
+JWT_SECRET = "history-upload-benchmark-secret-key"
+USER_ID = "bench-user"
+EDGE_ID = "edge-bench"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列解析器。"""
+    parser = argparse.ArgumentParser(description="指令歷史上傳吞吐量基準測試")
+    parser.add_argument("--uploads", type=int, default=5, help="上傳次數（預設 5）")
+    parser.add_argument("--batch-size", type=int, default=10000, help="每次上傳的記錄數（預設 10000）")
+    parser.add_argument(
+        "--duplicate-ratio", type=float, default=0.0,
+        help="每批與前一批重複的記錄比例（0–1，模擬離線佇列重送）",
+    )
+    return parser
+
+
+def build_batch(index: int, batch_size: int, duplicate_ratio: float) -> List[Dict[str, Any]]:
+    """產生第 index 批記錄；前 duplicate_ratio 比例與前一批末段重複"""
+    start = index * (batch_size - int(batch_size * duplicate_ratio))
+    return [
+        {"command_id": f"cmd-{i}", "status": "succeeded", "robot_id": "robot-1"}
+        for i in range(start, start + batch_size)
+    ]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run(uploads: int, batch_size: int, duplicate_ratio: float, storage_path: str) -> Dict[str, Any]:
+    """連續上傳 uploads 批記錄，統計吞吐量與延遲"""
+    app = Flask(__name__)
+    app.register_blueprint(data_sync_bp)
+    init_data_sync_api(jwt_secret=JWT_SECRET, storage_path=storage_path)
+    token = CloudAuthService(JWT_SECRET).generate_token(user_id=USER_ID, username=USER_ID, role="user")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client = app.test_client()
+    latencies: List[float] = []
+    inserted = 0
+    total = 0
+    for index in range(uploads):
+        records = build_batch(index, batch_size, duplicate_ratio)
+        started = time.perf_counter()
+        response = client.post(
+            f"/api/cloud/data_sync/history/{USER_ID}",
+            json={"records": records, "edge_id": EDGE_ID},
+            headers=headers,
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+        data = response.get_json()
+        if response.status_code != 200 or not data.get("success"):
+            raise RuntimeError(f"Upload {index} failed: {response.status_code} {data}")
+        inserted += data["synced_count"]
+        total = data["total"]
+
+    elapsed = sum(latencies) / 1000
+    latencies.sort()
+    return {
+        "uploads": uploads,
+        "batch_size": batch_size,
+        "duplicate_ratio": duplicate_ratio,
+        "inserted": inserted,
+        "total": total,
+        "seconds": round(elapsed, 3),
+        "uploads_per_second": round(uploads / elapsed, 2) if elapsed else 0.0,
+        "records_per_second": round(uploads * batch_size / elapsed) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 3),
+            "p95": round(_percentile(latencies, 95), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """主程式進入點。"""
+    opts = build_parser().parse_args(args)
+    if not 0 <= opts.duplicate_ratio < 1:
+        print("--duplicate-ratio must be in [0, 1)", file=sys.stderr)
+        return 2
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        report = run(opts.uploads, opts.batch_size, opts.duplicate_ratio, tmpdir)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,501 @@
+"""
+Queue Benchmark Harness
+
+佇列效能基準測試工具：以可設定的生產者／消費者數量、payload 大小與優先權
+比例驅動各佇列實作，輸出吞吐量與 enqueue→dequeue 延遲百分位（p50/p99/p999）
+的 JSON 報告，並可與基準報告比較以在本機抓出效能退化。
+
+支援的目標：
+    memory          MemoryQueue（可選每台機器人公平排程）
+    offline_buffer  OfflineBuffer（離線緩衝後重連 flush）
+    cloud_sync      CloudSyncQueue（離線入隊後 flush）
+    broker          本機 broker 替身（MemoryQueue + 模擬網路往返延遲）
+
+用法範例：
+    python scripts/queue_benchmark.py
+    python scripts/queue_benchmark.py --targets memory broker --messages 5000 --consumers 8
+    python scripts/queue_benchmark.py --priority-mix urgent=1,high=2,normal=6,low=1
+    python scripts/queue_benchmark.py --output baseline.json
+    python scripts/queue_benchmark.py --baseline baseline.json --tolerance 0.15
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 確保可從專案根目錄 import（src.robot_service、Edge.cloud_sync）
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from Edge.cloud_sync.sync_queue import CloudSyncQueue  # noqa: E402
+from src.robot_service.queue import (  # noqa: E402
+    MemoryQueue,
+    Message,
+    MessagePriority,
+    OfflineBuffer,
+)
+
+
+TARGETS = ("memory", "offline_buffer", "cloud_sync", "broker")
+
+DEFAULT_PRIORITY_MIX = {"urgent": 1, "high": 2, "normal": 6, "low": 1}
+
+# 與基準比較的指標：(指標路徑, 越大越好)
+COMPARED_METRICS = (
+    ("throughput_msgs_per_sec", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p99", False),
+)
+
+
+@dataclass
+class BenchmarkConfig:
+    """基準測試設定"""
+    targets: List[str] = field(default_factory=lambda: list(TARGETS))
+    messages: int = 2000
+    producers: int = 4
+    consumers: int = 4
+    payload_bytes: int = 256
+    robots: int = 8
+    priority_mix: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_PRIORITY_MIX))
+    partition_by_robot: bool = False
+    batch_size: int = 50
+    broker_latency_ms: float = 0.5
+    seed: int = 42
+
+
+class BrokerStandIn:
+    """
+    本機 broker 替身
+
+    以 MemoryQueue 儲存訊息，並在每次 enqueue／dequeue／ack 時加入模擬的網路
+    往返延遲，用於在沒有 RabbitMQ／SQS 的環境下比較網路佇列的行為。
+    """
+
+    def __init__(self, round_trip_ms: float = 0.5):
+        self._queue = MemoryQueue()
+        self._round_trip = round_trip_ms / 1000.0
+
+    async def _round_trip_delay(self) -> None:
+        await asyncio.sleep(self._round_trip)
+
+    async def enqueue(self, message: Message) -> bool:
+        await self._round_trip_delay()
+        return await self._queue.enqueue(message)
+
+    async def dequeue(self, timeout: Optional[float] = None) -> Optional[Message]:
+        await self._round_trip_delay()
+        return await self._queue.dequeue(timeout=timeout)
+
+    async def ack(self, message_id: str) -> bool:
+        await self._round_trip_delay()
+        return await self._queue.ack(message_id)
+
+
+# ==================== 統計 ====================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    以 nearest-rank 計算百分位數
+
+    Args:
+        sorted_values: 已排序的數值
+        pct: 百分位（0-100）
+
+    Returns:
+        百分位數值，無資料時返回 0.0
+    """
+    if not sorted_values:
+        return 0.0
+    # 先四捨五入以避免浮點誤差（例如 99.9% × 1000 = 999.0000000000001）
+    rank = math.ceil(round(pct / 100.0 * len(sorted_values), 9))
+    index = min(max(rank - 1, 0), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies_s: List[float]) -> Dict[str, float]:
+    """將延遲（秒）整理為毫秒統計"""
+    values = sorted(v * 1000.0 for v in latencies_s)
+    return {
+        "p50": round(percentile(values, 50), 4),
+        "p99": round(percentile(values, 99), 4),
+        "p999": round(percentile(values, 99.9), 4),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "max": round(values[-1], 4) if values else 0.0,
+    }
+
+
+def parse_priority_mix(value: str) -> Dict[str, int]:
+    """
+    解析優先權比例字串，例如 "urgent=1,high=2,normal=6,low=1"
+
+    Raises:
+        ValueError: 優先權名稱或權重無效
+    """
+    mix: Dict[str, int] = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip().lower()
+        if name.upper() not in MessagePriority.__members__:
+            raise ValueError(f"Unknown priority: {name}")
+        mix[name] = int(weight) if weight else 1
+        if mix[name] < 0:
+            raise ValueError(f"Priority weight must be >= 0: {part}")
+    if not mix or sum(mix.values()) == 0:
+        raise ValueError("Priority mix must contain at least one positive weight")
+    return mix
+
+
+def _build_result(
+    target: str,
+    config: BenchmarkConfig,
+    latencies: List[float],
+    elapsed: float,
+    **phases: float,
+) -> Dict[str, Any]:
+    """組合單一目標的結果"""
+    result: Dict[str, Any] = {
+        "target": target,
+        "messages": len(latencies),
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_msgs_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+    }
+    for name, seconds in phases.items():
+        result[name] = round(seconds, 4)
+    return result
+
+
+# ==================== 工作負載 ====================
+
+class _Workload:
+    """產生測試訊息並記錄送出時間"""
+
+    def __init__(self, config: BenchmarkConfig):
+        self.config = config
+        self.payload_data = "x" * config.payload_bytes
+        self.sent_at: Dict[str, float] = {}
+        self._priorities = [MessagePriority[name.upper()] for name in config.priority_mix]
+        self._weights = list(config.priority_mix.values())
+
+    def shares(self) -> List[int]:
+        """將訊息數平均分配給各生產者"""
+        producers = max(self.config.producers, 1)
+        base, extra = divmod(self.config.messages, producers)
+        return [base + (1 if i < extra else 0) for i in range(producers)]
+
+    def make_message(self, producer: int, index: int, rng: random.Random) -> Message:
+        priority = rng.choices(self._priorities, weights=self._weights)[0]
+        robot_id = f"robot-{(producer + index) % max(self.config.robots, 1)}"
+        return Message(
+            id=f"bench-{producer}-{index}",
+            payload={"robot_id": robot_id, "data": self.payload_data},
+            priority=priority,
+        )
+
+
+async def _run_live_queue(target: str, queue: Any, config: BenchmarkConfig) -> Dict[str, Any]:
+    """同時執行生產者與消費者（MemoryQueue／broker 替身）"""
+    workload = _Workload(config)
+    latencies: List[float] = []
+    total = config.messages
+
+    async def producer(idx: int, count: int) -> None:
+        rng = random.Random(config.seed + idx)  # nosec B311 - 僅用於產生測試資料
+        for i in range(count):
+            message = workload.make_message(idx, i, rng)
+            workload.sent_at[message.id] = time.perf_counter()
+            await queue.enqueue(message)
+            if i % 64 == 0:
+                await asyncio.sleep(0)
+
+    async def consumer() -> None:
+        while len(latencies) < total:
+            message = await queue.dequeue(timeout=0.05)
+            if message is None:
+                continue
+            latencies.append(time.perf_counter() - workload.sent_at[message.id])
+            await queue.ack(message.id)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(producer(i, n) for i, n in enumerate(workload.shares())),
+        *(consumer() for _ in range(max(config.consumers, 1))),
+    )
+    elapsed = time.perf_counter() - start
+    return _build_result(target, config, latencies, elapsed)
+
+
+async def bench_memory(config: BenchmarkConfig) -> Dict[str, Any]:
+    """MemoryQueue 基準測試"""
+    queue = MemoryQueue(partition_by_robot=config.partition_by_robot)
+    return await _run_live_queue("memory", queue, config)
+
+
+async def bench_broker(config: BenchmarkConfig) -> Dict[str, Any]:
+    """本機 broker 替身基準測試"""
+    queue = BrokerStandIn(round_trip_ms=config.broker_latency_ms)
+    return await _run_live_queue("broker", queue, config)
+
+
+async def bench_offline_buffer(config: BenchmarkConfig) -> Dict[str, Any]:
+    """OfflineBuffer 基準測試：離線時緩衝，重連後 flush"""
+    workload = _Workload(config)
+    latencies: List[float] = []
+    buffer = OfflineBuffer(
+        max_size=config.messages,
+        default_ttl_seconds=0,
+        send_batch_size=config.batch_size,
+    )
+
+    async def send(message: Message) -> bool:
+        latencies.append(time.perf_counter() - workload.sent_at[message.id])
+        return True
+
+    async def producer(idx: int, count: int) -> None:
+        rng = random.Random(config.seed + idx)  # nosec B311 - 僅用於產生測試資料
+        for i in range(count):
+            message = workload.make_message(idx, i, rng)
+            workload.sent_at[message.id] = time.perf_counter()
+            await buffer.buffer(message)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(i, n) for i, n in enumerate(workload.shares())))
+    buffered = time.perf_counter()
+
+    buffer.set_send_handler(send)
+    buffer.set_online(True)
+    await buffer.flush()
+    elapsed = time.perf_counter() - start
+
+    return _build_result(
+        "offline_buffer", config, latencies, elapsed,
+        enqueue_seconds=buffered - start,
+        drain_seconds=elapsed - (buffered - start),
+    )
+
+
+async def bench_cloud_sync(config: BenchmarkConfig) -> Dict[str, Any]:
+    """CloudSyncQueue 基準測試：離線時入隊，重連後 flush"""
+    workload = _Workload(config)
+    latencies: List[float] = []
+    queue = CloudSyncQueue(max_size=config.messages, batch_size=config.batch_size)
+
+    def send(op_type: str, payload: Dict[str, Any]) -> bool:
+        latencies.append(time.perf_counter() - workload.sent_at[payload["id"]])
+        return True
+
+    def producer(idx: int, count: int) -> None:
+        rng = random.Random(config.seed + idx)  # nosec B311 - 僅用於產生測試資料
+        for i in range(count):
+            message = workload.make_message(idx, i, rng)
+            workload.sent_at[message.id] = time.perf_counter()
+            queue.enqueue("command_history", {"id": message.id, **message.payload})
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            asyncio.to_thread(producer, i, n) for i, n in enumerate(workload.shares())
+        ))
+        enqueued = time.perf_counter()
+
+        queue.set_online(True)
+        queue.flush(send)
+        elapsed = time.perf_counter() - start
+    finally:
+        queue.close()
+
+    return _build_result(
+        "cloud_sync", config, latencies, elapsed,
+        enqueue_seconds=enqueued - start,
+        drain_seconds=elapsed - (enqueued - start),
+    )
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "offline_buffer": bench_offline_buffer,
+    "cloud_sync": bench_cloud_sync,
+    "broker": bench_broker,
+}
+
+
+async def run_benchmarks(config: BenchmarkConfig) -> Dict[str, Any]:
+    """
+    依序執行各目標的基準測試
+
+    Returns:
+        包含設定、執行環境與各目標結果的報告
+    """
+    results = {}
+    for target in config.targets:
+        results[target] = await BENCHMARKS[target](config)
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "config": asdict(config),
+        "results": results,
+    }
+
+
+# ==================== 基準比較 ====================
+
+def _get_metric(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_with_baseline(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.1,
+) -> List[Dict[str, Any]]:
+    """
+    比較目前報告與基準報告
+
+    吞吐量低於基準 (1 - tolerance) 倍，或 p50／p99 延遲高於基準
+    (1 + tolerance) 倍時視為退化。僅比較兩份報告都有的目標。
+
+    Returns:
+        退化項目列表（空列表表示沒有退化）
+    """
+    regressions = []
+    baseline_results = baseline.get("results", {})
+
+    for target, result in report.get("results", {}).items():
+        base_result = baseline_results.get(target)
+        if not base_result:
+            continue
+
+        for metric, higher_is_better in COMPARED_METRICS:
+            current = _get_metric(result, metric)
+            previous = _get_metric(base_result, metric)
+            if current is None or not previous:
+                continue
+
+            change = (current - previous) / previous
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            if regressed:
+                regressions.append({
+                    "target": target,
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "change": round(change, 4),
+                })
+
+    return regressions
+
+
+# ==================== CLI ====================
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列解析器。"""
+    parser = argparse.ArgumentParser(
+        description="佇列效能基準測試工具",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+範例：
+  python scripts/queue_benchmark.py --targets memory broker
+  python scripts/queue_benchmark.py --messages 10000 --producers 8 --consumers 8
+  python scripts/queue_benchmark.py --output baseline.json
+  python scripts/queue_benchmark.py --baseline baseline.json --tolerance 0.15
+        """,
+    )
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS), help="要測試的佇列")
+    parser.add_argument("--messages", type=int, default=2000, help="每個目標的訊息數")
+    parser.add_argument("--producers", type=int, default=4, help="生產者數量")
+    parser.add_argument("--consumers", type=int, default=4, help="消費者數量（memory／broker）")
+    parser.add_argument("--payload-bytes", type=int, default=256, help="每則訊息的 payload 大小")
+    parser.add_argument("--robots", type=int, default=8, help="訊息分散的機器人數量")
+    parser.add_argument(
+        "--priority-mix",
+        type=parse_priority_mix,
+        default=dict(DEFAULT_PRIORITY_MIX),
+        metavar="MIX",
+        help="優先權比例，例如 urgent=1,high=2,normal=6,low=1",
+    )
+    parser.add_argument("--partition-by-robot", action="store_true", help="MemoryQueue 啟用每台機器人公平排程")
+    parser.add_argument("--batch-size", type=int, default=50, help="OfflineBuffer／CloudSyncQueue 的 flush 批次大小")
+    parser.add_argument("--broker-latency-ms", type=float, default=0.5, help="broker 替身每次操作的往返延遲")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    parser.add_argument("--output", type=Path, metavar="FILE", help="將 JSON 報告寫入檔案（預設輸出到 stdout）")
+    parser.add_argument("--baseline", type=Path, metavar="FILE", help="與基準 JSON 報告比較，退化時返回 1")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="基準比較容許的相對變化（預設 0.1）")
+    return parser
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """主程式進入點。"""
+    parser = build_parser()
+    opts = parser.parse_args(args)
+
+    config = BenchmarkConfig(
+        targets=opts.targets,
+        messages=opts.messages,
+        producers=opts.producers,
+        consumers=opts.consumers,
+        payload_bytes=opts.payload_bytes,
+        robots=opts.robots,
+        priority_mix=opts.priority_mix,
+        partition_by_robot=opts.partition_by_robot,
+        batch_size=opts.batch_size,
+        broker_latency_ms=opts.broker_latency_ms,
+        seed=opts.seed,
+    )
+
+    report = asyncio.run(run_benchmarks(config))
+
+    exit_code = 0
+    if opts.baseline:
+        baseline = json.loads(opts.baseline.read_text(encoding="utf-8"))
+        regressions = compare_with_baseline(report, baseline, opts.tolerance)
+        report["baseline_comparison"] = {
+            "baseline": str(opts.baseline),
+            "tolerance": opts.tolerance,
+            "regressions": regressions,
+        }
+        if regressions:
+            exit_code = 1
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if opts.output:
+        opts.output.write_text(output + "\n", encoding="utf-8")
+        print(f"報告已寫入 {opts.output}")
+    else:
+        print(output)
+
+    if exit_code:
+        for item in report["baseline_comparison"]["regressions"]:
+            print(
+                f"⚠️  {item['target']} {item['metric']}: "
+                f"{item['baseline']} → {item['current']} ({item['change']:+.1%})",
+                file=sys.stderr,
+            )
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
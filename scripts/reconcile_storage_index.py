@@ -0,0 +1,67 @@
+"""
+Storage Index Reconcile Tool
+
+由磁碟重建 CloudStorageService 的元數據索引（列表、統計與配額所用的 SQLite 索引），
+並將尚未連結到內容儲存區的檔案去重。輸出包含跨使用者去重報告（節省的位元組數）。
+適用於手動搬移／刪除儲存檔案、從備份還原或索引檔遺失之後。
+
+用法範例：
+    python scripts/reconcile_storage_index.py --storage-path /var/data/cloud_storage
+    python scripts/reconcile_storage_index.py --storage-path ./storage --index-path ./storage_index.db
+    python scripts/reconcile_storage_index.py --storage-path ./storage --collect-garbage
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+# 確保可從專案根目錄 import（Cloud.api）
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from Cloud.api.storage import CloudStorageService  # noqa: E402
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列解析器。"""
+    parser = argparse.ArgumentParser(description="由磁碟重建雲端儲存元數據索引")
+    parser.add_argument(
+        "--storage-path",
+        default=os.environ.get("CLOUD_STORAGE_PATH"),
+        help="儲存根目錄（預設讀取環境變數 CLOUD_STORAGE_PATH）",
+    )
+    parser.add_argument("--index-path", help="索引 SQLite 路徑（預設為 {storage-path}/.storage_index.db）")
+    parser.add_argument(
+        "--collect-garbage",
+        action="store_true",
+        help="重建後回收引用數為 0 且超過寬限期的內容 blob",
+    )
+    return parser
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """主程式進入點。"""
+    parser = build_parser()
+    opts = parser.parse_args(args)
+    if not opts.storage_path:
+        parser.error("--storage-path is required (or set CLOUD_STORAGE_PATH)")
+    if not Path(opts.storage_path).is_dir():
+        print(f"儲存目錄不存在：{opts.storage_path}", file=sys.stderr)
+        return 1
+
+    service = CloudStorageService(opts.storage_path, index_path=opts.index_path)
+    result = service.reconcile_index()
+    if opts.collect_garbage:
+        result["gc"] = service.collect_garbage()
+    result["stats"] = service.get_storage_stats()
+    result["dedup"] = service.get_dedup_report()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
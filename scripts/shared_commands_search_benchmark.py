@@ -0,0 +1,156 @@
+"""
+Shared Commands Search Benchmark
+
+共享指令搜尋效能基準測試：在暫存 SQLite 資料庫中產生指定數量的共享指令，
+分別以全文檢索索引（FTS5）與 ILIKE 篩選執行 SharedCommandService.search_commands，
+輸出每種模式的延遲百分位（p50/p95/max，毫秒）JSON 報告。
+
+用法範例：
+    python scripts/shared_commands_search_benchmark.py
+    python scripts/shared_commands_search_benchmark.py --commands 100000 --repeat 20
+    python scripts/shared_commands_search_benchmark.py --database-url sqlite:////tmp/bench.db
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 確保可從專案根目錄 import（Cloud.shared_commands）
+PROJECT_ROOT = Path(__file__).parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from Cloud.shared_commands.database import close_db, get_db_session, get_engine, init_db  # noqa: E402
+from Cloud.shared_commands.models import SharedAdvancedCommand  # noqa: E402
+from Cloud.shared_commands.search_index import get_search_tokenizer  # noqa: E402
+from Cloud.shared_commands.service import SharedCommandService  # noqa: E402
+
+WORDS = (
+    "patrol", "wave", "arm", "walk", "forward", "turn", "left", "right", "dance", "greet",
+    "inspect", "warehouse", "charge", "dock", "lift", "grip", "release", "scan", "route", "avoid",
+    "巡邏", "揮手", "前進", "轉彎", "充電", "夾取", "掃描", "倉庫", "舞蹈", "問候",
+)
+SYLLABLES = ("ka", "ro", "mi", "tes", "lun", "vor", "qui", "zen", "pa", "dor")
+CATEGORIES = ("patrol", "motion", "navigation", "interaction", "maintenance")
+# 常見詞、中等、罕見詞、中文（trigram 下 2 字中文詞退回 ILIKE）與不存在的詞
+DEFAULT_QUERIES = ("patrol", "wave arm", "warehouse scan", "kalunzen", "巡邏前進", "充電 dock", "nonexistent")
+
+INSERT_BATCH_SIZE = 5000
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """建立命令列解析器。"""
+    parser = argparse.ArgumentParser(description="共享指令搜尋效能基準測試")
+    parser.add_argument("--commands", type=int, default=100000, help="產生的指令數量（預設 100000）")
+    parser.add_argument("--repeat", type=int, default=10, help="每個關鍵字的重複次數")
+    parser.add_argument("--queries", nargs="+", default=list(DEFAULT_QUERIES), help="搜尋關鍵字")
+    parser.add_argument("--database-url", help="資料庫 URL（預設為暫存目錄中的 SQLite 檔案）")
+    parser.add_argument("--seed", type=int, default=42, help="亂數種子")
+    return parser
+
+
+def build_vocabulary() -> List[str]:
+    """常用詞在前、由音節組合的長尾詞在後的詞彙表（以 Zipf 分佈抽樣）"""
+    generated = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+    return list(WORDS) + generated
+
+
+def populate(count: int, seed: int) -> None:
+    """以批次 INSERT 產生 count 筆公開指令（觸發器同步建立全文檢索索引）"""
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary()
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    engine = get_engine()
+    table = SharedAdvancedCommand.__table__
+    with engine.begin() as conn:
+        for start in range(0, count, INSERT_BATCH_SIZE):
+            rows = []
+            for i in range(start, min(start + INSERT_BATCH_SIZE, count)):
+                rows.append({
+                    "name": f"{' '.join(rng.choices(vocabulary, weights, k=2))} {i}",
+                    "description": " ".join(rng.choices(vocabulary, weights, k=12)),
+                    "category": rng.choice(CATEGORIES),
+                    "content": "[]",
+                    "version": 1,
+                    "author_username": f"user{i % 500}",
+                    "download_count": int(rng.paretovariate(1.2)) - 1,
+                    "usage_count": 0,
+                    "average_rating": round(rng.uniform(0, 5), 2),
+                    "rating_count": rng.randint(0, 50),
+                    "is_public": True,
+                    "is_featured": False,
+                })
+            conn.execute(table.insert(), rows)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_mode(use_search_index: bool, queries: List[str], repeat: int) -> Dict[str, Any]:
+    """以指定模式執行所有關鍵字，統計整體與各關鍵字的延遲"""
+    session = get_db_session()
+    try:
+        service = SharedCommandService(session, use_search_index=use_search_index)
+        all_latencies: List[float] = []
+        per_query: Dict[str, Any] = {}
+        for query in queries:
+            latencies = []
+            total = 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                _, total = service.search_commands(query=query, limit=20)
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            all_latencies.extend(latencies)
+            per_query[query] = {"total": total, "p50_ms": round(_percentile(latencies, 50), 3)}
+        all_latencies.sort()
+        return {
+            "searches": len(all_latencies),
+            "latency_ms": {
+                "p50": round(_percentile(all_latencies, 50), 3),
+                "p95": round(_percentile(all_latencies, 95), 3),
+                "max": round(all_latencies[-1], 3) if all_latencies else 0.0,
+            },
+            "queries": per_query,
+        }
+    finally:
+        session.close()
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """主程式進入點。"""
+    opts = build_parser().parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = opts.database_url or f"sqlite:///{Path(tmpdir) / 'shared_commands_bench.db'}"
+        init_db(database_url)
+        try:
+            started = time.perf_counter()
+            populate(opts.commands, opts.seed)
+            report: Dict[str, Any] = {
+                "commands": opts.commands,
+                "populate_seconds": round(time.perf_counter() - started, 2),
+                "tokenizer": get_search_tokenizer(get_engine()),
+                "modes": {
+                    "fts": run_mode(True, opts.queries, opts.repeat),
+                    "ilike": run_mode(False, opts.queries, opts.repeat),
+                },
+            }
+        finally:
+            close_db()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
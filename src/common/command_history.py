@@ -11,7 +11,7 @@ import sqlite3
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any, Union
 
 from .datetime_utils import utc_now, parse_iso_datetime
 
@@ -156,24 +156,7 @@ class CommandHistoryStore:
                     status, created_at, updated_at, completed_at, result, error,
                     execution_time_ms, actor_type, actor_id, source, labels
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                record.command_id,
-                record.trace_id,
-                record.robot_id,
-                record.command_type,
-                json.dumps(record.command_params),
-                record.status,
-                record.created_at.isoformat(),
-                record.updated_at.isoformat(),
-                record.completed_at.isoformat() if record.completed_at else None,
-                json.dumps(record.result) if record.result else None,
-                json.dumps(record.error) if record.error else None,
-                record.execution_time_ms,
-                record.actor_type,
-                record.actor_id,
-                record.source,
-                json.dumps(record.labels) if record.labels else None
-            ))
+            ''', self._record_params(record))
 
             conn.commit()
             conn.close()
@@ -186,6 +169,71 @@ class CommandHistoryStore:
             logger.error(f"Failed to add command record: {e}")
             return False
 
+    def add_records(self, records: Iterable[Union[CommandRecord, Dict[str, Any]]]) -> int:
+        """批量新增指令記錄（單一交易，已存在的 command_id 略過）
+
+        用於從雲端還原歷史等大量寫入情境；可直接傳入 CommandRecord.to_dict()
+        格式的字典，無法解析的記錄會被略過。
+
+        Args:
+            records: 指令記錄或其字典形式
+
+        Returns:
+            實際新增的筆數
+        """
+        rows = []
+        for record in records:
+            try:
+                if not isinstance(record, CommandRecord):
+                    record = CommandRecord.from_dict(dict(record))
+                rows.append(self._record_params(record))
+            except (TypeError, ValueError, AttributeError) as e:
+                logger.warning(f"Skipping invalid command record: {e}")
+        if not rows:
+            return 0
+
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    cursor = conn.executemany('''
+                        INSERT OR IGNORE INTO command_history (
+                            command_id, trace_id, robot_id, command_type, command_params,
+                            status, created_at, updated_at, completed_at, result, error,
+                            execution_time_ms, actor_type, actor_id, source, labels
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    inserted = max(cursor.rowcount, 0)
+            finally:
+                conn.close()
+            logger.debug(f"Added {inserted}/{len(rows)} command records in bulk")
+            return inserted
+        except Exception as e:
+            logger.error(f"Failed to add command records in bulk: {e}")
+            return 0
+
+    @staticmethod
+    def _record_params(record: CommandRecord) -> tuple:
+        """將指令記錄轉換為 INSERT 參數"""
+        return (
+            record.command_id,
+            record.trace_id,
+            record.robot_id,
+            record.command_type,
+            json.dumps(record.command_params),
+            record.status,
+            record.created_at.isoformat(),
+            record.updated_at.isoformat(),
+            record.completed_at.isoformat() if record.completed_at else None,
+            json.dumps(record.result) if record.result else None,
+            json.dumps(record.error) if record.error else None,
+            record.execution_time_ms,
+            record.actor_type,
+            record.actor_id,
+            record.source,
+            json.dumps(record.labels) if record.labels else None
+        )
+
     def update_record(self, command_id: str, updates: Dict[str, Any]) -> bool:
         """更新指令記錄
 
@@ -7,15 +7,18 @@ Network Monitor
 - 離線/上線事件發布
 - 多端點彈性檢查
 - 定期連線監控
+- 被動連線偵測：以實際請求結果判定連線狀態，僅在無流量時主動探測
 """
 
 import asyncio
 import logging
 import socket
+import threading
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Any, Callable, Coroutine, Dict, List, Optional
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set
 
 from .datetime_utils import utc_now
 
@@ -41,6 +44,8 @@ class NetworkState:
     consecutive_successes: int = 0
     latency_ms: Optional[float] = None
     checked_endpoint: Optional[str] = None
+    last_passive_at: Optional[datetime] = None
+    last_passive_source: Optional[str] = None
 
     def to_dict(self) -> Dict[str, Any]:
         """轉換為字典"""
@@ -53,6 +58,8 @@ class NetworkState:
             "consecutive_successes": self.consecutive_successes,
             "latency_ms": self.latency_ms,
             "checked_endpoint": self.checked_endpoint,
+            "last_passive_at": self.last_passive_at.isoformat() if self.last_passive_at else None,
+            "last_passive_source": self.last_passive_source,
         }
 
 
@@ -72,6 +79,8 @@ class NetworkMonitor:
     - 支援多個備用檢測端點
     - 狀態變更時發送通知
     - 記錄連線統計資訊
+    - 接收實際請求結果作為被動信號（record_success / record_failure），
+      連續失敗或成功達門檻時立即切換狀態；檢測間隔內有被動信號時略過主動探測
     """
 
     # 預設檢測端點（考慮不同網路環境）
@@ -112,6 +121,18 @@ class NetworkMonitor:
         self._shutdown_event = asyncio.Event()
         self._callbacks: List[NetworkStatusCallback] = []
 
+        # 被動信號可能來自執行緒（如 requests），以鎖保護狀態更新
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._notify_tasks: Set[asyncio.Task] = set()
+        self._last_passive_monotonic: Optional[float] = None
+        # 主動探測期間狀態為 CHECKING，被動信號以此作為探測前的狀態
+        self._status_before_check = NetworkStatus.UNKNOWN
+        self._passive_successes = 0
+        self._passive_failures = 0
+        self._probes_run = 0
+        self._probes_skipped = 0
+
         logger.info("NetworkMonitor initialized", extra={
             "check_interval": check_interval,
             "timeout": timeout,
@@ -162,6 +183,7 @@ class NetworkMonitor:
 
         self._running = True
         self._shutdown_event.clear()
+        self._loop = asyncio.get_running_loop()
 
         # 執行初始檢查
         await self.check_connection()
@@ -191,6 +213,9 @@ class NetworkMonitor:
                 pass
             self._monitor_task = None
 
+        if self._notify_tasks:
+            await asyncio.gather(*self._notify_tasks, return_exceptions=True)
+
         logger.info("NetworkMonitor stopped", extra={
             "service": "network_monitor"
         })
@@ -202,9 +227,11 @@ class NetworkMonitor:
         Returns:
             是否連線成功
         """
-        old_status = self._state.status
-        self._state.status = NetworkStatus.CHECKING
-        self._state.last_check_at = utc_now()
+        with self._lock:
+            self._status_before_check = self._state.status
+            self._state.status = NetworkStatus.CHECKING
+            self._state.last_check_at = utc_now()
+            self._probes_run += 1
 
         is_connected = False
         latency_ms: Optional[float] = None
@@ -227,6 +254,10 @@ class NetworkMonitor:
                     "service": "network_monitor"
                 })
 
+        # 探測期間收到的被動信號可能已變更狀態，以最新狀態為準
+        with self._lock:
+            old_status = self._status_before_check
+
         self._state.latency_ms = latency_ms
         self._state.checked_endpoint = checked_endpoint
 
@@ -273,6 +304,120 @@ class NetworkMonitor:
 
         return is_connected
 
+    # ==================== 被動信號 ====================
+
+    def record_success(self, source: Optional[str] = None, latency_ms: Optional[float] = None) -> None:
+        """
+        記錄一次成功的實際請求
+
+        Args:
+            source: 信號來源（如 cloud_sync、robot_router）
+            latency_ms: 請求延遲（毫秒）
+        """
+        self.record_request_outcome(True, source=source, latency_ms=latency_ms)
+
+    def record_failure(self, source: Optional[str] = None, error: Optional[str] = None) -> None:
+        """
+        記錄一次因連線問題失敗的實際請求
+
+        Args:
+            source: 信號來源
+            error: 錯誤描述
+        """
+        self.record_request_outcome(False, source=source, error=error)
+
+    def record_request_outcome(
+        self,
+        success: bool,
+        source: Optional[str] = None,
+        latency_ms: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        記錄實際請求結果作為被動連線信號
+
+        連續失敗達 failure_threshold 時立即判定離線，連續成功達 recovery_threshold 時立即恢復上線，
+        不必等待下一次主動探測。可從事件迴圈或其他執行緒呼叫。
+
+        只應回報可判斷連線狀態的結果：收到任何回應（含 HTTP 錯誤狀態碼）視為成功，
+        連線錯誤或逾時視為失敗。
+
+        Args:
+            success: 是否成功連線
+            source: 信號來源
+            latency_ms: 請求延遲（毫秒）
+            error: 錯誤描述
+        """
+        with self._lock:
+            checking = self._state.status == NetworkStatus.CHECKING
+            old_status = self._status_before_check if checking else self._state.status
+
+            self._last_passive_monotonic = time.monotonic()
+            self._state.last_passive_at = utc_now()
+            self._state.last_passive_source = source
+
+            new_status = old_status
+            if success:
+                self._passive_successes += 1
+                self._state.consecutive_successes += 1
+                self._state.consecutive_failures = 0
+                if latency_ms is not None:
+                    self._state.latency_ms = latency_ms
+                if (old_status != NetworkStatus.ONLINE
+                        and self._state.consecutive_successes >= self._recovery_threshold):
+                    new_status = NetworkStatus.ONLINE
+                    self._state.last_online_at = utc_now()
+            else:
+                self._passive_failures += 1
+                self._state.consecutive_failures += 1
+                self._state.consecutive_successes = 0
+                if (old_status != NetworkStatus.OFFLINE
+                        and self._state.consecutive_failures >= self._failure_threshold):
+                    new_status = NetworkStatus.OFFLINE
+                    self._state.last_offline_at = utc_now()
+
+            if new_status == old_status:
+                return
+            if checking:
+                self._status_before_check = new_status
+            else:
+                self._state.status = new_status
+
+        logger.info("Network status changed by request outcome", extra={
+            "source": source,
+            "success": success,
+            "error": error,
+            "service": "network_monitor"
+        })
+        self._dispatch_notification(old_status, new_status)
+
+    def _dispatch_notification(self, old_status: NetworkStatus, new_status: NetworkStatus) -> None:
+        """在事件迴圈上排程狀態變更通知（被動信號可能來自同步程式碼或其他執行緒）"""
+        coro = self._notify_status_change(old_status, new_status)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is not None:
+            task = running_loop.create_task(coro)
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+        elif self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(coro, self._loop)
+        else:
+            # 沒有可用的事件迴圈：狀態已更新，僅無法呼叫非同步回呼
+            coro.close()
+            logger.debug("No event loop for network status callbacks", extra={
+                "new_status": new_status.value,
+                "service": "network_monitor"
+            })
+
+    def _has_recent_traffic(self) -> bool:
+        """檢測間隔內是否收到過被動信號"""
+        last = self._last_passive_monotonic
+        return last is not None and time.monotonic() - last < self._check_interval
+
     async def _check_endpoint(self, endpoint: str) -> bool:
         """
         檢查單個端點
@@ -329,6 +474,10 @@ class NetworkMonitor:
                 # 正常超時，執行檢查
                 if not self._running:
                     break
+                if self._has_recent_traffic():
+                    # 實際流量已反映連線狀態，不需主動探測
+                    self._probes_skipped += 1
+                    continue
                 await self.check_connection()
 
     async def _notify_status_change(
@@ -366,6 +515,12 @@ class NetworkMonitor:
             "check_interval": self._check_interval,
             "timeout": self._timeout,
             "endpoints_count": len(self._check_endpoints),
+            "passive_signals": {
+                "successes": self._passive_successes,
+                "failures": self._passive_failures,
+            },
+            "probes_run": self._probes_run,
+            "probes_skipped": self._probes_skipped,
             "timestamp": utc_now().isoformat(),
         }
 
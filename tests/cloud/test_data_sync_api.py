@@ -1,9 +1,15 @@
 # imports
+import gzip
+import json
+import sqlite3
 import tempfile
+import tracemalloc
+from pathlib import Path
 
 import pytest
 from flask import Flask
 
+from Cloud.api.compression import ZSTD_AVAILABLE
 from Cloud.api.data_sync import _validate_user_id, data_sync_bp, init_data_sync_api
 
 
@@ -356,3 +362,392 @@ class TestDataSyncHistoryAPI:
             headers={'Authorization': f'Bearer {admin_token}'}
         )
         assert response.status_code == 200
+
+
+class TestDataSyncBatchAPI:
+    """測試批次同步端點"""
+
+    def test_batch_mixed_ops_with_per_op_results(self, client, app):
+        """測試混合操作類型的批次上傳，逐筆回傳結果"""
+        token = _make_token('user-123')
+        response = client.post(
+            '/api/cloud/data_sync/batch',
+            json={
+                'ops': [
+                    {'op_id': 'op-1', 'op_type': 'user_settings',
+                     'payload': {'user_id': 'user-123', 'settings': {'theme': 'dark'}}},
+                    {'op_id': 'op-2', 'op_type': 'command_history',
+                     'payload': {'user_id': 'user-123', 'records': [{'command_id': 'cmd-001'}]}},
+                    {'op_id': 'op-3', 'op_type': 'command_history',
+                     'payload': {'user_id': 'user-999', 'records': [{'command_id': 'cmd-002'}]}},
+                    {'op_id': 'op-4', 'op_type': 'unknown', 'payload': {'user_id': 'user-123'}},
+                ],
+                'edge_id': 'edge-001'
+            },
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        data = response.get_json()
+        assert response.status_code == 200
+        assert [r['op_id'] for r in data['results']] == ['op-1', 'op-2', 'op-3', 'op-4']
+        assert [r['success'] for r in data['results']] == [True, True, False, False]
+        assert data['results'][1]['synced_count'] == 1
+        assert data['results'][2]['status'] == 403
+        assert data['succeeded'] == 2
+        assert data['failed'] == 2
+
+        # 批次寫入的資料可由單筆端點讀取
+        history = client.get(
+            '/api/cloud/data_sync/history/user-123',
+            headers={'Authorization': f'Bearer {token}'}
+        ).get_json()
+        assert history['data']['total'] == 1
+        settings = client.get(
+            '/api/cloud/data_sync/settings/user-123',
+            headers={'Authorization': f'Bearer {token}'}
+        ).get_json()
+        assert settings['data']['settings'] == {'theme': 'dark'}
+        assert settings['data']['edge_id'] == 'edge-001'
+
+    def test_batch_rejects_too_many_ops(self, client, app):
+        """測試超過批次上限時回傳 413"""
+        from Cloud.api.data_sync import MAX_BATCH_OPS
+        token = _make_token('user-123')
+        op = {'op_type': 'user_settings', 'payload': {'user_id': 'user-123', 'settings': {}}}
+        response = client.post(
+            '/api/cloud/data_sync/batch',
+            json={'ops': [op] * (MAX_BATCH_OPS + 1)},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        assert response.status_code == 413
+
+    def test_batch_requires_auth(self, client):
+        """測試批次端點需要認證"""
+        response = client.post('/api/cloud/data_sync/batch', json={'ops': []})
+        assert response.status_code == 401
+
+
+class TestDataSyncHistoryDelta:
+    """測試指令歷史增量同步（高水位與游標）"""
+
+    def _upload(self, client, token, records, edge_id='edge-001'):
+        return client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': records, 'edge_id': edge_id},
+            headers={'Authorization': f'Bearer {token}'}
+        ).get_json()
+
+    def test_upload_advances_per_edge_watermark(self, client, app):
+        """上傳後回傳並保存此 Edge 的高水位，且只前進不後退"""
+        token = _make_token('user-123')
+        data = self._upload(client, token, [
+            {'command_id': 'cmd-002', 'created_at': '2026-01-01T00:00:02+00:00'},
+            {'command_id': 'cmd-001', 'created_at': '2026-01-01T00:00:01+00:00'},
+        ])
+        assert data['watermark'] == {'created_at': '2026-01-01T00:00:02+00:00', 'command_id': 'cmd-002'}
+
+        # 較舊的記錄不會讓水位後退
+        self._upload(client, token, [{'command_id': 'cmd-000', 'created_at': '2025-12-31T00:00:00+00:00'}])
+
+        response = client.get(
+            '/api/cloud/data_sync/history/user-123/watermark?edge_id=edge-001',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        assert response.get_json()['data']['command_id'] == 'cmd-002'
+
+        other = client.get(
+            '/api/cloud/data_sync/history/user-123/watermark?edge_id=edge-002',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        assert other.get_json()['data'] is None
+
+    def test_cursor_download_resumes_and_excludes_edge(self, client, app):
+        """游標下載從上次位置繼續，並可排除自己上傳的記錄"""
+        token = _make_token('user-123')
+        self._upload(client, token, [{'command_id': f'a-{i}'} for i in range(3)], edge_id='edge-a')
+        self._upload(client, token, [{'command_id': f'b-{i}'} for i in range(2)], edge_id='edge-b')
+
+        headers = {'Authorization': f'Bearer {token}'}
+        page1 = client.get(
+            '/api/cloud/data_sync/history/user-123?cursor=0&limit=2', headers=headers
+        ).get_json()['data']
+        assert [r['command_id'] for r in page1['records']] == ['a-0', 'a-1']
+        assert page1['has_more'] is True
+        assert page1['total'] is None
+
+        page2 = client.get(
+            f"/api/cloud/data_sync/history/user-123?cursor={page1['next_cursor']}&limit=10", headers=headers
+        ).get_json()['data']
+        assert [r['command_id'] for r in page2['records']] == ['a-2', 'b-0', 'b-1']
+        assert page2['has_more'] is False
+
+        others = client.get(
+            '/api/cloud/data_sync/history/user-123?cursor=0&exclude_edge_id=edge-a', headers=headers
+        ).get_json()['data']
+        assert [r['command_id'] for r in others['records']] == ['b-0', 'b-1']
+
+        # 已在最新位置時游標不變
+        empty = client.get(
+            f"/api/cloud/data_sync/history/user-123?cursor={page2['next_cursor']}", headers=headers
+        ).get_json()['data']
+        assert empty['records'] == []
+        assert empty['next_cursor'] == page2['next_cursor']
+
+
+class TestDataSyncCompression:
+    """測試請求/回應主體壓縮"""
+
+    def _records(self, count):
+        return [{'command_id': f'cmd-{i:04d}', 'status': 'succeeded', 'robot_id': 'robot-1'} for i in range(count)]
+
+    def test_gzip_request_body_accepted(self, client, app):
+        """Content-Encoding: gzip 的上傳主體以串流解壓後正常處理"""
+        token = _make_token('user-123')
+        body = gzip.compress(json.dumps({'records': self._records(50), 'edge_id': 'edge-001'}).encode())
+        response = client.post(
+            '/api/cloud/data_sync/history/user-123',
+            data=body,
+            headers={
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip',
+            }
+        )
+        assert response.status_code == 200
+        assert response.get_json()['synced_count'] == 50
+        assert 'gzip' in response.headers['Accept-Encoding']
+
+    def test_decompressed_size_cap(self, client, app, monkeypatch):
+        """解壓後超過上限的主體被拒絕（413）"""
+        import Cloud.api.compression as compression
+        monkeypatch.setattr(compression, 'MAX_DECOMPRESSED_BYTES', 1024)
+
+        token = _make_token('user-123')
+        body = gzip.compress(json.dumps({'records': self._records(200)}).encode())
+        assert len(body) < 1024
+        response = client.post(
+            '/api/cloud/data_sync/history/user-123',
+            data=body,
+            headers={'Authorization': f'Bearer {token}', 'Content-Encoding': 'gzip'}
+        )
+        assert response.status_code == 413
+
+    @pytest.mark.skipif(not ZSTD_AVAILABLE, reason="zstandard 未安裝")
+    def test_zstd_decompression_bomb_rejected(self, client, app, monkeypatch):
+        """高壓縮率的 zstd 主體解壓超過上限時中止（413），不會整塊展開"""
+        import zstandard
+
+        import Cloud.api.compression as compression
+        monkeypatch.setattr(compression, 'MAX_DECOMPRESSED_BYTES', 64 * 1024)
+
+        token = _make_token('user-123')
+        payload = json.dumps({'records': [], 'padding': 'a' * (8 * 1024 * 1024)}).encode()
+        body = zstandard.ZstdCompressor().compress(payload)
+        assert len(body) < 64 * 1024
+        del payload
+
+        tracemalloc.start()
+        try:
+            response = client.post(
+                '/api/cloud/data_sync/history/user-123',
+                data=body,
+                headers={'Authorization': f'Bearer {token}', 'Content-Encoding': 'zstd'}
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert response.status_code == 413
+        # 輸出受剩餘額度限制，峰值記憶體遠小於完整展開的 8 MiB
+        assert peak < 2 * 1024 * 1024
+
+    def test_unsupported_encoding_rejected(self, client, app):
+        """不支援的 Content-Encoding 回傳 415 並宣告可接受的編碼"""
+        token = _make_token('user-123')
+        response = client.post(
+            '/api/cloud/data_sync/settings/user-123',
+            data=b'...',
+            headers={'Authorization': f'Bearer {token}', 'Content-Encoding': 'br'}
+        )
+        assert response.status_code == 415
+        assert 'gzip' in response.headers['Accept-Encoding']
+
+    def test_large_response_compressed_when_accepted(self, client, app):
+        """客戶端接受 gzip 時，較大的下載回應以 gzip 壓縮"""
+        token = _make_token('user-123')
+        headers = {'Authorization': f'Bearer {token}'}
+        client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': self._records(100), 'edge_id': 'edge-001'},
+            headers=headers
+        )
+
+        plain = client.get('/api/cloud/data_sync/history/user-123?limit=100', headers=headers)
+        assert 'Content-Encoding' not in plain.headers
+
+        compressed = client.get(
+            '/api/cloud/data_sync/history/user-123?limit=100',
+            headers={**headers, 'Accept-Encoding': 'gzip'}
+        )
+        assert compressed.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in compressed.headers['Vary']
+        assert len(compressed.data) < len(plain.data)
+        assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+
+
+class TestDataSyncHistoryIngestion:
+    """測試指令歷史批量寫入與用戶計數器"""
+
+    def _upload(self, client, token, records):
+        return client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': records, 'edge_id': 'edge-001'},
+            headers={'Authorization': f'Bearer {token}'}
+        ).get_json()
+
+    def test_counter_tracks_inserted_rows_and_backfills(self, client, app, storage_dir):
+        """總筆數由計數器維護；計數器遺失（升級前資料）時以 COUNT(*) 回填一次"""
+        token = _make_token('user-123')
+        data = self._upload(client, token, [
+            {'command_id': 'cmd-1'}, {'command_id': 'cmd-2'}, {'command_id': 'cmd-1'}, {'status': 'no-id'},
+        ])
+        assert data['synced_count'] == 2
+        assert data['total'] == 2
+
+        db_path = Path(storage_dir) / 'command_history' / 'history.db'
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("DELETE FROM history_user_counts")
+
+        data = self._upload(client, token, [{'command_id': 'cmd-2'}, {'command_id': 'cmd-3'}])
+        assert data['synced_count'] == 1
+        assert data['total'] == 3
+
+        download = client.get(
+            '/api/cloud/data_sync/history/user-123',
+            headers={'Authorization': f'Bearer {token}'}
+        ).get_json()
+        assert download['data']['total'] == 3
+
+    def test_bulk_upload_counter_matches_rows(self, client, app, storage_dir):
+        """大批量上傳（含重複記錄）時，計數器總數與實際寫入列數一致"""
+        token = _make_token('user-123')
+        batch_size = 2000
+        for n in range(3):
+            # 每批與前一批重疊一半，重複記錄由 INSERT OR IGNORE 略過且不計入
+            start = n * batch_size // 2
+            records = [
+                {'command_id': f'cmd-{i}', 'status': 'succeeded', 'robot_id': 'robot-1'}
+                for i in range(start, start + batch_size)
+            ]
+            data = self._upload(client, token, records)
+            assert data['synced_count'] == (batch_size if n == 0 else batch_size // 2)
+            assert data['total'] == start + batch_size
+
+        db_path = Path(storage_dir) / 'command_history' / 'history.db'
+        with sqlite3.connect(db_path) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM command_history WHERE user_id = ?", ('user-123',)).fetchone()
+            counter = conn.execute(
+                "SELECT total FROM history_user_counts WHERE user_id = ?", ('user-123',)
+            ).fetchone()
+        assert rows[0] == counter[0] == 4000
+
+
+class TestDataSyncHistoryStream:
+    """測試 NDJSON 串流歷史下載"""
+
+    def _lines(self, response):
+        return [json.loads(line) for line in response.data.decode().splitlines()]
+
+    def test_stream_resumes_from_cursor_and_ends_with_trailer(self, client, app):
+        """串流依 id 順序逐行送出記錄，結尾標記提供 next_cursor"""
+        token = _make_token('user-123')
+        headers = {'Authorization': f'Bearer {token}'}
+        client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': [{'command_id': f'a-{i}'} for i in range(3)], 'edge_id': 'edge-a'},
+            headers=headers
+        )
+        client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': [{'command_id': 'b-0'}], 'edge_id': 'edge-b'},
+            headers=headers
+        )
+
+        response = client.get('/api/cloud/data_sync/history/user-123/stream', headers=headers)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = self._lines(response)
+        assert [line['record']['command_id'] for line in lines[:-1]] == ['a-0', 'a-1', 'a-2', 'b-0']
+        assert lines[-1] == {'done': True, 'next_cursor': lines[-2]['id'], 'count': 4, 'has_more': False}
+
+        limited = self._lines(client.get(
+            '/api/cloud/data_sync/history/user-123/stream?limit=2', headers=headers
+        ))
+        assert limited[-1]['has_more'] is True
+        resumed = self._lines(client.get(
+            f"/api/cloud/data_sync/history/user-123/stream?cursor={limited[-1]['next_cursor']}"
+            "&exclude_edge_id=edge-b",
+            headers=headers
+        ))
+        assert [line['record']['command_id'] for line in resumed[:-1]] == ['a-2']
+
+    def test_stream_compressed_incrementally(self, client, app):
+        """接受 gzip 時串流回應逐塊壓縮"""
+        token = _make_token('user-123')
+        headers = {'Authorization': f'Bearer {token}'}
+        client.post(
+            '/api/cloud/data_sync/history/user-123',
+            json={'records': [{'command_id': f'cmd-{i}'} for i in range(20)]},
+            headers=headers
+        )
+        response = client.get(
+            '/api/cloud/data_sync/history/user-123/stream',
+            headers={**headers, 'Accept-Encoding': 'gzip'}
+        )
+        assert response.headers['Content-Encoding'] == 'gzip'
+        lines = gzip.decompress(response.data).decode().splitlines()
+        assert len(lines) == 21
+        assert json.loads(lines[-1])['done'] is True
+
+    def test_stream_requires_auth(self, client):
+        response = client.get('/api/cloud/data_sync/history/user-123/stream')
+        assert response.status_code == 401
+
+
+class TestDataSyncConditionalGet:
+    """測試設定下載的 ETag / If-None-Match"""
+
+    def test_settings_etag_and_not_modified(self, client, app):
+        """內容未變更時回傳 304，設定更新後 ETag 改變"""
+        token = _make_token('user-123')
+        headers = {'Authorization': f'Bearer {token}'}
+        client.post('/api/cloud/data_sync/settings/user-123', json={'settings': {'theme': 'dark'}}, headers=headers)
+
+        first = client.get('/api/cloud/data_sync/settings/user-123', headers=headers)
+        etag = first.headers['ETag']
+        assert etag.startswith('"')
+
+        cached = client.get('/api/cloud/data_sync/settings/user-123', headers={**headers, 'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert cached.data == b''
+        assert cached.headers['ETag'] == etag
+
+        client.post('/api/cloud/data_sync/settings/user-123', json={'settings': {'theme': 'light'}}, headers=headers)
+        changed = client.get('/api/cloud/data_sync/settings/user-123', headers={**headers, 'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+
+    def test_compressed_representation_etag_revalidates(self, client, app):
+        """壓縮回應的 ETag 帶編碼後綴，回送時仍可比對成功"""
+        token = _make_token('user-123')
+        headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip'}
+        settings = {f'key_{i}': 'value' * 10 for i in range(50)}
+        client.post('/api/cloud/data_sync/settings/user-123', json={'settings': settings}, headers=headers)
+
+        first = client.get('/api/cloud/data_sync/settings/user-123', headers=headers)
+        assert first.headers['Content-Encoding'] == 'gzip'
+        assert first.headers['ETag'].endswith('-gzip"')
+
+        cached = client.get(
+            '/api/cloud/data_sync/settings/user-123',
+            headers={**headers, 'If-None-Match': first.headers['ETag']}
+        )
+        assert cached.status_code == 304
@@ -75,6 +75,27 @@ class TestEngagementAPIAuth(unittest.TestCase):
             resp = client.get('/api/cloud/engagement/leaderboard')
             self.assertEqual(resp.status_code, 200)
 
+    @patch('Cloud.engagement.api.get_service')
+    def test_get_leaderboard_rank_no_token(self, mock_get_service):
+        """GET 名次端點不需 token；用戶不存在時回傳 404"""
+        svc = MagicMock()
+        svc.get_rank.side_effect = lambda username, sort_by: 3 if username == 'alice' else None
+
+        @contextmanager
+        def _ctx():
+            yield svc
+
+        mock_get_service.side_effect = _ctx
+
+        with self.app.test_client() as client:
+            resp = client.get('/api/cloud/engagement/leaderboard/rank/alice?sort_by=level')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()['data']['rank'], 3)
+            svc.get_rank.assert_called_with('alice', sort_by='level')
+
+            resp = client.get('/api/cloud/engagement/leaderboard/rank/nobody')
+            self.assertEqual(resp.status_code, 404)
+
     @patch('Cloud.engagement.api.get_service')
     def test_get_posts_no_token(self, mock_get_service):
         """GET posts 端點不需 token"""
@@ -1,9 +1,16 @@
 # imports
+import random
+
 import pytest
 from unittest.mock import Mock, MagicMock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
+from Cloud.engagement.leaderboard import Leaderboard, RankedIndex, SORT_KEYS
 from Cloud.engagement.service import EngagementService, POINTS_AWARD, _calculate_level, _get_title_for_level
 from Cloud.engagement.models import (
+    Base,
     UserEngagementProfile,
     Post,
     PostComment,
@@ -335,3 +342,122 @@ class TestLevelCalculation:
         title_lv1 = _get_title_for_level(1)
         title_lv20 = _get_title_for_level(20)
         assert title_lv1 != title_lv20
+
+
+class TestRankedIndex:
+    """測試可索引跳躍串列"""
+
+    def test_matches_sorted_list_under_random_operations(self):
+        """隨機插入與刪除後，名次與區段查詢皆與排序後的列表一致"""
+        rng = random.Random(7)
+        index = RankedIndex(seed=7)
+        expected = []
+        for step in range(2000):
+            if expected and rng.random() < 0.4:
+                key = expected.pop(rng.randrange(len(expected)))
+                index.remove(key)
+            else:
+                key = (rng.randint(-50, 0), step)
+                index.insert(key)
+                expected.append(key)
+        expected.sort()
+
+        assert len(index) == len(expected)
+        assert index.slice(0, len(expected) + 5) == expected
+        assert index.slice(10, 7) == expected[10:17]
+        for position in range(0, len(expected), 37):
+            assert index.rank(expected[position]) == position
+        with pytest.raises(KeyError):
+            index.remove((1, -1))
+
+    def test_from_sorted_supports_later_updates(self):
+        """由已排序鍵批次建立後，後續插入與刪除仍維持正確名次"""
+        keys = [(-points, i) for i, points in enumerate(range(500, 0, -1))]
+        index = RankedIndex.from_sorted(keys, seed=1)
+        assert index.slice(0, 600) == keys
+        assert index.rank(keys[321]) == 321
+
+        index.remove(keys[0])
+        index.insert((-1000, 999))
+        expected = sorted(keys[1:] + [(-1000, 999)])
+        assert index.slice(0, 600) == expected
+        assert index.slice(250, 3) == expected[250:253]
+        assert index.rank((-1000, 999)) == 0
+
+
+class TestEngagementLeaderboard:
+    """測試排名索引與 SQL 排序結果一致"""
+
+    @pytest.fixture
+    def session_factory(self):
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        yield sessionmaker(bind=engine, expire_on_commit=False)
+        engine.dispose()
+
+    @pytest.fixture
+    def board(self):
+        return Leaderboard()
+
+    def _populate(self, session_factory, users=40, awards=300, seed=3):
+        rng = random.Random(seed)
+        session = session_factory()
+        service = EngagementService(session)
+        for i in range(users):
+            profile = service.get_or_create_profile(f'user{i:02d}')
+            profile.reputation = rng.randint(0, 5)
+            profile.total_commands = rng.randint(0, 5)
+        for _ in range(awards):
+            service.award_points(f'user{rng.randrange(users):02d}', 'custom', amount=rng.choice([1, 5, 20, 50]))
+        session.commit()
+        session.close()
+
+    def _assert_matches_sql(self, session, board):
+        indexed = EngagementService(session, leaderboard=board)
+        plain = EngagementService(session)
+        for sort_by in SORT_KEYS:
+            expected = [p.user_username for p in plain.get_leaderboard(limit=100, sort_by=sort_by)]
+            actual = [p.user_username for p in indexed.get_leaderboard(limit=100, sort_by=sort_by)]
+            assert actual == expected, sort_by
+            assert [p.user_username for p in indexed.get_leaderboard(limit=5, sort_by=sort_by, offset=7)] == \
+                expected[7:12]
+            for position, username in enumerate(expected):
+                assert board.rank(username, sort_by) == position + 1
+                assert plain.get_rank(username, sort_by) == position + 1
+
+    def test_rebuild_and_incremental_updates_match_sql(self, session_factory, board):
+        """啟動時重建與之後逐筆更新的排名，都與 SQL ORDER BY 一致"""
+        self._populate(session_factory)
+        session = session_factory()
+        assert board.rebuild(session) == 40
+        self._assert_matches_sql(session, board)
+
+        rng = random.Random(11)
+        service = EngagementService(session, leaderboard=board)
+        for _ in range(200):
+            service.award_points(f'user{rng.randrange(45):02d}', 'custom', amount=rng.choice([1, 5, 20, 50]))
+            if rng.random() < 0.3:
+                session.commit()
+        session.commit()
+        assert len(board) == len(service.get_leaderboard(limit=100))
+        self._assert_matches_sql(session, board)
+        session.close()
+
+    def test_rolled_back_awards_not_ranked(self, session_factory, board):
+        """回滾的積分不進入排名索引；索引在第一次查詢時自動載入"""
+        self._populate(session_factory, users=3, awards=0)
+        session = session_factory()
+        service = EngagementService(session, leaderboard=board)
+        assert service.get_rank('user02') == 3
+        assert board.is_loaded
+
+        service.award_points('user02', 'custom', amount=100)
+        session.rollback()
+        assert service.get_rank('user02') == 3
+
+        service.award_points('user02', 'custom', amount=100)
+        session.commit()
+        assert service.get_rank('user02') == 1
+        assert service.get_leaderboard(limit=1)[0].user_username == 'user02'
+        assert service.get_rank('nobody') is None
+        session.close()
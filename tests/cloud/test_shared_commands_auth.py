@@ -3,6 +3,7 @@
 """
 
 import unittest
+from datetime import datetime
 from unittest.mock import Mock, patch, MagicMock
 
 from Cloud.api.auth import CloudAuthService
@@ -10,6 +11,7 @@ from Cloud.shared_commands.api import (
     init_shared_commands_auth,
     bp as shared_commands_bp
 )
+from Cloud.shared_commands.browse_cache import browse_cache
 
 
 class TestSharedCommandsAuth(unittest.TestCase):
@@ -246,6 +248,151 @@ class TestSharedCommandsAuth(unittest.TestCase):
             response = client.get('/api/cloud/shared_commands/featured')
             self.assertEqual(response.status_code, 200)
 
+    @patch('Cloud.shared_commands.api.get_service')
+    def test_conditional_search_and_download(self, mock_get_service):
+        """搜尋結果未變更時回傳 304；下載內容未變更時回傳 412 且不計入下載"""
+        from flask import Flask
+
+        app = Flask(__name__)
+        app.register_blueprint(shared_commands_bp)
+
+        mock_command = Mock(
+            id=1, name='test', description='desc', category='test', content='[]', version=2
+        )
+        mock_command.to_dict.return_value = {"id": 1, "name": "test"}
+
+        mock_service = Mock()
+        mock_service.search_commands.return_value = ([], 0)
+        mock_service.get_command.return_value = mock_command
+        mock_service.download_command.return_value = mock_command
+        mock_ctx = MagicMock()
+        mock_ctx.__enter__.return_value = mock_service
+        mock_ctx.__exit__.return_value = False
+        mock_get_service.return_value = mock_ctx
+
+        token = self.auth_service.generate_token(user_id="test-user", username="testuser")
+        auth = {'Authorization': f'Bearer {token}'}
+
+        with app.test_client() as client:
+            search = client.get('/api/cloud/shared_commands/search')
+            etag = search.headers['ETag']
+            response = client.get('/api/cloud/shared_commands/search', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+            download = client.post(
+                '/api/cloud/shared_commands/1/download', json={'edge_id': 'edge-001'}, headers=auth
+            )
+            self.assertEqual(download.status_code, 200)
+            self.assertEqual(mock_service.download_command.call_count, 1)
+
+            response = client.post(
+                '/api/cloud/shared_commands/1/download',
+                json={'edge_id': 'edge-001'},
+                headers={**auth, 'If-None-Match': download.headers['ETag']}
+            )
+            self.assertEqual(response.status_code, 412)
+            self.assertEqual(mock_service.download_command.call_count, 1)
+
+            # 指令版本更新後重新下載
+            mock_command.version = 3
+            response = client.post(
+                '/api/cloud/shared_commands/1/download',
+                json={'edge_id': 'edge-001'},
+                headers={**auth, 'If-None-Match': download.headers['ETag']}
+            )
+            self.assertEqual(response.status_code, 200)
+
+    @patch('Cloud.shared_commands.api.get_service')
+    def test_cached_listings_and_cache_stats(self, mock_get_service):
+        """瀏覽列表經快取且支援 304；快取統計僅限管理員"""
+        from flask import Flask
+
+        app = Flask(__name__)
+        app.register_blueprint(shared_commands_bp)
+        browse_cache.clear()
+
+        mock_service = Mock()
+        mock_service.get_categories.return_value = [{'category': 'patrol', 'count': 3}]
+        mock_ctx = MagicMock()
+        mock_ctx.__enter__.return_value = mock_service
+        mock_ctx.__exit__.return_value = False
+        mock_get_service.return_value = mock_ctx
+
+        user_token = self.auth_service.generate_token(user_id="u1", username="user", role="user")
+        admin_token = self.auth_service.generate_token(user_id="a1", username="admin", role="admin")
+
+        with app.test_client() as client:
+            first = client.get('/api/cloud/shared_commands/categories')
+            self.assertEqual(first.status_code, 200)
+            response = client.get(
+                '/api/cloud/shared_commands/categories', headers={'If-None-Match': first.headers['ETag']}
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(mock_service.get_categories.call_count, 1)
+
+            response = client.get(
+                '/api/cloud/shared_commands/cache/stats', headers={'Authorization': f'Bearer {user_token}'}
+            )
+            self.assertEqual(response.status_code, 403)
+
+            response = client.get(
+                '/api/cloud/shared_commands/cache/stats', headers={'Authorization': f'Bearer {admin_token}'}
+            )
+            self.assertEqual(response.status_code, 200)
+            stats = response.get_json()['data']['categories']
+            self.assertEqual(stats['hits'], 1)
+            self.assertEqual(stats['misses'], 1)
+
+        browse_cache.clear()
+
+    @patch('Cloud.shared_commands.api.get_service')
+    def test_command_changes_requires_auth_and_returns_watermark(self, mock_get_service):
+        """變更端點需認證；回傳最後一筆的 (updated_at, id) 作為下一個水位"""
+        from flask import Flask
+
+        app = Flask(__name__)
+        app.register_blueprint(shared_commands_bp)
+
+        changed = Mock()
+        changed.to_dict.return_value = {'id': 7, 'name': 'wave', 'updated_at': '2026-01-01T12:00:00.500000'}
+        mock_service = Mock()
+        mock_service.get_changed_commands.return_value = ([changed], False)
+        mock_ctx = MagicMock()
+        mock_ctx.__enter__.return_value = mock_service
+        mock_ctx.__exit__.return_value = False
+        mock_get_service.return_value = mock_ctx
+
+        token = self.auth_service.generate_token(user_id="u1", username="user", role="user")
+        auth = {'Authorization': f'Bearer {token}'}
+
+        with app.test_client() as client:
+            response = client.get('/api/cloud/shared_commands/changes')
+            self.assertEqual(response.status_code, 401)
+
+            response = client.get('/api/cloud/shared_commands/changes?since=yesterday', headers=auth)
+            self.assertEqual(response.status_code, 400)
+
+            response = client.get(
+                '/api/cloud/shared_commands/changes?since=2026-01-01T00:00:00%2B00:00&since_id=3&limit=50',
+                headers=auth
+            )
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()['data']
+            self.assertEqual(data['next_watermark'], {'updated_at': '2026-01-01T12:00:00.500000', 'id': 7})
+            self.assertFalse(data['has_more'])
+            kwargs = mock_service.get_changed_commands.call_args.kwargs
+            self.assertEqual(kwargs['since'], datetime(2026, 1, 1))
+            self.assertEqual(kwargs['since_id'], 3)
+            self.assertEqual(kwargs['limit'], 50)
+
+            mock_service.get_changed_commands.return_value = ([], False)
+            response = client.get(
+                '/api/cloud/shared_commands/changes?since=2026-01-01T12:00:00.500000&since_id=7', headers=auth
+            )
+            self.assertEqual(
+                response.get_json()['data']['next_watermark'], {'updated_at': '2026-01-01T12:00:00.500000', 'id': 7}
+            )
+
 
 if __name__ == '__main__':
     unittest.main()
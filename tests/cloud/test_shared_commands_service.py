@@ -1,12 +1,26 @@
 # imports
+from datetime import datetime, timedelta
+
 import pytest
 from unittest.mock import Mock, MagicMock
 
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
 from Cloud.shared_commands.service import SharedCommandService
 from Cloud.shared_commands.models import (
+    Base,
     SharedAdvancedCommand,
     CommandRating
 )
+from Cloud.shared_commands.browse_cache import BrowseCache, FEATURED, POPULAR, CATEGORIES
+from Cloud.shared_commands.counters import CommandCounterBuffer
+from Cloud.shared_commands.search_index import (
+    build_match_expression,
+    ensure_search_index,
+    get_search_tokenizer
+)
 
 
 class TestSharedCommandService:
@@ -270,3 +284,472 @@ class TestSharedCommandService:
         assert len(categories) == 2
         assert categories[0]["category"] == "test"
         assert categories[0]["count"] == 5
+
+
+class TestSharedCommandFullTextSearch:
+    """測試共享指令全文檢索索引（SQLite FTS5）"""
+
+    @pytest.fixture
+    def engine(self):
+        """建立含全文檢索索引的 in-memory SQLite 引擎"""
+        engine = create_engine(
+            'sqlite://',
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool
+        )
+        Base.metadata.create_all(engine)
+        if not ensure_search_index(engine):
+            pytest.skip("SQLite FTS5 not available")
+        yield engine
+        engine.dispose()
+
+    @pytest.fixture
+    def db_session(self, engine):
+        session = sessionmaker(bind=engine, expire_on_commit=False)()
+        yield session
+        session.close()
+
+    @pytest.fixture
+    def service(self, db_session):
+        return SharedCommandService(db_session)
+
+    def _upload(self, service, name, description, author='alice', category='motion'):
+        return service.upload_command(
+            name=name,
+            description=description,
+            category=category,
+            content='[]',
+            author_username=author,
+            author_email=f'{author}@example.com',
+            edge_id='edge-001',
+            original_command_id=1
+        )
+
+    def test_search_matches_name_and_description(self, service):
+        """關鍵字比對名稱與說明中的子字串"""
+        self._upload(service, 'wave arm', 'greet visitors')
+        self._upload(service, 'dance', 'a routine that waves both arms')
+        self._upload(service, 'walk', 'walk forward')
+
+        commands, total = service.search_commands(query='wave')
+
+        assert total == 2
+        assert {cmd.name for cmd in commands} == {'wave arm', 'dance'}
+
+    def test_search_matches_chinese_substring(self, service):
+        """trigram 分詞可比對中文子字串，少於 3 字的詞在索引命中的列上篩選"""
+        self._upload(service, '巡邏機器人', '夜間倉庫巡邏路線')
+        self._upload(service, '充電', '返回充電座')
+
+        commands, total = service.search_commands(query='機器人')
+        assert total == 1
+        assert commands[0].name == '巡邏機器人'
+
+        commands, total = service.search_commands(query='倉庫 巡邏路線')
+        assert total == 1
+
+        # 只有短詞時退回 ILIKE
+        commands, total = service.search_commands(query='充電')
+        assert total == 1
+        assert commands[0].name == '充電'
+
+    def test_index_follows_upload_updates(self, service, db_session):
+        """更新指令說明後索引同步，刪除後不再命中"""
+        self._upload(service, 'patrol', 'old route description')
+        self._upload(service, 'patrol', 'new warehouse loop')
+
+        assert service.search_commands(query='route')[1] == 0
+        assert service.search_commands(query='warehouse')[1] == 1
+
+        db_session.delete(db_session.query(SharedAdvancedCommand).filter_by(name='patrol').one())
+        db_session.commit()
+        assert service.search_commands(query='warehouse')[1] == 0
+
+    def test_relevance_blends_rating_and_downloads(self, service, db_session):
+        """文字相關性相同時，評分與下載數較高者排前面；名稱命中優先於說明命中"""
+        plain = self._upload(service, 'lift box', 'move cargo', author='alice')
+        popular = self._upload(service, 'lift box', 'move cargo', author='bob')
+        popular.average_rating = 4.8
+        popular.download_count = 500
+        described = self._upload(service, 'carry', 'lift the box onto the shelf', author='carol')
+        described.average_rating = 5.0
+        db_session.commit()
+
+        commands, total = service.search_commands(query='lift')
+
+        assert total == 3
+        assert [cmd.id for cmd in commands] == [popular.id, plain.id, described.id]
+
+    def test_explicit_sort_and_filters(self, service, db_session):
+        """指定排序欄位與篩選條件時仍以索引比對"""
+        low = self._upload(service, 'scan shelf', 'inventory scan', author='alice', category='inspect')
+        high = self._upload(service, 'scan floor', 'floor scan', author='bob', category='inspect')
+        self._upload(service, 'scan wall', 'wall scan', author='carol', category='motion')
+        low.download_count = 1
+        high.download_count = 9
+        db_session.commit()
+
+        commands, total = service.search_commands(
+            query='scan', category='inspect', sort_by='downloads', order='asc'
+        )
+
+        assert total == 2
+        assert [cmd.id for cmd in commands] == [low.id, high.id]
+
+    def test_private_commands_excluded(self, service, db_session):
+        """非公開指令不出現在搜尋結果"""
+        command = self._upload(service, 'secret patrol', 'hidden route')
+        command.is_public = False
+        db_session.commit()
+
+        assert service.search_commands(query='patrol') == ([], 0)
+
+    def test_query_syntax_is_escaped(self, service):
+        """FTS5 語法字元視為一般文字，不會造成查詢錯誤"""
+        self._upload(service, 'grip "AND" release', 'gripper test')
+
+        commands, total = service.search_commands(query='"AND" OR* NEAR(')
+        assert total == 0
+
+        commands, total = service.search_commands(query='"AND"')
+        assert total == 1
+
+    def test_fallback_matches_index_results(self, db_session, service):
+        """停用索引時以 ILIKE 篩選，單一關鍵字的結果與索引相同"""
+        self._upload(service, 'wave arm', 'greet visitors')
+        self._upload(service, 'dance', 'arm waves')
+
+        fallback = SharedCommandService(db_session, use_search_index=False)
+        indexed_total = service.search_commands(query='wave')[1]
+        assert fallback.search_commands(query='wave')[1] == indexed_total == 2
+
+    def test_existing_rows_indexed_on_creation(self):
+        """索引建立時以既有資料重建"""
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(SharedAdvancedCommand(name='legacy patrol', content='[]', author_username='alice'))
+        session.commit()
+
+        if not ensure_search_index(engine):
+            pytest.skip("SQLite FTS5 not available")
+
+        assert get_search_tokenizer(engine) in ('trigram', 'unicode61')
+        assert SharedCommandService(session).search_commands(query='patrol')[1] == 1
+        session.close()
+        engine.dispose()
+
+    def test_build_match_expression(self):
+        """關鍵字轉為引號包住的 MATCH 詞，trigram 下短詞另外返回"""
+        assert build_match_expression('wave  arms', 'trigram') == ('"wave" "arms"', [])
+        assert build_match_expression('巡邏路線 前進', 'trigram') == ('"巡邏路線"', ['前進'])
+        assert build_match_expression('前進', 'trigram') == (None, ['前進'])
+        assert build_match_expression('say "hi"', 'unicode61') == ('"say"* """hi"""*', [])
+        assert build_match_expression('   ', 'trigram') == (None, [])
+
+
+class TestSharedCommandBrowseCache:
+    """測試精選／熱門／分類列表快取與寫入觸發的失效"""
+
+    @pytest.fixture
+    def db_session(self):
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine, expire_on_commit=False)()
+        yield session
+        session.close()
+        engine.dispose()
+
+    @pytest.fixture
+    def cache(self):
+        return BrowseCache()
+
+    @pytest.fixture
+    def service(self, db_session, cache):
+        return SharedCommandService(db_session, cache=cache)
+
+    def _upload(self, service, name, category='motion', downloads=0, rating=0.0, featured=False):
+        command = service.upload_command(
+            name=name,
+            description=f'{name} description',
+            category=category,
+            content='[]',
+            author_username='alice',
+            author_email='alice@example.com',
+            edge_id='edge-001',
+            original_command_id=1
+        )
+        command.download_count = downloads
+        command.average_rating = rating
+        command.is_featured = featured
+        service.db.commit()
+        return command
+
+    def _popular(self, service, cache, limit=2):
+        return cache.get_or_build(
+            POPULAR, limit, lambda: [cmd.to_dict() for cmd in service.get_popular_commands(limit)]
+        )
+
+    def test_hit_miss_and_stats(self, cache):
+        """命中時不重建，統計命中率與重建耗時"""
+        builds = []
+
+        def builder():
+            builds.append(1)
+            return [{'category': 'motion', 'count': 1}]
+
+        first = cache.get_or_build(CATEGORIES, None, builder)
+        second = cache.get_or_build(CATEGORIES, None, builder)
+
+        assert first == second
+        assert len(builds) == 1
+        stats = cache.get_stats()[CATEGORIES]
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_rate'] == 0.5
+        assert stats['rebuilds'] == 1
+        assert stats['entries'] == 1
+        assert stats['max_rebuild_ms'] >= stats['last_rebuild_ms'] >= 0
+
+    def test_expired_entry_rebuilt_with_same_etag(self):
+        """TTL 到期後重建；內容不變時 ETag 相同，Edge 仍可得到 304"""
+        cache = BrowseCache(ttls={FEATURED: 0})
+        _, etag1 = cache.get_or_build(FEATURED, 10, lambda: [{'id': 1}])
+        _, etag2 = cache.get_or_build(FEATURED, 10, lambda: [{'id': 1}])
+        _, etag3 = cache.get_or_build(FEATURED, 10, lambda: [{'id': 2}])
+
+        assert etag1 == etag2 != etag3
+        assert cache.get_stats()[FEATURED]['rebuilds'] == 3
+
+    def test_invalidated_during_build_is_not_stored(self, cache):
+        """重建期間發生失效時，結果返回但不寫入快取"""
+        def builder():
+            cache.invalidate(POPULAR)
+            return [{'id': 1, 'download_count': 0}]
+
+        cache.get_or_build(POPULAR, 10, builder)
+
+        assert cache.get_stats()[POPULAR]['entries'] == 0
+
+    def test_upload_invalidates_categories(self, service, cache):
+        """上傳新指令後分類數量重新計算"""
+        self._upload(service, 'wave')
+        categories, etag = cache.get_or_build(CATEGORIES, None, service.get_categories)
+        assert categories == [{'category': 'motion', 'count': 1}]
+
+        self._upload(service, 'walk')
+        categories, new_etag = cache.get_or_build(CATEGORIES, None, service.get_categories)
+
+        assert categories == [{'category': 'motion', 'count': 2}]
+        assert new_etag != etag
+
+    def test_download_reordering_popular_invalidates(self, service, cache):
+        """下載使指令進入熱門前 N 名或超過前一名時失效，否則保留快取"""
+        top = self._upload(service, 'top', downloads=10)
+        second = self._upload(service, 'second', downloads=5)
+        outside = self._upload(service, 'outside', downloads=1)
+        commands, _ = self._popular(service, cache)
+        assert [cmd['id'] for cmd in commands] == [top.id, second.id]
+
+        # 不改變排名：保留快取
+        service.download_command(top.id, 'edge-002')
+        service.download_command(outside.id, 'edge-002')
+        assert cache.get_stats()[POPULAR]['invalidations'] == 0
+
+        # 超過最後一名：進入列表
+        for _ in range(4):
+            service.download_command(outside.id, 'edge-002')
+        commands, _ = self._popular(service, cache)
+        assert [cmd['id'] for cmd in commands] == [top.id, outside.id]
+        assert cache.get_stats()[POPULAR]['invalidations'] == 1
+
+    def test_rating_featured_command_invalidates_featured(self, service, cache):
+        """評分精選指令時精選列表失效；非精選指令的評分不影響"""
+        featured = self._upload(service, 'featured', rating=3.0, featured=True)
+        plain = self._upload(service, 'plain')
+
+        def featured_listing():
+            return cache.get_or_build(
+                FEATURED, 10, lambda: [cmd.to_dict() for cmd in service.get_featured_commands(10)]
+            )
+
+        featured_listing()
+        service.rate_command(plain.id, 'bob', 5)
+        assert cache.get_stats()[FEATURED]['invalidations'] == 0
+
+        service.rate_command(featured.id, 'bob', 5)
+        commands, _ = featured_listing()
+        assert commands[0]['average_rating'] == 5.0
+        assert cache.get_stats()[FEATURED]['invalidations'] == 1
+
+
+class TestSharedCommandCounterBuffer:
+    """測試下載／使用／評分計數器的寫回緩衝"""
+
+    @pytest.fixture
+    def engine(self):
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        yield engine
+        engine.dispose()
+
+    @pytest.fixture
+    def session_factory(self, engine):
+        return sessionmaker(bind=engine, expire_on_commit=False)
+
+    @pytest.fixture
+    def counters(self):
+        return CommandCounterBuffer()
+
+    @pytest.fixture
+    def service(self, session_factory, counters):
+        session = session_factory()
+        yield SharedCommandService(session, counters=counters)
+        session.close()
+
+    def _upload(self, service, name, downloads=0):
+        command = service.upload_command(
+            name=name,
+            description='',
+            category='motion',
+            content='[]',
+            author_username='alice',
+            author_email='alice@example.com',
+            edge_id='edge-001',
+            original_command_id=1
+        )
+        command.download_count = downloads
+        service.db.commit()
+        return command
+
+    def _stored(self, session_factory, command_id):
+        session = session_factory()
+        try:
+            return session.get(SharedAdvancedCommand, command_id)
+        finally:
+            session.close()
+
+    def test_downloads_buffered_until_flush(self, service, counters, session_factory, engine):
+        """下載只累加增量；讀取包含未寫回的增量，寫回後資料庫一致"""
+        command = self._upload(service, 'wave', downloads=2)
+
+        for _ in range(3):
+            assert service.download_command(command.id, 'edge-002').download_count > 2
+
+        assert self._stored(session_factory, command.id).download_count == 2
+        other = SharedCommandService(session_factory(), counters=counters)
+        assert other.get_command(command.id).download_count == 5
+        # 同一物件重複套用不會重複累加
+        assert other.get_command(command.id).download_count == 5
+
+        assert counters.flush(engine) == 1
+        assert self._stored(session_factory, command.id).download_count == 5
+        assert counters.pending(command.id)['download_count'] == 0
+        assert SharedCommandService(session_factory(), counters=counters).get_command(command.id).download_count == 5
+
+    def test_popular_includes_pending_downloads(self, service):
+        """熱門列表以包含未寫回下載數的值排序"""
+        first = self._upload(service, 'first', downloads=3)
+        second = self._upload(service, 'second', downloads=2)
+
+        for _ in range(2):
+            service.download_command(second.id, 'edge-002')
+
+        commands = service.get_popular_commands(limit=2)
+        assert [cmd.id for cmd in commands] == [second.id, first.id]
+        assert commands[0].download_count == 4
+
+    def test_ratings_buffered_without_row_lock(self, service, counters, session_factory, engine):
+        """評分只寫入評分記錄，平均評分由緩衝寫回；更新評分只計入差值"""
+        command = self._upload(service, 'wave')
+
+        service.rate_command(command.id, 'bob', 4)
+        service.rate_command(command.id, 'carol', 2)
+        service.rate_command(command.id, 'bob', 5)
+
+        stored = self._stored(session_factory, command.id)
+        assert (stored.rating_count, stored.average_rating) == (0, 0.0)
+        reader = SharedCommandService(session_factory(), counters=counters).get_command(command.id)
+        assert reader.rating_count == 2
+        assert reader.average_rating == pytest.approx(3.5)
+
+        counters.flush(engine)
+        stored = self._stored(session_factory, command.id)
+        assert stored.rating_count == 2
+        assert stored.average_rating == pytest.approx(3.5)
+
+    def test_failed_flush_keeps_deltas(self, counters, engine, session_factory, service):
+        """寫回失敗時增量留在緩衝中，下次寫回"""
+        command = self._upload(service, 'wave')
+        service.download_command(command.id, 'edge-002')
+
+        broken = MagicMock()
+        broken.begin.side_effect = RuntimeError("database is locked")
+        assert counters.flush(broken) == 0
+        assert counters.get_stats()['flush_failures'] == 1
+        assert counters.pending(command.id)['download_count'] == 1
+
+        assert counters.flush(engine) == 1
+        assert self._stored(session_factory, command.id).download_count == 1
+
+
+class TestSharedCommandChanges:
+    """測試以 (updated_at, id) 水位增量取得變更的公開指令"""
+
+    @pytest.fixture
+    def service(self):
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        yield SharedCommandService(session)
+        session.close()
+        engine.dispose()
+
+    def _add(self, service, name, updated_at, is_public=True):
+        command = SharedAdvancedCommand(
+            name=name,
+            content='[]',
+            author_username='alice',
+            is_public=is_public,
+            updated_at=updated_at
+        )
+        service.db.add(command)
+        service.db.commit()
+        return command
+
+    def test_keyset_pages_by_updated_at_then_id(self, service):
+        """同一 updated_at 以 id 排序；分頁從水位之後繼續，不重複也不遺漏"""
+        t0 = datetime(2026, 1, 1, 12, 0, 0)
+        later = self._add(service, 'later', t0 + timedelta(minutes=5))
+        first = self._add(service, 'first', t0)
+        second = self._add(service, 'second', t0)
+        self._add(service, 'private', t0 + timedelta(minutes=1), is_public=False)
+
+        page, has_more = service.get_changed_commands(limit=2)
+        assert [cmd.name for cmd in page] == ['first', 'second']
+        assert has_more is True
+
+        page, has_more = service.get_changed_commands(since=second.updated_at, since_id=second.id, limit=2)
+        assert [cmd.name for cmd in page] == ['later']
+        assert has_more is False
+
+        page, has_more = service.get_changed_commands(since=later.updated_at, since_id=later.id)
+        assert page == []
+        assert has_more is False
+
+        # 水位之後再次更新的指令重新出現
+        first.description = 'edited'
+        first.updated_at = t0 + timedelta(minutes=10)
+        service.db.commit()
+        page, _ = service.get_changed_commands(since=later.updated_at, since_id=later.id)
+        assert [cmd.name for cmd in page] == ['first']
+
+    def test_recent_changes_wait_for_settle_window(self, service):
+        """updated_at 在 settle 時間內的變更下次同步才返回，避免較晚提交的變更落在水位之前"""
+        self._add(service, 'fresh', datetime.utcnow())
+
+        page, _ = service.get_changed_commands()
+        assert page == []
+
+        page, _ = service.get_changed_commands(settle_seconds=0)
+        assert [cmd.name for cmd in page] == ['fresh']
@@ -87,6 +87,17 @@ class TestCommandHistoryStore:
         success = history_store.add_record(sample_record)
         assert success is False
     
+    def test_add_records_bulk(self, history_store, sample_record):
+        """測試批量新增記錄（略過重複與無效記錄）"""
+        history_store.add_record(sample_record)
+        other = sample_record.to_dict()
+        other['command_id'] = 'cmd-002'
+
+        inserted = history_store.add_records([sample_record.to_dict(), other, {'command_id': 'bad'}])
+        assert inserted == 1
+        assert history_store.get_record('cmd-002').robot_id == 'robot_7'
+        assert history_store.add_records([]) == 0
+
     def test_get_record(self, history_store, sample_record):
         """測試取得記錄"""
         history_store.add_record(sample_record)
@@ -1,4 +1,8 @@
 # imports
+import gzip
+import io
+import json
+
 import pytest
 from unittest.mock import Mock, patch
 import requests
@@ -182,6 +186,25 @@ class TestCloudSyncClient:
         call_kwargs = mock_get.call_args[1]
         assert call_kwargs['params'] == {'limit': 50, 'offset': 0}
 
+    @patch('Edge.cloud_sync.client.requests.Session.get')
+    def test_get_command_changes_sends_watermark(self, mock_get, client):
+        """增量取得指令變更時帶上 (since, since_id) 水位；首次同步不帶水位"""
+        mock_response = Mock()
+        mock_response.json.return_value = {
+            'success': True,
+            'data': {'commands': [], 'next_watermark': None, 'has_more': False}
+        }
+        mock_response.raise_for_status = Mock()
+        mock_get.return_value = mock_response
+
+        client.get_command_changes(limit=200)
+        assert mock_get.call_args[1]['params'] == {'limit': 200}
+
+        result = client.get_command_changes(since='2026-01-01T00:00:00', since_id=7)
+        assert result['success'] is True
+        assert mock_get.call_args[0][0].endswith('/shared_commands/changes')
+        assert mock_get.call_args[1]['params'] == {'limit': 500, 'since': '2026-01-01T00:00:00', 'since_id': 7}
+
     # ==================== 各方法失敗案例（異常處理）====================
 
     @patch('Edge.cloud_sync.client.requests.Session.post')
@@ -437,3 +460,155 @@ class TestCloudSyncClient:
         update_jwt_token(c, 'new-token')
         assert c.jwt_token == 'new-token'
         assert c.session.headers.get('Authorization') == 'Bearer new-token'
+
+    def test_network_monitor_receives_request_outcomes(self):
+        """提供 network_monitor 時，實際請求結果應回報為被動連線信號"""
+        monitor = Mock()
+        c = CloudSyncClient(
+            cloud_api_url='https://cloud.example.com/api/cloud',
+            edge_id='edge-001',
+            network_monitor=monitor
+        )
+
+        response = requests.Response()
+        response.status_code = 503
+        with patch('requests.adapters.HTTPAdapter.send', return_value=response):
+            c.session.get('https://cloud.example.com/api/cloud/health')
+        monitor.record_success.assert_called_once()
+        assert monitor.record_success.call_args.kwargs['source'] == 'cloud_sync'
+
+        with patch('requests.adapters.HTTPAdapter.send', side_effect=requests.ConnectionError('refused')):
+            with pytest.raises(requests.ConnectionError):
+                c.session.get('https://cloud.example.com/api/cloud/health')
+        monitor.record_failure.assert_called_once()
+
+    @staticmethod
+    def _json_response(status_code, payload, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(payload).encode()
+        response.headers.update(headers or {})
+        return response
+
+    def test_upload_compressed_after_cloud_advertises_gzip(self, client):
+        """雲端宣告 Accept-Encoding 前不壓縮，之後較大的上傳主體以 gzip 壓縮並記錄線上位元組"""
+        records = [{'command_id': f'cmd-{i}', 'status': 'succeeded'} for i in range(100)]
+        ok = self._json_response(200, {'success': True}, {'Accept-Encoding': 'gzip'})
+
+        with patch('Edge.cloud_sync.client.requests.Session.post', return_value=ok) as mock_post:
+            client.upload_command_history('user-1', records)
+            first = mock_post.call_args.kwargs
+            assert 'Content-Encoding' not in first['headers']
+
+            client.upload_command_history('user-1', records)
+            second = mock_post.call_args.kwargs
+            assert second['headers']['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(second['data']))['records'] == records
+
+        stats = client.get_transfer_stats()
+        assert stats['requests'] == 2
+        assert stats['compressed_uploads'] == 1
+        assert stats['bytes_sent'] == len(first['data']) + len(second['data'])
+        assert stats['bytes_sent_uncompressed'] == 2 * len(first['data'])
+        assert stats['bytes_saved'] > 0
+
+    def test_upload_falls_back_to_identity_on_415(self, client):
+        """雲端拒絕壓縮主體（415）時改以未壓縮主體重送"""
+        client._upload_encodings = ('gzip',)
+        records = [{'command_id': f'cmd-{i}'} for i in range(100)]
+        rejected = self._json_response(415, {'success': False})
+        ok = self._json_response(200, {'success': True})
+
+        with patch('Edge.cloud_sync.client.requests.Session.post', side_effect=[rejected, ok]) as mock_post:
+            result = client.upload_command_history('user-1', records)
+
+        assert result['success'] is True
+        assert mock_post.call_count == 2
+        assert 'Content-Encoding' not in mock_post.call_args.kwargs['headers']
+        assert client._choose_upload_encoding() is None
+
+    @staticmethod
+    def _ndjson_response(lines):
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(''.join(json.dumps(line) + '\n' for line in lines).encode())
+        return response
+
+    def test_history_stream_consumed_in_batches(self, client):
+        """NDJSON 串流逐批產出記錄與游標，並記錄接收位元組"""
+        lines = [{'id': i, 'record': {'command_id': f'cmd-{i}'}} for i in range(1, 6)]
+        lines.append({'done': True, 'next_cursor': 5, 'count': 5, 'has_more': False})
+
+        response = self._ndjson_response(lines)
+        with patch('Edge.cloud_sync.client.requests.Session.get', return_value=response) as mock_get:
+            batches = list(client.iter_command_history_stream('user-1', cursor=0, batch_size=2))
+
+        assert [cursor for _, cursor in batches] == [2, 4, 5]
+        assert [len(records) for records, _ in batches] == [2, 2, 1]
+        assert mock_get.call_args.kwargs['stream'] is True
+        assert client.get_transfer_stats()['bytes_received'] > 0
+
+    def test_history_stream_without_trailer_raises(self, client):
+        """串流未以 done=true 結尾時視為不完整"""
+        lines = [{'id': 1, 'record': {'command_id': 'cmd-1'}}]
+        with patch('Edge.cloud_sync.client.requests.Session.get', return_value=self._ndjson_response(lines)):
+            with pytest.raises(requests.RequestException):
+                list(client.iter_command_history_stream('user-1'))
+
+    def test_download_command_history_into_store(self, client):
+        """提供 history_store 時以串流下載並批量寫入"""
+        lines = [{'id': i, 'record': {'command_id': f'cmd-{i}'}} for i in range(1, 4)]
+        lines.append({'done': True, 'next_cursor': 3, 'count': 3, 'has_more': False})
+        store = Mock()
+        store.add_records.side_effect = lambda records: len(records)
+
+        with patch('Edge.cloud_sync.client.requests.Session.get', return_value=self._ndjson_response(lines)):
+            result = client.download_command_history('user-1', history_store=store)
+
+        assert result['data'] == {'received': 3, 'stored': 3, 'next_cursor': 3}
+        store.add_records.assert_called_once()
+
+    def test_conditional_get_reuses_cached_body_on_304(self, client):
+        """設定下載帶 If-None-Match；304 時返回快取主體並標記 not_modified"""
+        body = {'success': True, 'data': {'settings': {'theme': 'dark'}}}
+        fresh = self._json_response(200, body, {'ETag': '"abc"'})
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+
+        with patch('Edge.cloud_sync.client.requests.Session.get', side_effect=[fresh, not_modified]) as mock_get:
+            assert client.download_user_settings('user-1') == body
+            result = client.download_user_settings('user-1')
+
+        assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': '"abc"'}
+        assert result['not_modified'] is True
+        assert result['data'] == body['data']
+        assert client.get_transfer_stats()['not_modified'] == 1
+
+    def test_popular_commands_revalidated_with_etag(self, client):
+        """熱門指令以 If-None-Match 重新驗證；304 時返回快取列表"""
+        body = {'success': True, 'data': {'commands': [{'id': 2, 'name': 'Popular'}]}}
+        fresh = self._json_response(200, body, {'ETag': '"pop"'})
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+
+        with patch('Edge.cloud_sync.client.requests.Session.get', side_effect=[fresh, not_modified]) as mock_get:
+            assert client.get_popular_commands(limit=3) == body
+            result = client.get_popular_commands(limit=3)
+
+        assert mock_get.call_args.kwargs['headers'] == {'If-None-Match': '"pop"'}
+        assert result['not_modified'] is True
+        assert result['data'] == body['data']
+
+    def test_download_command_precondition_failed_means_unchanged(self, client):
+        """下載指令時雲端回傳 412（內容未變更）視為未修改"""
+        body = {'success': True, 'data': {'name': 'cmd', 'version': 1}}
+        fresh = self._json_response(200, body, {'ETag': '"v1"'})
+        unchanged = self._json_response(412, {'success': False})
+
+        with patch('Edge.cloud_sync.client.requests.Session.post', side_effect=[fresh, unchanged]) as mock_post:
+            client.download_command(7)
+            result = client.download_command(7)
+
+        assert mock_post.call_args.kwargs['headers']['If-None-Match'] == '"v1"'
+        assert result['not_modified'] is True
+        assert result['data']['name'] == 'cmd'
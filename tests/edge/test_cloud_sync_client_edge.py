@@ -61,7 +61,7 @@ class TestEdgeCloudSyncClientHealthCheck(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_health_check_success(self, mock_get):
         """健康檢查成功時應返回包含狀態的字典"""
         mock_response = Mock()
@@ -74,7 +74,7 @@ class TestEdgeCloudSyncClientHealthCheck(unittest.TestCase):
         assert result['status'] == 'healthy'
         mock_get.assert_called_once()
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_health_check_connection_error(self, mock_get):
         """連線失敗時應返回 unhealthy 狀態而非拋出例外"""
         mock_get.side_effect = requests.ConnectionError("Connection refused")
@@ -84,7 +84,7 @@ class TestEdgeCloudSyncClientHealthCheck(unittest.TestCase):
         assert result['status'] == 'unhealthy'
         assert 'error' in result
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_health_check_timeout(self, mock_get):
         """超時時應返回 unhealthy 狀態"""
         mock_get.side_effect = requests.Timeout("Request timed out")
@@ -103,7 +103,7 @@ class TestEdgeCloudSyncClientFileUpload(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.post')
+    @patch('Edge.cloud_client.sync_client.requests.Session.post')
     def test_upload_file_success(self, mock_post):
         """上傳存在的檔案應成功返回結果"""
         import tempfile
@@ -131,7 +131,7 @@ class TestEdgeCloudSyncClientFileUpload(unittest.TestCase):
         result = self.client.upload_file('/nonexistent/path/file.txt')
         assert result is None
 
-    @patch('Edge.cloud_client.sync_client.requests.post')
+    @patch('Edge.cloud_client.sync_client.requests.Session.post')
     def test_upload_file_request_exception(self, mock_post):
         """上傳時遇到網路錯誤應返回 None"""
         import tempfile
@@ -149,6 +149,61 @@ class TestEdgeCloudSyncClientFileUpload(unittest.TestCase):
         finally:
             os.unlink(tmp_path)
 
+    @patch('Edge.cloud_client.sync_client.time.sleep')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.put')
+    @patch('Edge.cloud_client.sync_client.requests.Session.post')
+    def test_upload_file_resumable_resumes_after_drop(self, mock_post, mock_put, mock_get, mock_sleep):
+        """分塊上傳中斷後查詢雲端 offset，只重送未確認的區塊"""
+        import hashlib
+        import tempfile
+        import os
+
+        content = b'0123456789'
+        received = bytearray()
+        put_offsets = []
+
+        def respond(status, payload):
+            response = Mock(status_code=status)
+            response.json.return_value = payload
+            response.raise_for_status = Mock()
+            return response
+
+        def fake_post(url, **kwargs):
+            if url.endswith('/storage/uploads'):
+                assert kwargs['json']['sha256'] == hashlib.sha256(content).hexdigest()
+                return respond(201, {'session_id': 'a' * 32, 'offset': 0})
+            assert url.endswith('/complete')
+            return respond(200, {'file_id': hashlib.sha256(bytes(received)).hexdigest()})
+
+        def fake_put(url, data, headers, timeout):
+            offset = int(headers['Upload-Offset'])
+            put_offsets.append(offset)
+            assert headers['X-Chunk-SHA256'] == hashlib.sha256(data).hexdigest()
+            received[offset:] = data
+            if len(put_offsets) == 2:
+                # 雲端已寫入區塊，但回應在途中遺失
+                raise requests.ConnectionError("connection dropped")
+            return respond(200, {'offset': len(received)})
+
+        mock_post.side_effect = fake_post
+        mock_put.side_effect = fake_put
+        mock_get.side_effect = lambda url, **kwargs: respond(200, {'offset': len(received)})
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.bin') as f:
+            f.write(content)
+            tmp_path = f.name
+
+        try:
+            result = self.client.upload_file_resumable(tmp_path, category='firmware', chunk_size=4)
+            assert result['file_id'] == hashlib.sha256(content).hexdigest()
+            assert put_offsets == [0, 4, 8]
+            assert bytes(received) == content
+            mock_sleep.assert_called_once()
+            assert self.client._upload_sessions == {}
+        finally:
+            os.unlink(tmp_path)
+
 
 class TestEdgeCloudSyncClientFileDownload(unittest.TestCase):
     """檔案下載測試"""
@@ -159,7 +214,7 @@ class TestEdgeCloudSyncClientFileDownload(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_download_file_success(self, mock_get):
         """下載檔案成功時應寫入本地並返回 True"""
         import tempfile
@@ -178,7 +233,34 @@ class TestEdgeCloudSyncClientFileDownload(unittest.TestCase):
             assert result is True
             assert os.path.exists(save_path)
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
+    def test_download_file_resumes_partial(self, mock_get):
+        """已有 .part 檔時以 Range 續傳並附加內容"""
+        import tempfile
+        import os
+
+        mock_response = Mock()
+        mock_response.status_code = 206
+        mock_response.raise_for_status = Mock()
+        mock_response.iter_content.return_value = [b'content']
+        mock_get.return_value = mock_response
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            save_path = os.path.join(tmpdir, 'downloaded.txt')
+            with open(save_path + '.part', 'wb') as f:
+                f.write(b'file')
+
+            result = self.client.download_file(file_id='abc123', save_path=save_path)
+
+            assert result is True
+            headers = mock_get.call_args[1]['headers']
+            assert headers['Range'] == 'bytes=4-'
+            assert headers['If-Range'] == '"abc123"'
+            with open(save_path, 'rb') as f:
+                assert f.read() == b'filecontent'
+            assert not os.path.exists(save_path + '.part')
+
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_download_file_request_exception(self, mock_get):
         """下載時遇到網路錯誤應返回 False"""
         mock_get.side_effect = requests.RequestException("Download failed")
@@ -198,7 +280,7 @@ class TestEdgeCloudSyncClientListFiles(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_list_files_success(self, mock_get):
         """列出檔案成功應返回檔案列表"""
         mock_response = Mock()
@@ -216,7 +298,7 @@ class TestEdgeCloudSyncClientListFiles(unittest.TestCase):
         assert result is not None
         assert len(result['files']) == 2
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_list_files_with_no_category(self, mock_get):
         """不指定 category 時應不傳遞 category 參數"""
         mock_response = Mock()
@@ -230,7 +312,7 @@ class TestEdgeCloudSyncClientListFiles(unittest.TestCase):
         call_kwargs = mock_get.call_args[1]
         assert call_kwargs.get('params') == {}
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_list_files_request_exception(self, mock_get):
         """列出檔案時遇到網路錯誤應返回 None"""
         mock_get.side_effect = requests.RequestException("Connection error")
@@ -248,7 +330,7 @@ class TestEdgeCloudSyncClientDeleteFile(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.delete')
+    @patch('Edge.cloud_client.sync_client.requests.Session.delete')
     def test_delete_file_success(self, mock_delete):
         """刪除檔案成功應返回 True"""
         mock_response = Mock()
@@ -260,7 +342,7 @@ class TestEdgeCloudSyncClientDeleteFile(unittest.TestCase):
         assert result is True
         mock_delete.assert_called_once()
 
-    @patch('Edge.cloud_client.sync_client.requests.delete')
+    @patch('Edge.cloud_client.sync_client.requests.Session.delete')
     def test_delete_file_request_exception(self, mock_delete):
         """刪除時遇到網路錯誤應返回 False"""
         mock_delete.side_effect = requests.RequestException("Forbidden")
@@ -278,7 +360,7 @@ class TestEdgeCloudSyncClientStorageStats(unittest.TestCase):
             token='test-token'
         )
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_get_storage_stats_success(self, mock_get):
         """取得儲存統計成功應返回統計字典"""
         mock_response = Mock()
@@ -291,7 +373,7 @@ class TestEdgeCloudSyncClientStorageStats(unittest.TestCase):
         assert result is not None
         assert result['total_files'] == 10
 
-    @patch('Edge.cloud_client.sync_client.requests.get')
+    @patch('Edge.cloud_client.sync_client.requests.Session.get')
     def test_get_storage_stats_request_exception(self, mock_get):
         """取得統計時遇到網路錯誤應返回 None"""
         mock_get.side_effect = requests.RequestException("Server error")
@@ -362,5 +444,101 @@ class TestEdgeCloudSyncClientSyncFiles(unittest.TestCase):
         assert result['errors'] == 0
 
 
+class TestEdgeCloudSyncClientManifestAndPool(unittest.TestCase):
+    """sync_files 雜湊清單與並行傳輸測試"""
+
+    def setUp(self):
+        self.client = CloudSyncClient(
+            cloud_api_url='https://cloud.example.com/api',
+            token='test-token',
+            max_workers=3
+        )
+
+    def _write_old_file(self, path, content):
+        import os
+        import time
+        path.write_bytes(content)
+        old = time.time_ns() - 60 * 1_000_000_000
+        os.utime(path, ns=(old, old))
+
+    @patch.object(CloudSyncClient, 'upload_file')
+    @patch.object(CloudSyncClient, 'list_files')
+    def test_unchanged_files_are_not_rehashed(self, mock_list, mock_upload):
+        """第二次同步時未變更的檔案使用清單中的雜湊，只重新計算變更的檔案"""
+        import tempfile
+        from pathlib import Path
+        from Edge.cloud_client import manifest as manifest_module
+
+        mock_list.return_value = {'files': []}
+        mock_upload.return_value = {'file_id': 'x'}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for i in range(3):
+                self._write_old_file(Path(tmpdir) / f'log_{i}.txt', f'content {i}'.encode())
+
+            with patch.object(manifest_module, 'hash_file', wraps=manifest_module.hash_file) as spy:
+                self.client.sync_files(local_dir=tmpdir, direction='upload')
+                assert spy.call_count == 3
+
+                spy.reset_mock()
+                self._write_old_file(Path(tmpdir) / 'log_1.txt', b'changed content')
+                result = self.client.sync_files(local_dir=tmpdir, direction='upload')
+                assert spy.call_count == 1
+
+            assert result['uploaded'] == 3
+            uploaded = {Path(call.args[0]).name for call in mock_upload.call_args_list}
+            assert uploaded == {'log_0.txt', 'log_1.txt', 'log_2.txt'}
+            assert (Path(tmpdir) / '.sync_manifest.json').exists()
+
+    @patch.object(CloudSyncClient, 'upload_file')
+    @patch.object(CloudSyncClient, 'list_files')
+    def test_files_already_in_cloud_are_skipped(self, mock_list, mock_upload):
+        """雲端已有相同雜湊的檔案略過，清單檔本身不上傳"""
+        import hashlib
+        import tempfile
+        from pathlib import Path
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_old_file(Path(tmpdir) / 'same.txt', b'same')
+            self._write_old_file(Path(tmpdir) / 'new.txt', b'new')
+            mock_list.return_value = {'files': [{'file_id': hashlib.sha256(b'same').hexdigest(),
+                                                 'storage_filename': 'same.txt'}]}
+            mock_upload.return_value = {'file_id': 'x'}
+
+            self.client.sync_files(local_dir=tmpdir, direction='upload')
+            result = self.client.sync_files(local_dir=tmpdir, direction='upload')
+
+            assert result['skipped'] == 1
+            uploaded = [Path(call.args[0]).name for call in mock_upload.call_args_list]
+            assert uploaded == ['new.txt', 'new.txt']
+
+    @patch.object(CloudSyncClient, 'download_file')
+    @patch.object(CloudSyncClient, 'list_files')
+    def test_transfers_run_in_parallel(self, mock_list, mock_download):
+        """下載在有界執行緒池中並行（三個下載同時進行才能通過 barrier）"""
+        import tempfile
+        import threading
+
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fake_download(file_id, save_path, category):
+            barrier.wait()
+            return True
+
+        mock_list.return_value = {'files': [{'file_id': f'f{i}', 'filename': f'f{i}.bin'} for i in range(3)]}
+        mock_download.side_effect = fake_download
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = self.client.sync_files(local_dir=tmpdir, direction='download')
+
+        assert result['downloaded'] == 3
+        assert result['errors'] == 0
+
+    def test_session_pool_matches_workers(self):
+        """所有請求共用同一個 Session，連線池大小等於並行數"""
+        adapter = self.client._session.get_adapter('https://cloud.example.com/api')
+        assert adapter._pool_maxsize == 3
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,9 +4,17 @@ CloudSyncQueue 單元測試
 涵蓋：先後發送機制（FIFO 序號）、本地 SQLite 快取、重試邏輯、
 批次發送、統計、邊界條件。
 """
+import json
+import threading
 import unittest
+from unittest.mock import patch
 
-from Edge.cloud_sync.sync_queue import CloudSyncQueue
+from Edge.cloud_sync.sync_queue import (
+    DEFAULT_COMPACTION_POLICIES,
+    COMPACT_MERGE_RECORDS,
+    CloudSyncQueue,
+    CompactionPolicy,
+)
 
 
 class TestCloudSyncQueueBasic(unittest.TestCase):
@@ -280,5 +288,182 @@ class TestCloudSyncQueueHandlerException(unittest.TestCase):
         queue.close()
 
 
+class TestCloudSyncQueueBatchedFlush(unittest.TestCase):
+    """打包發送（flush_batched）測試"""
+
+    def setUp(self):
+        self.queue = CloudSyncQueue(db_path=None, max_size=100, max_retry_count=3)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_packs_by_op_count_in_seq_order(self):
+        """每包不超過 max_ops 筆，且依入隊順序排列"""
+        for i in range(7):
+            self.queue.enqueue('user_settings', {'seq_marker': i})
+
+        packs = []
+
+        def handler(items):
+            packs.append([payload['seq_marker'] for _, _, payload in items])
+            return {op_id: True for op_id, _, _ in items}
+
+        result = self.queue.flush_batched(handler, max_ops=3)
+        self.assertEqual(packs, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(result['sent'], 7)
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['remaining'], 0)
+
+    def test_packs_by_bytes(self):
+        """payload 合計超過 max_bytes 時切包，超大單筆仍單獨成包"""
+        self.queue.enqueue('command_history', {'data': 'x' * 100})
+        self.queue.enqueue('command_history', {'data': 'y' * 100})
+        self.queue.enqueue('command_history', {'data': 'z' * 500})
+
+        sizes = []
+
+        def handler(items):
+            sizes.append(len(items))
+            return {op_id: True for op_id, _, _ in items}
+
+        self.queue.flush_batched(handler, max_ops=10, max_bytes=300)
+        self.assertEqual(sizes, [2, 1])
+
+    def test_partial_failure_retried_on_next_flush(self):
+        """逐筆結果：失敗項目保留待下次 flush，不在同一次 flush 內重送"""
+        for i in range(4):
+            self.queue.enqueue('user_settings', {'seq_marker': i})
+
+        attempts = []
+
+        def handler(items):
+            attempts.extend(payload['seq_marker'] for _, _, payload in items)
+            return {op_id: payload['seq_marker'] != 1 for op_id, _, payload in items}
+
+        result = self.queue.flush_batched(handler, max_ops=2)
+        self.assertEqual(attempts, [0, 1, 2, 3])
+        self.assertEqual(result['sent'], 3)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(result['remaining'], 1)
+
+        result = self.queue.flush_batched(lambda items: {op_id: True for op_id, _, _ in items})
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(self.queue.get_statistics()['total_sent'], 4)
+
+    def test_stops_when_whole_pack_fails(self):
+        """整包失敗（例如請求例外）時停止，避免持續打到不可用的雲端"""
+        for i in range(6):
+            self.queue.enqueue('user_settings', {'seq_marker': i})
+
+        calls = []
+
+        def handler(items):
+            calls.append(len(items))
+            raise ConnectionError("offline")
+
+        result = self.queue.flush_batched(handler, max_ops=2)
+        self.assertEqual(calls, [2])
+        self.assertEqual(result['sent'], 0)
+        self.assertEqual(result['remaining'], 6)
+
+
+class TestCloudSyncQueueCompaction(unittest.TestCase):
+    """入隊壓縮策略測試"""
+
+    def setUp(self):
+        self.queue = CloudSyncQueue(db_path=None, max_size=3, compaction=DEFAULT_COMPACTION_POLICIES)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_settings_last_write_wins_per_user(self):
+        """相同用戶的設定快照只保留最新一筆，並排到佇列尾端"""
+        self.queue.enqueue('user_settings', {'user_id': 'u1', 'settings': {'theme': 'light'}})
+        self.queue.enqueue('command_history', {'user_id': 'u2', 'records': [{'command_id': 'c1'}]})
+        self.queue.enqueue('user_settings', {'user_id': 'u1', 'settings': {'theme': 'dark'}})
+        # 佇列已達上限，但取代舊快照不會增加項目數
+        self.assertIsNotNone(
+            self.queue.enqueue('user_settings', {'user_id': 'u1', 'settings': {'theme': 'blue'}})
+        )
+        self.assertEqual(self.queue.size(), 2)
+
+        sent = []
+        self.queue.flush(lambda op, p: sent.append((op, p)) or True)
+        self.assertEqual([op for op, _ in sent], ['command_history', 'user_settings'])
+        self.assertEqual(sent[1][1]['settings'], {'theme': 'blue'})
+        self.assertEqual(self.queue.get_statistics()['total_compacted'], 2)
+
+    def test_history_records_merge_into_one_item(self):
+        """相同用戶的歷史上傳合併為一筆，依 command_id 去重"""
+        first = self.queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c1'}]})
+        merged = self.queue.enqueue(
+            'command_history', {'user_id': 'u1', 'records': [{'command_id': 'c1'}, {'command_id': 'c2'}]}
+        )
+        self.queue.enqueue('command_history', {'user_id': 'u2', 'records': [{'command_id': 'c3'}]})
+
+        self.assertEqual(merged, first)
+        self.assertEqual(self.queue.size(), 2)
+
+        sent = []
+        self.queue.flush(lambda op, p: sent.append(p) or True)
+        self.assertEqual([r['command_id'] for r in sent[0]['records']], ['c1', 'c2'])
+
+    def test_merge_respects_max_records(self):
+        """合併後超過 max_records 時另起新項目"""
+        queue = CloudSyncQueue(
+            db_path=None,
+            compaction={'command_history': CompactionPolicy(COMPACT_MERGE_RECORDS, max_records=2)},
+        )
+        queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c1'}]})
+        queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c2'}]})
+        queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c3'}]})
+        self.assertEqual(queue.size(), 2)
+        queue.close()
+
+    def test_inflight_item_not_compacted(self):
+        """發送中的項目不會被合併，避免新記錄隨舊項目一起被刪除"""
+        self.queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c1'}]})
+
+        def handler(op_type, payload):
+            if payload['records'][0]['command_id'] == 'c1':
+                self.queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c2'}]})
+            return True
+
+        self.queue.flush(handler)
+        self.assertEqual(self.queue.size(), 0)
+        self.assertEqual(self.queue.get_statistics()['total_sent'], 2)
+
+    def test_merge_during_pack_read_not_lost(self):
+        """flush_batched 取包期間的並行合併不會併入已取出的項目"""
+        self.queue.enqueue('command_history', {'user_id': 'u1', 'records': [{'command_id': 'c1'}]})
+        real_loads = json.loads
+        writers = []
+
+        def loads_with_concurrent_enqueue(*args, **kwargs):
+            # 首次解析包內項目時，由另一執行緒嘗試合併同鍵記錄
+            if not writers:
+                writer = threading.Thread(target=self.queue.enqueue, args=(
+                    'command_history', {'user_id': 'u1', 'records': [{'command_id': 'c2'}]},
+                ))
+                writers.append(writer)
+                writer.start()
+                writer.join(timeout=0.2)
+            return real_loads(*args, **kwargs)
+
+        sent = []
+
+        def handler(items):
+            sent.extend(r['command_id'] for _, _, payload in items for r in payload['records'])
+            return {op_id: True for op_id, _, _ in items}
+
+        with patch('Edge.cloud_sync.sync_queue.json.loads', side_effect=loads_with_concurrent_enqueue):
+            self.queue.flush_batched(handler)
+        writers[0].join()
+        self.queue.flush_batched(handler)
+
+        self.assertEqual(sorted(sent), ['c1', 'c2'])
+        self.assertEqual(self.queue.size(), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
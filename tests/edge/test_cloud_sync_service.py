@@ -4,6 +4,7 @@ Edge CloudSyncService 單元測試
 import unittest
 from unittest.mock import Mock, patch
 import sys
+import requests
 
 # Mock WebUI models before importing CloudSyncService
 webui_mock = Mock()
@@ -189,6 +190,29 @@ class TestCloudSyncService(unittest.TestCase):
         mock_client.download_command.assert_called_once_with(123)
         assert result == mock_cmd_instance
 
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_download_and_import_command_not_modified_skips_import(self, mock_client_class):
+        """雲端指令未變更時直接返回已導入的本地指令，不重新導入"""
+        mock_client = Mock()
+        mock_client.download_command.return_value = {
+            'success': True,
+            'not_modified': True,
+            'data': {'name': 'Cloud Command', 'version': 1}
+        }
+        mock_client_class.return_value = mock_client
+
+        existing = Mock()
+        mock_db = Mock()
+        mock_db.query.return_value.filter_by.return_value.first.return_value = existing
+
+        service = CloudSyncService(cloud_api_url=self.cloud_api_url, edge_id=self.edge_id)
+        with patch('Edge.cloud_sync.sync_service.FHS_PATHS_AVAILABLE', False):
+            result = service.download_and_import_command(123, mock_db, 1)
+
+        assert result is existing
+        mock_db.add.assert_not_called()
+        mock_db.commit.assert_not_called()
+
     @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
     def test_download_and_import_command_missing_field(self, mock_client_class):
         """測試下載指令時缺少必要欄位"""
@@ -482,9 +506,11 @@ class TestCloudSyncService(unittest.TestCase):
         }
         mock_client_class.return_value = mock_client
 
+        # 記憶體資料庫：已上傳記錄不會殘留到下一次測試
         service = CloudSyncService(
             cloud_api_url=self.cloud_api_url,
-            edge_id=self.edge_id
+            edge_id=self.edge_id,
+            queue_db_path=':memory:'
         )
 
         records = [
@@ -527,9 +553,11 @@ class TestCloudSyncService(unittest.TestCase):
         mock_client.upload_command_history.side_effect = req.RequestException("Timeout")
         mock_client_class.return_value = mock_client
 
+        # 記憶體資料庫：已上傳記錄不會殘留到下一次測試
         service = CloudSyncService(
             cloud_api_url=self.cloud_api_url,
-            edge_id=self.edge_id
+            edge_id=self.edge_id,
+            queue_db_path=':memory:'
         )
 
         result = service.sync_command_history(
@@ -556,7 +584,8 @@ class TestCloudSyncService(unittest.TestCase):
 
         service = CloudSyncService(
             cloud_api_url=self.cloud_api_url,
-            edge_id=self.edge_id
+            edge_id=self.edge_id,
+            queue_db_path=':memory:'
         )
 
         # 第一次同步失敗 → 自動快取
@@ -891,7 +920,8 @@ class TestCloudSyncService(unittest.TestCase):
 
         service = CloudSyncService(
             cloud_api_url=self.cloud_api_url,
-            edge_id=self.edge_id
+            edge_id=self.edge_id,
+            queue_db_path=':memory:'
         )
 
         result = service.sync_command_history(
@@ -905,6 +935,285 @@ class TestCloudSyncService(unittest.TestCase):
         assert flush_result['sent'] == 1
         assert flush_result['remaining'] == 0
 
+    # ==================== flush_queue 批次模式 ====================
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_flush_queue_batched_packs_ops_into_one_request(self, mock_client_class):
+        """flush_queue(batched=True) 應以單一批次請求補發多筆操作"""
+        import requests as req
+        mock_client = Mock()
+        mock_client.upload_user_settings.side_effect = req.RequestException("Connection failed")
+        mock_client.upload_command_history.side_effect = req.RequestException("Connection failed")
+        mock_client.upload_sync_batch.side_effect = lambda ops, edge_id: {
+            'success': True,
+            'results': [{'op_id': op['op_id'], 'success': True} for op in ops],
+        }
+        mock_client_class.return_value = mock_client
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        service.sync_user_settings(user_id='user-123', settings={'theme': 'dark'})
+        service.sync_command_history(user_id='user-123', records=[{'command_id': 'cmd-001'}])
+
+        flush_result = service.flush_queue(batched=True)
+        assert flush_result['sent'] == 2
+        assert flush_result['requests'] == 1
+        ops = mock_client.upload_sync_batch.call_args.kwargs['ops']
+        assert [op['op_type'] for op in ops] == ['user_settings', 'command_history']
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_flush_queue_batched_falls_back_when_endpoint_missing(self, mock_client_class):
+        """雲端不支援批次端點（404）時應改為逐筆補發"""
+        import requests as req
+        mock_client = Mock()
+        mock_client.upload_user_settings.side_effect = [
+            req.RequestException("Connection failed"),
+            {'success': True},
+        ]
+        not_found = req.Response()
+        not_found.status_code = 404
+        mock_client.upload_sync_batch.side_effect = req.HTTPError(response=not_found)
+        mock_client_class.return_value = mock_client
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        service.sync_user_settings(user_id='user-123', settings={'theme': 'dark'})
+
+        flush_result = service.flush_queue(batched=True)
+        assert flush_result['sent'] == 1
+        assert service._batch_endpoint_supported is False
+
+    def test_network_monitor_receives_cloud_request_outcomes(self):
+        """雲端請求結果回報給網路監控器；未指定時使用共用的全域監控器"""
+        from src.common.network_monitor import NetworkMonitor, get_network_monitor, reset_network_monitor
+
+        monitor = NetworkMonitor()
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:',
+            network_monitor=monitor,
+        )
+        with patch('requests.adapters.HTTPAdapter.send', side_effect=requests.ConnectionError('refused')):
+            assert service.get_cloud_status()['available'] is False
+        assert monitor.state.consecutive_failures == 1
+        assert monitor.state.last_passive_source == 'cloud_sync'
+        service.close()
+
+        reset_network_monitor()
+        try:
+            service = CloudSyncService(
+                cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+            )
+            with patch('requests.adapters.HTTPAdapter.send', side_effect=requests.ConnectionError('refused')):
+                assert service.client.health_check() is False
+            assert get_network_monitor().state.consecutive_failures == 1
+            service.close()
+        finally:
+            reset_network_monitor()
+
+    # ==================== 指令歷史增量同步 ====================
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_sync_command_history_sends_only_records_past_watermark(self, mock_client_class):
+        """只上傳高水位之後的記錄；本地無水位時採用雲端水位"""
+        mock_client = Mock()
+        mock_client.get_history_watermark.return_value = {
+            'success': True,
+            'data': {'created_at': '2026-01-01T00:10:00+00:00', 'command_id': 'cmd-010'},
+        }
+        mock_client.upload_command_history.return_value = {'success': True, 'synced_count': 1, 'total': 2}
+        mock_client_class.return_value = mock_client
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        old = {'command_id': 'cmd-001', 'created_at': '2026-01-01T00:00:00+00:00'}
+        seeded = {'command_id': 'cmd-010', 'created_at': '2026-01-01T00:10:00+00:00'}
+        newer = {'command_id': 'cmd-011', 'created_at': '2026-01-01T00:11:00+00:00'}
+        result = service.sync_command_history(user_id='user-123', records=[old, seeded, newer])
+
+        sent = mock_client.upload_command_history.call_args.kwargs['records']
+        assert [r['command_id'] for r in sent] == ['cmd-011']
+        assert result['skipped'] == 2
+
+        # 水位已推進：再次同步相同記錄不會發出請求
+        result = service.sync_command_history(user_id='user-123', records=[old, seeded, newer])
+        assert result == {'success': True, 'synced_count': 0, 'skipped': 3}
+        assert mock_client.upload_command_history.call_count == 1
+        mock_client.get_history_watermark.assert_called_once()
+        service.close()
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_sync_command_history_tie_window(self, mock_client_class):
+        """水位前容忍窗口內晚到的記錄仍會上傳一次，之後以 command_id 略過"""
+        mock_client = Mock()
+        mock_client.get_history_watermark.return_value = {'success': True, 'data': None}
+        mock_client.upload_command_history.return_value = {'success': True, 'synced_count': 1, 'total': 2}
+        mock_client_class.return_value = mock_client
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        newer = {'command_id': 'cmd-002', 'created_at': '2026-01-01T00:00:02+00:00'}
+        late = {'command_id': 'cmd-001', 'created_at': '2026-01-01T00:00:01+00:00'}
+
+        service.sync_command_history(user_id='user-123', records=[newer])
+        result = service.sync_command_history(user_id='user-123', records=[late, newer])
+        sent = mock_client.upload_command_history.call_args.kwargs['records']
+        assert [r['command_id'] for r in sent] == ['cmd-001']
+        assert result['skipped'] == 1
+
+        result = service.sync_command_history(user_id='user-123', records=[late, newer])
+        assert result == {'success': True, 'synced_count': 0, 'skipped': 2}
+        assert mock_client.upload_command_history.call_count == 2
+        service.close()
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_pull_command_history_resumes_from_cursor(self, mock_client_class):
+        """增量下載保存游標，下次從上次位置繼續"""
+        mock_client = Mock()
+        mock_client.download_command_history.side_effect = [
+            {'success': True, 'data': {'records': [{'command_id': 'b-0'}], 'next_cursor': 5, 'has_more': True}},
+            {'success': True, 'data': {'records': [{'command_id': 'b-1'}], 'next_cursor': 9, 'has_more': False}},
+            {'success': True, 'data': {'records': [], 'next_cursor': 9, 'has_more': False}},
+        ]
+        mock_client_class.return_value = mock_client
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        result = service.pull_command_history(user_id='user-123', page_size=1)
+        assert [r['command_id'] for r in result['records']] == ['b-0', 'b-1']
+        assert result['cursor'] == 9
+
+        result = service.pull_command_history(user_id='user-123')
+        assert result['records'] == []
+        last_call = mock_client.download_command_history.call_args.kwargs
+        assert last_call['cursor'] == 9
+        assert last_call['exclude_edge_id'] == self.edge_id
+        service.close()
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_pull_command_history_streams_into_store(self, mock_client_class):
+        """提供 history_store 時以串流逐批寫入並在每批後保存游標"""
+        mock_client = Mock()
+
+        def stream(user_id, cursor, exclude_edge_id, batch_size):
+            yield [{'command_id': 'b-0'}], 4
+            raise requests.ConnectionError('reset')
+        mock_client.iter_command_history_stream.side_effect = stream
+        mock_client_class.return_value = mock_client
+        store = Mock()
+        store.add_records.return_value = 1
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        result = service.pull_command_history(user_id='user-123', history_store=store)
+        assert result['success'] is False
+        assert result['stored'] == 1
+        assert service._watermarks.get_download_cursor('user-123') == 4
+        service.close()
+
+    # ==================== 共享指令增量導入 ====================
+
+    def _command_change(self, cloud_id, name, version=1, author='alice', updated_at='2026-01-01T00:00:00'):
+        """雲端變更端點回傳的單筆指令"""
+        return {
+            'id': cloud_id, 'name': name, 'description': 'desc', 'category': 'motion',
+            'content': '[]', 'version': version, 'author_username': author, 'updated_at': updated_at,
+        }
+
+    def _command_model(self):
+        """以簡單類別代替 AdvancedCommand（記錄建構參數）"""
+        class FakeCommand:
+            name = Mock()
+
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+
+        return FakeCommand
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_pull_command_changes_imports_pages_in_one_transaction(self, mock_client_class):
+        """所有頁面的變更在一次提交中導入，提交後保存水位，下次從水位繼續"""
+        mock_client = Mock()
+        mock_client.get_command_changes.side_effect = [
+            {'success': True, 'data': {
+                'commands': [self._command_change(1, 'wave'), self._command_change(2, 'patrol', version=3)],
+                'next_watermark': {'updated_at': '2026-01-01T00:00:00', 'id': 2}, 'has_more': True,
+            }},
+            {'success': True, 'data': {
+                'commands': [self._command_change(5, 'local-only', version=9, updated_at='2026-01-02T00:00:00')],
+                'next_watermark': {'updated_at': '2026-01-02T00:00:00', 'id': 5}, 'has_more': False,
+            }},
+            {'success': True, 'data': {
+                'commands': [],
+                'next_watermark': {'updated_at': '2026-01-02T00:00:00', 'id': 5}, 'has_more': False,
+            }},
+        ]
+        mock_client_class.return_value = mock_client
+
+        model = self._command_model()
+        imported_patrol = model(
+            name='patrol', version=2, status='approved', description='old\n\n[從雲端下載 - 原始作者: alice]'
+        )
+        local_only = model(name='local-only', version=1, status='approved', description='mine')
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.side_effect = [[imported_patrol], [local_only]]
+        models_mock = Mock(AdvancedCommand=model)
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        with patch.dict(sys.modules, {'WebUI.app.models': models_mock}):
+            result = service.pull_command_changes(mock_db, user_id=1, page_size=2)
+
+            assert result['success'] is True
+            assert (result['imported'], result['updated'], result['skipped']) == (1, 1, 1)
+            assert result['watermark'] == ('2026-01-02T00:00:00', 5)
+            mock_db.commit.assert_called_once()
+            created = mock_db.add.call_args[0][0]
+            assert (created.name, created.status, created.author_id) == ('wave', 'pending', 1)
+            assert (imported_patrol.version, imported_patrol.status) == (3, 'pending')
+            assert (local_only.version, local_only.description) == (1, 'mine')
+
+            result = service.pull_command_changes(mock_db, user_id=1)
+
+        assert (result['imported'], result['updated']) == (0, 0)
+        last_call = mock_client.get_command_changes.call_args.kwargs
+        assert (last_call['since'], last_call['since_id']) == ('2026-01-02T00:00:00', 5)
+        service.close()
+
+    @patch('Edge.cloud_sync.sync_service.CloudSyncClient')
+    def test_pull_command_changes_rolls_back_and_keeps_watermark_on_failure(self, mock_client_class):
+        """任何一頁失敗時整批回滾，水位不前進"""
+        mock_client = Mock()
+        mock_client.get_command_changes.side_effect = [
+            {'success': True, 'data': {
+                'commands': [self._command_change(1, 'wave')],
+                'next_watermark': {'updated_at': '2026-01-01T00:00:00', 'id': 1}, 'has_more': True,
+            }},
+            requests.ConnectionError('reset'),
+        ]
+        mock_client_class.return_value = mock_client
+        mock_db = Mock()
+        mock_db.query.return_value.filter.return_value.all.return_value = []
+
+        service = CloudSyncService(
+            cloud_api_url=self.cloud_api_url, edge_id=self.edge_id, queue_db_path=':memory:'
+        )
+        with patch.dict(sys.modules, {'WebUI.app.models': Mock(AdvancedCommand=self._command_model())}):
+            result = service.pull_command_changes(mock_db, user_id=1)
+
+        assert result['success'] is False
+        assert result['watermark'] is None
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+        assert service._watermarks.get_command_watermark(self.cloud_api_url) is None
+        service.close()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+"""
+SyncWatermarkStore 單元測試
+
+涵蓋：上傳高水位與容忍窗口過濾、水位只前進不後退、下載游標保存、跨實例持久化。
+"""
+import os
+import tempfile
+import unittest
+
+from Edge.cloud_sync.watermark_store import SyncWatermarkStore, record_watermark_key
+
+
+class TestSyncWatermarkStore(unittest.TestCase):
+    """水位存儲測試"""
+
+    def setUp(self):
+        self.store = SyncWatermarkStore()
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_record_watermark_key(self):
+        """缺少 created_at 或 command_id 的記錄沒有水位鍵"""
+        self.assertEqual(
+            record_watermark_key({'command_id': 'c1', 'created_at': '2026-01-01T00:00:00+00:00'}),
+            ('2026-01-01T00:00:00+00:00', 'c1'),
+        )
+        self.assertIsNone(record_watermark_key({'command_id': 'c1'}))
+        self.assertIsNone(record_watermark_key({'created_at': '2026-01-01T00:00:00+00:00'}))
+
+    def test_upload_watermark_only_advances(self):
+        """上傳高水位取已上傳記錄中的最大值，且不會後退"""
+        self.assertIsNone(self.store.get_upload_watermark('u1'))
+
+        self.store.advance_upload_watermark('u1', [
+            {'command_id': 'c2', 'created_at': '2026-01-01T00:00:02+00:00'},
+            {'command_id': 'c1', 'created_at': '2026-01-01T00:00:01+00:00'},
+            {'command_id': 'c9'},
+        ])
+        self.store.set_upload_watermark('u1', ('2025-01-01T00:00:00+00:00', 'old'))
+
+        self.assertEqual(self.store.get_upload_watermark('u1'), ('2026-01-01T00:00:02+00:00', 'c2'))
+        self.assertIsNone(self.store.get_upload_watermark('u2'))
+
+    def test_filter_unsent_by_watermark_and_tie_window(self):
+        """高於水位的記錄上傳；窗口內以 command_id 判斷；更早的記錄略過"""
+        newer = {'command_id': 'c3', 'created_at': '2026-01-01T01:00:00+00:00'}
+        self.store.mark_uploaded('u1', [newer])
+        watermark = self.store.get_upload_watermark('u1')
+        self.assertEqual(watermark, ('2026-01-01T01:00:00+00:00', 'c3'))
+
+        late = {'command_id': 'c2', 'created_at': '2026-01-01T00:59:00+00:00'}
+        stale = {'command_id': 'c1', 'created_at': '2026-01-01T00:00:00+00:00'}
+        no_key = {'command_id': 'c0'}
+        latest = {'command_id': 'c4', 'created_at': '2026-01-01T01:00:01+00:00'}
+        self.assertEqual(
+            self.store.filter_unsent('u1', [stale, late, newer, no_key, latest], watermark),
+            [late, no_key, latest],
+        )
+        self.assertEqual(self.store.filter_unsent('u2', [stale], None), [stale])
+
+    def test_mark_uploaded_prunes_ids_below_window(self):
+        """水位前進後，窗口下界之前的 command_id 被刪除"""
+        self.store.mark_uploaded('u1', [{'command_id': 'c1', 'created_at': '2026-01-01T00:00:00+00:00'}])
+        self.store.mark_uploaded('u1', [{'command_id': 'c2', 'created_at': '2026-01-01T00:04:00+00:00'}])
+        self.store.mark_uploaded('u1', [{'command_id': 'c3', 'created_at': '2026-01-01T01:00:00+00:00'}])
+
+        with self.store._get_conn() as conn:
+            rows = conn.execute("SELECT command_id FROM history_upload_window WHERE user_id = 'u1'").fetchall()
+        self.assertEqual([row['command_id'] for row in rows], ['c3'])
+
+    def test_command_watermark_per_scope(self):
+        """共享指令變更水位依來源分開保存，後寫入的值覆蓋先前的值"""
+        self.assertIsNone(self.store.get_command_watermark('https://a.example.com'))
+
+        self.store.set_command_watermark('https://a.example.com', ('2026-01-01T00:00:00', 3))
+        self.store.set_command_watermark('https://a.example.com', ('2026-01-02T00:00:00', 1))
+        self.store.set_command_watermark('https://b.example.com', ('2026-01-01T00:00:00', 9))
+
+        self.assertEqual(self.store.get_command_watermark('https://a.example.com'), ('2026-01-02T00:00:00', 1))
+        self.assertEqual(self.store.get_command_watermark('https://b.example.com'), ('2026-01-01T00:00:00', 9))
+
+    def test_download_cursor_persists_across_instances(self):
+        """下載游標與上傳水位寫入檔案資料庫後可跨實例讀取"""
+        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
+            db_path = f.name
+        try:
+            store = SyncWatermarkStore(db_path=db_path)
+            self.assertEqual(store.get_download_cursor('u1'), 0)
+            store.set_download_cursor('u1', 42)
+            store.set_upload_watermark('u1', ('2026-01-01T00:00:00+00:00', 'c1'))
+
+            reopened = SyncWatermarkStore(db_path=db_path)
+            self.assertEqual(reopened.get_download_cursor('u1'), 42)
+            self.assertEqual(reopened.get_upload_watermark('u1'), ('2026-01-01T00:00:00+00:00', 'c1'))
+        finally:
+            os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,7 @@ import asyncio
 import sys
 import os
 import unittest
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 # 添加 src 目錄到路徑
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -155,7 +155,7 @@ class TestMemoryQueue(unittest.TestCase):
     def test_nack_with_requeue(self):
         """測試拒絕訊息並重新入隊"""
         async def test():
-            queue = MemoryQueue()
+            queue = MemoryQueue(retry_base_delay=0)
 
             message = Message(payload={"command": "test"}, max_retries=3)
             await queue.enqueue(message)
@@ -176,7 +176,7 @@ class TestMemoryQueue(unittest.TestCase):
     def test_max_retries(self):
         """測試最大重試次數"""
         async def test():
-            queue = MemoryQueue()
+            queue = MemoryQueue(retry_base_delay=0)
 
             message = Message(payload={"command": "test"}, max_retries=2)
             await queue.enqueue(message)
@@ -254,6 +254,411 @@ class TestMemoryQueue(unittest.TestCase):
         self.loop.run_until_complete(test())
 
 
+class TestPartitionedMemoryQueue(unittest.TestCase):
+    """測試 MemoryQueue 的每台機器人公平排程模式"""
+
+    def setUp(self):
+        """設定測試環境"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        """清理測試環境"""
+        self.loop.close()
+
+    def test_round_robin_across_robots(self):
+        """測試大量批次不會阻塞其他機器人的指令"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            for i in range(5):
+                await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": i}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-b", "seq": 0}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-c", "seq": 0}))
+
+            order = []
+            for _ in range(3):
+                msg = await queue.dequeue(timeout=0)
+                order.append(msg.payload["robot_id"])
+                await queue.ack(msg.id)
+
+            self.assertEqual(order, ["robot-a", "robot-b", "robot-c"])
+
+        self.loop.run_until_complete(test())
+
+    def test_single_in_flight_per_robot(self):
+        """測試同一機器人同時只會有一則處理中的訊息"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 0}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 1}))
+
+            first = await queue.dequeue(timeout=0)
+            self.assertEqual(first.payload["seq"], 0)
+
+            # robot-a 仍在處理中，不應取得第二則
+            self.assertIsNone(await queue.dequeue(timeout=0))
+            self.assertIsNone(await queue.peek())
+
+            await queue.ack(first.id)
+            second = await queue.dequeue(timeout=0)
+            self.assertEqual(second.payload["seq"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_waiting_dequeue_wakes_on_ack(self):
+        """測試等待中的 dequeue 會在機器人釋放後取得訊息"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 0}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 1}))
+            first = await queue.dequeue(timeout=0)
+
+            waiter = asyncio.ensure_future(queue.dequeue(timeout=1.0))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+
+            await queue.ack(first.id)
+            second = await waiter
+            self.assertIsNotNone(second)
+            self.assertEqual(second.payload["seq"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_priority_preserved_across_partitions(self):
+        """測試分區模式仍優先處理高優先權訊息"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a"}, priority=MessagePriority.LOW))
+            await queue.enqueue(Message(payload={"robot_id": "robot-b"}, priority=MessagePriority.URGENT))
+
+            msg = await queue.dequeue(timeout=0)
+            self.assertEqual(msg.payload["robot_id"], "robot-b")
+
+        self.loop.run_until_complete(test())
+
+    def test_nack_requeue_keeps_robot_order(self):
+        """測試重新入隊的訊息會回到該機器人子佇列的隊首"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True, retry_base_delay=0.01, retry_jitter=0)
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 0}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "seq": 1}))
+
+            first = await queue.dequeue(timeout=0)
+            await queue.nack(first.id, requeue=True)
+
+            again = await queue.dequeue(timeout=1.0)
+            self.assertEqual(again.payload["seq"], 0)
+
+        self.loop.run_until_complete(test())
+
+    def test_deficit_round_robin_weights_by_action_count(self):
+        """測試 deficit round-robin 依動作數量分配服務額度"""
+        async def test():
+            queue = MemoryQueue(
+                partition_by_robot=True,
+                scheduling="deficit_round_robin",
+                quantum=2,
+            )
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a", "actions": ["wave"] * 6}))
+            for i in range(3):
+                await queue.enqueue(Message(payload={"robot_id": "robot-b", "actions": ["bow"], "seq": i}))
+
+            order = []
+            for _ in range(4):
+                msg = await queue.dequeue(timeout=0)
+                order.append(msg.payload["robot_id"])
+                await queue.ack(msg.id)
+
+            # robot-a 的 6 個動作需累積 3 輪額度，期間 robot-b 的短指令先行
+            self.assertEqual(order, ["robot-b", "robot-b", "robot-b", "robot-a"])
+
+        self.loop.run_until_complete(test())
+
+    def test_messages_without_robot_id_not_serialized(self):
+        """測試沒有 robot_id 的訊息不受單一處理中限制"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"command": "a"}))
+            await queue.enqueue(Message(payload={"command": "b"}))
+
+            self.assertIsNotNone(await queue.dequeue(timeout=0))
+            self.assertIsNotNone(await queue.dequeue(timeout=0))
+
+        self.loop.run_until_complete(test())
+
+    def test_health_check_reports_partitions(self):
+        """測試健康檢查包含分區資訊"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"robot_id": "robot-a"}))
+            await queue.enqueue(Message(payload={"robot_id": "robot-b"}))
+            await queue.dequeue(timeout=0)
+
+            health = await queue.health_check()
+            self.assertTrue(health["partition_by_robot"])
+            self.assertEqual(health["pending_robot_count"], 1)
+            self.assertEqual(health["busy_robot_count"], 1)
+            self.assertEqual(health["total_size"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_invalid_scheduling_rejected(self):
+        """測試不支援的排程策略"""
+        with self.assertRaises(ValueError):
+            MemoryQueue(partition_by_robot=True, scheduling="lottery")
+
+
+class TestMemoryQueueRedelivery(unittest.TestCase):
+    """測試 MemoryQueue 的延遲重送與死信佇列"""
+
+    def setUp(self):
+        """設定測試環境"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        """清理測試環境"""
+        self.loop.close()
+
+    def test_nack_delays_redelivery(self):
+        """測試 nack 後訊息在退避期間不會被取出"""
+        async def test():
+            queue = MemoryQueue(retry_base_delay=0.05, retry_jitter=0)
+
+            await queue.enqueue(Message(payload={"command": "test"}))
+            msg = await queue.dequeue(timeout=0)
+            await queue.nack(msg.id, requeue=True)
+
+            self.assertIsNone(await queue.dequeue(timeout=0))
+            self.assertEqual(await queue.size(), 1)
+
+            redelivered = await queue.dequeue(timeout=1.0)
+            self.assertIsNotNone(redelivered)
+            self.assertEqual(redelivered.id, msg.id)
+            self.assertEqual(redelivered.retry_count, 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_backoff_grows_exponentially(self):
+        """測試退避延遲依重試次數指數成長並受上限限制"""
+        queue = MemoryQueue(retry_base_delay=0.5, retry_max_delay=3.0, retry_jitter=0)
+
+        self.assertEqual(queue._retry_delay(1), 0.5)
+        self.assertEqual(queue._retry_delay(2), 1.0)
+        self.assertEqual(queue._retry_delay(3), 2.0)
+        self.assertEqual(queue._retry_delay(4), 3.0)
+
+        jittered = MemoryQueue(retry_base_delay=1.0, retry_jitter=0.2)
+        for _ in range(20):
+            self.assertTrue(0.8 <= jittered._retry_delay(1) <= 1.2)
+
+    def test_exhausted_message_dead_lettered(self):
+        """測試超過最大重試次數的訊息進入死信佇列"""
+        async def test():
+            queue = MemoryQueue(retry_base_delay=0)
+
+            message = Message(payload={"command": "poison"}, max_retries=1)
+            await queue.enqueue(message)
+
+            msg = await queue.dequeue(timeout=0)
+            await queue.nack(msg.id, requeue=True)
+            msg = await queue.dequeue(timeout=0)
+            await queue.nack(msg.id, requeue=True)
+
+            self.assertIsNone(await queue.dequeue(timeout=0))
+
+            dead = await queue.get_dead_letters()
+            self.assertEqual(len(dead), 1)
+            self.assertEqual(dead[0]["message"]["id"], message.id)
+            self.assertEqual(dead[0]["reason"], "max_retries_exceeded")
+
+            health = await queue.health_check()
+            self.assertEqual(health["dead_letter_count"], 1)
+            self.assertEqual(health["statistics"]["total_dead_lettered"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_reject_without_requeue_dead_lettered(self):
+        """測試 requeue=False 的訊息直接進入死信佇列"""
+        async def test():
+            queue = MemoryQueue()
+
+            await queue.enqueue(Message(payload={"command": "bad"}))
+            msg = await queue.dequeue(timeout=0)
+            await queue.nack(msg.id, requeue=False)
+
+            dead = await queue.get_dead_letters()
+            self.assertEqual(dead[0]["reason"], "rejected")
+
+        self.loop.run_until_complete(test())
+
+    def test_replay_dead_letters(self):
+        """測試重播死信"""
+        async def test():
+            queue = MemoryQueue()
+
+            first = Message(payload={"seq": 1})
+            second = Message(payload={"seq": 2})
+            for message in (first, second):
+                await queue.enqueue(message)
+                msg = await queue.dequeue(timeout=0)
+                await queue.nack(msg.id, requeue=False)
+
+            replayed = await queue.replay_dead_letters([second.id])
+            self.assertEqual(replayed, 1)
+
+            msg = await queue.dequeue(timeout=0)
+            self.assertEqual(msg.id, second.id)
+            self.assertEqual(msg.retry_count, 0)
+
+            remaining = await queue.get_dead_letters()
+            self.assertEqual([d["message"]["id"] for d in remaining], [first.id])
+
+        self.loop.run_until_complete(test())
+
+    def test_purge_dead_letters(self):
+        """測試清除死信"""
+        async def test():
+            queue = MemoryQueue()
+
+            for i in range(3):
+                await queue.enqueue(Message(payload={"seq": i}))
+                msg = await queue.dequeue(timeout=0)
+                await queue.nack(msg.id, requeue=False)
+
+            self.assertEqual(await queue.purge_dead_letters(), 3)
+            self.assertEqual(await queue.get_dead_letters(), [])
+
+        self.loop.run_until_complete(test())
+
+    def test_dead_letter_queue_bounded(self):
+        """測試死信佇列有上限並捨棄最舊項目"""
+        async def test():
+            queue = MemoryQueue(dead_letter_max_size=2)
+
+            ids = []
+            for i in range(3):
+                message = Message(payload={"seq": i})
+                ids.append(message.id)
+                await queue.enqueue(message)
+                msg = await queue.dequeue(timeout=0)
+                await queue.nack(msg.id, requeue=False)
+
+            dead = await queue.get_dead_letters()
+            self.assertEqual([d["message"]["id"] for d in dead], ids[1:])
+
+            health = await queue.health_check()
+            self.assertEqual(health["statistics"]["total_dead_letters_evicted"], 1)
+
+        self.loop.run_until_complete(test())
+
+
+class TestMessageExpiry(unittest.TestCase):
+    """測試訊息期限與過期丟棄"""
+
+    def setUp(self):
+        """設定測試環境"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        """清理測試環境"""
+        self.loop.close()
+
+    def test_effective_expiry_uses_earliest(self):
+        """測試實際過期時間取 expires_at 與 deadline_ms 中較早者"""
+        now = datetime.now(timezone.utc)
+        message = Message(
+            payload={},
+            timestamp=now,
+            expires_at=now + timedelta(seconds=10),
+            deadline_ms=2000,
+        )
+
+        self.assertEqual(message.effective_expires_at, now + timedelta(seconds=2))
+        self.assertFalse(message.is_expired(now))
+        self.assertTrue(message.is_expired(now + timedelta(seconds=2)))
+        self.assertFalse(Message(payload={}).is_expired())
+
+        restored = Message.from_dict(message.to_dict())
+        self.assertEqual(restored.expires_at, message.expires_at)
+        self.assertEqual(restored.deadline_ms, 2000)
+
+    def test_expired_message_rejected_on_enqueue(self):
+        """測試已過期的訊息不會進入佇列"""
+        async def test():
+            queue = MemoryQueue()
+            expired = Message(
+                payload={},
+                expires_at=datetime.now(timezone.utc) - timedelta(seconds=1),
+            )
+
+            self.assertFalse(await queue.enqueue(expired))
+            self.assertEqual(await queue.size(), 0)
+
+            health = await queue.health_check()
+            self.assertEqual(health["statistics"]["total_expired"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_expired_message_not_dequeued(self):
+        """測試在佇列中過期的訊息會被丟棄而不會被取出"""
+        async def test():
+            queue = MemoryQueue()
+
+            await queue.enqueue(Message(id="short", payload={}, deadline_ms=20))
+            await queue.enqueue(Message(id="long", payload={}))
+
+            await asyncio.sleep(0.05)
+
+            msg = await queue.dequeue(timeout=0)
+            self.assertEqual(msg.id, "long")
+            self.assertIsNone(await queue.dequeue(timeout=0))
+
+        self.loop.run_until_complete(test())
+
+    def test_sweep_frees_capacity(self):
+        """測試過期清除會釋放佇列空間"""
+        async def test():
+            queue = MemoryQueue(max_size=1)
+
+            await queue.enqueue(Message(payload={}, deadline_ms=20))
+            self.assertFalse(await queue.enqueue(Message(payload={})))
+
+            await asyncio.sleep(0.05)
+
+            self.assertTrue(await queue.enqueue(Message(payload={})))
+            self.assertEqual(await queue.size(), 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_purge_expired_partitioned(self):
+        """測試分區模式下清除過期訊息"""
+        async def test():
+            queue = MemoryQueue(partition_by_robot=True)
+
+            await queue.enqueue(Message(payload={"robot_id": "r1"}, deadline_ms=20))
+            await queue.enqueue(Message(id="keep", payload={"robot_id": "r1"}))
+
+            await asyncio.sleep(0.05)
+
+            self.assertEqual(await queue.purge_expired(), 1)
+            self.assertEqual(await queue.size(), 1)
+
+            msg = await queue.dequeue(timeout=0)
+            self.assertEqual(msg.id, "keep")
+
+        self.loop.run_until_complete(test())
+
+
 class TestQueueHandler(unittest.TestCase):
     """測試 QueueHandler"""
 
@@ -336,6 +741,21 @@ class TestServiceManager(unittest.TestCase):
 
         self.loop.run_until_complete(test())
 
+    def test_submit_command_carries_deadline(self):
+        """測試 MCP 指令的 timeout_ms 延續為訊息期限"""
+        async def test():
+            manager = ServiceManager()
+
+            message_id = await manager.submit_command(
+                payload={"command": {"id": "cmd-1", "type": "robot.move", "timeout_ms": 5000}},
+            )
+
+            message = await manager.queue.dequeue(timeout=0)
+            self.assertEqual(message.id, message_id)
+            self.assertEqual(message.deadline_ms, 5000)
+
+        self.loop.run_until_complete(test())
+
     def test_health_check(self):
         """測試健康檢查"""
         async def test():
@@ -12,6 +12,7 @@ Phase 3.2 - 離線模式完善與斷線處理測試
 
 import asyncio
 import sys
+import tempfile
 from pathlib import Path
 import unittest
 from unittest.mock import AsyncMock, patch
@@ -36,6 +37,8 @@ from common.connection_manager import (  # noqa: E402
 from robot_service.queue.offline_buffer import (  # noqa: E402
     OfflineBuffer,
 )
+from robot_service.queue.coalescing import CoalescingRules  # noqa: E402
+from robot_service.queue.drain_scheduler import DrainScheduler  # noqa: E402
 from robot_service.queue.interface import Message, MessagePriority  # noqa: E402
 from common.shared_state import (  # noqa: E402
     SharedStateManager,
@@ -43,6 +46,12 @@ from common.shared_state import (  # noqa: E402
 )
 
 
+def _reset_shared_network_monitor():
+    """重置 OfflineQueueService 預設共用的全域監控器，避免狀態殘留到其他事件迴圈"""
+    from src.common.network_monitor import reset_network_monitor as reset_shared
+    reset_shared()
+
+
 # ==================== 網路監控器測試 ====================
 
 class TestNetworkMonitor(unittest.TestCase):
@@ -163,6 +172,57 @@ class TestNetworkMonitor(unittest.TestCase):
 
         self.loop.run_until_complete(test())
 
+    def test_passive_failures_flip_offline_immediately(self):
+        """測試連續的實際請求失敗立即切換為離線並通知"""
+        async def test():
+            callback = AsyncMock()
+            self.monitor.add_callback(callback)
+
+            self.monitor.record_failure(source="cloud_sync", error="connection refused")
+            self.assertNotEqual(self.monitor.status, NetworkStatus.OFFLINE)
+
+            self.monitor.record_failure(source="cloud_sync", error="connection refused")
+            self.assertEqual(self.monitor.status, NetworkStatus.OFFLINE)
+
+            await asyncio.sleep(0)
+            callback.assert_called_once()
+            self.assertEqual(callback.call_args[0][1], NetworkStatus.OFFLINE)
+            self.assertEqual(self.monitor.state.last_passive_source, "cloud_sync")
+
+            # 恢復閾值為 1：一次成功即上線
+            self.monitor.record_success(source="robot_router", latency_ms=12.0)
+            self.assertEqual(self.monitor.status, NetworkStatus.ONLINE)
+            self.assertEqual(self.monitor.state.latency_ms, 12.0)
+
+        self.loop.run_until_complete(test())
+
+    def test_probe_skipped_when_traffic_is_recent(self):
+        """測試檢測間隔內有實際流量時略過主動探測"""
+        async def test():
+            monitor = NetworkMonitor(check_interval=0.05, timeout=0.5)
+            with patch.object(monitor, '_check_endpoint', new_callable=AsyncMock) as mock_check:
+                mock_check.return_value = True
+                await monitor.start()
+                self.assertEqual(mock_check.await_count, 1)
+
+                # 持續有流量：不應再探測
+                for _ in range(6):
+                    monitor.record_success(source="queue_service")
+                    await asyncio.sleep(0.02)
+                self.assertEqual(mock_check.await_count, 1)
+
+                # 無流量後恢復主動探測
+                await asyncio.sleep(0.2)
+                self.assertGreater(mock_check.await_count, 1)
+
+                health = await monitor.health_check()
+                self.assertGreater(health["probes_skipped"], 0)
+                self.assertEqual(health["passive_signals"]["successes"], 6)
+
+                await monitor.stop()
+
+        self.loop.run_until_complete(test())
+
     def test_global_monitor(self):
         """測試全域監控器"""
         monitor1 = get_network_monitor()
@@ -339,6 +399,186 @@ class TestOfflineBuffer(unittest.TestCase):
 
         self.loop.run_until_complete(test())
 
+    def test_concurrent_flush_keeps_robot_order(self):
+        """測試並行發送時同一機器人的指令維持順序"""
+        async def test():
+            buffer = OfflineBuffer(db_path=":memory:", send_batch_size=50, send_concurrency=3)
+            await buffer.start()
+
+            in_flight = 0
+            max_in_flight = 0
+            sent = []
+
+            async def send_handler(msg):
+                nonlocal in_flight, max_in_flight
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+                sent.append(msg.id)
+                return True
+
+            buffer.set_send_handler(send_handler)
+            buffer.set_online(True)
+
+            for robot in ("r1", "r2", "r3", "r4"):
+                for i in range(5):
+                    await buffer.buffer(Message(id=f"{robot}-{i}", payload={"robot_id": robot}))
+
+            result = await buffer.flush()
+
+            self.assertEqual(result["sent"], 20)
+            self.assertEqual(result["remaining"], 0)
+            self.assertEqual(max_in_flight, 3)
+            for robot in ("r1", "r2", "r3", "r4"):
+                robot_sent = [m for m in sent if m.startswith(robot)]
+                self.assertEqual(robot_sent, [f"{robot}-{i}" for i in range(5)])
+
+            await buffer.stop()
+
+        self.loop.run_until_complete(test())
+
+    def test_failed_send_blocks_only_its_robot(self):
+        """測試發送失敗時不會讓同一機器人的後續指令越過，其他機器人不受影響"""
+        async def test():
+            buffer = OfflineBuffer(db_path=":memory:", max_retry_count=1)
+            await buffer.start()
+
+            sent = []
+
+            async def send_handler(msg):
+                if msg.id == "r1-0":
+                    return False
+                sent.append(msg.id)
+                return True
+
+            buffer.set_send_handler(send_handler)
+            buffer.set_online(True)
+
+            await buffer.buffer(Message(id="r1-0", payload={"robot_id": "r1"}))
+            await buffer.buffer(Message(id="r1-1", payload={"robot_id": "r1"}))
+            await buffer.buffer(Message(id="r2-0", payload={"robot_id": "r2"}))
+
+            result = await buffer.flush()
+
+            self.assertEqual(result["sent"], 2)
+            self.assertEqual(result["failed"], 1)
+            self.assertEqual(sorted(sent), ["r1-1", "r2-0"])
+
+            stats = await buffer.get_statistics()
+            self.assertEqual(stats["failed"], 1)
+            self.assertEqual(stats["pending"], 0)
+
+            await buffer.stop()
+
+        self.loop.run_until_complete(test())
+
+    def test_pending_count_tracked_in_memory(self):
+        """測試待發送數量在記憶體中維護並與資料庫一致"""
+        async def test():
+            await self.buffer.start()
+
+            await self.buffer.buffer(Message(id="msg-001", payload={}))
+            await self.buffer.buffer(Message(id="msg-002", payload={}))
+            # 相同 ID 取代原條目，不重複計數
+            await self.buffer.buffer(Message(id="msg-001", payload={"v": 2}))
+
+            self.assertEqual(await self.buffer.size(), 2)
+            self.assertEqual(self.buffer._count_pending(), 2)
+
+            await self.buffer.clear()
+            self.assertEqual(await self.buffer.size(), 0)
+
+            await self.buffer.stop()
+
+        self.loop.run_until_complete(test())
+
+    def test_stale_sending_entries_reset_on_restart(self):
+        """測試重啟時殘留的 SENDING 條目重置為 PENDING"""
+        async def test():
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = str(Path(tmp_dir) / "buffer.db")
+                buffer = OfflineBuffer(db_path=db_path)
+                await buffer.buffer(Message(id="msg-001", payload={}))
+                buffer._begin_batch(await buffer._get_pending_entries(10))
+                self.assertEqual(await buffer.size(), 0)
+
+                restarted = OfflineBuffer(db_path=db_path)
+                self.assertEqual(await restarted.size(), 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_coalescing_last_write_wins(self):
+        """測試相同機器人與指令類型只保留最新一筆"""
+        async def test():
+            buffer = OfflineBuffer(
+                db_path=":memory:",
+                coalescing=CoalescingRules(last_write_wins_types=frozenset({"robot.status"})),
+            )
+
+            def status_query(msg_id, robot):
+                return Message(id=msg_id, payload={"command": {"type": "robot.status", "target": {"robot_id": robot}}})
+
+            await buffer.buffer(status_query("s1", "r1"))
+            await buffer.buffer(status_query("s2", "r1"))
+            await buffer.buffer(status_query("s3", "r2"))
+
+            entries = await buffer._get_pending_entries(10)
+            self.assertEqual(sorted(e.id for e in entries), ["s2", "s3"])
+            self.assertEqual(await buffer.size(), 2)
+
+            stats = await buffer.get_statistics()
+            self.assertEqual(stats["coalesced_by_rule"]["last_write_wins"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_coalescing_dedup_within_window(self):
+        """測試時間窗內內容相同的指令只保留一筆"""
+        async def test():
+            buffer = OfflineBuffer(
+                db_path=":memory:",
+                coalescing=CoalescingRules(dedup_window_seconds=0.1),
+            )
+
+            def click(msg_id):
+                return Message(id=msg_id, payload={"robot_id": "r1", "action": "wave", "command_id": msg_id})
+
+            self.assertTrue(await buffer.buffer(click("c1")))
+            self.assertTrue(await buffer.buffer(click("c2")))
+            self.assertEqual(await buffer.size(), 1)
+
+            await asyncio.sleep(0.15)
+
+            self.assertTrue(await buffer.buffer(click("c3")))
+            self.assertEqual(await buffer.size(), 2)
+
+            stats = await buffer.get_statistics()
+            self.assertEqual(stats["total_coalesced"], 1)
+
+        self.loop.run_until_complete(test())
+
+    def test_coalescing_stop_supersedes_motion(self):
+        """測試停止指令取代同一機器人待發送的移動指令"""
+        async def test():
+            buffer = OfflineBuffer(
+                db_path=":memory:",
+                max_size=3,
+                coalescing=CoalescingRules(stop_supersedes_motion=True),
+            )
+
+            await buffer.buffer(Message(id="m1", payload={"robot_id": "r1", "actions": ["go_forward"]}))
+            await buffer.buffer(Message(id="m2", payload={"robot_id": "r1", "actions": ["turn_left", "go_forward"]}))
+            await buffer.buffer(Message(id="m3", payload={"robot_id": "r2", "actions": ["go_forward"]}))
+
+            # 緩衝區已滿，但停止指令取代的移動指令會先釋放空間
+            self.assertTrue(await buffer.buffer(Message(id="stop", payload={"robot_id": "r1", "actions": ["stop"]})))
+
+            entries = await buffer._get_pending_entries(10)
+            self.assertEqual(sorted(e.id for e in entries), ["m3", "stop"])
+            self.assertEqual(await buffer.size(), 2)
+
+        self.loop.run_until_complete(test())
+
     def test_cleanup_expired(self):
         """測試清理過期條目"""
         async def test():
@@ -365,6 +605,55 @@ class TestOfflineBuffer(unittest.TestCase):
 
         self.loop.run_until_complete(test())
 
+    def test_cleanup_during_send_keeps_pending_count(self):
+        """發送期間被清理的過期條目，寫回重試結果時不再計入待發送數"""
+        async def test():
+            buffer = OfflineBuffer(db_path=":memory:", default_ttl_seconds=0.1)
+            await buffer.start()
+
+            async def send_handler(msg):
+                await asyncio.sleep(0.2)
+                # 條目仍為 SENDING 時到期並被清理
+                self.assertEqual(await buffer.cleanup_expired(), 1)
+                return False
+
+            buffer.set_send_handler(send_handler)
+            buffer.set_online(True)
+            await buffer.buffer(Message(id="msg-001", payload={}))
+
+            await buffer.flush()
+            self.assertEqual(await buffer.size(), 0)
+
+            await buffer.stop()
+
+        self.loop.run_until_complete(test())
+
+    def test_message_deadline_caps_ttl(self):
+        """測試訊息期限早於 TTL 時以訊息期限為準"""
+        async def test():
+            await self.buffer.start()
+
+            expired = Message(id="msg-expired", payload={}, deadline_ms=0)
+            self.assertFalse(await self.buffer.buffer(expired))
+
+            message = Message(id="msg-001", payload={}, deadline_ms=100)
+            self.assertTrue(await self.buffer.buffer(message))
+
+            # 尚未到期時不會清除
+            self.assertEqual(await self.buffer.cleanup_expired(), 0)
+
+            await asyncio.sleep(0.2)
+
+            self.assertEqual(await self.buffer.cleanup_expired(), 1)
+            self.assertEqual(await self.buffer.size(), 0)
+
+            stats = await self.buffer.get_statistics()
+            self.assertEqual(stats["total_expired"], 2)
+
+            await self.buffer.stop()
+
+        self.loop.run_until_complete(test())
+
     def test_statistics(self):
         """測試統計資訊"""
         async def test():
@@ -399,6 +688,104 @@ class TestOfflineBuffer(unittest.TestCase):
         self.loop.run_until_complete(test())
 
 
+# ==================== 排空排程測試 ====================
+
+class TestDrainScheduler(unittest.TestCase):
+    """重連排空排程測試"""
+
+    def setUp(self):
+        """測試前置設定"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        _reset_shared_network_monitor()
+
+    def tearDown(self):
+        """測試後清理"""
+        _reset_shared_network_monitor()
+        self.loop.close()
+
+    def test_token_bucket_limits_rate(self):
+        """測試 token bucket 限制發送速率"""
+        async def test():
+            scheduler = DrainScheduler("test", rate=20.0, burst=1, min_rate=1.0)
+
+            start = self.loop.time()
+            for _ in range(6):
+                await scheduler.acquire()
+            elapsed = self.loop.time() - start
+
+            # 第一個 token 立即可用，其餘 5 個以 20/秒補充
+            self.assertGreaterEqual(elapsed, 0.2)
+
+        self.loop.run_until_complete(test())
+
+    def test_adaptive_rate(self):
+        """測試依錯誤率與延遲調整速率"""
+        scheduler = DrainScheduler(
+            "test", rate=40.0, increase_step=5.0, decrease_factor=0.5,
+            latency_target_ms=100.0, window_size=5,
+        )
+
+        for _ in range(5):
+            scheduler.record(0.01, False)
+        self.assertEqual(scheduler.rate, 20.0)
+
+        for _ in range(5):
+            scheduler.record(0.5, True)
+        self.assertEqual(scheduler.rate, 10.0)
+
+        for _ in range(5):
+            scheduler.record(0.01, True)
+        self.assertEqual(scheduler.rate, 15.0)
+
+    def test_start_delay_within_jitter(self):
+        """測試啟動延遲落在 jitter 範圍內"""
+        scheduler = DrainScheduler("test", start_jitter_seconds=2.0)
+        for _ in range(20):
+            self.assertTrue(0 <= scheduler.start_delay() <= 2.0)
+
+        with self.assertRaises(ValueError):
+            DrainScheduler("test", rate=0.5, min_rate=1.0)
+
+    def test_service_drains_after_jitter_with_progress(self):
+        """測試佇列服務恢復後延遲排空，並在統計中顯示進度"""
+        async def test():
+            from robot_service.queue.offline_queue_service import (
+                OfflineQueueService,
+                QueueServiceStatus,
+            )
+
+            sent = []
+
+            async def queue_send_handler(msg):
+                sent.append(msg.id)
+                return True
+
+            service = OfflineQueueService(drain_start_jitter=0.05, drain_rate=1000.0)
+            service.set_queue_send_handler(queue_send_handler)
+
+            for i in range(3):
+                await service.submit_command(payload={"robot_id": "robot-001", "action": f"cmd{i}"})
+            self.assertEqual(await service.command_buffer.size(), 3)
+
+            await service._set_queue_service_status(QueueServiceStatus.AVAILABLE)
+            stats = await service.get_statistics()
+            self.assertEqual(stats["drain"]["command_buffer"]["phase"], "waiting_jitter")
+
+            await service._drain_tasks["command_buffer"]
+
+            self.assertEqual(len(sent), 3)
+            stats = await service.get_statistics()
+            drain = stats["drain"]["command_buffer"]
+            self.assertEqual(drain["phase"], "idle")
+            self.assertEqual(drain["backlog"], 3)
+            self.assertEqual(drain["sent"], 3)
+            self.assertEqual(drain["remaining"], 0)
+            self.assertEqual(drain["progress"], 1.0)
+
+        self.loop.run_until_complete(test())
+
+
 # ==================== 連線管理器測試 ====================
 
 class TestConnectionManager(unittest.TestCase):
@@ -837,9 +1224,11 @@ class TestOfflineModeIntegration(unittest.TestCase):
         """測試前置設定"""
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
+        _reset_shared_network_monitor()
 
     def tearDown(self):
         """測試後清理"""
+        _reset_shared_network_monitor()
         self.loop.close()
 
     def test_offline_flow(self):
@@ -995,6 +1384,65 @@ class TestOfflineModeIntegration(unittest.TestCase):
 
         self.loop.run_until_complete(test())
 
+    def test_send_outcomes_feed_network_monitor(self):
+        """
+        測試佇列發送結果作為被動信號回報給網路監控器
+        """
+        async def test():
+            from robot_service.queue.offline_queue_service import (
+                OfflineQueueService,
+                QueueServiceStatus,
+            )
+
+            fail = True
+
+            async def queue_send_handler(msg):
+                if fail:
+                    raise ConnectionError("queue unreachable")
+                return True
+
+            monitor = NetworkMonitor(failure_threshold=2)
+            service = OfflineQueueService(network_monitor=monitor, drain_start_jitter=0)
+            service.set_queue_send_handler(queue_send_handler)
+
+            with patch.object(monitor, '_check_endpoint', new_callable=AsyncMock) as mock_check:
+                mock_check.return_value = True
+                await service.start()
+                self.assertEqual(monitor.status, NetworkStatus.ONLINE)
+
+                for _ in range(2):
+                    await service._set_queue_service_status(QueueServiceStatus.AVAILABLE)
+                    await service.submit_command(payload={"command": "go_forward", "robot_id": "robot-001"})
+
+                self.assertEqual(monitor.status, NetworkStatus.OFFLINE)
+                self.assertEqual(monitor.state.last_passive_source, "queue_service")
+
+                fail = False
+                await service._set_queue_service_status(QueueServiceStatus.AVAILABLE)
+                await service.submit_command(payload={"command": "go_forward", "robot_id": "robot-001"})
+                self.assertEqual(monitor.status, NetworkStatus.ONLINE)
+
+                await service.stop()
+
+        self.loop.run_until_complete(test())
+
+    def test_defaults_to_shared_network_monitor(self):
+        """未指定 network_monitor 時與雲端同步、機器人路由共用全域監控器"""
+        from src.common.network_monitor import get_network_monitor as get_shared_network_monitor
+        from robot_service.queue.offline_queue_service import OfflineQueueService
+
+        service = OfflineQueueService()
+        self.assertIs(service.network_monitor, get_shared_network_monitor())
+
+    def test_positional_arguments_keep_original_order(self):
+        """新增的建構參數附加在既有參數之後，位置參數呼叫的綁定不變"""
+        from robot_service.queue.offline_queue_service import OfflineQueueService
+
+        service = OfflineQueueService(None, None, None, None, None, None, False, 10, 7.5, 3.0)
+        self.assertFalse(service._auto_flush_on_online)
+        self.assertEqual(service._flush_interval, 7.5)
+        self.assertEqual(service._health_check_interval, 3.0)
+
     def test_command_buffer_flushed_when_queue_service_recovers(self):
         """
         測試佇列服務恢復時自動清空指令緩衝
@@ -7,6 +7,7 @@ Cloud API 測試
 import io
 import tempfile
 import unittest
+from pathlib import Path
 
 from Cloud.api.auth import CloudAuthService
 from Cloud.api.storage import CloudStorageService
@@ -256,5 +257,458 @@ class TestCloudStorageService(unittest.TestCase):
         self.assertIn("total_files", stats)
 
 
+class TestCloudStorageStreamingDownload(unittest.TestCase):
+    """測試串流與 Range 下載"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_service = CloudStorageService(storage_path=self.temp_dir)
+        self.content = bytes(range(256)) * 400
+        self.file_id = self.storage_service.upload_file(
+            file_data=io.BytesIO(self.content),
+            filename="firmware.bin",
+            user_id="user-123",
+            category="firmware"
+        )["file_id"]
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_lookup_does_not_scan_directory(self):
+        """上傳過的檔案以查找表直接定位，不列舉目錄"""
+        from unittest.mock import patch
+        with patch('pathlib.Path.iterdir', side_effect=AssertionError("directory scanned")):
+            path = self.storage_service.get_file_path(self.file_id, "user-123", "firmware")
+        self.assertEqual(path.name, f"{self.file_id}.bin")
+
+    def test_lookup_after_restart_falls_back_once(self):
+        """重啟後（查找表為空）以目錄比對找到檔案並寫回查找表"""
+        restarted = CloudStorageService(storage_path=self.temp_dir)
+        self.assertIsNotNone(restarted.get_file_path(self.file_id, "user-123", "firmware"))
+
+        from unittest.mock import patch
+        with patch('pathlib.Path.iterdir', side_effect=AssertionError("directory scanned")):
+            self.assertIsNotNone(restarted.get_file_path(self.file_id, "user-123", "firmware"))
+
+    def test_iter_file_range(self):
+        """iter_file 依位元組範圍以區塊串流"""
+        chunks = list(self.storage_service.iter_file(
+            self.file_id, "user-123", "firmware", start=1000, end=70000, chunk_size=4096
+        ))
+        self.assertTrue(all(len(c) <= 4096 for c in chunks))
+        self.assertEqual(b''.join(chunks), self.content[1000:70001])
+        self.assertIsNone(self.storage_service.iter_file(
+            self.file_id, "user-123", "firmware", start=len(self.content)
+        ))
+
+    def test_download_route_supports_range(self):
+        """下載端點支援 Range（206）與 If-Range，並以檔案雜湊作為 ETag"""
+        from flask import Flask
+        from Cloud.api import routes
+
+        routes.init_cloud_services('test-secret-key', self.temp_dir)
+        app = Flask(__name__)
+        app.register_blueprint(routes.cloud_bp)
+        token = routes.auth_service.generate_token(user_id="user-123", username="user-123")
+        headers = {'Authorization': f'Bearer {token}'}
+        url = f'/api/cloud/storage/download/{self.file_id}?category=firmware'
+
+        with app.test_client() as client:
+            full = client.get(url, headers=headers)
+            self.assertEqual(full.status_code, 200)
+            self.assertEqual(full.data, self.content)
+            self.assertEqual(full.headers['Accept-Ranges'], 'bytes')
+            self.assertEqual(full.headers['ETag'], f'"{self.file_id}"')
+
+            partial = client.get(url, headers={
+                **headers, 'Range': 'bytes=50000-', 'If-Range': f'"{self.file_id}"'
+            })
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(partial.data, self.content[50000:])
+
+            stale = client.get(url, headers={**headers, 'Range': 'bytes=50000-', 'If-Range': '"other"'})
+            self.assertEqual(stale.status_code, 200)
+
+            missing = client.get(f'/api/cloud/storage/download/{"0" * 64}?category=firmware', headers=headers)
+            self.assertEqual(missing.status_code, 404)
+
+
+class TestCloudStorageMetadataIndex(unittest.TestCase):
+    """測試儲存元數據索引（列表、統計、配額與重建）"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_service = CloudStorageService(storage_path=self.temp_dir, max_user_bytes=100)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _upload(self, content, filename="a.txt", user_id="user-123", category="test", metadata=None):
+        return self.storage_service.upload_file(
+            file_data=io.BytesIO(content),
+            filename=filename,
+            user_id=user_id,
+            category=category,
+            metadata=metadata
+        )
+
+    def test_listing_and_stats_do_not_scan_storage(self):
+        """列表與統計來自索引，包含原始檔名與元數據"""
+        from unittest.mock import patch
+        result = self._upload(b"hello", filename="Report.TXT", metadata={"robot": "r1"})
+        self._upload(b"world!", user_id="user-456", category="logs")
+
+        with patch('pathlib.Path.iterdir', side_effect=AssertionError("directory scanned")), \
+                patch('pathlib.Path.glob', side_effect=AssertionError("directory scanned")), \
+                patch('pathlib.Path.rglob', side_effect=AssertionError("directory scanned")):
+            files = self.storage_service.list_files(user_id="user-123")
+            user_stats = self.storage_service.get_storage_stats(user_id="user-123")
+            system_stats = self.storage_service.get_storage_stats()
+
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0]["file_id"], result["file_id"])
+        self.assertEqual(files[0]["storage_filename"], f"{result['file_id']}.txt")
+        self.assertEqual(files[0]["original_filename"], "Report.TXT")
+        self.assertEqual(files[0]["metadata"], {"robot": "r1"})
+        self.assertEqual(user_stats["total_size"], 5)
+        self.assertEqual(user_stats["quota_remaining"], 95)
+        self.assertEqual((system_stats["total_files"], system_stats["total_size"]), (2, 11))
+
+    def test_reupload_and_delete_keep_usage_consistent(self):
+        """重複上傳相同內容不重複計算用量，刪除後扣除"""
+        first = self._upload(b"same content", filename="a.txt")
+        second = self._upload(b"same content", filename="b.bin")
+        self.assertEqual(second["storage_path"], first["storage_path"])
+        self.assertEqual(self.storage_service.get_storage_stats("user-123")["total_files"], 1)
+        self.assertEqual(self.storage_service.list_files("user-123")[0]["original_filename"], "b.bin")
+
+        self.assertTrue(self.storage_service.delete_file(first["file_id"], "user-123", "test"))
+        stats = self.storage_service.get_storage_stats("user-123")
+        self.assertEqual((stats["total_files"], stats["total_size"]), (0, 0))
+
+    def test_quota_exceeded_rejects_upload(self):
+        """超過使用者配額時拒絕上傳，且不留下檔案"""
+        from Cloud.api.storage_index import StorageQuotaExceededError
+        self._upload(b"x" * 60)
+        with self.assertRaises(StorageQuotaExceededError):
+            self._upload(b"y" * 60, filename="b.txt")
+        self.assertEqual(len(self.storage_service.list_files("user-123", category="test")), 1)
+        self.assertEqual(len(list((Path(self.temp_dir) / "test" / "user-123").iterdir())), 1)
+        # 其他使用者不受影響
+        self._upload(b"y" * 60, user_id="user-456")
+
+    def test_reconcile_rebuilds_from_disk(self):
+        """重建索引：補上磁碟新增的檔案、移除已消失的檔案，保留既有元數據"""
+        import hashlib
+        kept = self._upload(b"kept", metadata={"k": 1})
+        gone = self._upload(b"gone", filename="gone.txt")
+        (Path(self.temp_dir) / gone["storage_path"]).unlink()
+        manual = b"dropped in by hand"
+        manual_id = hashlib.sha256(manual).hexdigest()
+        (Path(self.temp_dir) / "test" / "user-123" / f"{manual_id}.bin").write_bytes(manual)
+        (Path(self.temp_dir) / "test" / "user-123" / ".upload_tmp").write_bytes(b"partial")
+
+        result = self.storage_service.reconcile_index()
+
+        self.assertEqual((result["added"], result["removed"], result["total_files"]), (1, 1, 2))
+        files = {f["file_id"]: f for f in self.storage_service.list_files("user-123")}
+        self.assertEqual(set(files), {kept["file_id"], manual_id})
+        self.assertEqual(files[kept["file_id"]]["metadata"], {"k": 1})
+        stats = self.storage_service.get_storage_stats("user-123")
+        self.assertEqual(stats["total_size"], len(b"kept") + len(manual))
+
+    def test_existing_storage_indexed_on_first_start(self):
+        """既有儲存區首次建立索引時自動由磁碟重建"""
+        result = self._upload(b"legacy")
+        (Path(self.temp_dir) / ".storage_index.db").unlink()
+        restarted = CloudStorageService(storage_path=self.temp_dir)
+        files = restarted.list_files("user-123")
+        self.assertEqual([f["file_id"] for f in files], [result["file_id"]])
+
+    def test_upload_route_returns_413_on_quota(self):
+        """上傳端點在超過配額時返回 413"""
+        from flask import Flask
+        from Cloud.api import routes
+
+        routes.init_cloud_services('test-secret-key', self.temp_dir, max_user_bytes=10)
+        app = Flask(__name__)
+        app.register_blueprint(routes.cloud_bp)
+        token = routes.auth_service.generate_token(user_id="user-789", username="user-789")
+        headers = {'Authorization': f'Bearer {token}'}
+
+        with app.test_client() as client:
+            ok = client.post('/api/cloud/storage/upload', headers=headers,
+                             data={'file': (io.BytesIO(b"12345"), 'a.txt')})
+            self.assertEqual(ok.status_code, 200)
+            too_big = client.post('/api/cloud/storage/upload', headers=headers,
+                                  data={'file': (io.BytesIO(b"1234567890"), 'b.txt')})
+            self.assertEqual(too_big.status_code, 413)
+
+
+class TestCloudStorageResumableUpload(unittest.TestCase):
+    """測試可續傳分塊上傳"""
+
+    def setUp(self):
+        import hashlib
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_service = CloudStorageService(storage_path=self.temp_dir, max_file_size=1024 * 1024)
+        self.content = bytes(range(256)) * 100
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _chunk_hash(self, chunk):
+        import hashlib
+        return hashlib.sha256(chunk).hexdigest()
+
+    def _create(self, **kwargs):
+        params = dict(user_id="user-123", filename="firmware.bin", category="firmware",
+                      size=len(self.content), sha256=self.sha256)
+        params.update(kwargs)
+        return self.storage_service.create_upload_session(**params)["session_id"]
+
+    def test_chunked_upload_matches_single_request_upload(self):
+        """分塊上傳完成後與 upload_file 相同的內容定址結果，並寫入索引"""
+        session_id = self._create()
+        for offset in range(0, len(self.content), 10000):
+            chunk = self.content[offset:offset + 10000]
+            info = self.storage_service.upload_chunk(
+                session_id, "user-123", offset, io.BytesIO(chunk), self._chunk_hash(chunk)
+            )
+            self.assertEqual(info["offset"], offset + len(chunk))
+
+        result = self.storage_service.finalize_upload_session(session_id, "user-123")
+
+        self.assertEqual(result["file_id"], self.sha256)
+        self.assertEqual(result["storage_path"], f"firmware/user-123/{self.sha256}.bin")
+        self.assertEqual(self.storage_service.download_file(self.sha256, "user-123", "firmware"), self.content)
+        self.assertEqual(self.storage_service.list_files("user-123")[0]["original_filename"], "firmware.bin")
+        self.assertIsNone(self.storage_service.get_upload_session(session_id, "user-123"))
+
+    def test_bad_or_interrupted_chunk_is_discarded(self):
+        """區塊雜湊不符或中途斷線時截回區塊起點"""
+        from Cloud.api.storage import ChunkHashMismatchError, UploadOffsetMismatchError
+
+        class DroppedStream(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell() >= 4096:
+                    raise ConnectionResetError("connection dropped")
+                return super().read(size)
+
+        session_id = self._create()
+        first = self.content[:10000]
+        self.storage_service.upload_chunk(session_id, "user-123", 0, io.BytesIO(first), self._chunk_hash(first))
+
+        second = self.content[10000:20000]
+        with self.assertRaises(ChunkHashMismatchError):
+            self.storage_service.upload_chunk(session_id, "user-123", 10000, io.BytesIO(second), "0" * 64)
+        with self.assertRaises(ConnectionResetError):
+            self.storage_service.upload_chunk(session_id, "user-123", 10000, DroppedStream(second))
+        self.assertEqual(self.storage_service.get_upload_session(session_id, "user-123")["offset"], 10000)
+
+        with self.assertRaises(UploadOffsetMismatchError) as ctx:
+            self.storage_service.upload_chunk(session_id, "user-123", 0, io.BytesIO(first))
+        self.assertEqual(ctx.exception.offset, 10000)
+
+    def test_session_survives_restart_and_is_private(self):
+        """工作階段持久化於磁碟，重啟後可續傳；其他使用者看不到"""
+        session_id = self._create()
+        self.storage_service.upload_chunk(session_id, "user-123", 0, io.BytesIO(self.content[:5000]))
+
+        restarted = CloudStorageService(storage_path=self.temp_dir)
+        self.assertIsNone(restarted.get_upload_session(session_id, "user-456"))
+        self.assertEqual(restarted.get_upload_session(session_id, "user-123")["offset"], 5000)
+        with self.assertRaises(ValueError):
+            restarted.finalize_upload_session(session_id, "user-123")
+        restarted.upload_chunk(session_id, "user-123", 5000, io.BytesIO(self.content[5000:]))
+        self.assertEqual(restarted.finalize_upload_session(session_id, "user-123")["file_id"], self.sha256)
+
+    def test_size_limits_enforced(self):
+        """宣告大小超過上限時拒絕建立；區塊超過宣告大小時拒絕寫入"""
+        with self.assertRaises(ValueError):
+            self._create(size=2 * 1024 * 1024)
+        session_id = self._create(size=100, sha256=None)
+        with self.assertRaises(ValueError):
+            self.storage_service.upload_chunk(session_id, "user-123", 0, io.BytesIO(b"x" * 101))
+        self.assertEqual(self.storage_service.get_upload_session(session_id, "user-123")["offset"], 0)
+        self.assertTrue(self.storage_service.abort_upload_session(session_id, "user-123"))
+
+    def test_upload_session_routes(self):
+        """工作階段端點：建立、PUT 區塊（409 offset 不符）、查詢、完成"""
+        from flask import Flask
+        from Cloud.api import routes
+
+        routes.init_cloud_services('test-secret-key', self.temp_dir)
+        app = Flask(__name__)
+        app.register_blueprint(routes.cloud_bp)
+        token = routes.auth_service.generate_token(user_id="user-123", username="user-123")
+        headers = {'Authorization': f'Bearer {token}'}
+
+        with app.test_client() as client:
+            created = client.post('/api/cloud/storage/uploads', headers=headers, json={
+                'filename': 'firmware.bin', 'category': 'firmware',
+                'size': len(self.content), 'sha256': self.sha256
+            })
+            self.assertEqual(created.status_code, 201)
+            url = f"/api/cloud/storage/uploads/{created.get_json()['session_id']}"
+
+            half = len(self.content) // 2
+            put = client.put(url, data=self.content[:half], headers={
+                **headers, 'Upload-Offset': '0', 'X-Chunk-SHA256': self._chunk_hash(self.content[:half])
+            })
+            self.assertEqual(put.get_json()['offset'], half)
+
+            conflict = client.put(url, data=self.content[:half], headers={**headers, 'Upload-Offset': '0'})
+            self.assertEqual(conflict.status_code, 409)
+            self.assertEqual(conflict.get_json()['offset'], half)
+
+            self.assertEqual(client.post(f'{url}/complete', headers=headers).status_code, 400)
+            client.put(url, data=self.content[half:], headers={**headers, 'Upload-Offset': str(half)})
+            self.assertEqual(client.get(url, headers=headers).get_json()['offset'], len(self.content))
+
+            done = client.post(f'{url}/complete', headers=headers)
+            self.assertEqual(done.status_code, 200)
+            self.assertEqual(done.get_json()['file_id'], self.sha256)
+            self.assertEqual(client.get(url, headers=headers).status_code, 404)
+
+
+class TestCloudStorageDeduplication(unittest.TestCase):
+    """測試跨使用者內容去重與引用計數回收"""
+
+    def setUp(self):
+        import hashlib
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_service = CloudStorageService(storage_path=self.temp_dir)
+        self.content = b"firmware image " * 1000
+        self.file_id = hashlib.sha256(self.content).hexdigest()
+
+    def tearDown(self):
+        import shutil
+        self.storage_service.stop_garbage_collector()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _upload(self, user_id, filename="fw.bin"):
+        return self.storage_service.upload_file(
+            file_data=io.BytesIO(self.content), filename=filename, user_id=user_id, category="firmware"
+        )
+
+    def _blob(self):
+        return Path(self.temp_dir) / ".blobs" / self.file_id[:2] / self.file_id
+
+    def test_same_content_stored_once_across_users(self):
+        """多位使用者上傳相同內容只存一份，各自的列表、統計與下載不變"""
+        import os
+        for user in ("user-1", "user-2", "user-3"):
+            self._upload(user)
+
+        self.assertEqual(os.stat(self._blob()).st_nlink, 4)
+        for user in ("user-1", "user-2", "user-3"):
+            self.assertEqual(self.storage_service.download_file(self.file_id, user, "firmware"), self.content)
+            self.assertEqual(self.storage_service.get_storage_stats(user)["total_size"], len(self.content))
+
+        report = self.storage_service.get_dedup_report()
+        self.assertEqual((report["references"], report["blobs"]), (3, 1))
+        self.assertEqual(report["bytes_saved"], 2 * len(self.content))
+        self.assertEqual(report["dedup_ratio"], 3.0)
+
+    def test_refcounted_delete_and_gc(self):
+        """刪除只釋放引用；最後一個引用刪除後，垃圾回收在寬限期後刪除 blob"""
+        self._upload("user-1")
+        self._upload("user-2")
+
+        self.storage_service.delete_file(self.file_id, "user-1", "firmware")
+        self.assertEqual(self.storage_service.collect_garbage(grace_seconds=0)["deleted"], 0)
+        self.assertEqual(self.storage_service.download_file(self.file_id, "user-2", "firmware"), self.content)
+
+        self.storage_service.delete_file(self.file_id, "user-2", "firmware")
+        self.assertEqual(self.storage_service.get_dedup_report()["orphaned_bytes"], len(self.content))
+        self.assertEqual(self.storage_service.collect_garbage(grace_seconds=3600)["deleted"], 0)
+        self.assertTrue(self._blob().exists())
+
+        result = self.storage_service.collect_garbage(grace_seconds=0)
+        self.assertEqual((result["deleted"], result["bytes_freed"]), (1, len(self.content)))
+        self.assertFalse(self._blob().exists())
+
+        # 回收後再次上傳會重新建立 blob
+        self._upload("user-3")
+        self.assertEqual(self.storage_service.download_file(self.file_id, "user-3", "firmware"), self.content)
+
+    def test_reupload_during_grace_period_revives_blob(self):
+        """寬限期內再次上傳相同內容直接引用孤立的 blob"""
+        self._upload("user-1")
+        self.storage_service.delete_file(self.file_id, "user-1", "firmware")
+        self._upload("user-2")
+        self.assertEqual(self.storage_service.collect_garbage(grace_seconds=0)["deleted"], 0)
+        self.assertEqual(self.storage_service.get_dedup_report()["orphaned_blobs"], 0)
+
+    def test_gc_keeps_blob_still_linked_on_disk(self):
+        """索引與磁碟不一致（blob 仍被使用者目錄連結）時不刪除"""
+        import os
+        self._upload("user-1")
+        self.storage_service._index.remove_file("firmware", "user-1", self.file_id)
+        self.assertEqual(self.storage_service.collect_garbage(grace_seconds=0)["skipped"], 1)
+        self.assertEqual(os.stat(self._blob()).st_nlink, 2)
+
+    def test_legacy_copies_deduplicated_on_upgrade(self):
+        """舊版配置（每位使用者各自一份）升級時驗證雜湊後改為 blob 硬連結"""
+        import os
+        legacy_dir = tempfile.mkdtemp()
+        try:
+            for user in ("user-1", "user-2"):
+                user_dir = Path(legacy_dir) / "firmware" / user
+                user_dir.mkdir(parents=True)
+                (user_dir / f"{self.file_id}.bin").write_bytes(self.content)
+            corrupted = Path(legacy_dir) / "firmware" / "user-3"
+            corrupted.mkdir(parents=True)
+            (corrupted / f"{self.file_id}.bin").write_bytes(b"not the same")
+
+            upgraded = CloudStorageService(storage_path=legacy_dir)
+
+            blob = Path(legacy_dir) / ".blobs" / self.file_id[:2] / self.file_id
+            self.assertTrue(os.path.samefile(blob, Path(legacy_dir) / "firmware" / "user-1" / f"{self.file_id}.bin"))
+            self.assertTrue(os.path.samefile(blob, Path(legacy_dir) / "firmware" / "user-2" / f"{self.file_id}.bin"))
+            self.assertFalse(os.path.samefile(blob, corrupted / f"{self.file_id}.bin"))
+            self.assertEqual(upgraded.get_dedup_report()["blobs"], 1)
+            self.assertEqual(upgraded.reconcile_index()["linked"], 0)
+        finally:
+            import shutil
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+
+    def test_background_gc_thread(self):
+        """背景垃圾回收執行緒定期回收孤立 blob"""
+        import time
+        self._upload("user-1")
+        self.storage_service.delete_file(self.file_id, "user-1", "firmware")
+        self.storage_service.start_garbage_collector(interval=0.01, grace_seconds=0)
+        deadline = time.time() + 5
+        while self._blob().exists() and time.time() < deadline:
+            time.sleep(0.01)
+        self.storage_service.stop_garbage_collector()
+        self.assertFalse(self._blob().exists())
+
+    def test_dedup_report_route_requires_admin(self):
+        """去重報告端點僅限 admin"""
+        from flask import Flask
+        from Cloud.api import routes
+
+        routes.init_cloud_services('test-secret-key', self.temp_dir)
+        self.addCleanup(routes.storage_service.stop_garbage_collector)
+        app = Flask(__name__)
+        app.register_blueprint(routes.cloud_bp)
+        user_token = routes.auth_service.generate_token(user_id="user-1", username="user-1")
+        admin_token = routes.auth_service.generate_token(user_id="admin", username="admin", role="admin")
+
+        with app.test_client() as client:
+            denied = client.get('/api/cloud/storage/dedup', headers={'Authorization': f'Bearer {user_token}'})
+            self.assertEqual(denied.status_code, 403)
+            report = client.get('/api/cloud/storage/dedup', headers={'Authorization': f'Bearer {admin_token}'})
+            self.assertEqual(report.status_code, 200)
+            self.assertIn('bytes_saved', report.get_json())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests for scripts/queue_benchmark.py
+
+測試佇列效能基準測試工具的統計、執行與基準比較功能。
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+# 確保 scripts/ 可被直接 import（須在第三方 import 前設定）
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+import pytest  # noqa: E402
+
+from queue_benchmark import (  # noqa: E402
+    BenchmarkConfig,
+    TARGETS,
+    compare_with_baseline,
+    main,
+    parse_priority_mix,
+    percentile,
+    run_benchmarks,
+    summarize_latencies,
+)
+
+
+def _report(throughput, p50, p99):
+    return {
+        "results": {
+            "memory": {
+                "throughput_msgs_per_sec": throughput,
+                "latency_ms": {"p50": p50, "p99": p99},
+            }
+        }
+    }
+
+
+# ---------------------------------------------------------------------------
+# 統計
+# ---------------------------------------------------------------------------
+
+class TestStatistics:
+    """測試百分位與延遲統計"""
+
+    def test_percentile_nearest_rank(self):
+        """確認 nearest-rank 百分位"""
+        values = [float(v) for v in range(1, 1001)]
+        assert percentile(values, 50) == 500.0
+        assert percentile(values, 99) == 990.0
+        assert percentile(values, 99.9) == 999.0
+        assert percentile([], 50) == 0.0
+
+    def test_summarize_latencies_in_ms(self):
+        """確認延遲由秒轉換為毫秒"""
+        summary = summarize_latencies([0.001, 0.002, 0.003])
+        assert summary["p50"] == 2.0
+        assert summary["max"] == 3.0
+        assert set(summary) == {"p50", "p99", "p999", "mean", "max"}
+
+    def test_parse_priority_mix(self):
+        """確認優先權比例解析與驗證"""
+        assert parse_priority_mix("urgent=1, normal=9") == {"urgent": 1, "normal": 9}
+        with pytest.raises(ValueError):
+            parse_priority_mix("critical=1")
+        with pytest.raises(ValueError):
+            parse_priority_mix("normal=0")
+
+
+# ---------------------------------------------------------------------------
+# 執行
+# ---------------------------------------------------------------------------
+
+class TestRunBenchmarks:
+    """測試各目標的基準測試執行"""
+
+    def test_all_targets_report_every_message(self):
+        """確認每個目標都處理全部訊息並輸出統計"""
+        config = BenchmarkConfig(messages=60, producers=3, consumers=2, batch_size=10, broker_latency_ms=0)
+        report = asyncio.run(run_benchmarks(config))
+
+        assert set(report["results"]) == set(TARGETS)
+        for result in report["results"].values():
+            assert result["messages"] == 60
+            assert result["throughput_msgs_per_sec"] > 0
+            assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"] <= result["latency_ms"]["max"]
+
+        # 報告需可序列化為 JSON
+        json.dumps(report)
+
+
+# ---------------------------------------------------------------------------
+# 基準比較
+# ---------------------------------------------------------------------------
+
+class TestCompareWithBaseline:
+    """測試與基準報告比較"""
+
+    def test_no_regression_within_tolerance(self):
+        """確認容許範圍內的變化不視為退化"""
+        assert compare_with_baseline(_report(950, 1.05, 2.1), _report(1000, 1.0, 2.0), 0.1) == []
+
+    def test_detects_throughput_and_latency_regression(self):
+        """確認吞吐量下降與延遲上升會被偵測"""
+        regressions = compare_with_baseline(_report(800, 1.0, 3.0), _report(1000, 1.0, 2.0), 0.1)
+        metrics = {r["metric"] for r in regressions}
+        assert metrics == {"throughput_msgs_per_sec", "latency_ms.p99"}
+
+    def test_main_returns_nonzero_on_regression(self, tmp_path, capsys):
+        """確認 --baseline 比較出退化時返回 1 並寫入報告"""
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(_report(1e12, 1e-9, 1e-9)), encoding="utf-8")
+        output = tmp_path / "report.json"
+
+        exit_code = main([
+            "--targets", "memory", "--messages", "20",
+            "--baseline", str(baseline), "--output", str(output),
+        ])
+
+        assert exit_code == 1
+        report = json.loads(output.read_text(encoding="utf-8"))
+        assert report["baseline_comparison"]["regressions"]
+        assert "throughput_msgs_per_sec" in capsys.readouterr().err